@@ -100,7 +100,10 @@ def process_flood_event(netcdf_file=None, hours=24):
         result = tag_polygons_by_grid(polygons,
                                       tif_file,
                                       threshold=0.3,
-                                      tag='affected')
+                                      tag='affected',
+                                      max_tag='max_depth',
+                                      fraction_tag='flooded',
+                                      nodata=0)
 
         new_geom = result.get_geometry()
         new_data = result.get_data()
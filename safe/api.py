@@ -25,7 +25,7 @@ __copyright__ = ('Copyright 2012, Australia Indonesia Facility for '
 #noinspection PyUnresolvedReferences
 from safe.storage.vector import Layer
 from safe.storage.vector import Vector
-from safe.storage.raster import Raster
+from safe.storage.raster import Raster, read_native_dtype
 from safe.defaults import DEFAULTS
 from safe.storage.utilities import (
     bbox_intersection,
@@ -33,9 +33,11 @@ from safe.storage.utilities import (
     verify,
     write_keywords,
     read_keywords,
-    calculate_polygon_centroid)
+    calculate_polygon_centroid,
+    get_working_dtype)
 
 from safe.storage.core import read_layer
+from safe.storage.layer_cache import enable_layer_cache, disable_layer_cache
 
 from safe.impact_functions import (
     load_plugins,  # you need to call this to ensure all plugins are loaded TS
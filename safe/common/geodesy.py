@@ -260,3 +260,38 @@ class Point(object):
         P.append(P[0])
 
         return numpy.array(P)
+
+
+def great_circle_distances(longitudes0, latitudes0, longitudes1, latitudes1):
+    """Distances between arrays of points on the sphere.
+
+    This is a vectorised version of Point.distance_to using the haversine
+    formula which is also accurate for very short distances.
+
+    :param longitudes0: Longitudes of first points in decimal degrees
+    :type longitudes0: numpy.ndarray
+
+    :param latitudes0: Latitudes of first points in decimal degrees
+    :type latitudes0: numpy.ndarray
+
+    :param longitudes1: Longitudes of second points in decimal degrees
+    :type longitudes1: numpy.ndarray
+
+    :param latitudes1: Latitudes of second points in decimal degrees
+    :type latitudes1: numpy.ndarray
+
+    :returns: Array of distances in meters
+    :rtype: numpy.ndarray
+    """
+
+    # Convert to radians
+    c = Point.degrees2radians
+    lon0 = numpy.asarray(longitudes0, dtype=numpy.float) * c
+    lat0 = numpy.asarray(latitudes0, dtype=numpy.float) * c
+    lon1 = numpy.asarray(longitudes1, dtype=numpy.float) * c
+    lat1 = numpy.asarray(latitudes1, dtype=numpy.float) * c
+
+    a = (numpy.sin((lat1 - lat0) / 2) ** 2 +
+         numpy.cos(lat0) * numpy.cos(lat1) *
+         numpy.sin((lon1 - lon0) / 2) ** 2)
+    return 2 * Point.R * numpy.arcsin(numpy.sqrt(numpy.clip(a, 0, 1)))
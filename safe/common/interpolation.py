@@ -76,7 +76,8 @@ def validate_inputs(
     :param y: 1D array of y-coordinates on which to interpolate
     :type z: numpy.ndarray
 
-    :param z: array of values for each x
+    :param z: array of values for each x. In 2D, z may be None if only
+        coordinates and points are to be validated.
     :type z: numpy.ndarray
 
     :param points: 1D array of coordinates where interpolated values are sought
@@ -99,21 +100,22 @@ def validate_inputs(
         dimensions = 2
         y = validate_coordinate_vector(y, 'y')
 
-    try:
-        z = numpy.array(z)
-    except Exception, e:
-        msg = (
-            'Input vector z could not be converted to a numpy array: '
-            '%s' % str(e))
-        raise Exception(msg)
+    if z is not None:
+        try:
+            z = numpy.asarray(z)
+        except Exception, e:
+            msg = (
+                'Input vector z could not be converted to a numpy array: '
+                '%s' % str(e))
+            raise Exception(msg)
 
-    if len(z.shape) != dimensions:
-        msg = 'z must be a %iD numpy array got a: %dD' % (
-            dimensions, len(z.shape))
-        raise Exception(msg)
+        if len(z.shape) != dimensions:
+            msg = 'z must be a %iD numpy array got a: %dD' % (
+                dimensions, len(z.shape))
+            raise Exception(msg)
 
     Nx = len(x)
-    points = numpy.array(points)
+    points = numpy.asarray(points)
     if not len(points.shape) == dimensions:
         msg = 'Interpolation points must be a %id array' % dimensions
         raise RuntimeError(msg)
@@ -130,17 +132,17 @@ def validate_inputs(
         xi = points[:]
 
     else:
-        (m, n) = z.shape
         Ny = len(y)
-        if not (Nx == m and Ny == n):
-            msg = (
-                'Input array Z must have dimensions %i x %i corresponding to '
-                'the lengths of the input coordinates x and y. However, '
-                'Z has dimensions %i x %i.' % (Nx, Ny, m, n))
-            raise InaSAFEError(msg)
+        if z is not None:
+            (m, n) = z.shape
+            if not (Nx == m and Ny == n):
+                msg = (
+                    'Input array Z must have dimensions %i x %i corresponding '
+                    'to the lengths of the input coordinates x and y. '
+                    'However, Z has dimensions %i x %i.' % (Nx, Ny, m, n))
+                raise InaSAFEError(msg)
 
         # Get interpolation points
-        points = numpy.array(points)
         xi = points[:, 0]
         eta = points[:, 1]
 
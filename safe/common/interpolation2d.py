@@ -85,92 +85,196 @@ def interpolate2d(x, y, z, points, mode='linear', bounds_error=False):
     # Input checks
     validate_mode(mode)
     #pylint: disable=W0632
-    x, y, z, xi, eta = validate_inputs(
+    x, y, z, _, _ = validate_inputs(
         x=x, y=y, z=z, points=points, bounds_error=bounds_error)
     #pylint: enable=W0632
 
-    # Identify elements that are outside interpolation domain or NaN
-    outside = (xi < x[0]) + (eta < y[0]) + (xi > x[-1]) + (eta > y[-1])
-    outside += numpy.isnan(xi) + numpy.isnan(eta)
-
-    inside = -outside
-    xi = xi[inside]
-    eta = eta[inside]
-
-    # Find upper neighbours for each interpolation point
-    idx = numpy.searchsorted(x, xi, side='left')
-    idy = numpy.searchsorted(y, eta, side='left')
-
-    # Internal check (index == 0 is OK)
-    if len(idx) > 0 or len(idy) > 0:
-        if (max(idx) >= len(x)) or (max(idy) >= len(y)):
-            msg = (
-                'Interpolation point outside domain. '
-                'This should never happen. '
-                'Please email Ole.Moller.Nielsen@gmail.com')
-            raise InaSAFEError(msg)
+    plan = InterpolationPlan(x, y, points, mode=mode,
+                             bounds_error=bounds_error)
+    return plan.apply(z)
+
+
+class InterpolationPlan(object):
+    """Precomputed interpolation from a fixed mesh to fixed points
+
+    The bounds mask, neighbour indices and interpolation weights depend
+    only on the mesh coordinates and the points. They are computed once
+    and can then be applied to any number of value grids on the same mesh.
+    This is useful when e.g. the same exposure is combined with many
+    hazard scenarios on one grid.
+
+    Example::
+
+        plan = InterpolationPlan(x, y, points)
+        for z in scenarios:
+            values = plan.apply(z)
+
+    This gives the same values as interpolate2d(x, y, z, points) for each
+    scenario.
+    """
 
-    # Get the four neighbours for each interpolation point
-    x0 = x[idx - 1]
-    x1 = x[idx]
-    y0 = y[idy - 1]
-    y1 = y[idy]
-
-    z00 = z[idx - 1, idy - 1]
-    z01 = z[idx - 1, idy]
-    z10 = z[idx, idy - 1]
-    z11 = z[idx, idy]
-
-    # Coefficients for weighting between lower and upper bounds
-    old_set = numpy.seterr(invalid='ignore')  # Suppress warnings
-    alpha = (xi - x0) / (x1 - x0)
-    beta = (eta - y0) / (y1 - y0)
-    numpy.seterr(**old_set)  # Restore
-
-    if mode == 'linear':
-        # Bilinear interpolation formula
-        dx = z10 - z00
-        dy = z01 - z00
-        z = z00 + alpha * dx + beta * dy + alpha * beta * (z11 - dx - dy - z00)
-    else:
-        # Piecewise constant (as verified in input_check)
-
-        # Set up masks for the quadrants
-        left = alpha < 0.5
-        right = -left
-        lower = beta < 0.5
-        upper = -lower
-
-        lower_left = lower * left
-        lower_right = lower * right
-        upper_left = upper * left
-
-        # Initialise result array with all elements set to upper right
-        z = z11
-
-        # Then set the other quadrants
-        z[lower_left] = z00[lower_left]
-        z[lower_right] = z10[lower_right]
-        z[upper_left] = z01[upper_left]
-
-    # Self test
-    if len(z) > 0:
-        mz = numpy.nanmax(z)
-        mZ = numpy.nanmax(z)
-        # noinspection PyStringFormat
-        msg = ('Internal check failed. Max interpolated value %.15f '
-               'exceeds max grid value %.15f ' % (mz, mZ))
-        if not(numpy.isnan(mz) or numpy.isnan(mZ)):
-            if not mz <= mZ:
+    def __init__(self, x, y, points, mode='linear', bounds_error=False,
+                 raster=False, window=None):
+        """Precompute interpolation from mesh to points
+
+        :param x: 1D array of x-coordinates of the mesh
+        :type x: numpy.ndarray
+
+        :param y: 1D array of y-coordinates of the mesh
+        :type y: numpy.ndarray
+
+        :param points: Nx2 array of coordinates where interpolated values
+            are sought
+        :type points: numpy.narray
+
+        :param mode: 'linear' (default) or 'constant'. See interpolate2d.
+        :type mode: str
+
+        :param bounds_error: If True a BoundsError exception will be raised
+            when points are outside the mesh. If False (default), nan is
+            returned for those values.
+        :type bounds_error: bool
+
+        :param raster: If False (default) value grids are organised as in
+            interpolate2d with dimension len(x) x len(y). If True they are
+            organised as rasters with latitudes (y) from north to south
+            along the first axis and longitudes (x) from west to east along
+            the second axis. See interpolate_raster.
+        :type raster: bool
+
+        :param window: Optional raster window (xoff, yoff, xsize, ysize)
+            the mesh was taken from. It is not used here but kept with the
+            plan for callers reading value grids from raster layers.
+        :type window: tuple
+
+        :raises: Exception, BoundsError
+        """
+
+        validate_mode(mode)
+        #pylint: disable=W0632
+        x, y, _, xi, eta = validate_inputs(
+            x=x, y=y, z=None, points=points, bounds_error=bounds_error)
+        #pylint: enable=W0632
+
+        self.x = x
+        self.y = y
+        self.mode = mode
+        self.raster = raster
+        self.window = window
+        if raster:
+            self.shape = (len(y), len(x))
+        else:
+            self.shape = (len(x), len(y))
+
+        # Identify elements that are outside interpolation domain or NaN
+        outside = (xi < x[0]) + (eta < y[0]) + (xi > x[-1]) + (eta > y[-1])
+        outside += numpy.isnan(xi) + numpy.isnan(eta)
+
+        self.number_of_points = len(xi)
+        self.inside = -outside
+        xi = xi[self.inside]
+        eta = eta[self.inside]
+
+        # Find upper neighbours for each interpolation point
+        idx = numpy.searchsorted(x, xi, side='left')
+        idy = numpy.searchsorted(y, eta, side='left')
+
+        # Internal check (index == 0 is OK)
+        if len(idx) > 0 or len(idy) > 0:
+            if (idx.max() >= len(x)) or (idy.max() >= len(y)):
+                msg = (
+                    'Interpolation point outside domain. '
+                    'This should never happen. '
+                    'Please email Ole.Moller.Nielsen@gmail.com')
                 raise InaSAFEError(msg)
 
-    # Populate result with interpolated values for points inside domain
-    # and NaN for values outside
-    r = numpy.zeros(len(points))
-    r[inside] = z
-    r[outside] = numpy.nan
+        # Coefficients for weighting between lower and upper bounds
+        x0 = x[idx - 1]
+        x1 = x[idx]
+        y0 = y[idy - 1]
+        y1 = y[idy]
+
+        old_set = numpy.seterr(invalid='ignore')  # Suppress warnings
+        alpha = (xi - x0) / (x1 - x0)
+        beta = (eta - y0) / (y1 - y0)
+        numpy.seterr(**old_set)  # Restore
+
+        # Flat indices of the four neighbours z00, z01, z10 and z11
+        # (index -1 refers to the last element as in numpy indexing)
+        idx0 = idx - 1
+        idx0[idx0 < 0] += len(x)
+        idy0 = idy - 1
+        idy0[idy0 < 0] += len(y)
+        if raster:
+            # Latitudes run from north to south along the first axis
+            stride_x = 1
+            stride_y = -len(x)
+            offset = (len(y) - 1) * len(x)
+        else:
+            stride_x = len(y)
+            stride_y = 1
+            offset = 0
+        indices = numpy.empty((4, len(idx)), dtype=idx.dtype)
+        indices[0] = idx0 * stride_x + idy0 * stride_y + offset
+        indices[1] = idx0 * stride_x + idy * stride_y + offset
+        indices[2] = idx * stride_x + idy0 * stride_y + offset
+        indices[3] = idx * stride_x + idy * stride_y + offset
+
+        if mode == 'linear':
+            self.indices = indices
+            self.alpha = alpha
+            self.beta = beta
+        else:
+            # Piecewise constant (as verified in input_check)
+            # Pick the neighbour in the quadrant of each point
+            left = alpha < 0.5
+            lower = beta < 0.5
+            quadrant = numpy.zeros(len(xi), dtype=numpy.int)
+            quadrant[:] = 3  # Upper right
+            quadrant[lower * left] = 0
+            quadrant[-lower * left] = 1
+            quadrant[lower * -left] = 2
+            self.indices = indices[quadrant, numpy.arange(len(xi))]
+
+    def apply(self, z):
+        """Interpolate values from grid to points
+
+        :param z: 2D array of values organised as specified by argument
+            raster when the plan was made
+        :type z: numpy.ndarray
+
+        :returns: 1D array with interpolated values for each point, nan
+            for points outside the mesh
+
+        :raises: InaSAFEError if z does not match the mesh
+        """
+
+        z = numpy.asarray(z)
+        if z.shape != self.shape:
+            msg = ('Grid of dimensions %s does not match interpolation plan '
+                   'made for dimensions %s' % (str(z.shape), str(self.shape)))
+            raise InaSAFEError(msg)
+
+        # Gather all neighbour values in one go
+        values = z.take(self.indices)
+
+        if self.mode == 'linear':
+            # Bilinear interpolation formula
+            z00, z01, z10, z11 = values
+            dx = z10 - z00
+            dy = z01 - z00
+            alpha = self.alpha
+            beta = self.beta
+            values = (z00 + alpha * dx + beta * dy +
+                      alpha * beta * (z11 - dx - dy - z00))
+
+        # Populate result with interpolated values for points inside domain
+        # and NaN for values outside
+        r = numpy.zeros(self.number_of_points)
+        r[self.inside] = values
+        r[-self.inside] = numpy.nan
 
-    return r
+        return r
 
 
 def interpolate_raster(x, y, z, points, mode='linear', bounds_error=False):
@@ -216,19 +320,28 @@ def interpolate_raster(x, y, z, points, mode='linear', bounds_error=False):
     :returns: 1D array with same length as points with interpolated values
 
     :raises: Exception, BoundsError (see note about bounds_error)
-    """
-
-    # Flip matrix z up-down to interpret latitudes ordered from south to north
-    z = numpy.flipud(z)
 
-    # Transpose z to have y coordinates along the first axis and x coordinates
-    # along the second axis
-    # noinspection PyUnresolvedReferences
-    z = z.transpose()
+    ..note::
+        Neighbours are looked up directly in z as organised above so it is
+        neither flipped nor transposed and not copied.
+    """
 
-    # Call underlying interpolation routine and return
-    res = interpolate2d(x, y, z, points, mode=mode, bounds_error=bounds_error)
-    return res
+    # Check that z is organised with latitudes along the first axis
+    z = numpy.asarray(z)
+    if len(z.shape) != 2:
+        msg = 'z must be a 2D numpy array got a: %dD' % len(z.shape)
+        raise Exception(msg)
+
+    if z.shape != (len(y), len(x)):
+        msg = ('Input array Z must have dimensions %i x %i corresponding to '
+               'the lengths of the input coordinates y and x. However, '
+               'Z has dimensions %i x %i.' % (len(y), len(x),
+                                              z.shape[0], z.shape[1]))
+        raise InaSAFEError(msg)
+
+    plan = InterpolationPlan(x, y, points, mode=mode,
+                             bounds_error=bounds_error, raster=True)
+    return plan.apply(z)
 
 
 # Mathematical derivation of the interpolation formula used
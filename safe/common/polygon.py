@@ -23,10 +23,11 @@ __copyright__ += 'Disaster Reduction'
 
 import logging
 import numpy
+from collections import defaultdict
 from random import uniform, seed as seed_function
 
 from safe.common.numerics import ensure_numeric
-from safe.common.numerics import grid_to_points, geotransform_to_axes
+from safe.common.numerics import geotransform_to_axes
 from safe.common.exceptions import (
     PolygonInputError, InaSAFEError, PointsInputError)
 
@@ -38,7 +39,8 @@ def separate_points_by_polygon(
         polygon_bbox=None,
         closed=True,
         check_input=True,
-        use_numpy=True):
+        use_numpy=True,
+        method='edges'):
     """Determine whether points are inside or outside a polygon.
 
     Args:
@@ -53,6 +55,13 @@ def separate_points_by_polygon(
               the code faster.
         * check_input: Allows faster execution if set to False
         * use_numpy: Use the fast numpy implementation
+        * method: (optional) Crossing number kernel used by the numpy
+              implementation. Either 'edges' (default) which loops over all
+              polygon edges or 'slabs' which buckets edges into horizontal
+              slabs so that each point is only tested against edges crossing
+              its row. The latter is much faster for polygons with many
+              vertices. Both give identical results. Ignored if use_numpy
+              is False.
 
     Returns:
         * indices_inside_polygon: array of indices of points
@@ -89,6 +98,11 @@ def separate_points_by_polygon(
         if not (isinstance(closed, bool) or closed is None):
             raise PolygonInputError(msg)
 
+        msg = ('Keyword argument "method" must be one of %s. I got %s'
+               % (POLYGON_METHODS.keys(), method))
+        if method not in POLYGON_METHODS:
+            raise PolygonInputError(msg)
+
         try:
             points = ensure_numeric(points, numpy.float)
         except Exception, e:
@@ -165,7 +179,7 @@ def separate_points_by_polygon(
     candidate_points = points[inside_box]
 
     if use_numpy:
-        func = _separate_points_by_polygon
+        func = POLYGON_METHODS[method]
     else:
         func = _separate_points_by_polygon_python
 
@@ -249,18 +263,100 @@ def _separate_points_by_polygon(points, polygon,
 
     if closed is not None:
         # Find points on polygon boundary
-        for i in range(N):
-            # Loop through polygon edges
-            j = (i + 1) % N
-            edge = [polygon[i, :], polygon[j, :]]
+        _assign_boundary_points(points, polygon, inside, closed, rtol, atol)
+
+    # Record point as either inside or outside
+    inside_index = numpy.sum(inside)  # How many points are inside
 
-            # Select those that are on the boundary
-            boundary_points = point_on_line(points, edge, rtol, atol)
+    # Indices of inside points
+    indices[:inside_index] = numpy.where(inside)[0]
 
-            if closed:
-                inside[boundary_points] = 1
-            else:
-                inside[boundary_points] = 0
+    # Indices of outside points
+    indices[inside_index:] = numpy.where(1 - inside)[0]
+
+    return indices[:inside_index], indices[inside_index:]
+
+
+def _separate_points_by_polygon_slabs(points, polygon,
+                                      closed, rtol=0.0, atol=0.0,
+                                      edges_per_slab=4,
+                                      max_pairs=2 ** 22):
+    """Underlying algorithm to partition point according to polygon
+
+    This is an alternative to _separate_points_by_polygon for polygons
+    with many vertices. Edges are bucketed into horizontal slabs of equal
+    height according to their y-range so that each point is only tested
+    against the edges overlapping the slab it falls in. The crossing test
+    for each (point, edge) pair is exactly the one used by
+    _separate_points_by_polygon so results are identical.
+
+    Input:
+       points, polygon, closed, rtol, atol:
+           See _separate_points_by_polygon
+       edges_per_slab: Average number of polygon vertices per slab used to
+           determine the number of slabs.
+       max_pairs: Maximal number of (point, edge) pairs evaluated at once.
+           This caps the size of temporary arrays.
+
+    Output:
+       See _separate_points_by_polygon
+    """
+
+    N = polygon.shape[0]
+    M = points.shape[0]
+
+    if M == 0:
+        # If no points return two 0-vectors
+        return numpy.arange(0), numpy.arange(0)
+
+    # Vector to return sorted indices (inside first, then outside)
+    indices = numpy.zeros(M, numpy.int)
+
+    # Vector keeping track of which points are inside
+    inside = numpy.zeros(M, dtype=numpy.int)  # All assumed outside initially
+
+    x = points[:, 0]
+    y = points[:, 1]
+
+    # Edge end points. Edge i goes from vertex i to vertex (i + 1) % N
+    px_i = polygon[:, 0]
+    py_i = polygon[:, 1]
+    px_j = numpy.roll(px_i, -1)
+    py_j = numpy.roll(py_i, -1)
+
+    # Horizontal edges are never crossed so they are left out.
+    # The others can only be crossed by points with miny < y <= maxy.
+    edges = numpy.where(py_i != py_j)[0]
+    lower = numpy.minimum(py_i[edges], py_j[edges])
+    upper = numpy.maximum(py_i[edges], py_j[edges])
+
+    number_of_slabs = max(1, N // edges_per_slab)
+    for start, end, pair_point, pair_edge in _slab_pairs(y, lower, upper,
+                                                         number_of_slabs,
+                                                         max_pairs):
+        pair_edge = edges[pair_edge]
+
+        xx = x[pair_point]
+        yy = y[pair_point]
+        pxi = px_i[pair_edge]
+        pyi = py_i[pair_edge]
+        pxj = px_j[pair_edge]
+        pyj = py_j[pair_edge]
+
+        # Edge crossing formula (as in _separate_points_by_polygon)
+        sigma = (yy - pyi) / (pyj - pyi) * (pxj - pxi)
+        seg_i = (pyi < yy) * (pyj >= yy)
+        seg_j = (pyj < yy) * (pyi >= yy)
+        mask = (pxi + sigma < xx) * (seg_i + seg_j)
+
+        crossings = numpy.bincount(pair_point - start,
+                                   weights=mask,
+                                   minlength=end - start)
+        inside[start:end] = crossings.astype(numpy.int) % 2
+
+    if closed is not None:
+        # Find points on polygon boundary
+        _assign_boundary_points(points, polygon, inside, closed, rtol, atol)
 
     # Record point as either inside or outside
     inside_index = numpy.sum(inside)  # How many points are inside
@@ -274,6 +370,244 @@ def _separate_points_by_polygon(points, polygon,
     return indices[:inside_index], indices[inside_index:]
 
 
+def _slab_pairs(y, lower, upper, number_of_slabs, max_pairs):
+    """Generate candidate (point, edge) pairs using horizontal slabs
+
+    The y-range spanned by all edges is divided into slabs of equal height.
+    Each edge is bucketed into the slabs overlapped by its interval
+    [lower, upper] and each point is paired with the edges of the slab it
+    falls in. Any point with lower <= y <= upper for a given edge is
+    therefore guaranteed to be paired with that edge.
+
+    Input:
+       y: Array of y coordinates of points
+       lower, upper: Arrays with y-range of each edge
+       number_of_slabs: Number of slabs to use
+       max_pairs: Approximate maximal number of pairs in each block
+
+    Output:
+       Generator of (start, end, pair_point, pair_edge) for consecutive
+       blocks of points [start:end] where pair_point and pair_edge are
+       indices into y and the edge arrays respectively.
+    """
+
+    M = len(y)
+    if M == 0 or len(lower) == 0:
+        return
+
+    miny = lower.min()
+    height = (upper.max() - miny) / number_of_slabs
+    if not height > 0:
+        # All edges lie on one horizontal line
+        number_of_slabs = 1
+        height = 1.0
+
+    def slab_index(v):
+        """Slab containing each value in v (monotone in v)
+        """
+        k = numpy.floor((v - miny) / height).astype(numpy.int)
+        return numpy.clip(k, 0, number_of_slabs - 1)
+
+    # Expand edges to (slab, edge) pairs sorted by slab.
+    # Since slab_index is monotone, points with lower <= y <= upper
+    # all lie in slabs between those of lower and upper.
+    first = slab_index(lower)
+    span = slab_index(upper) - first + 1
+    slab_ids = numpy.repeat(first, span) + _ragged_arange(span)
+    order = numpy.argsort(slab_ids, kind='mergesort')
+    slab_edges = numpy.repeat(numpy.arange(len(lower)), span)[order]
+
+    counts = numpy.bincount(slab_ids, minlength=number_of_slabs)
+    slab_offsets = numpy.zeros(number_of_slabs + 1, dtype=numpy.int)
+    numpy.cumsum(counts, out=slab_offsets[1:])
+
+    # Number of candidate edges for each point
+    point_slab = slab_index(y)
+    point_start = slab_offsets[point_slab]
+    point_count = slab_offsets[point_slab + 1] - point_start
+
+    # Process blocks of points limited by the number of pairs
+    cumulative = numpy.cumsum(point_count)
+    start = 0
+    while start < M:
+        done = 0 if start == 0 else cumulative[start - 1]
+        end = numpy.searchsorted(cumulative, done + max_pairs, side='right')
+        end = min(max(end, start + 1), M)
+
+        c = point_count[start:end]
+        pair_point = numpy.repeat(numpy.arange(start, end), c)
+        pair_edge = slab_edges[numpy.repeat(point_start[start:end], c) +
+                               _ragged_arange(c)]
+
+        yield start, end, pair_point, pair_edge
+        start = end
+
+
+def _ragged_arange(counts):
+    """Concatenation of arange(c) for each c in counts
+
+    Input:
+       counts: Array of non-negative integers
+
+    Output:
+       Array of length sum(counts), e.g. [0, 1, 2, 0, 1] for counts [3, 2]
+    """
+
+    total = numpy.sum(counts)
+    starts = numpy.cumsum(counts) - counts
+    return numpy.arange(total) - numpy.repeat(starts, counts)
+
+
+def _interval_pairs(lower0, upper0, lower1, upper1, number_of_slabs,
+                    max_pairs):
+    """Generate candidate pairs of overlapping intervals using slabs
+
+    The range spanned by the second set of intervals is divided into slabs
+    of equal height and each interval is bucketed into the slabs it
+    overlaps. Intervals of the first set are paired with all intervals
+    bucketed in the slabs they overlap. A pair is only reported from the
+    slab containing the larger of the two lower bounds, so each pair of
+    overlapping intervals is generated exactly once.
+
+    Input:
+       lower0, upper0: Arrays with first set of intervals
+       lower1, upper1: Arrays with second set of intervals
+       number_of_slabs: Number of slabs to use
+       max_pairs: Approximate maximal number of pairs in each block
+
+    Output:
+       Generator of (pair0, pair1) for consecutive blocks of the first set
+       where pair0 and pair1 are indices into the first and second set.
+       Pairs that do not overlap may be included too.
+    """
+
+    M = len(lower0)
+    if M == 0 or len(lower1) == 0:
+        return
+
+    miny = lower1.min()
+    height = (upper1.max() - miny) / number_of_slabs
+    if not height > 0:
+        # All intervals of second set are the same point
+        number_of_slabs = 1
+        height = 1.0
+
+    def slab_index(v):
+        """Slab containing each value in v (monotone in v)
+        """
+        k = numpy.floor((v - miny) / height).astype(numpy.int)
+        return numpy.clip(k, 0, number_of_slabs - 1)
+
+    # Expand second set to (slab, interval) pairs sorted by slab
+    first = slab_index(lower1)
+    span = slab_index(upper1) - first + 1
+    slab_ids = numpy.repeat(first, span) + _ragged_arange(span)
+    order = numpy.argsort(slab_ids, kind='mergesort')
+    slab_ids = slab_ids[order]
+    slab_members = numpy.repeat(numpy.arange(len(lower1)), span)[order]
+
+    counts = numpy.bincount(slab_ids, minlength=number_of_slabs)
+    slab_offsets = numpy.zeros(number_of_slabs + 1, dtype=numpy.int)
+    numpy.cumsum(counts, out=slab_offsets[1:])
+
+    # Members of the slabs overlapped by an interval of the first set
+    # are contiguous in slab_members
+    member_start = slab_offsets[slab_index(lower0)]
+    member_count = slab_offsets[slab_index(upper0) + 1] - member_start
+
+    # Process blocks limited by the number of pairs
+    cumulative = numpy.cumsum(member_count)
+    start = 0
+    while start < M:
+        done = 0 if start == 0 else cumulative[start - 1]
+        end = numpy.searchsorted(cumulative, done + max_pairs, side='right')
+        end = min(max(end, start + 1), M)
+
+        c = member_count[start:end]
+        pair0 = numpy.repeat(numpy.arange(start, end), c)
+        position = numpy.repeat(member_start[start:end], c) + \
+            _ragged_arange(c)
+        pair1 = slab_members[position]
+
+        # Overlapping intervals both contain the larger lower bound
+        lower = numpy.maximum(lower0[pair0], lower1[pair1])
+        keep = slab_ids[position] == slab_index(lower)
+
+        yield pair0[keep], pair1[keep]
+        start = end
+
+
+def _assign_boundary_points(points, polygon, inside, closed, rtol, atol,
+                            edges_per_slab=4, max_pairs=2 ** 22):
+    """Set inside flag for points on polygon boundary
+
+    Input:
+       points: Mx2 array of points
+       polygon: Nx2 array of polygon vertices
+       inside: Integer array of length M which will be modified in place:
+           Points on boundary are set to 1 if closed is True and 0 otherwise
+       closed, rtol, atol: See _separate_points_by_polygon
+       edges_per_slab, max_pairs: See _separate_points_by_polygon_slabs
+
+    Note:
+       All edges are tested in one pass against blocks of points using the
+       same test as point_on_line. A point can only be on an edge if it is
+       no further from the first vertex of the edge than the edge is long,
+       so only points within that reach (along both axes) of an edge are
+       given the full test.
+    """
+
+    N = polygon.shape[0]
+
+    x = points[:, 0]
+    y = points[:, 1]
+
+    # Edge i goes from vertex i to vertex (i + 1) % N
+    x0 = polygon[:, 0]
+    y0 = polygon[:, 1]
+    b0 = numpy.roll(x0, -1) - x0
+    b1 = numpy.roll(y0, -1) - y0
+
+    denominator = b0 * b0 + b1 * b1
+    len_b = numpy.sqrt(denominator)
+
+    # Allow for rounding in the len_a <= len_b test below
+    reach = len_b * (1 + 1.0e-9)
+
+    number_of_slabs = max(1, N // edges_per_slab)
+    for _, _, pair_point, pair_edge in _slab_pairs(y, y0 - reach, y0 + reach,
+                                                   number_of_slabs,
+                                                   max_pairs):
+        # Vector from first vertex of edge to point
+        a0 = x[pair_point] - x0[pair_edge]
+        a1 = y[pair_point] - y0[pair_edge]
+
+        near = abs(a0) <= reach[pair_edge]
+        pair_point = pair_point[near]
+        pair_edge = pair_edge[near]
+        a0 = a0[near]
+        a1 = a1[near]
+
+        # Same test as in point_on_line
+        e0 = b0[pair_edge]
+        e1 = b1[pair_edge]
+        nominator = abs(a1 * e0 + (-a0) * e1)
+        is_parallel = nominator <= atol + rtol * denominator[pair_edge]
+        len_a = numpy.sqrt(a0 * a0 + a1 * a1)
+        cross = a0 * e0 + a1 * e1
+
+        on_edge = is_parallel * (cross >= 0) * (len_a <= len_b[pair_edge])
+        if closed:
+            inside[pair_point[on_edge]] = 1
+        else:
+            inside[pair_point[on_edge]] = 0
+
+
+# Numpy kernels available for separate_points_by_polygon
+POLYGON_METHODS = {'edges': _separate_points_by_polygon,
+                   'slabs': _separate_points_by_polygon_slabs}
+
+
 def _separate_points_by_polygon_python(points, polygon,
                                        closed, rtol=0.0, atol=0.0):
     """Underlying algorithm to partition point according to polygon
@@ -474,7 +808,8 @@ def in_and_outside_polygon(
         points, polygon,
         closed=True,
         holes=None,
-        check_input=True):
+        check_input=True,
+        index=None):
     """Separate a list of points into two sets inside and outside a polygon
 
     :param points: (tuple, list or array) of coordinates
@@ -489,6 +824,11 @@ def in_and_outside_polygon(
 
     :param check_input: Allows faster execution if set to False
 
+    :param index: Optional PointIndex (module spatial_index.py) built from
+      points. If given, only points inside the polygon bounding box are
+      tested which is much faster when many polygons are applied to the
+      same points.
+
     Output:
       inside: Indices of points inside the polygon
 
@@ -497,6 +837,13 @@ def in_and_outside_polygon(
     See separate_points_by_polygon for more documentation
     """
 
+    if index is not None:
+        return _in_and_outside_polygon_indexed(points, polygon,
+                                               closed=closed,
+                                               holes=holes,
+                                               check_input=check_input,
+                                               index=index)
+
     # Get separation by outer_ring
     inside, outside = separate_points_by_polygon(points, polygon,
                                                  closed=closed,
@@ -524,6 +871,56 @@ def in_and_outside_polygon(
     return inside, outside
 
 
+def _in_and_outside_polygon_indexed(points, polygon,
+                                    closed, holes, check_input, index):
+    """Separate points by polygon using a spatial index of the points
+
+    Underlying function.
+    - see in_and_outside_polygon for details
+
+    The index is only used to select candidate points, the points
+    themselves are tested as given.
+    """
+
+    try:
+        points = ensure_numeric(points, numpy.float)
+    except Exception, e:
+        msg = ('Points could not be converted to numeric array: %s'
+               % str(e))
+        raise PointsInputError(msg)
+
+    msg = ('Spatial index must be built from the points being separated. '
+           'I got %i points and an index of %i points'
+           % (len(points), len(index)))
+    if len(points) != len(index):
+        raise PointsInputError(msg)
+
+    try:
+        polygon = ensure_numeric(polygon, numpy.float)
+    except Exception, e:
+        msg = ('Polygon could not be converted to numeric array: %s'
+               % str(e))
+        raise PolygonInputError(msg)
+
+    polygon_bbox = [min(polygon[:, 0]), max(polygon[:, 0]),
+                    min(polygon[:, 1]), max(polygon[:, 1])]
+
+    # Only points inside the polygon bounding box need testing
+    candidates = index.query(polygon_bbox)
+    inside, _ = in_and_outside_polygon(points[candidates], polygon,
+                                       closed=closed,
+                                       holes=holes,
+                                       check_input=check_input)
+    inside = candidates[inside]
+
+    # Everything else is outside
+    is_outside = numpy.ones(len(points), dtype=numpy.bool)
+    is_outside[inside] = False
+    outside = numpy.where(is_outside)[0]
+
+    return inside, outside
+
+
 def is_inside_polygon(point, polygon, closed=True):
     """Determine if one point is inside a polygon
 
@@ -539,7 +936,7 @@ def is_inside_polygon(point, polygon, closed=True):
 
 
 def inside_polygon(points, polygon, closed=True, holes=None,
-                   check_input=True):
+                   check_input=True, index=None):
     """Determine points inside a polygon
 
        Functions inside_polygon and outside_polygon have been defined in
@@ -553,12 +950,16 @@ def inside_polygon(points, polygon, closed=True, holes=None,
 
        holes: list of polygons representing holes. Points inside either of
        these are not considered inside_polygon
+
+       index: Optional PointIndex built from points.
+       See in_and_outside_polygon for details
     """
 
     indices, _ = in_and_outside_polygon(points, polygon,
                                         closed=closed,
                                         holes=holes,
-                                        check_input=check_input)
+                                        check_input=check_input,
+                                        index=index)
 
     # Return indices of points inside polygon
     return indices
@@ -580,7 +981,7 @@ def is_outside_polygon(point, polygon, closed=True):
 
 
 def outside_polygon(points, polygon, closed=True,
-                    holes=None, check_input=True):
+                    holes=None, check_input=True, index=None):
     """Determine points outside a polygon
 
        Functions inside_polygon and outside_polygon have been defined in
@@ -591,12 +992,16 @@ def outside_polygon(points, polygon, closed=True,
 
        holes: list of polygons representing holes. Points inside either of
               these are considered outside polygon
+
+       index: Optional PointIndex built from points.
+              See in_and_outside_polygon for details
     """
 
     _, indices = in_and_outside_polygon(points, polygon,
                                         closed=closed,
                                         holes=holes,
-                                        check_input=check_input)
+                                        check_input=check_input,
+                                        index=index)
 
     # Return indices of points outside polygon
     return indices
@@ -634,7 +1039,8 @@ def clip_lines_by_polygon(lines, polygon,
        come from, if one e.g. wants to assign the original attribute values
        to clipped lines.
 
-    This is a wrapper around clip_line_by_polygon
+    All segments of all lines are clipped in one vectorised pass.
+    The result is the same as clipping each line by clip_line_by_polygon.
     """
 
     if check_input:
@@ -679,15 +1085,11 @@ def clip_lines_by_polygon(lines, polygon,
     maxpy = max(polygon[:, 1])
     polygon_bbox = [minpx, maxpx, minpy, maxpy]
 
-    # Get polygon_segments
-    polygon_segments = polygon2segments(polygon)
-
     # Call underlying function
-    return _clip_lines_by_polygon(lines,
-                                  polygon,
-                                  polygon_segments,
-                                  polygon_bbox,
-                                  closed=closed)
+    return _clip_lines_by_polygon_vectorised(lines,
+                                             polygon,
+                                             polygon_bbox,
+                                             closed=closed)
 
 
 def _clip_lines_by_polygon(lines,
@@ -739,6 +1141,257 @@ def _clip_lines_by_polygon(lines,
     return inside_line_segments, outside_line_segments
 
 
+def _clip_lines_by_polygon_vectorised(lines,
+                                      polygon,
+                                      polygon_bbox,
+                                      closed=True,
+                                      edges_per_slab=4,
+                                      max_pairs=2 ** 22):
+    """Clip multiple lines by polygon processing all segments at once
+
+    Underlying function giving the same result as _clip_lines_by_polygon
+    - see clip_lines_by_polygon for details
+
+    Algorithm
+
+    1: Flag segments of all lines that are outside polygon bounding box
+    2: Find intersections between remaining segments and polygon edges
+       using (segment, edge) pairs bucketed in horizontal slabs
+    3: Sort intersections by distance from first end point within each
+       segment and cut segments into pieces
+    4: Classify midpoints of all pieces with one call to
+       separate_points_by_polygon
+    5: Join consecutive pieces of each line with the same classification
+       as done by join_line_segments
+
+    Additional input:
+       edges_per_slab: Average number of polygon edges per slab
+       max_pairs: Approximate maximal number of (segment, edge) pairs
+           held in memory at any one time
+    """
+
+    # Get bounding box
+    minpx = polygon_bbox[0]
+    maxpx = polygon_bbox[1]
+    minpy = polygon_bbox[2]
+    maxpy = polygon_bbox[3]
+
+    inside_line_segments = {}
+    outside_line_segments = {}
+    for k in range(len(lines)):
+        inside_line_segments[k] = []
+        outside_line_segments[k] = []
+
+    number_of_vertices = numpy.array([len(line) for line in lines],
+                                     dtype=numpy.int)
+    line_ids = numpy.where(number_of_vertices > 0)[0]
+    if len(line_ids) == 0:
+        return inside_line_segments, outside_line_segments
+
+    # All vertices of all lines
+    counts = number_of_vertices[line_ids]
+    offsets = numpy.cumsum(counts) - counts
+    vertices = ensure_numeric(numpy.concatenate([lines[k] for k in line_ids]),
+                              numpy.float)
+    x = vertices[:, 0]
+    y = vertices[:, 1]
+
+    # Exclude lines that are fully outside polygon bounding box
+    excluded = ((numpy.maximum.reduceat(x, offsets) < minpx) |
+                (numpy.minimum.reduceat(x, offsets) > maxpx) |
+                (numpy.maximum.reduceat(y, offsets) < minpy) |
+                (numpy.minimum.reduceat(y, offsets) > maxpy))
+    for k in line_ids[excluded]:
+        outside_line_segments[k].append(lines[k])
+
+    # Segments are formed by each vertex and the next in the same line
+    is_start = numpy.repeat(~excluded, counts)
+    is_start[offsets + counts - 1] = False
+    start_vertex = numpy.where(is_start)[0]
+    segment_line = numpy.repeat(line_ids, counts)[start_vertex]
+    x0 = x[start_vertex]
+    y0 = y[start_vertex]
+    x1 = x[start_vertex + 1]
+    y1 = y[start_vertex + 1]
+
+    # Skip segments that are outside polygon bounding box
+    # (same tests as in _clip_line_by_polygon)
+    outside_bbox = (((x0 < minpx) & (x1 < minpx)) |
+                    ((x0 > maxpx) & (x1 > maxpx)) |
+                    ((y0 < minpy) & (y1 < minpy)) |
+                    ((y0 > maxpy) & (y1 > maxpy)))
+    endpoint_inside = (((minpx < x0) & (x0 < maxpx)) |
+                       ((minpy < y0) & (y0 < maxpy)) |
+                       ((minpx < x1) & (x1 < maxpx)) |
+                       ((minpy < y1) & (y1 < maxpy)))
+    undecided = numpy.where(~outside_bbox & ~endpoint_inside)[0]
+    if len(undecided) > 0:
+        # Both end points are outside bounding box so check if segment
+        # intersects polygon bounding box.
+        corners = numpy.array([[minpx, minpy], [maxpx, minpy],
+                               [maxpx, maxpy], [minpx, maxpy],
+                               [minpx, minpy]])
+        crosses = numpy.zeros(len(undecided), dtype=bool)
+        for i in range(4):
+            mask, _, _ = _intersect_segments(x0[undecided], y0[undecided],
+                                             x1[undecided], y1[undecided],
+                                             corners[i, 0], corners[i, 1],
+                                             corners[i + 1, 0],
+                                             corners[i + 1, 1])
+            crosses |= mask
+        outside_bbox[undecided] = ~crosses
+
+    # Intersect remaining segments with polygon edges
+    candidates = numpy.where(~outside_bbox)[0]
+    cx0 = x0[candidates]
+    cy0 = y0[candidates]
+    cx1 = x1[candidates]
+    cy1 = y1[candidates]
+
+    px_i = polygon[:, 0]
+    py_i = polygon[:, 1]
+    px_j = numpy.roll(px_i, -1)
+    py_j = numpy.roll(py_i, -1)
+
+    # Pad segment extents so that rounding in the intersection formula
+    # can not lose intersections at the ends of segments or edges
+    eps = 1.0e-9 * (numpy.max(numpy.abs(polygon_bbox)) + 1)
+    segment_minx = numpy.minimum(cx0, cx1) - eps
+    segment_maxx = numpy.maximum(cx0, cx1) + eps
+    edge_minx = numpy.minimum(px_i, px_j)
+    edge_maxx = numpy.maximum(px_i, px_j)
+
+    number_of_slabs = max(1, len(polygon) // edges_per_slab)
+    found_segments = []
+    found_edges = []
+    found_x = []
+    found_y = []
+    for pair_segment, pair_edge in _interval_pairs(
+            numpy.minimum(cy0, cy1) - eps, numpy.maximum(cy0, cy1) + eps,
+            numpy.minimum(py_i, py_j), numpy.maximum(py_i, py_j),
+            number_of_slabs, max_pairs):
+
+        # Prune pairs that do not overlap along x
+        keep = ((segment_minx[pair_segment] <= edge_maxx[pair_edge]) &
+                (edge_minx[pair_edge] <= segment_maxx[pair_segment]))
+        pair_segment = pair_segment[keep]
+        pair_edge = pair_edge[keep]
+
+        mask, xi, yi = _intersect_segments(cx0[pair_segment],
+                                           cy0[pair_segment],
+                                           cx1[pair_segment],
+                                           cy1[pair_segment],
+                                           px_i[pair_edge], py_i[pair_edge],
+                                           px_j[pair_edge], py_j[pair_edge])
+        found_segments.append(pair_segment[mask])
+        found_edges.append(pair_edge[mask])
+        found_x.append(xi[mask])
+        found_y.append(yi[mask])
+
+    # Points of each segment are its end points and its intersections.
+    # Rank keeps the order used by _clip_line_by_polygon for equal
+    # distances: first end point, last end point, intersections by edge.
+    n = len(candidates)
+    point_segment = numpy.concatenate([numpy.arange(n), numpy.arange(n)] +
+                                      found_segments)
+    point_rank = numpy.concatenate([numpy.zeros(n, dtype=numpy.int),
+                                    numpy.ones(n, dtype=numpy.int)] +
+                                   [edge + 2 for edge in found_edges])
+    points = numpy.zeros((len(point_segment), 2))
+    points[:, 0] = numpy.concatenate([cx0, cx1] + found_x)
+    points[:, 1] = numpy.concatenate([cy0, cy1] + found_y)
+
+    # Sort points by distance from first end point within each segment
+    V = points - numpy.column_stack((cx0, cy0))[point_segment]
+    distances = (V * V).sum(axis=1)
+    idx = numpy.lexsort((point_rank, distances, point_segment))
+    point_segment = point_segment[idx]
+    distances = distances[idx]
+    points = points[idx]
+
+    # Remove duplicate points
+    duplicates = numpy.zeros(len(distances), dtype=bool)
+    duplicates[1:] = ((point_segment[1:] == point_segment[:-1]) &
+                      (distances[1:] - distances[:-1] == 0))
+    point_segment = point_segment[~duplicates]
+    points = points[~duplicates]
+
+    # Cut segments into pieces between consecutive points
+    same = point_segment[1:] == point_segment[:-1]
+    piece_start = points[:-1][same]
+    piece_end = points[1:][same]
+    piece_segment = candidates[point_segment[1:][same]]
+
+    # Separate piece midpoints according to polygon
+    # Deliberately ignore boundary as midpoints by definition
+    # are fully inside or fully outside.
+    midpoints = (piece_start + piece_end) / 2
+    inside, _ = separate_points_by_polygon(midpoints,
+                                           polygon,
+                                           polygon_bbox,
+                                           check_input=False,
+                                           closed=closed,
+                                           method='slabs')
+    piece_inside = numpy.zeros(len(midpoints), dtype=bool)
+    piece_inside[inside] = True
+
+    # Add segments outside bounding box as pieces outside polygon
+    # and order all pieces along their lines
+    outside_segments = numpy.where(outside_bbox)[0]
+    piece_segment = numpy.concatenate((piece_segment, outside_segments))
+    piece_inside = numpy.concatenate((piece_inside,
+                                      numpy.zeros(len(outside_segments),
+                                                  dtype=bool)))
+    piece_start = numpy.concatenate((piece_start,
+                                     numpy.column_stack(
+                                         (x0, y0))[outside_segments]))
+    piece_end = numpy.concatenate((piece_end,
+                                   numpy.column_stack(
+                                       (x1, y1))[outside_segments]))
+
+    idx = numpy.argsort(piece_segment, kind='mergesort')
+    piece_segment = piece_segment[idx]
+    piece_inside = piece_inside[idx]
+    piece_start = piece_start[idx]
+    piece_end = piece_end[idx]
+
+    # Rejoin adjacent pieces and add to result lines
+    for flag, result in [(True, inside_line_segments),
+                         (False, outside_line_segments)]:
+        selected = numpy.where(piece_inside == flag)[0]
+        if len(selected) == 0:
+            continue
+
+        line = segment_line[piece_segment[selected]]
+        start = piece_start[selected]
+        end = piece_end[selected]
+
+        # Pieces are adjacent if they belong to the same line and the end
+        # of one is close to the start of the next (as numpy.allclose in
+        # join_line_segments).
+        rtol = atol = 1.0e-12
+        adjacent = numpy.zeros(len(selected), dtype=bool)
+        adjacent[1:] = ((line[1:] == line[:-1]) &
+                        numpy.all(numpy.abs(end[:-1] - start[1:]) <=
+                                  atol + rtol * numpy.abs(start[1:]),
+                                  axis=1))
+
+        # Each joined line holds the start of its first piece followed by
+        # the ends of all its pieces
+        first = numpy.where(~adjacent)[0]
+        joined = numpy.cumsum(~adjacent) - 1
+        line_start = first + numpy.arange(len(first))
+        joined_vertices = numpy.zeros((len(selected) + len(first), 2))
+        joined_vertices[line_start] = start[first]
+        joined_vertices[numpy.arange(len(selected)) + joined + 1] = end
+
+        joined_lines = numpy.split(joined_vertices, line_start[1:])
+        for k, joined_line in zip(line[first], joined_lines):
+            result[k].append(joined_line)
+
+    return inside_line_segments, outside_line_segments
+
+
 def clip_line_by_polygon(line, polygon,
                          closed=True,
                          polygon_bbox=None,
@@ -1271,9 +1924,247 @@ def intersection(line0, line1):
     return result
 
 
+def _intersect_segments(x0, y0, x1, y1, x2, y2, x3, y3):
+    """Intersections between pairs of line segments
+
+    Same formula as intersection, but vectorised over both segments.
+
+    Input:
+        x0, y0, x1, y1: Arrays with end points of first segments
+        x2, y2, x3, y3: Arrays (or scalars) with end points of second segments
+
+    Output:
+        mask: Boolean array which is True where segments intersect
+        x, y: Arrays with intersection points (only valid where mask is True)
+    """
+
+    # Calculate denominator (lines are parallel if it is 0)
+    y3y2 = y3 - y2
+    x3x2 = x3 - x2
+    x1x0 = x1 - x0
+    y1y0 = y1 - y0
+    x2x0 = x2 - x0
+    y2y0 = y2 - y0
+    denominator = y3y2 * x1x0 - x3x2 * y1y0
+
+    # Suppress numpy warnings (as we'll be dividing by zero)
+    original_numpy_settings = numpy.seterr(invalid='ignore', divide='ignore')
+
+    u0 = (y3y2 * x2x0 - x3x2 * y2y0) / denominator
+    u1 = (x2x0 * y1y0 - y2y0 * x1x0) / denominator
+
+    # Only points that lie within given line segments are true intersections
+    mask = (0.0 <= u0) * (u0 <= 1.0) * (0.0 <= u1) * (u1 <= 1.0)
+
+    # Calculate intersection points
+    x = x0 + u0 * x1x0
+    y = y0 + u0 * y1y0
+
+    # Restore numpy warnings
+    numpy.seterr(**original_numpy_settings)
+
+    return mask, x, y
+
+
 # Main functions for polygon clipping
 # FIXME (Ole): Both can be rigged to return points or lines
 # outside any polygon by adding that as the entry in the list returned
+def rasterize_polygons(polygons, geotransform, shape):
+    """Burn polygon ids into a label grid
+
+    Args:
+        * polygons: list of polygon geometry objects or list of polygon arrays
+        * geotransform: 6-tuple used to locate the grid geographically
+            (top left x, w-e pixel resolution, rotation,
+            top left y, rotation, n-s pixel resolution)
+        * shape: Shape (rows, columns) of the grid
+
+    Returns:
+        labels: Integer array of the given shape holding for each grid cell
+            the index of the first polygon containing its centre or -1 if
+            none does.
+
+    .. note:: Grid points are pixel-registered as for
+        :func:`clip_grid_by_polygons` and points on the boundary of a
+        polygon (including boundaries of holes) are inside it.
+
+        Each polygon is scanned one row of cell centres at a time: The
+        crossings of its edges with the row are sorted and consecutive
+        pairs of crossings delimit spans of cells inside the polygon
+        (even-odd rule, so holes are left out). Polygons are burned in
+        reverse order so the first polygon wins where polygons overlap.
+    """
+
+    ny, nx = shape
+    x, y = geotransform_to_axes(geotransform, nx, ny)
+
+    labels = -numpy.ones((ny, nx), dtype=numpy.int)
+    for i in range(len(polygons) - 1, -1, -1):
+        polygon = polygons[i]
+        if hasattr(polygon, 'outer_ring'):
+            rings = [polygon.outer_ring] + list(polygon.inner_rings)
+        else:
+            # Assume it is an array
+            rings = [polygon]
+
+        rows, columns = _polygon_cells(rings, x, y)
+
+        # Rows of the grid are counted from the north
+        labels[ny - 1 - rows, columns] = i
+
+    return labels
+
+
+def _polygon_cells(rings, x, y):
+    """Cells of grid with centre inside or on the boundary of polygon
+
+    Input:
+       rings: List of Nx2 arrays with outer ring and inner rings (holes)
+       x, y: Increasing coordinates of cell centres along each axis
+
+    Output:
+       rows, columns: Indices into y and x of cells inside polygon. Cells
+       may be listed more than once.
+    """
+
+    # Edges from each vertex to the next (cyclic) in the same ring
+    start_points = []
+    end_points = []
+    for ring in rings:
+        ring = ensure_numeric(ring, numpy.float)
+        if len(ring) == 0:
+            continue
+        start_points.append(ring)
+        end_points.append(numpy.roll(ring, -1, axis=0))
+
+    if len(start_points) == 0:
+        return numpy.zeros(0, dtype=numpy.int), numpy.zeros(0, dtype=numpy.int)
+
+    p0 = numpy.concatenate(start_points)
+    p1 = numpy.concatenate(end_points)
+    x0 = p0[:, 0]
+    y0 = p0[:, 1]
+    x1 = p1[:, 0]
+    y1 = p1[:, 1]
+
+    # Crossings of non horizontal edges with rows of cell centres. Rows
+    # are half open at the top of each edge so that every row crosses a
+    # closed ring an even number of times.
+    k = numpy.where(y0 != y1)[0]
+    lower = numpy.minimum(y0[k], y1[k])
+    upper = numpy.maximum(y0[k], y1[k])
+    first = numpy.searchsorted(y, lower, side='left')
+    count = numpy.searchsorted(y, upper, side='left') - first
+    edges = numpy.repeat(k, count)
+    rows = numpy.repeat(first, count) + _ragged_arange(count)
+    crossings = x0[edges] + ((y[rows] - y0[edges]) *
+                             (x1[edges] - x0[edges]) / (y1[edges] - y0[edges]))
+
+    # Spans between consecutive pairs of crossings in each row
+    idx = numpy.lexsort((crossings, rows))
+    rows = rows[idx][::2]
+    start = crossings[idx][::2]
+    end = crossings[idx][1::2]
+
+    # Boundary points exactly on rows of cell centres: horizontal edges
+    # and vertices (e.g. a peak of the polygon touching a row)
+    k = numpy.where(y0 == y1)[0]
+    on_row = numpy.searchsorted(y, y0, side='left')
+    on_row = numpy.minimum(on_row, len(y) - 1)
+    k = k[y[on_row[k]] == y0[k]]
+    v = numpy.where(y[on_row] == y0)[0]
+    rows = numpy.concatenate((rows, on_row[k], on_row[v]))
+    start = numpy.concatenate((start, numpy.minimum(x0[k], x1[k]), x0[v]))
+    end = numpy.concatenate((end, numpy.maximum(x0[k], x1[k]), x0[v]))
+
+    # Cells with centres inside each span (end points included)
+    first = numpy.searchsorted(x, start, side='left')
+    count = numpy.maximum(numpy.searchsorted(x, end, side='right') - first,
+                          0)
+    columns = numpy.repeat(first, count) + _ragged_arange(count)
+    rows = numpy.repeat(rows, count)
+
+    return rows, columns
+
+
+def zonal_statistics(labels, A, number_of_zones=None, threshold=None):
+    """Statistics of grid values within each zone of a label grid
+
+    Args:
+        * labels: Integer array of zone ids (e.g. made by rasterize_polygons)
+            with negative values for cells outside all zones
+        * A: Array of grid values of the same shape as labels
+        * number_of_zones: Number of zones. If None (default) it is one
+            more than the largest zone id.
+        * threshold: Optional value. If given, the number of values
+            exceeding it and their fraction of all values are also
+            computed for each zone.
+
+    Returns:
+        Dictionary with arrays 'count', 'sum', 'mean', 'min' and 'max' each
+        with one entry per zone. Values that are nan are left out. Zones
+        without values have count and sum 0 and nan mean, min and max.
+        If threshold is given, the dictionary also holds 'exceedance'
+        (counts of values > threshold) and 'fraction' (exceedance / count,
+        nan for zones without values).
+
+    Note:
+        Counts and sums come from one numpy.bincount pass. Minima and
+        maxima are reduced over the values sorted by zone.
+    """
+
+    labels = ensure_numeric(labels, numpy.int).reshape(-1)
+    values = ensure_numeric(A, numpy.float).reshape(-1)
+
+    msg = ('Labels and grid values must have the same number of cells. '
+           'I got %i and %i' % (len(labels), len(values)))
+    if len(labels) != len(values):
+        raise InaSAFEError(msg)
+
+    if number_of_zones is None:
+        number_of_zones = 0
+        if len(labels) > 0:
+            number_of_zones = max(numpy.max(labels) + 1, 0)
+
+    valid = (labels >= 0) & (labels < number_of_zones) & ~numpy.isnan(values)
+    labels = labels[valid]
+    values = values[valid]
+
+    minlength = max(number_of_zones, 1)
+    count = numpy.bincount(labels, minlength=minlength)[:number_of_zones]
+    total = numpy.bincount(labels, weights=values,
+                           minlength=minlength)[:number_of_zones]
+
+    minimum = numpy.zeros(number_of_zones)
+    maximum = numpy.zeros(number_of_zones)
+    minimum[:] = maximum[:] = numpy.nan
+    nonempty = count > 0
+    if numpy.any(nonempty):
+        ordered = values[numpy.argsort(labels, kind='mergesort')]
+        starts = (numpy.cumsum(count) - count)[nonempty]
+        minimum[nonempty] = numpy.minimum.reduceat(ordered, starts)
+        maximum[nonempty] = numpy.maximum.reduceat(ordered, starts)
+
+    mean = numpy.zeros(number_of_zones)
+    mean[:] = numpy.nan
+    mean[nonempty] = total[nonempty] / count[nonempty]
+
+    stats = {'count': count, 'sum': total, 'mean': mean,
+             'min': minimum, 'max': maximum}
+
+    if threshold is not None:
+        exceedance = numpy.bincount(labels[values > threshold],
+                                    minlength=minlength)[:number_of_zones]
+        fraction = numpy.zeros(number_of_zones)
+        fraction[:] = numpy.nan
+        fraction[nonempty] = (exceedance[nonempty] /
+                              count[nonempty].astype(numpy.float))
+        stats['exceedance'] = exceedance
+        stats['fraction'] = fraction
+
+    return stats
+
+
 def clip_grid_by_polygons(A, geotransform, polygons):
     """Clip raster grid by polygon.
 
@@ -1297,46 +2188,46 @@ def clip_grid_by_polygons(A, geotransform, polygons):
 
         If multiple polygons overlap, the one first encountered will be used.
 
+        Polygons are burned into a label grid by :func:`rasterize_polygons`
+        so coordinates are only generated for grid points inside polygons.
     """
 
-    # Convert raster grid to Nx2 array of points and an N array of pixel values
     ny, nx = A.shape
     x, y = geotransform_to_axes(geotransform, nx, ny)
-    points, values = grid_to_points(A, x, y)
+    labels = rasterize_polygons(polygons, geotransform, A.shape).reshape(-1)
+
+    # Grid points inside polygons in row major order grouped by polygon
+    cells = numpy.where(labels >= 0)[0]
+    cells = cells[numpy.argsort(labels[cells], kind='mergesort')]
+    counts = numpy.bincount(labels[cells],
+                            minlength=max(len(polygons), 1))[:len(polygons)]
+
+    # Point k lies in row k / nx (counted from the north) and column k % nx
+    points = numpy.zeros((len(cells), 2))
+    points[:, 0] = x[cells % nx]
+    points[:, 1] = y[ny - 1 - cells // nx]
+    values = A.reshape(-1)[cells]
 
     # Generate list of points and values that fall inside each polygon
     points_covered = []
-    remaining_points = points
-    remaining_values = values
+    start = 0
+    for count in counts:
+        points_covered.append((points[start:start + count],
+                               values[start:start + count]))
+        start += count
 
-    for polygon in polygons:
-        #print 'Remaining points', len(remaining_points)
+    return points_covered
 
-        if hasattr(polygon, 'outer_ring'):
-            outer_ring = polygon.outer_ring
-            inner_rings = polygon.inner_rings
-        else:
-            # Assume it is an array
-            outer_ring = polygon
-            inner_rings = None
-
-        inside, outside = in_and_outside_polygon(remaining_points,
-                                                 outer_ring,
-                                                 holes=inner_rings,
-                                                 closed=True,
-                                                 check_input=False)
-        # Add features inside this polygon
-        points_covered.append((remaining_points[inside],
-                               remaining_values[inside]))
-
-        # Select remaining points to clip
-        remaining_points = remaining_points[outside]
-        remaining_values = remaining_values[outside]
 
-    return points_covered
+def _drop_zero_length(lines):
+    """Lines of list that have non-zero length
+    """
+
+    return [line for line in lines if numpy.any(line[1:] != line[:-1])]
 
 
-def clip_lines_by_polygons(lines, polygons, check_input=True, closed=True):
+def clip_lines_by_polygons(lines, polygons, check_input=True, closed=True,
+                           overlapping=True):
     """Clip multiple lines by multiple polygons
 
     Args:
@@ -1350,14 +2241,22 @@ def clip_lines_by_polygons(lines, polygons, check_input=True, closed=True):
             algorithm up but lines on boundaries may or may not be
             deemed to fall inside the polygon and so will be
             indeterministic.
+        * overlapping: If True (default) every polygon gets all parts of
+            lines inside it. Set to False to assign parts of lines inside
+            overlapping polygons to the first polygon only. Only the parts
+            of lines outside a polygon are then clipped by the following
+            polygons so the work shrinks as lines are consumed.
 
     Returns:
         lines_covered: List of polylines inside a polygon -o ne per input
-        polygon.
-
-
-    .. note:: If multiple polygons overlap, the one first encountered will be
-        used.
+        polygon. Each element is a dictionary with the indices of the input
+        lines as keys and the list of lines clipped from that parent line
+        by the polygon as values. If overlapping is False, lines without
+        parts inside the polygon may be missing from the dictionary and
+        looking them up gives an empty list.
+
+    .. note:: Lines of zero length, e.g. from lines touching a polygon
+        boundary, are left out.
     """
 
     if check_input:
@@ -1385,32 +2284,357 @@ def clip_lines_by_polygons(lines, polygons, check_input=True, closed=True):
     lines_covered = []
     remaining_lines = lines
 
+    # Index of the input line each remaining line was clipped from
+    parent_ids = range(len(lines))
+
     # Clip lines to polygons
     for polygon in polygons:
-    #for i, polygon in enumerate(polygons):
-        #print ('Doing polygon %i (%i vertices) of %i with '
-        #       '%i lines' % (i, len(polygon),
-        #                     len(polygons),
-        #                     len(remaining_lines)))
-        inside_lines, _ = clip_lines_by_polygon(remaining_lines,
-                                                polygon,
-                                                check_input=False)
-        #print ('- %i segments were inside'
-        #       % len(line_dictionary_to_geometry(inside_lines)))
+        inside_lines, outside_lines = clip_lines_by_polygon(remaining_lines,
+                                                            polygon,
+                                                            closed=closed,
+                                                            check_input=False)
+        if overlapping:
+            # All lines are clipped by every polygon
+            for k in inside_lines:
+                inside_lines[k] = _drop_zero_length(inside_lines[k])
+            lines_covered.append(inside_lines)
+            continue
+
+        # Record lines inside this polygon by parent line
+        covered = defaultdict(list)
 
-        # Record lines inside this polygon
-        lines_covered.append(inside_lines)
+        # Use lines outside as remaining lines keeping track of
+        # the parent line to get its attributes
+        remaining_lines = []
+        remaining_parent_ids = []
+        for k, parent_id in enumerate(parent_ids):
+            if inside_lines[k]:
+                covered[parent_id].extend(
+                    _drop_zero_length(inside_lines[k]))
+            outside = _drop_zero_length(outside_lines[k])
+            remaining_lines.extend(outside)
+            remaining_parent_ids.extend([parent_id] * len(outside))
 
-        # Use lines outside as remaining lines
-        # FIXME (Ole): This optimisation needs some thought
-        # as lines are often partially clipped. We also need to keep
-        # track of the parent line to get its attributes if we want
-        # to go down this road
-        #remaining_lines = outside_lines
+        lines_covered.append(covered)
+        parent_ids = remaining_parent_ids
 
     return lines_covered
 
 
+def split_lines_by_grid(lines, geotransform):
+    """Split lines at the cell boundaries of a grid
+
+    Args:
+        * lines: Sequence of polylines: [[p0, p1, ...], [q0, q1, ...], ...]
+            where pi and qi are point coordinates (x, y).
+        * geotransform: GDAL geotransform (6-tuple) of the grid.
+            (top left x, w-e pixel resolution, rotation,
+            top left y, rotation, n-s pixel resolution).
+
+    Returns:
+        * line_ids: Array with index of the line each piece belongs to
+        * pieces: Px2x2 array of straight pieces [[x0, y0], [x1, y1]]
+            each falling within one grid cell. Pieces are ordered along
+            the lines they belong to.
+
+    Note:
+        All segments are split in one vectorised pass. Crossings with the
+        vertical and horizontal cell boundaries are found from the cell
+        coordinates of the segment end points. Pieces of zero length are
+        left out.
+    """
+
+    pieces = numpy.zeros((0, 2, 2))
+    line_ids = numpy.zeros(0, dtype=numpy.int)
+
+    counts = numpy.array([len(line) for line in lines], dtype=numpy.int)
+    nonempty = numpy.where(counts > 0)[0]
+    if len(nonempty) == 0:
+        return line_ids, pieces
+
+    # Segments formed by each vertex and the next in the same line
+    counts = counts[nonempty]
+    vertices = ensure_numeric(numpy.concatenate([lines[k]
+                                                 for k in nonempty]),
+                              numpy.float)
+    is_start = numpy.ones(len(vertices), dtype=bool)
+    is_start[numpy.cumsum(counts) - 1] = False
+    start_vertex = numpy.where(is_start)[0]
+    segment_line = numpy.repeat(nonempty, counts)[start_vertex]
+    p0 = vertices[start_vertex]
+    p1 = vertices[start_vertex + 1]
+    N = len(start_vertex)
+
+    # Parameters t along each segment where it crosses cell boundaries
+    # in x (dimension 0) and y (dimension 1)
+    crossing_segments = []
+    crossing_t = []
+    for dim, origin, resolution in [(0, geotransform[0], geotransform[1]),
+                                    (1, geotransform[3], geotransform[5])]:
+        u0 = (p0[:, dim] - origin) / resolution
+        u1 = (p1[:, dim] - origin) / resolution
+        first = numpy.floor(numpy.minimum(u0, u1)) + 1
+        last = numpy.ceil(numpy.maximum(u0, u1)) - 1
+        count = numpy.maximum(last - first + 1, 0).astype(numpy.int)
+
+        segments = numpy.repeat(numpy.arange(N), count)
+        boundary = origin + (numpy.repeat(first, count) +
+                             _ragged_arange(count)) * resolution
+        start = p0[segments, dim]
+        crossing_t.append((boundary - start) / (p1[segments, dim] - start))
+        crossing_segments.append(segments)
+
+    # Points along each segment sorted by t. End points are copied
+    # exactly and crossings at grid corners are only used once.
+    point_segment = numpy.concatenate([numpy.arange(N), numpy.arange(N)] +
+                                      crossing_segments)
+    t = numpy.concatenate([numpy.zeros(N), numpy.ones(N)] + crossing_t)
+    idx = numpy.lexsort((t, point_segment))
+    point_segment = point_segment[idx]
+    t = t[idx]
+
+    keep = numpy.ones(len(t), dtype=bool)
+    keep[1:] = (point_segment[1:] != point_segment[:-1]) | (t[1:] != t[:-1])
+    point_segment = point_segment[keep]
+    t = t[keep]
+
+    d = p1 - p0
+    points = p0[point_segment] + t[:, numpy.newaxis] * d[point_segment]
+    points[t == 0] = p0[point_segment[t == 0]]
+    points[t == 1] = p1[point_segment[t == 1]]
+
+    # Pieces between consecutive points within each segment
+    same = point_segment[1:] == point_segment[:-1]
+    start = points[:-1][same]
+    end = points[1:][same]
+    nonzero = numpy.any(start != end, axis=1)
+
+    line_ids = segment_line[point_segment[1:][same][nonzero]]
+    pieces = numpy.zeros((len(line_ids), 2, 2))
+    pieces[:, 0, :] = start[nonzero]
+    pieces[:, 1, :] = end[nonzero]
+
+    return line_ids, pieces
+
+
+def polygon_to_trapezoids(rings):
+    """Decompose polygon into convex trapezoids
+
+    Args:
+        * rings: List of Nx2 arrays with the outer ring followed by any
+            inner rings (holes) of a polygon. Rings may be open or closed.
+
+    Returns:
+        * trapezoids: Kx4x2 array of trapezoid vertices in counter
+            clockwise order starting at the lower left corner. Bottom and
+            top edges are horizontal and one of them may have zero length
+            (triangles). The trapezoids do not overlap and their union is
+            the polygon.
+
+    Note:
+        This is a vertical decomposition: The plane is divided into
+        horizontal slabs at the y coordinate of every vertex. Within a slab
+        the polygon edges crossing it are sorted by x and consecutive pairs
+        bound the interior (even-odd rule) so holes are left out. Trapezoids
+        in consecutive slabs bounded by the same pair of edges are merged.
+        All slabs are processed in one vectorised pass.
+    """
+
+    trapezoids = numpy.zeros((0, 4, 2))
+
+    # Edges from each vertex to the next (cyclic) in the same ring
+    start_points = []
+    end_points = []
+    for ring in rings:
+        ring = ensure_numeric(ring, numpy.float)
+        if len(ring) < 3:
+            continue
+        start_points.append(ring)
+        end_points.append(numpy.roll(ring, -1, axis=0))
+
+    if len(start_points) == 0:
+        return trapezoids
+
+    p0 = numpy.concatenate(start_points)
+    p1 = numpy.concatenate(end_points)
+
+    # Orient edges upwards and leave out horizontal ones
+    flip = p0[:, 1] > p1[:, 1]
+    p0[flip], p1[flip] = p1[flip], p0[flip]
+    keep = p1[:, 1] > p0[:, 1]
+    x0 = p0[keep, 0]
+    y0 = p0[keep, 1]
+    x1 = p1[keep, 0]
+    y1 = p1[keep, 1]
+    if len(x0) == 0:
+        return trapezoids
+    slope = (x1 - x0) / (y1 - y0)
+
+    def x_at(edges, y):
+        """x coordinates of edges at y using end points exactly
+        """
+        x = x0[edges] + (y - y0[edges]) * slope[edges]
+        x = numpy.where(y == y0[edges], x0[edges], x)
+        x = numpy.where(y == y1[edges], x1[edges], x)
+        return x
+
+    # Each edge spans a contiguous range of slabs
+    levels = numpy.unique(numpy.concatenate((y0, y1)))
+    first = numpy.searchsorted(levels, y0)
+    count = numpy.searchsorted(levels, y1) - first
+    edge_ids = numpy.repeat(numpy.arange(len(x0)), count)
+    slab_ids = numpy.repeat(first, count) + _ragged_arange(count)
+
+    # Sort edges by their x coordinate in the middle of each slab
+    middle = (levels[slab_ids] + levels[slab_ids + 1]) / 2
+    idx = numpy.lexsort((x_at(edge_ids, middle), slab_ids))
+    edge_ids = edge_ids[idx]
+    slab_ids = slab_ids[idx]
+
+    # Pair edges within each slab. Slabs of invalid (self intersecting)
+    # polygons may have an odd number of edges of which the last is
+    # left out.
+    rank = numpy.arange(len(slab_ids)) - numpy.searchsorted(slab_ids,
+                                                            slab_ids)
+    left = numpy.where(rank % 2 == 0)[0]
+    left = left[left + 1 < len(slab_ids)]
+    left = left[slab_ids[left + 1] == slab_ids[left]]
+    L = edge_ids[left]
+    R = edge_ids[left + 1]
+    S = slab_ids[left]
+
+    # Merge runs of consecutive slabs with the same pair of edges
+    idx = numpy.lexsort((S, R, L))
+    L = L[idx]
+    R = R[idx]
+    S = S[idx]
+    new = numpy.ones(len(S), dtype=bool)
+    new[1:] = (L[1:] != L[:-1]) | (R[1:] != R[:-1]) | (S[1:] != S[:-1] + 1)
+    first = numpy.where(new)[0]
+    last = numpy.append(first[1:], len(S)) - 1
+
+    L = L[first]
+    R = R[first]
+    bottom = levels[S[first]]
+    top = levels[S[last] + 1]
+
+    trapezoids = numpy.zeros((len(first), 4, 2))
+    trapezoids[:, 0, 0] = x_at(L, bottom)
+    trapezoids[:, 1, 0] = x_at(R, bottom)
+    trapezoids[:, 2, 0] = x_at(R, top)
+    trapezoids[:, 3, 0] = x_at(L, top)
+    trapezoids[:, :2, 1] = bottom[:, numpy.newaxis]
+    trapezoids[:, 2:, 1] = top[:, numpy.newaxis]
+
+    return trapezoids
+
+
+def clip_rings_by_convex_polygons(vertices, offsets, ring_ids,
+                                  convex_polygons, convex_ids):
+    """Clip rings by convex polygons (Sutherland-Hodgman)
+
+    Args:
+        * vertices: Mx2 array of ring vertices packed one ring after the
+            other.
+        * offsets: Array of R + 1 offsets such that ring i is
+            vertices[offsets[i]:offsets[i + 1]].
+        * ring_ids, convex_ids: Arrays of equal length with the pairs of
+            ring and convex polygon to clip.
+        * convex_polygons: KxCx2 array of convex polygons with vertices in
+            counter clockwise order such as made by polygon_to_trapezoids.
+            Edges of zero length are allowed.
+
+    Returns:
+        * vertices: Array of vertices of clipped rings
+        * offsets: Array of P + 1 offsets into vertices where P is the
+            number of pairs. Clipped ring k corresponds to pair k and is
+            empty if the ring is outside the convex polygon. Non empty
+            rings are closed, i.e. their last vertex is the first one.
+
+    Note:
+        All pairs are clipped together, one convex polygon edge at a time.
+        Clipped rings preserve the orientation of the original rings. If
+        the intersection of a non convex ring and a convex polygon has
+        several parts, they are joined by edges of zero area along the
+        boundary of the convex polygon so areas are still correct.
+    """
+
+    vertices = ensure_numeric(vertices, numpy.float)
+    offsets = ensure_numeric(offsets, numpy.int)
+    convex_polygons = ensure_numeric(convex_polygons, numpy.float)
+    ring_ids = ensure_numeric(ring_ids, numpy.int)
+    convex_ids = ensure_numeric(convex_ids, numpy.int)
+
+    P = len(ring_ids)
+    msg = ('Arrays ring_ids and convex_ids must have the same length. '
+           'I got %i and %i' % (P, len(convex_ids)))
+    if len(convex_ids) != P:
+        raise PolygonInputError(msg)
+
+    if P == 0:
+        return numpy.zeros((0, 2)), numpy.zeros(1, dtype=numpy.int)
+
+    # Expand vertices of each ring once for every pair it takes part in
+    counts = offsets[ring_ids + 1] - offsets[ring_ids]
+    points = vertices[numpy.repeat(offsets[ring_ids], counts) +
+                      _ragged_arange(counts)]
+
+    C = convex_polygons.shape[1]
+    for k in range(C):
+        starts = numpy.cumsum(counts) - counts
+        owner = numpy.repeat(numpy.arange(P), counts)
+
+        # Signed distance (scaled) to the left of edge a -> b
+        a = convex_polygons[convex_ids, k]
+        b = convex_polygons[convex_ids, (k + 1) % C]
+        ab = (b - a)[owner]
+        ap = points - a[owner]
+        s = ab[:, 0] * ap[:, 1] - ab[:, 1] * ap[:, 0]
+        inside = s >= 0
+
+        # Previous vertex in the same ring (cyclic)
+        previous = numpy.arange(len(points)) - 1
+        nonempty = counts > 0
+        previous[starts[nonempty]] = (starts + counts - 1)[nonempty]
+
+        # Output a crossing point for each edge crossing the line followed
+        # by the vertex itself if it is inside
+        crossing = inside != inside[previous]
+        number = inside.astype(numpy.int) + crossing
+        position = numpy.cumsum(number) - number
+
+        new_points = numpy.zeros((numpy.sum(number), 2))
+        c = numpy.where(crossing)[0]
+        q = previous[c]
+        t = s[q] / (s[q] - s[c])
+        new_points[position[c]] = (points[q] + t[:, numpy.newaxis] *
+                                   (points[c] - points[q]))
+        i = numpy.where(inside)[0]
+        new_points[position[i] + crossing[i]] = points[i]
+
+        points = new_points
+        counts = numpy.bincount(owner, weights=number,
+                                minlength=P).astype(numpy.int)
+
+    # Close rings whose last vertex differs from the first. This is the
+    # case whenever the first vertex was outside one of the edges.
+    starts = numpy.cumsum(counts) - counts
+    close = numpy.zeros(P, dtype=bool)
+    nonempty = counts > 0
+    close[nonempty] = numpy.any(points[starts[nonempty]] !=
+                                points[(starts + counts - 1)[nonempty]],
+                                axis=1)
+
+    offsets = numpy.zeros(P + 1, dtype=numpy.int)
+    numpy.cumsum(counts + close, out=offsets[1:])
+    owner = numpy.repeat(numpy.arange(P), counts)
+    closed_points = numpy.zeros((offsets[-1], 2))
+    closed_points[numpy.arange(len(points)) + numpy.cumsum(close)[owner] -
+                  close[owner]] = points
+    closed_points[offsets[1:][close] - 1] = points[starts[close]]
+    return closed_points, offsets
+
+
 def polygon2segments(polygon):
     """Convert polygon to segments structure suitable for use in intersection
 
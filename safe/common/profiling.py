@@ -0,0 +1,228 @@
+"""**Profiling of the start up of headless runs.**
+
+.. tip::
+   Measures the time taken to import each module, to make the impact
+   functions available, to set up translations and to read the first layer
+   and records the results as JSON so they can be compared between
+   versions. Run it as::
+
+       python -m safe.common.profiling --output startup.json \
+           --layer /path/to/layer.tif
+
+   Only the standard library is imported by this module so that the
+   imports of the modules being profiled are measured in full. Modules
+   imported before profiling starts (safe, safe.common and
+   safe.common.version when run as above) are not measured.
+"""
+
+import __builtin__
+import argparse
+import json
+import platform
+import sys
+from timeit import default_timer as timer
+
+# Modules imported by a headless run
+STARTUP_MODULES = ['safe.api']
+
+
+def imported_module_name(name, global_dict, level):
+    """Full name of module imported by an import statement
+
+    Input:
+        name: Name given to __import__
+        global_dict: Globals of the importing module
+        level: Level given to __import__
+
+    Output:
+        Name of the module in sys.modules. Implicit relative imports
+        (python 2) are resolved against the package of the importing module.
+    """
+
+    if level == 0 or not global_dict or '__name__' not in global_dict:
+        return name
+
+    package = global_dict['__name__']
+    if '__path__' not in global_dict:
+        package = package.rpartition('.')[0]
+    if level > 1:
+        package = package.rsplit('.', level - 1)[0]
+
+    candidate = '%s.%s' % (package, name) if name else package
+    if sys.modules.get(candidate) is not None:
+        return candidate
+    return name
+
+
+class ImportProfiler(object):
+    """Measure the time taken to import each module
+
+    While started, all import statements are timed. Imports that load
+    new modules are recorded with
+
+    * module: Name of the imported module
+    * cumulative: Time in seconds including the imports done by the module
+    * self: Time in seconds excluding the imports done by the module
+    """
+
+    def __init__(self):
+        self.records = []
+        self._import = None
+        self._nested = []
+
+    def start(self):
+        """Start timing imports
+        """
+
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+
+    def stop(self):
+        """Stop timing imports
+        """
+
+        if self._import is not None:
+            __builtin__.__import__ = self._import
+            self._import = None
+
+    def _timed_import(self, name, global_dict=None, local_dict=None,
+                      fromlist=None, level=-1):
+        number_of_modules = len(sys.modules)
+        self._nested.append(0.0)
+        t0 = timer()
+        try:
+            return self._import(name, global_dict, local_dict, fromlist,
+                                level)
+        finally:
+            elapsed = timer() - t0
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+
+            if len(sys.modules) > number_of_modules:
+                module = imported_module_name(name, global_dict, level)
+                self.records.append({'module': module,
+                                     'cumulative': elapsed,
+                                     'self': elapsed - nested})
+
+    def get_records(self):
+        """Recorded imports, slowest first
+        """
+
+        return sorted(self.records, key=lambda x: x['cumulative'],
+                      reverse=True)
+
+
+def time_call(func, *args, **kwargs):
+    """Call function and return the time it took in seconds
+    """
+
+    t0 = timer()
+    func(*args, **kwargs)
+    return timer() - t0
+
+
+def profile_startup(modules=None, layer_filename=None):
+    """Measure the start up of a headless run
+
+    Input:
+        modules: Names of modules to import. Default is STARTUP_MODULES.
+        layer_filename: Optional layer to read with read_layer
+
+    Output:
+        Dictionary with
+
+        * python: Python version
+        * platform: Platform description
+        * modules: Names of the modules imported
+        * imports: Records of ImportProfiler for all imported modules,
+          slowest first
+        * steps: Times in seconds of
+
+          - import: Importing modules
+          - load_plugins: Making impact functions available again
+          - plugin_index: Finding admissible impact functions the first time
+          - translation: Translating the first string
+          - read_layer: Reading layer_filename (if given)
+    """
+
+    if modules is None:
+        modules = STARTUP_MODULES
+
+    steps = {}
+    profiler = ImportProfiler()
+    profiler.start()
+    try:
+        t0 = timer()
+        for module in modules:
+            __import__(module)
+        steps['import'] = timer() - t0
+    finally:
+        profiler.stop()
+
+    from safe.impact_functions import load_plugins, get_admissible_plugins
+    from safe.common.utilities import ugettext
+
+    steps['load_plugins'] = time_call(load_plugins)
+    steps['plugin_index'] = time_call(get_admissible_plugins,
+                                      {'category': 'hazard'})
+    steps['translation'] = time_call(ugettext, 'Need evacuation')
+
+    if layer_filename is not None:
+        from safe.storage.core import read_layer
+        steps['read_layer'] = time_call(read_layer, layer_filename)
+
+    return {'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'modules': list(modules),
+            'imports': profiler.get_records(),
+            'steps': steps}
+
+
+def write_profile(profile, filename):
+    """Write profile as returned by profile_startup to JSON file
+    """
+
+    fid = open(filename, 'w')
+    try:
+        json.dump(profile, fid, indent=2, sort_keys=True)
+    finally:
+        fid.close()
+
+
+def main(argv=None):
+    """Profile start up from the command line
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Profile the start up of headless InaSAFE runs')
+    parser.add_argument('-o', '--output',
+                        help='Name of JSON file to write results to')
+    parser.add_argument('-l', '--layer',
+                        help='Layer to read after start up')
+    parser.add_argument('-m', '--module', action='append',
+                        help='Module to import (default %s). May be '
+                             'given several times.'
+                             % ', '.join(STARTUP_MODULES))
+    parser.add_argument('-n', '--number', type=int, default=20,
+                        help='Number of slowest imports to print')
+    args = parser.parse_args(argv)
+
+    profile = profile_startup(modules=args.module,
+                              layer_filename=args.layer)
+
+    print 'Slowest imports (cumulative / self seconds):'
+    for record in profile['imports'][:args.number]:
+        print '  %8.4f %8.4f  %s' % (record['cumulative'], record['self'],
+                                     record['module'])
+    print 'Steps (seconds):'
+    for name, value in sorted(profile['steps'].items()):
+        print '  %8.4f  %s' % (value, name)
+
+    if args.output is not None:
+        write_profile(profile, args.output)
+        print 'Profile written to %s' % args.output
+
+
+if __name__ == '__main__':
+    main()
@@ -21,7 +21,6 @@ __copyright__ = ('Copyright 2012, Australia Indonesia Facility for '
 import os
 import sys
 import shutil
-from xml.dom import minidom
 from subprocess import call, CalledProcessError
 import logging
 
@@ -182,6 +181,8 @@ class ShakeGridConverter(object):
            single file.
         """
         LOGGER.debug('ParseGridXml requested.')
+        from xml.dom import minidom
+
         my_path = self.grid_file_path()
         try:
             document = minidom.parse(my_path)
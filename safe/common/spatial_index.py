@@ -0,0 +1,365 @@
+"""**Spatial index for point and bounding box data.**
+
+.. tip::
+   Provides a uniform grid index over a fixed set of points so that the
+   candidate points falling inside a bounding box (typically that of a
+   polygon) can be found without scanning all points. This is used to
+   speed up point in polygon separation when many polygons are applied
+   to the same (large) set of points.
+
+   A similar grid index over bounding boxes finds all pairs of overlapping
+   boxes between two sets of geometries, e.g. candidate pairs of hazard
+   and exposure polygons for overlays.
+"""
+
+import numpy
+
+from safe.common.numerics import ensure_numeric
+from safe.common.exceptions import PointsInputError
+
+
+class PointIndex(object):
+    """Uniform grid index over an Nx2 array of points
+
+    Points are bucketed into square cells and stored sorted by cell so that
+    each row of cells occupies one contiguous slice of the permutation
+    array. A bounding box query therefore costs one slice per row of cells
+    overlapped by the box plus an exact bounding box test on the candidates.
+
+    Args:
+        * points: Nx2 array (or list) of point coordinates
+        * cell_size: (optional) Side length of grid cells in the units of
+            the point coordinates. If None, it is chosen so that each cell
+            holds about points_per_cell points on average.
+        * points_per_cell: (optional) Target average cell occupancy used when
+            cell_size is None.
+
+    Example:
+
+        index = PointIndex(points)
+        candidates = index.query([minx, maxx, miny, maxy])
+
+        candidates will hold the (sorted) indices of all points that fall
+        inside or on the given bounding box.
+    """
+
+    def __init__(self, points, cell_size=None, points_per_cell=16):
+        """Build the index - see class docstring for details
+        """
+
+        try:
+            points = ensure_numeric(points, numpy.float)
+        except Exception, e:
+            msg = ('Points could not be converted to numeric array: %s'
+                   % str(e))
+            raise PointsInputError(msg)
+
+        if len(points.shape) == 1 and points.shape[0] == 0:
+            points = points.reshape((0, 2))
+
+        msg = ('Points must be an Nx2 array. I got shape %s'
+               % str(points.shape))
+        if len(points.shape) != 2 or points.shape[1] != 2:
+            raise PointsInputError(msg)
+
+        self.points = points
+        N = points.shape[0]
+
+        if N == 0:
+            self.minx = self.miny = 0.0
+            self.cell_size = 1.0
+            self.nx = self.ny = 1
+            self.order = numpy.arange(0)
+            self.offsets = numpy.zeros(2, dtype=numpy.int)
+            return
+
+        x = points[:, 0]
+        y = points[:, 1]
+        self.minx = x.min()
+        self.miny = y.min()
+        width = x.max() - self.minx
+        height = y.max() - self.miny
+
+        if cell_size is None:
+            number_of_cells = max(1.0, float(N) / points_per_cell)
+            if width > 0 and height > 0:
+                cell_size = numpy.sqrt(width * height / number_of_cells)
+            else:
+                # Points are collinear along one of the axes
+                cell_size = max(width, height) / number_of_cells
+
+            if cell_size <= 0:
+                # All points coincide
+                cell_size = 1.0
+
+        msg = 'Cell size must be positive. I got %s' % str(cell_size)
+        if not cell_size > 0:
+            raise PointsInputError(msg)
+
+        self.cell_size = float(cell_size)
+        self.nx = int(width / self.cell_size) + 1
+        self.ny = int(height / self.cell_size) + 1
+
+        # Bucket points by cell and sort them by cell id (row major)
+        cell_ids = self._cell_ids(x, y)
+        self.order = numpy.argsort(cell_ids, kind='mergesort')
+
+        counts = numpy.bincount(cell_ids, minlength=self.nx * self.ny)
+        self.offsets = numpy.zeros(self.nx * self.ny + 1, dtype=numpy.int)
+        numpy.cumsum(counts, out=self.offsets[1:])
+
+    def __len__(self):
+        """Number of points in index
+        """
+        return self.points.shape[0]
+
+    def _cell_ids(self, x, y):
+        """Map coordinates to row major cell ids
+        """
+
+        ix = numpy.floor((x - self.minx) / self.cell_size).astype(numpy.int)
+        iy = numpy.floor((y - self.miny) / self.cell_size).astype(numpy.int)
+        numpy.clip(ix, 0, self.nx - 1, out=ix)
+        numpy.clip(iy, 0, self.ny - 1, out=iy)
+
+        return iy * self.nx + ix
+
+    def query(self, bbox):
+        """Get indices of points inside bounding box
+
+        Args:
+            * bbox: Bounding box [minx, maxx, miny, maxy] following the
+                convention for polygon_bbox in module polygon.py
+
+        Returns:
+            * indices: Sorted array of indices of points inside or on the
+                bounding box.
+        """
+
+        minx, maxx, miny, maxy = [float(v) for v in bbox]
+
+        # Range of cells overlapped by bounding box
+        ix0 = int(numpy.floor((minx - self.minx) / self.cell_size))
+        ix1 = int(numpy.floor((maxx - self.minx) / self.cell_size))
+        iy0 = int(numpy.floor((miny - self.miny) / self.cell_size))
+        iy1 = int(numpy.floor((maxy - self.miny) / self.cell_size))
+
+        if (len(self) == 0 or ix1 < 0 or iy1 < 0 or
+                ix0 >= self.nx or iy0 >= self.ny):
+            # Bounding box does not overlap the indexed points
+            return numpy.arange(0)
+
+        ix0 = max(ix0, 0)
+        iy0 = max(iy0, 0)
+        ix1 = min(ix1, self.nx - 1)
+        iy1 = min(iy1, self.ny - 1)
+
+        # Cells in each row are contiguous in the permutation array
+        slices = []
+        for iy in range(iy0, iy1 + 1):
+            start = self.offsets[iy * self.nx + ix0]
+            end = self.offsets[iy * self.nx + ix1 + 1]
+            if end > start:
+                slices.append(self.order[start:end])
+
+        if len(slices) == 0:
+            return numpy.arange(0)
+
+        candidates = numpy.concatenate(slices)
+
+        # Exact test for points in boundary cells
+        x = self.points[candidates, 0]
+        y = self.points[candidates, 1]
+        mask = (x >= minx) * (x <= maxx) * (y >= miny) * (y <= maxy)
+        candidates = candidates[mask]
+
+        # Preserve original point order
+        candidates.sort()
+        return candidates
+
+
+class BoxIndex(object):
+    """Uniform grid index over an Nx4 array of bounding boxes
+
+    Each box is bucketed into every cell it overlaps and stored sorted by
+    cell. Pairs of overlapping boxes between the index and another set of
+    boxes are found in one vectorised pass by expanding the query boxes to
+    the cells they overlap as well. A pair is only reported from the cell
+    holding the lower left corner of the intersection of the two boxes so
+    each pair is found exactly once.
+
+    Args:
+        * bboxes: Nx4 array (or list) of bounding boxes
+            [minx, maxx, miny, maxy] following the convention for
+            polygon_bbox in module polygon.py. Rows containing nan (as
+            given for empty rings) are not indexed.
+        * cell_size: (optional) Side length of grid cells in the units of
+            the box coordinates. If None, it is chosen so that each cell
+            holds about boxes_per_cell boxes on average, but cells are
+            never smaller than the median box.
+        * boxes_per_cell: (optional) Target average cell occupancy used when
+            cell_size is None.
+
+    Example:
+
+        index = BoxIndex(hazard_bboxes)
+        i, j = index.query_pairs(exposure_bboxes)
+
+        exposure box i[k] overlaps (or touches) hazard box j[k].
+    """
+
+    def __init__(self, bboxes, cell_size=None, boxes_per_cell=4):
+        """Build the index - see class docstring for details
+        """
+
+        bboxes = _check_bboxes(bboxes)
+        self.bboxes = bboxes
+
+        ids = numpy.where(numpy.all(numpy.isfinite(bboxes), axis=1))[0]
+        if len(ids) == 0:
+            self.minx = self.miny = 0.0
+            self.cell_size = 1.0
+            self.nx = self.ny = 1
+            self.order = numpy.arange(0)
+            self.offsets = numpy.zeros(2, dtype=numpy.int)
+            return
+
+        B = bboxes[ids]
+        self.minx = B[:, 0].min()
+        self.miny = B[:, 2].min()
+        width = B[:, 1].max() - self.minx
+        height = B[:, 3].max() - self.miny
+
+        if cell_size is None:
+            number_of_cells = max(1.0, float(len(ids)) / boxes_per_cell)
+            if width > 0 and height > 0:
+                cell_size = numpy.sqrt(width * height / number_of_cells)
+            else:
+                cell_size = max(width, height) / number_of_cells
+
+            # Avoid bucketing typical boxes into many cells
+            sizes = numpy.maximum(B[:, 1] - B[:, 0], B[:, 3] - B[:, 2])
+            cell_size = max(cell_size, numpy.median(sizes))
+
+            if cell_size <= 0:
+                # All boxes are the same point
+                cell_size = 1.0
+
+        msg = 'Cell size must be positive. I got %s' % str(cell_size)
+        if not cell_size > 0:
+            raise PointsInputError(msg)
+
+        self.cell_size = float(cell_size)
+        self.nx = int(width / self.cell_size) + 1
+        self.ny = int(height / self.cell_size) + 1
+
+        # Bucket boxes by cell and sort them by cell id (row major)
+        members, cell_ids = self._expand(B)
+        order = numpy.argsort(cell_ids, kind='mergesort')
+        self.order = ids[members[order]]
+
+        counts = numpy.bincount(cell_ids, minlength=self.nx * self.ny)
+        self.offsets = numpy.zeros(self.nx * self.ny + 1, dtype=numpy.int)
+        numpy.cumsum(counts, out=self.offsets[1:])
+
+    def __len__(self):
+        """Number of boxes in index
+        """
+        return self.bboxes.shape[0]
+
+    def _cell_indices(self, x, y):
+        """Map coordinates to column and row indices of cells
+        """
+
+        ix = numpy.floor((x - self.minx) / self.cell_size).astype(numpy.int)
+        iy = numpy.floor((y - self.miny) / self.cell_size).astype(numpy.int)
+        numpy.clip(ix, 0, self.nx - 1, out=ix)
+        numpy.clip(iy, 0, self.ny - 1, out=iy)
+
+        return ix, iy
+
+    def _expand(self, bboxes):
+        """Expand boxes to all cells they overlap
+
+        Returns:
+            * boxes: Index of box for each (box, cell) pair
+            * cell_ids: Row major cell id for each (box, cell) pair
+        """
+
+        ix0, iy0 = self._cell_indices(bboxes[:, 0], bboxes[:, 2])
+        ix1, iy1 = self._cell_indices(bboxes[:, 1], bboxes[:, 3])
+        columns = ix1 - ix0 + 1
+        counts = columns * (iy1 - iy0 + 1)
+
+        boxes = numpy.repeat(numpy.arange(len(bboxes)), counts)
+        k = (numpy.arange(numpy.sum(counts)) -
+             numpy.repeat(numpy.cumsum(counts) - counts, counts))
+        ix = ix0[boxes] + k % columns[boxes]
+        iy = iy0[boxes] + k // columns[boxes]
+
+        return boxes, iy * self.nx + ix
+
+    def query_pairs(self, bboxes):
+        """Get all pairs of overlapping boxes
+
+        Args:
+            * bboxes: Mx4 array of bounding boxes [minx, maxx, miny, maxy].
+                Rows containing nan are ignored.
+
+        Returns:
+            * i, j: Arrays of indices into bboxes and the indexed boxes
+                respectively such that bboxes[i[k]] overlaps or touches
+                indexed box j[k]. Pairs are sorted by i then j.
+        """
+
+        bboxes = _check_bboxes(bboxes)
+        ids = numpy.where(numpy.all(numpy.isfinite(bboxes), axis=1))[0]
+        if len(ids) == 0 or len(self.order) == 0:
+            return numpy.arange(0), numpy.arange(0)
+
+        # Candidates are all indexed boxes in the cells overlapped
+        B = bboxes[ids]
+        boxes, cell_ids = self._expand(B)
+        start = self.offsets[cell_ids]
+        counts = self.offsets[cell_ids + 1] - start
+        k = (numpy.arange(numpy.sum(counts)) -
+             numpy.repeat(numpy.cumsum(counts) - counts, counts))
+        i = numpy.repeat(boxes, counts)
+        j = self.order[numpy.repeat(start, counts) + k]
+        cell_ids = numpy.repeat(cell_ids, counts)
+
+        # Exact overlap test and report each pair from one cell only
+        P = B[i]
+        Q = self.bboxes[j]
+        mask = ((P[:, 0] <= Q[:, 1]) & (Q[:, 0] <= P[:, 1]) &
+                (P[:, 2] <= Q[:, 3]) & (Q[:, 2] <= P[:, 3]))
+        ix, iy = self._cell_indices(numpy.maximum(P[:, 0], Q[:, 0]),
+                                    numpy.maximum(P[:, 2], Q[:, 2]))
+        mask &= iy * self.nx + ix == cell_ids
+
+        i = ids[i[mask]]
+        j = j[mask]
+        order = numpy.lexsort((j, i))
+        return i[order], j[order]
+
+
+def _check_bboxes(bboxes):
+    """Convert bounding boxes to Nx4 array or raise PointsInputError
+    """
+
+    try:
+        bboxes = ensure_numeric(bboxes, numpy.float)
+    except Exception, e:
+        msg = ('Bounding boxes could not be converted to numeric array: %s'
+               % str(e))
+        raise PointsInputError(msg)
+
+    if len(bboxes.shape) == 1 and bboxes.shape[0] == 0:
+        bboxes = bboxes.reshape((0, 4))
+
+    msg = ('Bounding boxes must be an Nx4 array. I got shape %s'
+           % str(bboxes.shape))
+    if len(bboxes.shape) != 2 or bboxes.shape[1] != 4:
+        raise PointsInputError(msg)
+
+    return bboxes
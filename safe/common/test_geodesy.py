@@ -1,7 +1,7 @@
 
 import unittest
 import numpy
-from safe.common.geodesy import Point
+from safe.common.geodesy import Point, great_circle_distances
 
 
 class TestCase(unittest.TestCase):
@@ -191,6 +191,26 @@ class TestCase(unittest.TestCase):
         #       geometry_type='point',
         #       data=None).write_to_file('center.shp')
 
+    def test_great_circle_distances(self):
+        """Vectorised distances agree with distances between points
+        """
+
+        points = [self.RSISE, self.Home, self.Syd, self.Nadi,
+                  self.Kobenhavn, self.Muncar]
+        for p in points:
+            D = great_circle_distances(
+                [p.longitude] * len(points), [p.latitude] * len(points),
+                [q.longitude for q in points], [q.latitude for q in points])
+            for i, q in enumerate(points):
+                # Point.distance_to uses acos which is only accurate to
+                # about 0.1 m for coinciding points
+                assert numpy.allclose(D[i], p.distance_to(q),
+                                      rtol=1.0e-6, atol=1.0e-1)
+
+        # Short distances are accurate (0.00001 degrees at equator)
+        D = great_circle_distances([114.0], [0.0], [114.00001], [0.0])
+        assert numpy.allclose(D, 0.00001 * Point.degrees2radians * Point.R)
+
 if __name__ == '__main__':
     mysuite = unittest.makeSuite(TestCase, 'test')
     runner = unittest.TextTestRunner(verbosity=2)
@@ -1,9 +1,12 @@
+import time
 import numpy
 import unittest
 
 # Import InaSAFE modules
-from safe.common.interpolation2d import interpolate2d, interpolate_raster
+from safe.common.interpolation2d import (interpolate2d, interpolate_raster,
+                                         InterpolationPlan)
 from safe.common.interpolation import BoundsError
+from safe.common.exceptions import InaSAFEError
 from safe.common.interpolation1d import interpolate1d
 from safe.common.testing import combine_coordinates
 from safe.common.numerics import nan_allclose
@@ -449,6 +452,71 @@ class Test_interpolate(unittest.TestCase):
 
         assert numpy.allclose(vals, refs, rtol=1e-12, atol=1e-12)
 
+    def test_interpolation_plan(self):
+        """Interpolation plan reproduces interpolate2d for many grids
+        """
+
+        numpy.random.seed(11)
+        x = numpy.sort(numpy.random.uniform(0, 10, 30))
+        y = numpy.sort(numpy.random.uniform(0, 5, 20))
+        points = numpy.random.uniform(0, 1, (1000, 2)) * [11, 6] - 0.5
+        points[0] = [x[0], y[0]]
+        points[1] = [x[-1], y[-1]]
+        points[2] = [numpy.nan, y[3]]
+
+        for mode in ['linear', 'constant']:
+            plan = InterpolationPlan(x, y, points, mode=mode)
+            raster_plan = InterpolationPlan(x, y, points, mode=mode,
+                                            raster=True)
+            for _ in range(3):
+                A = numpy.random.uniform(0, 1, (len(x), len(y)))
+                A[A < 0.1] = numpy.nan
+                refs = interpolate2d(x, y, A, points, mode=mode)
+                assert nan_allclose(plan.apply(A), refs, rtol=0, atol=0)
+
+                # Same grid organised as raster
+                B = numpy.flipud(A.transpose())
+                assert nan_allclose(raster_plan.apply(B), refs,
+                                    rtol=0, atol=0)
+
+        # Grids must match the plan
+        self.assertRaises(InaSAFEError, plan.apply, A[1:])
+        self.assertRaises(BoundsError, InterpolationPlan, x, y, points,
+                          bounds_error=True)
+
+    def test_interpolation_raster_data_performance(self):
+        """Raster interpolation does not reorganise or copy the grid
+        """
+
+        # Grid of 2000 x 3000 cells and a modest number of points
+        numpy.random.seed(13)
+        longitudes = numpy.linspace(100.0, 103.0, 3000)
+        latitudes = numpy.linspace(-8.0, -6.0, 2000)
+        A = numpy.random.uniform(0, 10, (len(latitudes), len(longitudes)))
+        points = numpy.random.uniform(0, 1, (1000, 2)) * [3, 2] + [100, -8]
+
+        # Reference is the grid flipped, transposed and copied as it used
+        # to be prior to interpolation
+        t_ref = t_new = float('inf')
+        for _ in range(3):
+            t0 = time.time()
+            B = numpy.flipud(A).transpose().copy()
+            refs = interpolate2d(longitudes, latitudes, B, points)
+            t1 = time.time()
+            vals = interpolate_raster(longitudes, latitudes, A, points)
+            t2 = time.time()
+
+            t_ref = min(t_ref, t1 - t0)
+            t_new = min(t_new, t2 - t1)
+
+        assert numpy.allclose(vals, refs, rtol=0, atol=0)
+        msg = ('Raster interpolation took %.4fs which is not faster than '
+               'interpolation of the reorganised grid (%.4fs)'
+               % (t_new, t_ref))
+        assert t_new < t_ref, msg
+
+    test_interpolation_raster_data_performance.slow = True
+
     #-----------------------
     # 1D interpolation tests
     #-----------------------
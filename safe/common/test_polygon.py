@@ -20,15 +20,35 @@ from safe.common.polygon import (separate_points_by_polygon,
                                  populate_polygon,
                                  generate_random_points_in_bbox,
                                  PolygonInputError,
-                                 line_dictionary_to_geometry)
+                                 line_dictionary_to_geometry,
+                                 polygon2segments,
+                                 split_lines_by_grid,
+                                 polygon_to_trapezoids,
+                                 clip_rings_by_convex_polygons,
+                                 rasterize_polygons,
+                                 zonal_statistics,
+                                 _assign_boundary_points,
+                                 _clip_lines_by_polygon)
 from safe.common.testing import test_polygon, test_lines
-from safe.common.numerics import ensure_numeric
+from safe.common.numerics import (ensure_numeric, geotransform_to_axes,
+                                  axes_to_points)
+from safe.common.exceptions import InaSAFEError
+from safe.storage.utilities import calculate_polygon_area
 
 
 def linear_function(x, y):
     return x + y
 
 
+def ring_area(ring):
+    """Signed area of open ring
+    """
+    if len(ring) == 0:
+        return 0
+    return calculate_polygon_area(numpy.concatenate([ring, ring[:1]]),
+                                  signed=True)
+
+
 class Test_Polygon(unittest.TestCase):
     def setUp(self):
         pass
@@ -540,6 +560,64 @@ class Test_Polygon(unittest.TestCase):
         assert numpy.allclose(ins_p, [1, 2, 3])
         assert numpy.allclose(out_p, [0, 4, 5])
 
+    def test_separate_points_by_polygon_slabs(self):
+        """Slab version of polygon clipping agrees with edge version
+        """
+
+        # Simple non-convex polygon and real polygon
+        polygons = [numpy.array([[0, 0], [1, 0], [0.5, -1], [2, -1],
+                                 [2, 1], [0, 1]], dtype='d'),
+                    numpy.array(test_polygon)]
+
+        for polygon in polygons:
+            # Random points around polygon as well as its vertices and
+            # the midpoints of its edges to test boundary semantics
+            points = generate_random_points_in_bbox(polygon, 5000, seed=17)
+            midpoints = (polygon + numpy.roll(polygon, -1, axis=0)) / 2
+            points = numpy.concatenate((points, polygon, midpoints))
+
+            for closed in [True, False, None]:
+                inside_e, outside_e = separate_points_by_polygon(
+                    points, polygon, closed=closed, method='edges')
+                inside_s, outside_s = separate_points_by_polygon(
+                    points, polygon, closed=closed, method='slabs')
+
+                assert numpy.alltrue(inside_e == inside_s)
+                assert numpy.alltrue(outside_e == outside_s)
+
+        # Unknown method
+        self.assertRaises(PolygonInputError, separate_points_by_polygon,
+                          [[0.5, 0.5]], polygons[0], method='dummy')
+
+    def test_assign_boundary_points(self):
+        """Batched boundary test agrees with point_on_line for each edge
+        """
+
+        polygon = numpy.array(test_polygon)
+        N = len(polygon)
+
+        # Points near the boundary as well as vertices and edge midpoints
+        midpoints = (polygon + numpy.roll(polygon, -1, axis=0)) / 2
+        numpy.random.seed(13)
+        noise = numpy.random.normal(0, 1.0e-7, size=midpoints.shape)
+        points = numpy.concatenate((polygon, midpoints, midpoints + noise))
+
+        for rtol, atol in [(0.0, 0.0), (1.0e-5, 1.0e-8)]:
+            expected = numpy.zeros(len(points), dtype=numpy.int)
+            for i in range(N):
+                edge = [polygon[i, :], polygon[(i + 1) % N, :]]
+                expected[point_on_line(points, edge, rtol, atol)] = 1
+
+            inside = numpy.zeros(len(points), dtype=numpy.int)
+            _assign_boundary_points(points, polygon, inside,
+                                    True, rtol, atol)
+            assert numpy.alltrue(inside == expected)
+
+            inside = numpy.ones(len(points), dtype=numpy.int)
+            _assign_boundary_points(points, polygon, inside,
+                                    False, rtol, atol)
+            assert numpy.alltrue(inside == 1 - expected)
+
     def test_polygon_clipping_error_handling(self):
         """Polygon clipping checks input as expected"""
 
@@ -648,6 +726,101 @@ class Test_Polygon(unittest.TestCase):
             Vector(geometry=points,
                    data=values).write_to_file('test_points.shp')
 
+    def test_rasterize_polygons(self):
+        """Polygons are burned into label grid
+        """
+
+        # Grid of 4 rows and 5 columns with cell centres at
+        # x = 0.5, ..., 4.5 and y = 0.5, ..., 3.5 (north to south)
+        geotransform = (0.0, 1.0, 0.0, 4.0, 0.0, -1.0)
+
+        # Square with a hole, overlapping rectangle and a triangle whose
+        # top vertex touches a row of cell centres
+        square = Polygon(numpy.array([[0, 0], [3, 0], [3, 3], [0, 3]]),
+                         inner_rings=[numpy.array([[1, 1], [2, 1],
+                                                   [2, 2], [1, 2]])])
+        rectangle = numpy.array([[2.5, 0.5], [4.5, 0.5],
+                                 [4.5, 2.5], [2.5, 2.5]])
+        triangle = numpy.array([[3.2, 2.8], [4.8, 2.8], [4.5, 3.5]])
+
+        labels = rasterize_polygons([square, rectangle, triangle],
+                                    geotransform, (4, 5))
+        assert numpy.alltrue(labels == [[-1, -1, -1, -1, 2],
+                                        [0, 0, 0, 1, 1],
+                                        [0, -1, 0, 1, 1],
+                                        [0, 0, 0, 1, 1]])
+
+        # Labels agree with points in polygons for random polygons
+        geotransform = (100.0, 0.1, 0.0, 10.0, 0.0, -0.1)
+        x, y = geotransform_to_axes(geotransform, 60, 40)
+        points = axes_to_points(x, y)
+        numpy.random.seed(11)
+        polygons = []
+        for i in range(4):
+            center = [101 + i, 8]
+            angles = numpy.sort(numpy.random.uniform(0, 2 * numpy.pi, 20))
+            radii = numpy.random.uniform(1, 2, 20)
+            outer_ring = numpy.zeros((20, 2))
+            outer_ring[:, 0] = center[0] + radii * numpy.cos(angles)
+            outer_ring[:, 1] = center[1] + radii * numpy.sin(angles)
+            inner_ring = numpy.array(center) + [[-0.3, -0.3], [0.3, -0.3],
+                                                [0.3, 0.3], [-0.3, 0.3]]
+            polygons.append(Polygon(outer_ring, inner_rings=[inner_ring]))
+
+        labels = rasterize_polygons(polygons, geotransform, (40, 60))
+        expected = -numpy.ones(len(points), dtype=numpy.int)
+        for i in range(len(polygons) - 1, -1, -1):
+            inside = inside_polygon(points, polygons[i].outer_ring,
+                                    holes=polygons[i].inner_rings)
+            expected[inside] = i
+        assert numpy.alltrue(labels.reshape(-1) == expected)
+
+        # Grid points are found from labels
+        A = numpy.arange(2400).reshape((40, 60))
+        res = clip_grid_by_polygons(A, geotransform, polygons)
+        for i, (P, V) in enumerate(res):
+            assert numpy.allclose(P, points[expected == i])
+            assert numpy.alltrue(V == A.reshape(-1)[expected == i])
+
+    def test_zonal_statistics(self):
+        """Zonal statistics are computed from label grid
+        """
+
+        labels = numpy.array([[0, 0, 1, -1],
+                              [2, 0, 1, -1],
+                              [2, 2, 1, 3]])
+        A = numpy.array([[1.0, 2.0, 3.0, 100],
+                         [numpy.nan, 4.0, 5.0, 100],
+                         [-1.0, 0.0, 7.0, numpy.nan]])
+
+        stats = zonal_statistics(labels, A, number_of_zones=5)
+        assert numpy.alltrue(stats['count'] == [3, 3, 2, 0, 0])
+        assert numpy.allclose(stats['sum'], [7, 15, -1, 0, 0])
+        assert numpy.allclose(stats['min'][:3], [1, 3, -1])
+        assert numpy.allclose(stats['max'][:3], [4, 7, 0])
+        assert numpy.allclose(stats['mean'][:3], [7.0 / 3, 5, -0.5])
+        for key in ['min', 'max', 'mean']:
+            assert numpy.alltrue(numpy.isnan(stats[key][3:]))
+
+        assert 'exceedance' not in stats
+
+        # Exceedance of threshold
+        stats = zonal_statistics(labels, A, number_of_zones=5, threshold=2)
+        assert numpy.alltrue(stats['exceedance'] == [1, 3, 0, 0, 0])
+        assert numpy.allclose(stats['fraction'][:3], [1.0 / 3, 1, 0])
+        assert numpy.alltrue(numpy.isnan(stats['fraction'][3:]))
+
+        # Number of zones defaults to largest label
+        stats = zonal_statistics(labels, A)
+        assert len(stats['count']) == 4
+
+        # No zones
+        stats = zonal_statistics(-numpy.ones((2, 2)), A[:2, :2], threshold=0)
+        assert len(stats['sum']) == 0
+        assert len(stats['fraction']) == 0
+
+        self.assertRaises(InaSAFEError, zonal_statistics, labels, A[:2])
+
     def test_populate_polygon(self):
         """Polygon can be populated by random points
         """
@@ -1524,6 +1697,90 @@ class Test_Polygon(unittest.TestCase):
                               [[0.3, 0.2],
                                [0.31666667, 0.31666667]])
 
+    def test_clip_lines_by_non_overlapping_polygons(self):
+        """Lines can be consumed by the first polygon they fall in
+        """
+
+        # Test polys (as in test_clip_lines_by_multiple_polygons)
+        polygons = [[[0, 0], [1, 0], [1, 1], [0, 1]],  # Unit square
+                    [[1, 0], [3, 0], [2, 1]],  # Adjacent triangle
+                    [[0, 3], [1, 3], [0.5, 2],
+                     [2, 2], [2, 4], [0, 4]],  # Convoluted
+                    [[-1, -1], [5, -1], [5, 3], [5, 3]],  # Overlapping
+                    [[-1, -1], [6, -1], [6, 6], [6, 6]]]  # Cover the others
+
+        # Test lines
+        input_lines = [[[0, 0.5], [4, 0.5]],
+                       [[2, 0], [2, 5]],
+                       [[0, 0], [5, 5]],
+                       [[10, 10], [30, 10]],
+                       [[-1, 0.5], [0.5, 0.5], [2.5, 3]],
+                       [[0.5, 0.5], [0.5, 2]],
+                       [[100, 100], [300, 100]],
+                       [[0.3, 0.2], [0.7, 3], [1.0, 1.9]],
+                       [[30, 10], [30, 20]]]
+
+        lines_covered = clip_lines_by_polygons(input_lines, polygons,
+                                               overlapping=False)
+        assert len(lines_covered) == len(polygons)
+
+        # Thorough check of all lines: Midpoints of all segments are
+        # inside the polygon (vertices may lie on its boundary)
+        for i, polygon in enumerate(polygons):
+            for key in lines_covered[i]:
+                for line in lines_covered[i][key]:
+                    assert len(line) > 1
+                    midpoints = (line[1:] + line[:-1]) / 2
+                    inside = inside_polygon(midpoints, polygon)
+                    assert len(inside) == len(midpoints)
+
+        # Polygon 0 and 4, line 2
+        assert numpy.allclose(lines_covered[0][2][0],
+                              [[0., 0.],
+                               [1., 1.]])
+
+        # Part inside polygon 0 is not repeated for overlapping polygon 4
+        # and parts remaining after polygon 2 are joined
+        assert len(lines_covered[4][2]) == 1
+        assert numpy.allclose(lines_covered[4][2][0],
+                              [[1., 1.],
+                               [2., 2.],
+                               [5., 5.]])
+
+        # Polygon 0 and 4, line 7
+        assert numpy.allclose(lines_covered[0][7][0],
+                              [[0.3, 0.2],
+                               [0.41428571, 1.0]])
+        assert lines_covered[4][7] == []
+
+        # Polygon 3, line 0 (two pieces either side of polygon 1)
+        assert len(lines_covered[3][0]) == 2
+        assert numpy.allclose(lines_covered[3][0][0],
+                              [[1.25, 0.5],
+                               [1.5, 0.5]])
+        assert numpy.allclose(lines_covered[3][0][1],
+                              [[2.5, 0.5],
+                               [4., 0.5]])
+
+        # Every part of a line is covered by at most one polygon and
+        # lines inside the union of polygons are covered entirely
+        for j, line in enumerate(input_lines):
+            line = numpy.array(line, dtype=numpy.float)
+            total = 0.0
+            for lines in lines_covered:
+                for x in lines[j]:
+                    total += numpy.sum(numpy.sqrt(numpy.sum(
+                        (x[1:] - x[:-1]) ** 2, axis=1)))
+            length = numpy.sum(numpy.sqrt(numpy.sum(
+                (line[1:] - line[:-1]) ** 2, axis=1)))
+            assert total <= length + 1.0e-12
+            if j in [0, 2]:
+                assert numpy.allclose(total, length)
+
+        # Line 1 is inside the union of polygons from y = 0 to 4
+        assert numpy.allclose(sum([numpy.sum(numpy.abs(numpy.diff(
+            x[:, 1]))) for lines in lines_covered for x in lines[1]]), 4)
+
     def test_clip_lines_by_polygon_real_data(self):
         """Real roads are clipped by complex polygon
         """
@@ -1628,6 +1885,227 @@ class Test_Polygon(unittest.TestCase):
 
     test_clip_lines_by_polygon_real_data.slow = True
 
+    def test_clip_lines_by_polygon_vectorised(self):
+        """Vectorised line clipping agrees with line by line clipping
+        """
+
+        def reference(lines, polygon, closed):
+            """Clip lines one by one with _clip_line_by_polygon
+            """
+            polygon = ensure_numeric(polygon, numpy.float)
+            polygon_bbox = [min(polygon[:, 0]), max(polygon[:, 0]),
+                            min(polygon[:, 1]), max(polygon[:, 1])]
+            return _clip_lines_by_polygon(lines, polygon,
+                                          polygon2segments(polygon),
+                                          polygon_bbox, closed=closed)
+
+        def compare(lines, polygon, closed=True):
+            lines = [ensure_numeric(line, numpy.float) for line in lines]
+            expected = reference(lines, polygon, closed)
+            result = clip_lines_by_polygon(lines, polygon, closed=closed)
+
+            for D, E in zip(expected, result):
+                assert sorted(D.keys()) == range(len(lines))
+                assert sorted(E.keys()) == range(len(lines))
+                for key in D:
+                    assert len(D[key]) == len(E[key])
+                    for a, b in zip(D[key], E[key]):
+                        assert a.shape == b.shape
+                        assert numpy.allclose(a, b, rtol=0, atol=1.0e-12)
+
+        # Real data
+        compare(test_lines, test_polygon)
+
+        # Lines outside, through vertices, along edges and single points
+        polygon = [[0, 0], [1, 0], [1, 1], [0, 1]]
+        lines = [[[-1, 0.5], [0.5, 0.5], [0.5, 2]],
+                 [[-1, 0.0], [1, 2.0 / 3]],
+                 [[0, 0], [1, 1]],
+                 [[0, 0], [1, 0], [1, 1]],
+                 [[5, 5], [6, 6]],
+                 [[0.5, 0.5]],
+                 [[-1, -1], [2, 2]],
+                 [[-1, 2], [2, -1]],
+                 [[-1, 0.5], [0.5, 0.5], [2, 0.5], [0.5, 0.5]]]
+        for closed in [True, False]:
+            compare(lines, polygon, closed=closed)
+
+        # Random star shaped polygons and polylines, some on a coarse grid
+        # to get many intersections at vertices
+        numpy.random.seed(17)
+        for i in range(30):
+            N = numpy.random.randint(3, 30)
+            angles = numpy.sort(numpy.random.uniform(0, 2 * numpy.pi, N))
+            radii = numpy.random.uniform(0.2, 1, N)
+            polygon = numpy.zeros((N, 2))
+            polygon[:, 0] = radii * numpy.cos(angles)
+            polygon[:, 1] = radii * numpy.sin(angles)
+
+            lines = []
+            for j in range(numpy.random.randint(1, 20)):
+                M = numpy.random.randint(1, 8)
+                lines.append(numpy.random.uniform(-1.5, 1.5, (M, 2)))
+
+            if i % 3 == 0:
+                polygon = numpy.round(polygon * 4) / 4
+                lines = [numpy.round(line * 4) / 4 for line in lines]
+
+            compare(lines, polygon)
+
+    def test_split_lines_by_grid(self):
+        """Lines are split at grid cell boundaries
+        """
+
+        # Grid with cells of size 0.5 and top left corner (0, 2)
+        geotransform = (0.0, 0.5, 0.0, 2.0, 0.0, -0.5)
+
+        # Diagonal through cell corners, line with a vertex on a cell
+        # boundary going back west, a single point and a short line
+        # within one cell
+        lines = [[[0.25, 0.25], [1.25, 1.25]],
+                 [[0.1, 1.9], [0.1, 1.5], [-0.6, 1.2]],
+                 [[0.3, 0.3]],
+                 [[0.6, 0.6], [0.7, 0.8]]]
+        line_ids, pieces = split_lines_by_grid(lines, geotransform)
+
+        assert line_ids.tolist() == [0, 0, 0, 1, 1, 1, 1, 3]
+        assert numpy.allclose(pieces[:3], [[[0.25, 0.25], [0.5, 0.5]],
+                                           [[0.5, 0.5], [1.0, 1.0]],
+                                           [[1.0, 1.0], [1.25, 1.25]]])
+        assert numpy.allclose(pieces[3], [[0.1, 1.9], [0.1, 1.5]])
+        assert numpy.allclose(pieces[4:7], [[[0.1, 1.5], [0.0, 1.45714286]],
+                                            [[0.0, 1.45714286],
+                                             [-0.5, 1.24285714]],
+                                            [[-0.5, 1.24285714],
+                                             [-0.6, 1.2]]])
+        assert numpy.allclose(pieces[7], lines[3])
+
+        # Each piece falls within one cell and pieces are joined up
+        numpy.random.seed(17)
+        lines = [numpy.random.uniform(-3, 3, (numpy.random.randint(2, 6), 2))
+                 for _ in range(50)]
+        line_ids, pieces = split_lines_by_grid(lines, geotransform)
+        midpoints = (pieces[:, 0, :] + pieces[:, 1, :]) / 2
+        for i in range(2):
+            cell = numpy.floor(midpoints[:, i] / 0.5)
+            for j in range(2):
+                assert numpy.all(pieces[:, j, i] >= cell * 0.5 - 1.0e-12)
+                assert numpy.all(pieces[:, j, i] <=
+                                 (cell + 1) * 0.5 + 1.0e-12)
+
+        for k, line in enumerate(lines):
+            line_pieces = pieces[line_ids == k]
+            assert numpy.allclose(line_pieces[1:, 0], line_pieces[:-1, 1],
+                                  rtol=0, atol=0)
+            assert numpy.allclose(line_pieces[0, 0], line[0])
+            assert numpy.allclose(line_pieces[-1, 1], line[-1])
+
+    def test_polygon_to_trapezoids(self):
+        """Polygons with holes are decomposed into convex trapezoids
+        """
+
+        # Square with a square hole gives four trapezoids
+        outer = numpy.array([[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]])
+        hole = numpy.array([[1, 1], [1, 2], [2, 2], [2, 1]])
+        trapezoids = polygon_to_trapezoids([outer, hole])
+        assert trapezoids.shape == (4, 4, 2)
+        areas = [ring_area(T) for T in trapezoids]
+        assert numpy.allclose(sorted(areas), [1, 2, 4, 8])
+
+        # Triangle is a single (degenerate) trapezoid
+        trapezoids = polygon_to_trapezoids([[[0, 0], [2, 0], [1, 3]]])
+        assert len(trapezoids) == 1
+        assert numpy.allclose(trapezoids[0], [[0, 0], [2, 0], [1, 3], [1, 3]])
+
+        # Degenerate input
+        assert len(polygon_to_trapezoids([])) == 0
+        assert len(polygon_to_trapezoids([[[0, 0], [1, 0], [2, 0]]])) == 0
+
+        # Random star shaped polygons. Trapezoids are counter clockwise,
+        # add up to the polygon area and cover the same points.
+        numpy.random.seed(17)
+        points = numpy.random.uniform(-1, 1, size=(1000, 2))
+        for _ in range(10):
+            N = numpy.random.randint(3, 50)
+            angles = numpy.sort(numpy.random.uniform(0, 2 * numpy.pi, N))
+            radii = numpy.random.uniform(0.2, 1, N)
+            polygon = numpy.zeros((N, 2))
+            polygon[:, 0] = radii * numpy.cos(angles)
+            polygon[:, 1] = radii * numpy.sin(angles)
+
+            trapezoids = polygon_to_trapezoids([polygon[::-1]])
+            areas = [ring_area(T) for T in trapezoids]
+            assert min(areas) > 0
+            assert numpy.allclose(sum(areas), ring_area(polygon))
+
+            count = numpy.zeros(len(points))
+            for T in trapezoids:
+                count[inside_polygon(points, T, closed=False)] += 1
+            assert max(count) == 1
+            assert numpy.alltrue(numpy.where(count == 1)[0] ==
+                                 inside_polygon(points, polygon,
+                                                closed=False))
+
+    def test_clip_rings_by_convex_polygons(self):
+        """Rings are clipped by convex polygons in one pass
+        """
+
+        square = numpy.array([[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]])
+        U = numpy.array([[0, 0], [3, 0], [3, 3], [2, 3], [2, 1],
+                         [1, 1], [1, 3], [0, 3]])
+        vertices = numpy.concatenate([square, U[::-1]])
+        offsets = [0, 5, 13]
+
+        convex_polygons = [[[1, 1], [3, 1], [3, 3], [1, 3]],
+                           [[-1, -1], [5, -1], [5, 0.5], [-1, 0.5]],
+                           [[5, 5], [6, 5], [6, 6], [5, 6]],
+                           [[0, 0], [4, 0], [0, 4], [0, 4]]]
+
+        ring_ids = [0, 0, 0, 1, 1, 1]
+        convex_ids = [0, 1, 2, 0, 2, 3]
+        vertices, offsets = clip_rings_by_convex_polygons(
+            vertices, offsets, ring_ids, convex_polygons, convex_ids)
+        assert len(offsets) == 7
+
+        rings = [vertices[offsets[k]:offsets[k + 1]] for k in range(6)]
+        areas = [ring_area(ring) for ring in rings]
+        assert numpy.allclose(areas, [1, 1, 0, -2, 0, -5.5])
+
+        # Ring outside convex polygon is empty
+        assert len(rings[2]) == 0
+
+        # Parts of non convex ring are joined along the boundary
+        assert numpy.allclose(numpy.unique(rings[3][:, 0]), [1, 2, 3])
+
+        # Random rings and convex polygons checked by sampling
+        numpy.random.seed(13)
+        points = numpy.random.uniform(-1, 1, size=(20000, 2))
+        for _ in range(5):
+            N = numpy.random.randint(3, 30)
+            angles = numpy.sort(numpy.random.uniform(0, 2 * numpy.pi, N))
+            radii = numpy.random.uniform(0.2, 1, N)
+            ring = numpy.zeros((N, 2))
+            ring[:, 0] = radii * numpy.cos(angles)
+            ring[:, 1] = radii * numpy.sin(angles) * 0.5 + 0.3
+
+            # Points on a circle in counter clockwise order are convex
+            angles = numpy.sort(numpy.random.uniform(0, 2 * numpy.pi, 5))
+            convex = numpy.zeros((1, 5, 2))
+            convex[0, :, 0] = 0.8 * numpy.cos(angles) + 0.2
+            convex[0, :, 1] = 0.8 * numpy.sin(angles)
+
+            vertices, offsets = clip_rings_by_convex_polygons(
+                ring, [0, N], [0], convex, [0])
+
+            ring_inside = inside_polygon(points, ring)
+            both = numpy.intersect1d(ring_inside,
+                                     inside_polygon(points, convex[0]))
+            if len(both) == 0:
+                continue
+            assert numpy.allclose(abs(ring_area(vertices)),
+                                  len(both) * 4.0 / len(points),
+                                  rtol=0, atol=0.03)
+
     def test_join_segments(self):
         """Consecutive line segments can be joined into continuous line
         """
@@ -0,0 +1,96 @@
+"""**Tests for profiling of start up**
+"""
+
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+from safe.common.profiling import (ImportProfiler, profile_startup,
+                                   write_profile)
+from safe.common.utilities import temp_dir, unique_filename
+
+
+class Test_Profiling(unittest.TestCase):
+
+    def test_import_profiler(self):
+        """Imports of new modules are timed including nested imports
+        """
+
+        dirname = temp_dir(sub_dir='test')
+        outer = os.path.basename(unique_filename(prefix='outer_',
+                                                 dir=dirname))
+        inner = os.path.basename(unique_filename(prefix='inner_',
+                                                 dir=dirname))
+        fid = open(os.path.join(dirname, outer + '.py'), 'w')
+        fid.write('import time\nimport %s\ntime.sleep(0.02)\n' % inner)
+        fid.close()
+        fid = open(os.path.join(dirname, inner + '.py'), 'w')
+        fid.write('import time\ntime.sleep(0.05)\n')
+        fid.close()
+
+        sys.path.insert(0, dirname)
+        profiler = ImportProfiler()
+        profiler.start()
+        try:
+            __import__(outer)
+        finally:
+            profiler.stop()
+            sys.path.remove(dirname)
+            for name in [outer, inner]:
+                sys.modules.pop(name, None)
+
+        records = profiler.get_records()
+        assert [x['module'] for x in records] == [outer, inner]
+        assert records[0]['cumulative'] >= 0.07
+        assert records[0]['self'] >= 0.02
+        assert records[0]['self'] <= records[0]['cumulative'] - 0.05
+        assert records[1]['self'] >= 0.05
+        assert records[1]['cumulative'] >= records[1]['self']
+
+        # Imports are no longer timed
+        assert __import__ is not profiler._timed_import
+
+    def test_profile_startup(self):
+        """Start up profile is recorded as JSON
+        """
+
+        profile = profile_startup(modules=['safe.common.numerics'])
+        assert profile['modules'] == ['safe.common.numerics']
+        for key in ['import', 'load_plugins', 'plugin_index', 'translation']:
+            assert profile['steps'][key] >= 0
+        assert 'read_layer' not in profile['steps']
+
+        filename = unique_filename(suffix='.json',
+                                   dir=temp_dir(sub_dir='test'))
+        write_profile(profile, filename)
+        fid = open(filename)
+        assert json.load(fid) == profile
+        fid.close()
+
+    def test_deferred_imports(self):
+        """Importing safe.api does not import unused subsystems
+        """
+
+        deferred = ['qgis.core', 'multiprocessing',
+                    'xml.dom.minidom', 'zipfile',
+                    'safe.postprocessors.gender_postprocessor']
+        script = ('import sys\n'
+                  'import safe.api\n'
+                  'print [x for x in %s if x in sys.modules]\n' % deferred)
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        p = subprocess.Popen([sys.executable, '-c', script], env=env,
+                             stdout=subprocess.PIPE)
+        output = p.communicate()[0]
+        assert p.returncode == 0
+        imported = output.strip().split('\n')[-1]
+        msg = 'Modules imported by safe.api: %s' % imported
+        assert imported == '[]', msg
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_Profiling, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,182 @@
+import unittest
+import numpy
+
+from safe.common.spatial_index import PointIndex, BoxIndex
+from safe.common.polygon import (in_and_outside_polygon,
+                                 inside_polygon,
+                                 outside_polygon,
+                                 generate_random_points_in_bbox)
+from safe.common.exceptions import PointsInputError
+from safe.common.testing import test_polygon
+
+
+class Test_SpatialIndex(unittest.TestCase):
+
+    def test_query_basic(self):
+        """Bounding box queries on point index match brute force
+        """
+
+        points = numpy.array([[0, 0], [1, 0], [1, 1], [0, 1],
+                              [0.5, 0.5], [2, 2], [-1, 3]], dtype='d')
+        index = PointIndex(points, cell_size=0.4)
+        assert len(index) == 7
+
+        # Unit square (boundary included)
+        indices = index.query([0, 1, 0, 1])
+        assert numpy.allclose(indices, [0, 1, 2, 3, 4])
+
+        # Box containing nothing
+        indices = index.query([0.1, 0.2, 0.1, 0.2])
+        assert len(indices) == 0
+
+        # Box entirely outside point extent
+        indices = index.query([10, 11, 10, 11])
+        assert len(indices) == 0
+
+        # Box covering everything
+        indices = index.query([-10, 10, -10, 10])
+        assert numpy.allclose(indices, numpy.arange(7))
+
+    def test_query_random(self):
+        """Point index agrees with brute force for random boxes
+        """
+
+        numpy.random.seed(17)
+        points = numpy.random.uniform(-5, 5, size=(5000, 2))
+
+        for cell_size in [None, 0.01, 0.37, 20]:
+            index = PointIndex(points, cell_size=cell_size)
+            for _ in range(20):
+                x0, x1 = numpy.sort(numpy.random.uniform(-6, 6, 2))
+                y0, y1 = numpy.sort(numpy.random.uniform(-6, 6, 2))
+
+                x = points[:, 0]
+                y = points[:, 1]
+                ref = numpy.where((x >= x0) * (x <= x1) *
+                                  (y >= y0) * (y <= y1))[0]
+
+                indices = index.query([x0, x1, y0, y1])
+                assert numpy.alltrue(indices == ref)
+
+    def test_degenerate_points(self):
+        """Point index handles empty, collinear and coinciding points
+        """
+
+        index = PointIndex([])
+        assert len(index) == 0
+        assert len(index.query([0, 1, 0, 1])) == 0
+
+        # Points on a horizontal line
+        points = [[x, 3.0] for x in range(10)]
+        index = PointIndex(points)
+        assert numpy.allclose(index.query([2.5, 6, 0, 5]), [3, 4, 5, 6])
+
+        # Coinciding points
+        index = PointIndex([[1, 1], [1, 1], [1, 1]])
+        assert numpy.allclose(index.query([0, 2, 0, 2]), [0, 1, 2])
+        assert len(index.query([1.5, 2, 0, 2])) == 0
+
+        # Wrong shape
+        self.assertRaises(PointsInputError, PointIndex, [1, 2, 3])
+
+    def test_indexed_polygon_separation(self):
+        """Indexed point in polygon separation matches unindexed version
+        """
+
+        polygon = numpy.array(test_polygon)
+        centre = polygon.mean(axis=0)
+        hole = centre + numpy.array([[-0.002, -0.002], [0.002, -0.002],
+                                     [0.002, 0.002], [-0.002, 0.002]])
+
+        points = generate_random_points_in_bbox(polygon, 5000, seed=42)
+
+        # Widen the scatter so that many points fall outside the bbox
+        points = (points - points.mean(axis=0)) * 3 + points.mean(axis=0)
+        index = PointIndex(points)
+
+        for holes in [None, [hole]]:
+            for closed in [True, False]:
+                inside, outside = in_and_outside_polygon(points, polygon,
+                                                         closed=closed,
+                                                         holes=holes)
+                i_inside, i_outside = in_and_outside_polygon(points, polygon,
+                                                             closed=closed,
+                                                             holes=holes,
+                                                             index=index)
+
+                assert numpy.alltrue(i_inside == inside)
+                assert numpy.alltrue(i_outside == numpy.sort(outside))
+
+                assert numpy.alltrue(
+                    inside_polygon(points, polygon, closed=closed,
+                                   holes=holes, index=index) == inside)
+                assert numpy.alltrue(
+                    outside_polygon(points, polygon, closed=closed,
+                                    holes=holes,
+                                    index=index) == numpy.sort(outside))
+
+        # Points are tested as given, the index only selects candidates
+        triangle = [[0, 0], [1, 0], [0, 1]]
+        small_index = PointIndex([[0.1, 0.1], [0.9, 0.9]])
+        inside, outside = in_and_outside_polygon([[0.9, 0.9], [0.1, 0.1]],
+                                                 triangle, index=small_index)
+        assert inside.tolist() == [1]
+        assert outside.tolist() == [0]
+
+        # Index built from other points is rejected
+        self.assertRaises(PointsInputError, inside_polygon,
+                          points[:10], polygon, index=index)
+
+    def test_box_index(self):
+        """Pairs of overlapping boxes match brute force
+        """
+
+        numpy.random.seed(23)
+        corners = numpy.random.uniform(0, 100, size=(2000, 2))
+        bboxes0 = numpy.zeros((2000, 4))
+        bboxes0[:, 0] = corners[:, 0]
+        bboxes0[:, 1] = corners[:, 0] + numpy.random.uniform(0, 3, 2000)
+        bboxes0[:, 2] = corners[:, 1]
+        bboxes0[:, 3] = corners[:, 1] + numpy.random.uniform(0, 2, 2000)
+
+        corners = numpy.random.uniform(-10, 110, size=(500, 2))
+        bboxes1 = numpy.zeros((500, 4))
+        bboxes1[:, 0] = corners[:, 0]
+        bboxes1[:, 1] = corners[:, 0] + numpy.random.uniform(0, 20, 500)
+        bboxes1[:, 2] = corners[:, 1]
+        bboxes1[:, 3] = corners[:, 1] + numpy.random.uniform(0, 1, 500)
+
+        overlap = ((bboxes0[:, numpy.newaxis, 0] <= bboxes1[:, 1]) &
+                   (bboxes1[:, 0] <= bboxes0[:, numpy.newaxis, 1]) &
+                   (bboxes0[:, numpy.newaxis, 2] <= bboxes1[:, 3]) &
+                   (bboxes1[:, 2] <= bboxes0[:, numpy.newaxis, 3]))
+
+        # Boxes of empty geometries are ignored
+        bboxes0[7] = numpy.nan
+        bboxes1[3] = numpy.nan
+        overlap[7, :] = False
+        overlap[:, 3] = False
+        ref_i, ref_j = numpy.where(overlap)
+
+        for cell_size in [None, 0.5, 7, 200]:
+            index = BoxIndex(bboxes1, cell_size=cell_size)
+            assert len(index) == 500
+            i, j = index.query_pairs(bboxes0)
+            assert numpy.alltrue(i == ref_i)
+            assert numpy.alltrue(j == ref_j)
+
+        # Touching and degenerate boxes
+        index = BoxIndex([[0, 1, 0, 1], [2, 2, 3, 3]])
+        i, j = index.query_pairs([[1, 2, 1, 3], [5, 6, 5, 6]])
+        assert numpy.alltrue(i == [0, 0])
+        assert numpy.alltrue(j == [0, 1])
+
+        # Empty index and wrong shape
+        i, j = BoxIndex([]).query_pairs(bboxes0)
+        assert len(i) == len(j) == 0
+        self.assertRaises(PointsInputError, BoxIndex, [[1, 2, 3]])
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_SpatialIndex, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
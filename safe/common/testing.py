@@ -6,7 +6,6 @@ import numpy
 import os
 import sys
 import logging
-from numpy.testing import Tester
 
 from safe.common.numerics import axes_to_points
 from safe.common.version import get_version
@@ -19,16 +18,29 @@ PARENT = None
 IFACE = None
 
 
-class SafeTester(Tester):
-    """Tester class for testing SAFE package."""
-    def _show_system_info(self):
-        print 'safe version %s' % get_version()
-        super(SafeTester, self)._show_system_info()
-
-
 # usage: >>> from safe.common.testing import test_safe
 #        >>> test_safe()
-test_safe = SafeTester().test
+def test_safe(*args, **kwargs):
+    """Run tests with numpy's Tester
+
+    numpy.testing is imported here rather than with this module as it is
+    slow to import and this module is imported by safe.api.
+    """
+    from numpy.testing import Tester
+
+    class SafeTester(Tester):
+        """Tester class for testing SAFE package."""
+        def _show_system_info(self):
+            print 'safe version %s' % get_version()
+            super(SafeTester, self)._show_system_info()
+
+    tester = SafeTester(os.path.dirname(os.path.abspath(__file__)))
+    tester.package_name = __name__
+    return tester.test(*args, **kwargs)
+
+
+# Not a test itself
+test_safe.__test__ = False
 
 # Find parent parent directory to path
 # NOTE: This must match Makefile target testdata
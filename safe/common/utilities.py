@@ -4,14 +4,10 @@
 import os
 import sys
 import numpy
-import zipfile
-import platform
-import gettext
 from datetime import date
 import getpass
 from tempfile import mkstemp
 from subprocess import PIPE, Popen
-import ctypes
 from numbers import Integral
 import math
 
@@ -32,26 +28,8 @@ except ImportError:
 import logging
 LOGGER = logging.getLogger('InaSAFE')
 
-
-class MEMORYSTATUSEX(ctypes.Structure):
-    """
-    This class is used for getting the free memory on Windows
-    """
-    _fields_ = [
-        ("dwLength", ctypes.c_ulong),
-        ("dwMemoryLoad", ctypes.c_ulong),
-        ("ullTotalPhys", ctypes.c_ulonglong),
-        ("ullAvailPhys", ctypes.c_ulonglong),
-        ("ullTotalPageFile", ctypes.c_ulonglong),
-        ("ullAvailPageFile", ctypes.c_ulonglong),
-        ("ullTotalVirtual", ctypes.c_ulonglong),
-        ("ullAvailVirtual", ctypes.c_ulonglong),
-        ("sullAvailExtendedVirtual", ctypes.c_ulonglong)]
-
-    def __init__(self):
-        # have to initialize this to the size of MEMORYSTATUSEX
-        self.dwLength = ctypes.sizeof(self)
-        super(MEMORYSTATUSEX, self).__init__()
+# Translations by language (see ugettext)
+_translations = {}
 
 
 def verify(statement, message=None):
@@ -76,15 +54,23 @@ def verify(statement, message=None):
 
 def ugettext(s):
     """Translation support
+
+    Translations are loaded once for each language.
     """
-    path = os.path.abspath(os.path.join(os.path.dirname(__file__),
-                                        '..', 'i18n'))
     if 'LANG' not in os.environ:
         return s
     lang = os.environ['LANG']
-    filename_prefix = 'inasafe'
-    t = gettext.translation(filename_prefix,
-                            path, languages=[lang], fallback=True)
+    try:
+        t = _translations[lang]
+    except KeyError:
+        import gettext
+
+        path = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', 'i18n'))
+        filename_prefix = 'inasafe'
+        t = gettext.translation(filename_prefix,
+                                path, languages=[lang], fallback=True)
+        _translations[lang] = t
     return t.ugettext(s)
 
 
@@ -192,6 +178,39 @@ def unique_filename(**kwargs):
     return filename
 
 
+def create_memmap(shape, dtype=numpy.float64):
+    """Create temporary array backed by a memory mapped file
+
+    Large grids held this way live in the page cache rather than on the
+    heap, so the operating system can page them out when memory is short.
+
+    :param shape: Shape of array
+    :type shape: tuple
+
+    :param dtype: Numeric type of array
+    :type dtype: numpy.dtype
+
+    :returns: Uninitialised array. The file is created in the 'memmap'
+        sub directory of temp_dir and, where the platform allows it,
+        removed straight away so that it disappears with the array.
+        Empty arrays are not memory mapped.
+    :rtype: numpy.memmap, numpy.ndarray
+    """
+
+    if numpy.prod(shape) == 0:
+        # Empty files can not be memory mapped
+        return numpy.empty(shape, dtype=dtype)
+
+    filename = unique_filename(suffix='.mmap', dir='memmap')
+    A = numpy.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+    try:
+        os.remove(filename)
+    except OSError:
+        # Open files can not be removed on Windows
+        pass
+    return A
+
+
 def zip_shp(shp_path, extra_ext=None, remove_file=False):
     """Zip shape file and its gang (.shx, .dbf, .prj).
 
@@ -217,6 +236,8 @@ def zip_shp(shp_path, extra_ext=None, remove_file=False):
         exts.extend(extra_ext)
 
     # zip files
+    import zipfile
+
     zip_filename = shp_basename + '.zip'
     zip_object = zipfile.ZipFile(zip_filename, 'w')
     for ext in exts:
@@ -253,6 +274,28 @@ def get_free_memory_win():
     Warning : this script is really not robust
     Return in MB unit
     """
+    import ctypes
+
+    class MEMORYSTATUSEX(ctypes.Structure):
+        """
+        This class is used for getting the free memory on Windows
+        """
+        _fields_ = [
+            ("dwLength", ctypes.c_ulong),
+            ("dwMemoryLoad", ctypes.c_ulong),
+            ("ullTotalPhys", ctypes.c_ulonglong),
+            ("ullAvailPhys", ctypes.c_ulonglong),
+            ("ullTotalPageFile", ctypes.c_ulonglong),
+            ("ullAvailPageFile", ctypes.c_ulonglong),
+            ("ullTotalVirtual", ctypes.c_ulonglong),
+            ("ullAvailVirtual", ctypes.c_ulonglong),
+            ("sullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+        def __init__(self):
+            # have to initialize this to the size of MEMORYSTATUSEX
+            self.dwLength = ctypes.sizeof(self)
+            super(MEMORYSTATUSEX, self).__init__()
+
     stat = MEMORYSTATUSEX()
     ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(stat))
     return int(stat.ullAvailPhys / 1024 / 1024)
@@ -289,6 +332,8 @@ def get_free_memory_osx():
         # 6456M used, 1735M free.
     except OSError:
         raise OSError
+    import platform
+
     platform_version = platform.mac_ver()[0]
     # Might get '10.9.1' so strop off the last no
     parts = platform_version.split('.')
@@ -3,15 +3,21 @@
 Provides the function calculate_impact()
 """
 
+import os
+import math
 import numpy
 
 from safe.storage.projection import Projection
 from safe.storage.projection import DEFAULT_PROJECTION
+from safe.storage.raster import Raster, TiledRasterWriter
+from safe.storage.vector import Vector
+from safe.storage.utilities import get_tile_windows, write_keywords
+from safe.storage.utilities import concatenate_columns
+from safe.common.utilities import OrderedDict
 from safe.impact_functions.core import extract_layers
 from safe.common.utilities import unique_filename, verify
 from utilities import REQUIRED_KEYWORDS
 from datetime import datetime
-from socket import gethostname
 from safe.common.utilities import ugettext as tr
 import getpass
 
@@ -20,7 +26,8 @@ import logging
 LOGGER = logging.getLogger('InaSAFE')
 
 
-def calculate_impact(layers, impact_fcn, extent=None, check_integrity=True):
+def calculate_impact(layers, impact_fcn, extent=None, check_integrity=True,
+                     tile_size=None, processes=None):
     """Calculate impact levels as a function of list of input layers
 
     Input
@@ -33,6 +40,20 @@ def calculate_impact(layers, impact_fcn, extent=None, check_integrity=True):
 
         check_integrity:    If true, perform checking of input data integrity
 
+        tile_size:  Optional maximal number of grid rows to process at a
+                    time. If given, and if the impact function supports it
+                    (see run_tiled), the impact is computed and written
+                    tile by tile so that memory use is bounded by the tile
+                    rather than the whole grid.
+
+        processes:  Optional number of worker processes. If greater than one,
+                    and if the impact function supports it, the analysis is
+                    split into spatial chunks that are computed in parallel
+                    by a multiprocessing pool. Raster layers are split into
+                    blocks of rows and vector exposure features are assigned
+                    to exactly one chunk each by their centroids. The merged
+                    result is the same as that of a single process run.
+
     Output
         filename of resulting impact layer (GML). Comment is embedded as
         metadata. Filename is generated from input data and date.
@@ -64,7 +85,18 @@ def calculate_impact(layers, impact_fcn, extent=None, check_integrity=True):
     start_time = datetime.now()
 
     # Pass input layers to plugin
-    F = impact_function.run(layers)
+    parallel = processes is not None and processes > 1
+    tiled = ((tile_size is not None or parallel) and
+             is_tileable(impact_function, layers))
+    if tiled:
+        if tile_size is None:
+            tile_size = int(math.ceil(float(layers[0].rows) / processes))
+        F = run_tiled(impact_function, layers, tile_size,
+                      processes=processes)
+    elif parallel and is_chunkable(impact_function, layers):
+        F = run_chunked(impact_function, layers, processes)
+    else:
+        F = impact_function.run(layers)
 
     # End time
     end_time = datetime.now()
@@ -83,6 +115,7 @@ def calculate_impact(layers, impact_fcn, extent=None, check_integrity=True):
     user = getpass.getuser().replace(' ', '_')
 
     # Get host
+    from socket import gethostname
     host_name = gethostname()
 
     # Get input layer sources
@@ -121,9 +154,14 @@ def calculate_impact(layers, impact_fcn, extent=None, check_integrity=True):
         extension = '.shp'
         # use default style for vector
 
-    output_filename = unique_filename(suffix=extension)
-    F.filename = output_filename
-    F.write_to_file(output_filename)
+    if tiled:
+        # Grid has already been written tile by tile
+        basename, _ = os.path.splitext(F.filename)
+        write_keywords(F.keywords, basename + '.keywords')
+    else:
+        output_filename = unique_filename(suffix=extension)
+        F.filename = output_filename
+        F.write_to_file(output_filename)
 
     # Establish default name (layer1 X layer1 x impact_function)
     if not F.get_name():
@@ -146,6 +184,356 @@ def calculate_impact(layers, impact_fcn, extent=None, check_integrity=True):
     return F
 
 
+def supports_tiles(impact_function):
+    """Check if impact function implements run_tile and finalise_impact
+    """
+
+    return (hasattr(impact_function, 'run_tile') and
+            hasattr(impact_function, 'finalise_impact'))
+
+
+def is_tileable(impact_function, layers):
+    """Check if impact function can be run tile by tile on layers
+
+    Input
+        impact_function: Instance of impact function
+        layers: List of Raster and Vector layer objects
+
+    Output
+        True if the impact function implements run_tile and
+        finalise_impact and all layers are aligned rasters
+    """
+
+    if not supports_tiles(impact_function):
+        return False
+
+    shapes = set()
+    for layer in layers:
+        if not layer.is_raster:
+            return False
+        shapes.add((layer.rows, layer.columns))
+
+    return len(shapes) == 1
+
+
+def is_chunkable(impact_function, layers):
+    """Check if impact function can be run on subsets of exposure features
+
+    Input
+        impact_function: Instance of impact function
+        layers: List of Raster and Vector layer objects
+
+    Output
+        True if the impact function implements run_tile and
+        finalise_impact and the exposure layer is a non-empty vector layer
+    """
+
+    if not supports_tiles(impact_function):
+        return False
+
+    exposure_layers = extract_layers(layers, 'category', 'exposure')
+    return (len(exposure_layers) == 1 and exposure_layers[0].is_vector and
+            len(exposure_layers[0]) > 0)
+
+
+def add_totals(total, value):
+    """Add totals returned by run_tile for one tile to accumulated totals
+
+    Input
+        total: Accumulated totals or None if this is the first tile
+        value: Numbers or (nested) dictionaries or lists of numbers
+
+    Output
+        Element wise sum of total and value with the same structure
+    """
+
+    if total is None:
+        return value
+
+    if isinstance(value, dict):
+        return dict([(key, add_totals(total[key], value[key]))
+                     for key in value])
+    elif isinstance(value, (list, tuple)):
+        return [add_totals(x, y) for x, y in zip(total, value)]
+    else:
+        return total + value
+
+
+# Impact function and layers common to all jobs (see map_jobs)
+_job_context = None
+
+
+def set_job_context(impact_function, layers):
+    """Set impact function and layers used by run_tile
+
+    Input
+        impact_function: Instance of impact function
+        layers: List of layers. Entries replaced by each job may be None.
+
+    Note
+        This is the initializer of worker processes so the layers are
+        passed once per process rather than with every job.
+    """
+
+    global _job_context
+    _job_context = (impact_function, layers)
+
+
+def run_tile(job):
+    """Run impact function for one tile or chunk
+
+    Input
+        job: Tuple (window, chunk) as made by run_tiled and run_chunked
+             where chunk is None or a tuple (i, layer) of a layer
+             replacing layer i of the layers set by set_job_context
+
+    Output
+        Result of impact_function.run_tile(layers, window)
+
+    Note
+        This is a module level function so that it can be passed to
+        worker processes.
+    """
+
+    impact_function, layers = _job_context
+    window, chunk = job
+    if chunk is not None:
+        i, layer = chunk
+        layers = list(layers)
+        layers[i] = layer
+    return impact_function.run_tile(layers, window=window)
+
+
+def map_jobs(impact_function, layers, jobs, processes=None):
+    """Iterate over results of run_tile for jobs in the given order
+
+    Input
+        impact_function: Instance of impact function
+        layers: List of layers common to all jobs
+        jobs: List of arguments for run_tile
+        processes: Number of worker processes. If None or 1 the jobs
+                   are run in this process.
+
+    Output
+        Generator of results - one for each job
+
+    Note
+        Jobs only hold their window and chunk of features. The impact
+        function and layers go to each worker process once, so grids
+        held in memory are not copied for every job.
+    """
+
+    if processes is None or processes <= 1:
+        set_job_context(impact_function, layers)
+        try:
+            for job in jobs:
+                yield run_tile(job)
+        finally:
+            set_job_context(None, None)
+        return
+
+    # Imported here as only parallel runs need it
+    import multiprocessing
+
+    pool = multiprocessing.Pool(processes=processes,
+                                initializer=set_job_context,
+                                initargs=(impact_function, layers))
+    try:
+        # Results are yielded in order as they become available
+        for result in pool.imap(run_tile, jobs):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def run_tiled(impact_function, layers, tile_size, processes=None):
+    """Run impact function tile by tile and write result incrementally
+
+    Input
+        impact_function: Instance of impact function implementing
+                         run_tile(layers, window) and
+                         finalise_impact(layers, totals, extrema)
+        layers: List of aligned Raster layers
+        tile_size: Maximal number of grid rows in each tile
+        processes: Optional number of worker processes computing tiles
+
+    Output
+        Raster impact layer backed by the file the tiles were written to.
+
+    Note
+        run_tile returns the impact grid for the given pixel window
+        together with a structure of counts that add up over tiles.
+        finalise_impact creates name, keywords and style from the
+        accumulated counts and the extrema of the impact grid.
+    """
+
+    reference = layers[0]
+    columns = reference.columns
+    rows = reference.rows
+    geotransform = reference.get_geotransform()
+    projection = reference.get_projection()
+
+    output_filename = unique_filename(suffix='.tif')
+    writer = TiledRasterWriter(output_filename, columns, rows,
+                               geotransform, projection)
+
+    windows = get_tile_windows(columns, rows, tile_size)
+    jobs = [(window, None) for window in windows]
+
+    totals = None
+    minimum = maximum = numpy.nan
+    try:
+        results = map_jobs(impact_function, layers, jobs,
+                           processes=processes)
+        for window, (impact, tile_totals) in zip(windows, results):
+            LOGGER.debug('Calculated impact for window %s' % str(window))
+            writer.write(impact, window)
+            totals = add_totals(totals, tile_totals)
+
+            # Extrema ignoring NaN (fmin and fmax propagate non-NaN values)
+            if numpy.isfinite(impact).any():
+                minimum = numpy.fmin(minimum, numpy.nanmin(impact))
+                maximum = numpy.fmax(maximum, numpy.nanmax(impact))
+    finally:
+        writer.close()
+
+    name, keywords, style_info = impact_function.finalise_impact(
+        layers, totals, (minimum, maximum))
+
+    F = Raster(output_filename, name=name, style_info=style_info)
+    F.keywords = keywords
+    return F
+
+
+def get_feature_locations(layer):
+    """Representative point of each feature in vector layer
+
+    Input
+        layer: Vector layer
+
+    Output
+        Nx2 array of points, centroids or (for lines) centres of
+        bounding boxes - one for each feature
+    """
+
+    if layer.is_point_data:
+        return numpy.array(layer.get_geometry(), dtype=numpy.float)
+
+    packed = layer.get_packed_geometry()
+    if layer.is_polygon_data:
+        return packed.centroids()
+    else:
+        bboxes = packed.bounding_boxes()
+        return numpy.array([(bboxes[:, 0] + bboxes[:, 1]) / 2,
+                            (bboxes[:, 2] + bboxes[:, 3]) / 2]).T
+
+
+def partition_features(layer, number_of_chunks):
+    """Assign each feature in vector layer to exactly one spatial chunk
+
+    Input
+        layer: Vector layer
+        number_of_chunks: Desired number of chunks
+
+    Output
+        List of arrays of feature indices in ascending order - one for
+        each non-empty chunk.
+
+    Note
+        Features are sorted by the longitude of their centroids and split
+        into strips of equal numbers of features. Features without a
+        well defined centroid (e.g. degenerate polygons) go to the last
+        chunk.
+    """
+
+    x = get_feature_locations(layer)[:, 0]
+    order = numpy.argsort(x, kind='mergesort')
+    chunks = numpy.array_split(order, min(number_of_chunks, len(order)))
+    return [numpy.sort(indices) for indices in chunks if len(indices) > 0]
+
+
+def merge_vector_layers(layers, indices):
+    """Merge impact layers computed for chunks of features
+
+    Input
+        layers: List of vector layers - one for each chunk
+        indices: List of arrays of feature indices - one for each chunk
+
+    Output
+        geometry: List of geometries in original feature order
+        columns: Dictionary of attribute columns in original feature order
+    """
+
+    order = numpy.argsort(numpy.concatenate(indices), kind='mergesort')
+
+    geometry = []
+    for layer in layers:
+        if layer.is_polygon_data:
+            geometry.extend(layer.get_geometry(as_geometry_objects=True))
+        else:
+            geometry.extend(layer.get_geometry())
+    geometry = [geometry[i] for i in order]
+
+    columns = OrderedDict()
+    for name in layers[0].get_attribute_names():
+        column = concatenate_columns([layer.get_data(name)
+                                      for layer in layers])
+        columns[name] = column[order]
+
+    return geometry, columns
+
+
+def run_chunked(impact_function, layers, processes):
+    """Run impact function in parallel on chunks of exposure features
+
+    Input
+        impact_function: Instance of impact function implementing
+                         run_tile(layers) and
+                         finalise_impact(layers, totals, extrema)
+        layers: List of layers with exactly one vector exposure layer
+        processes: Number of worker processes
+
+    Output
+        Vector impact layer with features in the order of the exposure layer
+
+    Note
+        Each chunk is computed by run_tile from the input layers with the
+        exposure layer replaced by the subset of features in the chunk.
+    """
+
+    exposure = extract_layers(layers, 'category', 'exposure')[0]
+    chunks = partition_features(exposure, processes)
+
+    # Only the exposure subsets differ between jobs
+    i = [layer is exposure for layer in layers].index(True)
+    common_layers = list(layers)
+    common_layers[i] = None
+    jobs = [(None, (i, exposure.get_subset(indices))) for indices in chunks]
+
+    totals = None
+    impact_layers = []
+    for impact_layer, chunk_totals in map_jobs(impact_function,
+                                               common_layers, jobs,
+                                               processes=processes):
+        impact_layers.append(impact_layer)
+        totals = add_totals(totals, chunk_totals)
+
+    name, keywords, style_info = impact_function.finalise_impact(
+        layers, totals, None)
+
+    geometry, columns = merge_vector_layers(impact_layers, chunks)
+    return Vector(data=columns,
+                  geometry=geometry,
+                  projection=impact_layers[0].get_projection(),
+                  name=name,
+                  keywords=keywords,
+                  style_info=style_info)
+
+
 def check_data_integrity(layer_objects):
     """Check list of layer objects
 
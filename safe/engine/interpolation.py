@@ -6,25 +6,33 @@ to another irrespective of layer types.
 
 import numpy
 
-from safe.common.interpolation2d import interpolate_raster
+from safe.common.interpolation2d import (interpolate_raster,
+                                         InterpolationPlan)
 from safe.common.utilities import verify
 from safe.common.utilities import ugettext as tr
 from safe.common.numerics import ensure_numeric
-from safe.common.geodesy import Point
+from safe.common.geodesy import Point, great_circle_distances
 from safe.common.exceptions import InaSAFEError, BoundsError
 from safe.common.polygon import (inside_polygon,
-                                 clip_lines_by_polygons, clip_grid_by_polygons)
+                                 clip_lines_by_polygons, rasterize_polygons,
+                                 zonal_statistics, split_lines_by_grid,
+                                 polygon_to_trapezoids,
+                                 clip_rings_by_convex_polygons)
+from safe.common.spatial_index import PointIndex, BoxIndex
 
 from safe.storage.vector import Vector, convert_polygons_to_centroids
 from safe.storage.utilities import geometry_type_to_string
 from safe.storage.utilities import DEFAULT_ATTRIBUTE
-from safe.storage.geometry import Polygon
+from safe.storage.utilities import take_values
+from safe.storage.geometry import Polygon, PackedGeometry
 
 
 def assign_hazard_values_to_exposure_data(hazard, exposure,
                                           layer_name=None,
                                           attribute_name=None,
-                                          mode='linear'):
+                                          mode='linear',
+                                          overlay=False,
+                                          compact=False):
     """Assign hazard values to exposure data
 
         This is the high level wrapper around interpolation functions for
@@ -60,6 +68,19 @@ def assign_hazard_values_to_exposure_data(hazard, exposure,
                  all the way down to the underlying interpolation function
                  interpolate2d (module common/interpolation2d.py)
 
+            * overlay:
+                 For polygon hazard and polygon exposure only. If True,
+                 exposure polygons are clipped by the hazard polygons and
+                 the part of each exposure polygon in each hazard polygon
+                 is returned with its area fraction.
+                 If False (default) hazard values are assigned to the
+                 centroids of the exposure polygons.
+
+            * compact:
+                 For polygon hazard and raster exposure only. If True,
+                 a GridValuesByPolygon instance is returned instead of a
+                 point layer. See interpolate_polygon_raster.
+
     Returns:
             Layer representing the exposure data with hazard levels assigned.
 
@@ -84,7 +105,9 @@ def assign_hazard_values_to_exposure_data(hazard, exposure,
 
           Polygon-Line: * Not Implemented *
 
-          Polygon-Polygon: * Not Implemented *
+          Polygon-Polygon: Assign polygon attributes to centroids or, with
+            overlay=True, clip exposure polygons by hazard polygons and
+            assign polygon attributes and area fractions to the parts
 
           Polygon-Raster: Convert raster to points, clip to polygon,
             assign values and return point data
@@ -92,7 +115,8 @@ def assign_hazard_values_to_exposure_data(hazard, exposure,
           Raster-Point: Bilinear (or constant) interpolation as currently
             implemented
 
-          Raster-Line: * Not Implemented *
+          Raster-Line: Split lines at grid cell boundaries and interpolate
+            raster to midpoint of each piece
 
           Raster-Polygon:  Calculate centroids and use Raster - Point algorithm
 
@@ -105,13 +129,13 @@ def assign_hazard_values_to_exposure_data(hazard, exposure,
 
           Polygon-Line: N/A
 
-          Polygon-Polygon: N/A
+          Polygon-Polygon: Polygon data
 
           Polygon-Raster: Point data
 
           Raster-Point: Point data
 
-          Raster-Line: N/A
+          Raster-Line: Line data
 
           Raster-Polygon: Polygon data
 
@@ -143,12 +167,14 @@ def assign_hazard_values_to_exposure_data(hazard, exposure,
     # Vector-Vector
     elif hazard.is_vector and exposure.is_vector:
         return interpolate_polygon_vector(hazard, exposure,
-                                          layer_name=layer_name)
+                                          layer_name=layer_name,
+                                          overlay=overlay)
     # Vector-Raster
     elif hazard.is_vector and exposure.is_raster:
         return interpolate_polygon_raster(hazard, exposure,
                                           layer_name=layer_name,
-                                          attribute_name=attribute_name)
+                                          attribute_name=attribute_name,
+                                          compact=compact)
     # Unknown
     else:
         msg = ('Unknown combination of types for hazard and exposure data. '
@@ -198,7 +224,8 @@ def check_inputs(hazard, exposure, layer_name, attribute_name):
         and attribute_name is None):
         attribute_name = exposure.get_name()
 
-    if (hazard.is_raster and exposure.is_vector and exposure.is_point_data
+    if (hazard.is_raster and exposure.is_vector and
+        (exposure.is_point_data or exposure.is_line_data)
         and attribute_name is None):
         attribute_name = hazard.get_name()
 
@@ -220,7 +247,7 @@ def interpolate_raster_vector(source, target,
 
     Args:
         * source: Raster data set (grid)
-        * target: Vector data set (points or polygons)
+        * target: Vector data set (points, lines or polygons)
         * layer_name: Optional name of returned interpolated layer.
               If None the name of V is used for the returned layer.
         * attribute_name: Name for new attribute.
@@ -244,9 +271,12 @@ def interpolate_raster_vector(source, target,
                                              layer_name=layer_name,
                                              attribute_name=attribute_name,
                                              mode=mode)
-    #elif target.is_line_data:
-    # TBA - issue https://github.com/AIFDR/inasafe/issues/36
-    #
+    elif target.is_line_data:
+        # Interpolate from raster to pieces of lines within each cell
+        R = interpolate_raster_vector_lines(source, target,
+                                            layer_name=layer_name,
+                                            attribute_name=attribute_name,
+                                            mode=mode)
     elif target.is_polygon_data:
         # Use centroids, in case of polygons
         P = convert_polygons_to_centroids(target)
@@ -256,7 +286,7 @@ def interpolate_raster_vector(source, target,
         # In case of polygon data, restore the polygon geometry
         # Do this setting the geometry of the returned set to
         # that of the original polygon
-        R = Vector(data=R.get_data(),
+        R = Vector(data=R.get_columns(),
                    projection=R.get_projection(),
                    geometry=target.get_geometry(),
                    name=R.get_name())
@@ -270,7 +300,7 @@ def interpolate_raster_vector(source, target,
 
 
 def interpolate_polygon_vector(source, target,
-                               layer_name=None):
+                               layer_name=None, overlay=False):
     """Interpolate from polygon vector layer to vector data
 
     Args:
@@ -278,14 +308,18 @@ def interpolate_polygon_vector(source, target,
         * target: Vector data set (points or polygons)  - TBA also lines
         * layer_name: Optional name of returned interpolated layer.
               If None the name of target is used for the returned layer.
+        * overlay: If True and target is polygon data, return the parts
+              of target polygons clipped by source polygons
+              (see interpolate_polygon_polygons).
 
     Output
         I: Vector data set; points located as target with values interpolated
            from source
 
     Note:
-        If target geometry is polygon, data will be interpolated to
-        its centroids and the output is a point data set.
+        If target geometry is polygon and overlay is False, data will be
+        interpolated to its centroids and the output has the original
+        polygon geometry.
     """
 
     # Input checks
@@ -299,6 +333,9 @@ def interpolate_polygon_vector(source, target,
     elif target.is_line_data:
         R = interpolate_polygon_lines(source, target,
                                       layer_name=layer_name)
+    elif target.is_polygon_data and overlay:
+        R = interpolate_polygon_polygons(source, target,
+                                         layer_name=layer_name)
     elif target.is_polygon_data:
         # Use polygon centroids
         X = convert_polygons_to_centroids(target)
@@ -308,7 +345,7 @@ def interpolate_polygon_vector(source, target,
         # In case of polygon data, restore the polygon geometry
         # Do this setting the geometry of the returned set to
         # that of the original polygon
-        R = Vector(data=P.get_data(),
+        R = Vector(data=P.get_columns(),
                    projection=P.get_projection(),
                    geometry=target.get_geometry(as_geometry_objects=True),
                    name=P.get_name())
@@ -321,8 +358,105 @@ def interpolate_polygon_vector(source, target,
     return R
 
 
+class GridValuesByPolygon(object):
+    """Grid values grouped by the polygons they fall in
+
+    This is the compact result of interpolate_polygon_raster. Rather than
+    one point feature with a copy of the polygon attributes for every grid
+    point it holds
+
+        * polygon_ids: Index of the polygon each grid point falls in
+        * values: Grid value at each grid point
+        * cells: Index of each grid point into the flattened grid
+        * polygons: The polygon layer, i.e. the attribute table referred
+          to by polygon_ids
+        * grid: The raster layer
+
+    Grid points are ordered by polygon and, within each polygon, row by row
+    from the north. A point layer as returned by interpolate_polygon_raster
+    with compact=False is available through method to_vector.
+    """
+
+    def __init__(self, polygon_ids, values, cells, polygons, grid):
+        self.polygon_ids = polygon_ids
+        self.values = values
+        self.cells = cells
+        self.polygons = polygons
+        self.grid = grid
+
+    def __len__(self):
+        return len(self.polygon_ids)
+
+    def get_columns(self):
+        """Attribute table of the polygons (not a copy)
+        """
+        return self.polygons.get_columns()
+
+    def get_geometry(self):
+        """Coordinates of grid points as an Nx2 array
+        """
+
+        # Point k lies in row k / nx (counted from the north) and column k % nx
+        longitudes, latitudes = self.grid.get_geometry()
+        nx = len(longitudes)
+        ny = len(latitudes)
+        points = numpy.zeros((len(self.cells), 2))
+        points[:, 0] = longitudes[self.cells % nx]
+        points[:, 1] = latitudes[ny - 1 - self.cells // nx]
+        return points
+
+    def sum_by_polygon(self, mask=None, ignore_nan=False):
+        """Sum of grid values in each polygon
+
+        Args:
+            * mask: Optional boolean array with one entry per polygon.
+                  Sums of polygons where mask is False are zero.
+            * ignore_nan: If True nan values are left out of the sums.
+                  Otherwise (default) the sum of a polygon with a nan
+                  value is nan as when adding up the values of the point
+                  layer.
+
+        Returns:
+            Array with one sum per polygon.
+        """
+
+        values = self.values
+        if ignore_nan:
+            values = numpy.where(numpy.isnan(values), 0, values)
+        if mask is not None:
+            values = numpy.where(mask[self.polygon_ids], values, 0)
+
+        N = len(self.polygons)
+        return numpy.bincount(self.polygon_ids, weights=values,
+                              minlength=max(N, 1))[:N]
+
+    def to_vector(self, layer_name=None, attribute_name=None):
+        """Point layer with one feature per grid point
+
+        Args:
+            * layer_name: Optional name of returned layer
+            * attribute_name: Name of attribute holding the grid values
+
+        Returns:
+            Vector point layer with the attributes of the polygon each
+            point falls in, the grid value and 'polygon_id'.
+        """
+
+        columns = {}
+        for key, column in self.get_columns().items():
+            columns[key] = take_values(column, self.polygon_ids)
+        columns[attribute_name] = self.values
+        columns['polygon_id'] = self.polygon_ids
+
+        return Vector(data=columns,
+                      projection=self.polygons.get_projection(),
+                      geometry=self.get_geometry(),
+                      name=layer_name)
+
+
 def interpolate_polygon_raster(source, target,
-                               layer_name=None, attribute_name=None):
+                               layer_name=None, attribute_name=None,
+                               compact=False):
     """Interpolate from polygon layer to raster data
 
     Args
@@ -332,9 +466,13 @@ def interpolate_polygon_raster(source, target,
               If None the name of source is used for the returned layer.
         * attribute_name: Name for new attribute.
               If None (default) the name of layer target is used
+        * compact: If True return grid values grouped by polygon as a
+              GridValuesByPolygon instance instead of a point layer.
+              This avoids copying polygon attributes to every grid point.
     Output
         I: Vector data set; points located as target with
-           values interpolated from source
+           values interpolated from source. If compact is True,
+           GridValuesByPolygon instance with the same information.
 
     Note:
         Each point in the resulting dataset will have an attribute
@@ -347,39 +485,85 @@ def interpolate_polygon_raster(source, target,
     verify(source.is_vector)
     verify(source.is_polygon_data)
 
-    # Run underlying clipping algorithm
+    # Burn polygon ids into a grid aligned with the raster
+    A = target.get_data(scaling=False)
     polygon_geometry = source.get_geometry(as_geometry_objects=True)
-
-    polygon_attributes = source.get_data()
-    res = clip_grid_by_polygons(target.get_data(scaling=False),
+    labels = rasterize_polygons(polygon_geometry,
                                 target.get_geotransform(),
-                                polygon_geometry)
+                                A.shape).reshape(-1)
 
-    # Create one new point layer with interpolated attributes
-    new_geometry = []
-    new_attributes = []
-    for i, (geometry, values) in enumerate(res):
+    # Grid points inside polygons grouped by polygon
+    cells = numpy.where(labels >= 0)[0]
+    cells = cells[numpy.argsort(labels[cells], kind='mergesort')]
 
-        # For each polygon assign attributes to points that fall inside it
-        for j, geom in enumerate(geometry):
-            attr = polygon_attributes[i].copy()  # Attributes for this polygon
-            attr[attribute_name] = values[j]  # Attribute value from grid cell
-            attr['polygon_id'] = i  # Store id for associated polygon
+    result = GridValuesByPolygon(labels[cells], A.reshape(-1)[cells], cells,
+                                 source, target)
+    if compact:
+        return result
 
-            new_attributes.append(attr)
-            new_geometry.append(geom)
+    return result.to_vector(layer_name=layer_name,
+                            attribute_name=attribute_name)
 
-    R = Vector(data=new_attributes,
-               projection=source.get_projection(),
-               geometry=new_geometry,
-               name=layer_name)
-    return R
+
+def make_interpolation_plan(source, target, mode='linear'):
+    """Precompute interpolation from raster layer to point data
+
+    Args:
+        * source: Raster data set (grid)
+        * target: Vector data set (points)
+        * mode: 'linear' or 'constant' - determines whether interpolation
+              from grid to points should be bilinear or piecewise constant
+
+    Output
+        plan: InterpolationPlan for the part of the grid surrounding
+              the points. It can be passed to
+              interpolate_raster_vector_points for this target and any
+              raster with the same geotransform and dimensions as source.
+    """
+
+    msg = ('There are no data points to interpolate to. Perhaps zoom out '
+           'and try again')
+    verify(len(target) > 0, msg)
+
+    # Input checks
+    verify(source.is_raster)
+    verify(target.is_vector)
+    verify(target.is_point_data)
+
+    # Get vector point geometry as Nx2 array
+    coordinates = numpy.array(target.get_geometry(),
+                              dtype='d',
+                              copy=False)
+
+    # Only use the part of the grid surrounding the points. One pixel
+    # of padding keeps all neighbours needed for bilinear interpolation.
+    bbox = [numpy.min(coordinates[:, 0]), numpy.min(coordinates[:, 1]),
+            numpy.max(coordinates[:, 0]), numpy.max(coordinates[:, 1])]
+    window = source.get_window(bbox, padding=1)
+    if window[2] < 2 or window[3] < 2:
+        # Points are outside or at the very edge of the grid
+        window = None
+
+    longitudes, latitudes = source.get_geometry(window=window)
+    try:
+        plan = InterpolationPlan(longitudes, latitudes, coordinates,
+                                 mode=mode, raster=True, window=window)
+    except (BoundsError, InaSAFEError), e:
+        msg = (tr('Could not interpolate from raster layer %(raster)s to '
+                 'vector layer %(vector)s. Error message: %(error)s')
+               % {'raster': source.get_name(),
+                  'vector': target.get_name(),
+                  'error': str(e)})
+        raise InaSAFEError(msg)
+
+    return plan
 
 
 def interpolate_raster_vector_points(source, target,
                                      layer_name=None,
                                      attribute_name=None,
-                                     mode='linear'):
+                                     mode='linear',
+                                     plan=None):
     """Interpolate from raster layer to point data
 
     Args:
@@ -391,6 +575,10 @@ def interpolate_raster_vector_points(source, target,
               If None (default) the name of layer source is used
         * mode: 'linear' or 'constant' - determines whether interpolation
               from grid to points should be bilinear or piecewise constant
+        * plan: Optional interpolation plan made by make_interpolation_plan
+              for target and a raster on the same grid as source. Use this
+              to interpolate many rasters to the same points. If given,
+              mode is ignored.
 
     Output
         I: Vector data set; points located as target with values
@@ -398,6 +586,83 @@ def interpolate_raster_vector_points(source, target,
 
     """
 
+    if plan is None:
+        plan = make_interpolation_plan(source, target, mode=mode)
+    else:
+        # Input checks
+        verify(source.is_raster)
+        verify(target.is_vector)
+        verify(target.is_point_data)
+
+        msg = ('Interpolation plan was made for %i points but layer %s has '
+               '%i' % (plan.number_of_points, target.get_name(),
+                       len(target)))
+        verify(plan.number_of_points == len(target), msg)
+
+        longitudes, latitudes = source.get_geometry(window=plan.window)
+        msg = ('Interpolation plan was not made for the grid of raster '
+               'layer %s' % source.get_name())
+        verify(numpy.array_equal(longitudes, plan.x) and
+               numpy.array_equal(latitudes, plan.y), msg)
+
+    # Get raster data for the part of the grid used by the plan
+    A = source.get_data(nan=True, window=plan.window)
+
+    # Get original attributes as columns
+    columns = target.get_columns()
+
+    # Create new attribute and interpolate
+    try:
+        values = plan.apply(A)
+    except InaSAFEError, e:
+        msg = (tr('Could not interpolate from raster layer %(raster)s to '
+                 'vector layer %(vector)s. Error message: %(error)s')
+               % {'raster': source.get_name(),
+                  'vector': target.get_name(),
+                  'error': str(e)})
+        raise InaSAFEError(msg)
+
+    # Add interpolated attribute to existing attributes and return
+    columns[attribute_name] = values
+
+    return Vector(data=columns,
+                  projection=target.get_projection(),
+                  geometry=numpy.array(target.get_geometry(),
+                                       dtype='d', copy=False),
+                  name=layer_name)
+
+
+def interpolate_raster_vector_lines(source, target,
+                                    layer_name=None,
+                                    attribute_name=None,
+                                    mode='linear'):
+    """Interpolate from raster layer to line data
+
+    Args:
+        * source: Raster data set (grid)
+        * target: Vector data set (lines)
+        * layer_name: Optional name of returned interpolated layer.
+              If None the name of target is used for the returned layer.
+        * attribute_name: Name for new attribute.
+              If None (default) the name of layer source is used
+        * mode: 'linear' or 'constant' - determines whether interpolation
+              from grid to the midpoints of line pieces should be bilinear
+              or piecewise constant
+
+    Output
+        I: Vector data set of lines. Each line is a piece of a line in
+           target with the attributes of that line and
+           * attribute_name: Value interpolated from source
+           * 'parent_line_id': Index of the line in target
+           * 'length': Length of the piece in meters if target is in
+             geographic coordinates and in projected units otherwise
+
+    Note:
+        Lines are split at the cell boundaries of the raster and the raster
+        is interpolated to the midpoint of each piece. Consecutive pieces of
+        the same line with the same value are joined again.
+    """
+
     msg = ('There are no data points to interpolate to. Perhaps zoom out '
            'and try again')
     verify(len(target) > 0, msg)
@@ -405,41 +670,85 @@ def interpolate_raster_vector_points(source, target,
     # Input checks
     verify(source.is_raster)
     verify(target.is_vector)
-    verify(target.is_point_data)
+    verify(target.is_line_data)
+
+    # Split all lines into pieces each falling within one grid cell
+    lines = target.get_geometry()
+    line_ids, pieces = split_lines_by_grid(lines, source.get_geotransform())
+    midpoints = (pieces[:, 0, :] + pieces[:, 1, :]) / 2
+
+    # Only read the part of the grid surrounding the lines.
+    window = None
+    coordinates = [line for line in lines if len(line)]
+    if coordinates:
+        coordinates = numpy.concatenate(coordinates)
+        bbox = [numpy.min(coordinates[:, 0]), numpy.min(coordinates[:, 1]),
+                numpy.max(coordinates[:, 0]), numpy.max(coordinates[:, 1])]
+        window = source.get_window(bbox, padding=1)
+        if window[2] < 2 or window[3] < 2:
+            # Lines are outside or at the very edge of the grid
+            window = None
 
     # Get raster data and corresponding x and y axes
-    A = source.get_data(nan=True)
-    longitudes, latitudes = source.get_geometry()
+    A = source.get_data(nan=True, window=window)
+    longitudes, latitudes = source.get_geometry(window=window)
     verify(len(longitudes) == A.shape[1])
     verify(len(latitudes) == A.shape[0])
 
-    # Get vector point geometry as Nx2 array
-    coordinates = numpy.array(target.get_geometry(),
-                              dtype='d',
-                              copy=False)
-    # Get original attributes
-    attributes = target.get_data()
-
-    # Create new attribute and interpolate
+    # Interpolate to midpoints of pieces
     try:
         values = interpolate_raster(longitudes, latitudes, A,
-                                    coordinates, mode=mode)
+                                    midpoints, mode=mode)
     except (BoundsError, InaSAFEError), e:
         msg = (tr('Could not interpolate from raster layer %(raster)s to '
-                 'vector layer %(vector)s. Error message: %(error)s')
+                  'vector layer %(vector)s. Error message: %(error)s')
                % {'raster': source.get_name(),
                   'vector': target.get_name(),
                   'error': str(e)})
         raise InaSAFEError(msg)
 
-    # Add interpolated attribute to existing attributes and return
-    N = len(target)
-    for i in range(N):
-        attributes[i][attribute_name] = values[i]
-
-    return Vector(data=attributes,
+    # Lengths of pieces
+    if target.projection.is_geographic():
+        lengths = great_circle_distances(pieces[:, 0, 0], pieces[:, 0, 1],
+                                         pieces[:, 1, 0], pieces[:, 1, 1])
+    else:
+        lengths = numpy.sqrt(numpy.sum((pieces[:, 1, :] -
+                                        pieces[:, 0, :]) ** 2, axis=1))
+
+    # Join consecutive pieces of same line with the same value
+    # (the pieces are contiguous along each line)
+    same_value = ((values[1:] == values[:-1]) |
+                  (numpy.isnan(values[1:]) & numpy.isnan(values[:-1])))
+    joined = numpy.zeros(len(values), dtype=bool)
+    joined[1:] = (line_ids[1:] == line_ids[:-1]) & same_value
+    joined[1:] &= numpy.all(pieces[1:, 0, :] == pieces[:-1, 1, :], axis=1)
+
+    first = numpy.where(~joined)[0]
+    group = numpy.cumsum(~joined) - 1
+    lengths = numpy.bincount(group, weights=lengths)
+
+    # Vertices of joined lines: start of first piece and ends of all pieces
+    line_start = first + numpy.arange(len(first))
+    vertices = numpy.zeros((len(values) + len(first), 2))
+    vertices[line_start] = pieces[first, 0, :]
+    vertices[numpy.arange(len(values)) + group + 1] = pieces[:, 1, :]
+    new_geometry = []
+    if len(first) > 0:
+        new_geometry = numpy.split(vertices, line_start[1:])
+
+    # Attributes of parent lines and interpolated values
+    parent_ids = line_ids[first]
+    columns = {}
+    for key, column in target.get_columns().items():
+        columns[key] = take_values(column, parent_ids)
+    columns[attribute_name] = values[first]
+    columns['parent_line_id'] = parent_ids
+    columns['length'] = lengths
+
+    return Vector(data=columns,
                   projection=target.get_projection(),
-                  geometry=coordinates,
+                  geometry=new_geometry,
+                  geometry_type='line',
                   name=layer_name)
 
 
@@ -480,44 +789,43 @@ def interpolate_polygon_points(source, target,
 
     # Extract point features
     points = ensure_numeric(target.get_geometry())
-    attributes = target.get_data()
+    columns = target.get_columns()
     original_geometry = target.get_geometry()  # Geometry for returned data
 
     # Extract polygon features
     geom = source.get_geometry(as_geometry_objects=True)
-    data = source.get_data()
-    verify(len(geom) == len(data))
+    verify(len(geom) == len(source))
 
-    # Include polygon_id as attribute
-    attribute_names.append('polygon_id')
-    attribute_names.append(DEFAULT_ATTRIBUTE)
+    # Index points once so that each polygon only tests nearby points
+    index = PointIndex(points)
 
-    # Augment point features with empty attributes from polygon
-    for a in attributes:
-        # Create all attributes that exist in source
-        for key in attribute_names:
-            a[key] = None
-
-    # Traverse polygons and assign attributes to points that fall inside
+    # Traverse polygons and record the polygon each point falls inside.
+    # If polygons overlap, the last one is used.
+    polygon_ids = -numpy.ones(len(points), dtype=numpy.int)
     for i, polygon in enumerate(geom):
-        # Carry all attributes across from source
-        poly_attr = data[i]
+        # Clip data points by polygons
+        indices = inside_polygon(points, polygon.outer_ring,
+                                 holes=polygon.inner_rings,
+                                 index=index)
+        polygon_ids[indices] = i
 
-        # Assign default attribute to indicate points inside
-        poly_attr[DEFAULT_ATTRIBUTE] = True
+    outside = polygon_ids < 0
+    selection = numpy.where(outside, 0, polygon_ids)
 
-        # Clip data points by polygons and add polygon attributes
-        indices = inside_polygon(points, polygon.outer_ring,
-                                 holes=polygon.inner_rings)
+    # Carry all attributes across from source. Points outside all polygons
+    # get None for these attributes.
+    for key in attribute_names:
+        column = source.get_data(attribute=key)
+        columns[key] = take_values(column, selection, missing=outside)
 
-        for k in indices:
-            for key in poly_attr:
-                # Assign attributes from polygon to points
-                attributes[k][key] = poly_attr[key]
-            attributes[k]['polygon_id'] = i  # Store id for associated polygon
+    # Store id for associated polygon and
+    # default attribute to indicate points inside
+    columns['polygon_id'] = numpy.ma.array(polygon_ids, mask=outside)
+    columns[DEFAULT_ATTRIBUTE] = numpy.ma.array(
+        numpy.ones(len(points), dtype=numpy.bool), mask=outside)
 
     # Create new Vector instance and return
-    V = Vector(data=attributes,
+    V = Vector(data=columns,
                projection=target.get_projection(),
                geometry=original_geometry,
                name=layer_name)
@@ -539,7 +847,10 @@ def interpolate_polygon_lines(source, target,
            Attributes are combined from polygon they fall into and
            line that was clipped.
 
-           Lines not in any polygon are ignored.
+           Lines not in any polygon are ignored. Parts of lines in
+           overlapping polygons are assigned to the first polygon only.
+           The attribute parent_line_id holds the index of the line in
+           target each new line was clipped from.
     """
 
     # Extract line features
@@ -554,12 +865,10 @@ def interpolate_polygon_lines(source, target,
     polygon_attributes = source.get_data()
     verify(len(polygons) == len(polygon_attributes))
 
-    # Data structure for resulting line segments
-    #clipped_geometry = []
-    #clipped_attributes = []
-
-    # Clip line lines to polygons
-    lines_covered = clip_lines_by_polygons(lines, polygons)
+    # Clip line lines to polygons. Lines remaining outside each polygon
+    # are passed on to the next keeping track of their parent line.
+    lines_covered = clip_lines_by_polygons(lines, polygons,
+                                           overlapping=False)
 
     # Create one new line data layer with joined attributes
     # from polygons and lines
@@ -594,6 +903,179 @@ def interpolate_polygon_lines(source, target,
     return R
 
 
+def interpolate_polygon_polygons(source, target,
+                                 layer_name=None):
+    """Overlay polygon vector layer onto polygon vector data
+
+    Args:
+        * source: Vector data set (polygon)
+        * target: Vector data set (polygons)
+        * layer_name: Optional name of returned interpolated layer.
+              If None the name of target is used for the returned layer.
+
+    Returns:
+        Vector data set with one polygon for each pair of overlapping
+           target and source polygons, which is their intersection.
+           Attributes are combined from the source polygon and the target
+           polygon together with
+           * 'polygon_id': Index of the source polygon
+           * 'parent_polygon_id': Index of the target polygon
+           * 'area_fraction': Area of the intersection divided by the area
+             of the target polygon. This is 0 for target polygons of zero
+             area.
+
+           Target polygons outside all source polygons are ignored.
+
+    Note:
+        Source polygons are decomposed into convex trapezoids (see
+        polygon_to_trapezoids) and candidate pairs of target rings and
+        trapezoids are found with a bounding box index. All pairs are then
+        clipped together (Sutherland-Hodgman) so large numbers of
+        buildings can be overlaid on detailed hazard polygons.
+
+        The clipped outer rings of a target polygon in the trapezoids of
+        one source polygon are joined into one ring by edges of zero area
+        (as clip_rings_by_convex_polygons does for rings clipped into
+        several parts) and their holes are kept. The intersection may
+        therefore have edges of zero area but its area is exact.
+        Overlapping source polygons give overlapping intersections.
+    """
+
+    # Input checks
+    verify(source.is_polygon_data)
+    verify(target.is_polygon_data)
+
+    # Decompose source polygons into convex parts
+    polygons = source.get_geometry(as_geometry_objects=True)
+    verify(len(polygons) == len(source))
+    trapezoids = [numpy.zeros((0, 4, 2))]
+    trapezoid_polygon = [numpy.zeros(0, dtype=numpy.int)]
+    for i, polygon in enumerate(polygons):
+        T = polygon_to_trapezoids([polygon.outer_ring] +
+                                  list(polygon.inner_rings))
+        trapezoids.append(T)
+        trapezoid_polygon.append(i * numpy.ones(len(T), dtype=numpy.int))
+    trapezoids = numpy.concatenate(trapezoids)
+    trapezoid_polygon = numpy.concatenate(trapezoid_polygon)
+
+    # Candidate pairs of target rings and trapezoids
+    packed = target.get_packed_geometry()
+    bboxes = numpy.zeros((len(trapezoids), 4))
+    bboxes[:, 0] = numpy.min(trapezoids[:, :, 0], axis=1)
+    bboxes[:, 1] = numpy.max(trapezoids[:, :, 0], axis=1)
+    bboxes[:, 2] = trapezoids[:, 0, 1]
+    bboxes[:, 3] = trapezoids[:, 2, 1]
+    index = BoxIndex(bboxes)
+    ring_ids, trapezoid_ids = index.query_pairs(
+        packed.ring_bounding_boxes())
+
+    # Clip all pairs at once
+    vertices, offsets = clip_rings_by_convex_polygons(
+        packed.coordinates, packed.ring_offsets, ring_ids,
+        trapezoids, trapezoid_ids)
+    areas = PackedGeometry(vertices, offsets,
+                           numpy.arange(len(offsets))).ring_areas()
+
+    # Group clipped rings into fragments by target polygon and trapezoid
+    # with the clipped outer ring first
+    feature_ids = numpy.repeat(numpy.arange(len(packed)),
+                               numpy.diff(packed.part_offsets))
+    is_outer = numpy.zeros(packed.number_of_rings(), dtype=bool)
+    is_outer[packed.part_offsets[:-1]] = True
+    parents = feature_ids[ring_ids]
+    outer = is_outer[ring_ids]
+    idx = numpy.lexsort((~outer, trapezoid_ids, parents))
+
+    new = numpy.ones(len(idx), dtype=bool)
+    new[1:] = ((parents[idx][1:] != parents[idx][:-1]) |
+               (trapezoid_ids[idx][1:] != trapezoid_ids[idx][:-1]))
+    fragment_ids = numpy.cumsum(new) - 1
+
+    # Keep fragments with non empty outer ring and their non empty holes
+    keep = (areas[idx] > 0)[new][fragment_ids] & (areas[idx] > 0)
+    idx = idx[keep]
+
+    # Regroup rings by target and source polygon with all outer rings
+    # of a pair first
+    sources = trapezoid_polygon[trapezoid_ids]
+    idx = idx[numpy.lexsort((trapezoid_ids[idx], ~outer[idx],
+                             sources[idx], parents[idx]))]
+    new = numpy.ones(len(idx), dtype=bool)
+    new[1:] = ((parents[idx][1:] != parents[idx][:-1]) |
+               (sources[idx][1:] != sources[idx][:-1]))
+    pair_ids = numpy.cumsum(new) - 1
+    first = idx[new]
+    is_joined = outer[idx]
+
+    # Outer rings of a pair are joined into one ring: each is traversed
+    # from its first vertex back to it, the next one is reached by an
+    # edge between first vertices and the first vertices are visited in
+    # reverse order to return to the start.
+    counts = numpy.diff(offsets)[idx]
+    number_joined = numpy.bincount(pair_ids[is_joined],
+                                   minlength=len(first))
+    pair_starts = numpy.where(new)[0]
+    rank = numpy.arange(len(idx)) - pair_starts[pair_ids]
+    extra = numpy.zeros(len(idx), dtype=numpy.int)
+    extra[is_joined] = (rank < number_joined[pair_ids] - 1)[is_joined]
+
+    # Each pair gives one feature whose first ring is the joined one and
+    # whose other rings are the holes
+    new_ring = new | ~is_joined
+    out_ring_ids = numpy.cumsum(new_ring) - 1
+    ring_sizes = numpy.bincount(out_ring_ids, weights=counts + extra,
+                                minlength=max(len(idx), 1)).astype(numpy.int)
+    ring_sizes = ring_sizes[:numpy.sum(new_ring)]
+    ring_offsets = numpy.zeros(len(ring_sizes) + 1, dtype=numpy.int)
+    numpy.cumsum(ring_sizes, out=ring_offsets[1:])
+    part_offsets = numpy.append(out_ring_ids[new], len(ring_sizes))
+
+    # Copy vertices of each clipped ring to its place in the output ring
+    within = numpy.cumsum(counts) - counts
+    within -= within[numpy.where(new_ring)[0]][out_ring_ids]
+    destination = ring_offsets[out_ring_ids] + within
+    starts = numpy.cumsum(counts) - counts
+    new_vertices = numpy.zeros((ring_offsets[-1], 2))
+    new_vertices[numpy.arange(numpy.sum(counts)) +
+                 numpy.repeat(destination - starts, counts)] = \
+        vertices[numpy.arange(numpy.sum(counts)) +
+                 numpy.repeat(offsets[idx] - starts, counts)]
+
+    # First vertices of all but the last outer ring in reverse order
+    back = numpy.where(extra > 0)[0]
+    ring_ends = ring_offsets[out_ring_ids[back] + 1]
+    new_vertices[ring_ends - 1 - rank[back]] = vertices[offsets[idx[back]]]
+    geometry = PackedGeometry(new_vertices, ring_offsets, part_offsets)
+
+    # Area of intersections relative to their parent polygons
+    sign = numpy.where(outer[idx], 1.0, -1.0)
+    pair_areas = numpy.bincount(pair_ids, weights=sign * areas[idx],
+                                minlength=max(len(first), 1))
+    pair_areas = pair_areas[:len(first)]
+    parent_ids = parents[first]
+    polygon_ids = sources[first]
+    parent_areas = packed.areas()[parent_ids]
+    nonzero = parent_areas > 0
+    area_fractions = numpy.zeros(len(first))
+    area_fractions[nonzero] = pair_areas[nonzero] / parent_areas[nonzero]
+
+    # Combine attributes with those of the target taking precedence
+    columns = {}
+    for key, column in source.get_columns().items():
+        columns[key] = take_values(column, polygon_ids)
+    for key, column in target.get_columns().items():
+        columns[key] = take_values(column, parent_ids)
+    columns['polygon_id'] = polygon_ids
+    columns['parent_polygon_id'] = parent_ids
+    columns['area_fraction'] = area_fractions
+    columns[DEFAULT_ATTRIBUTE] = numpy.ones(len(first), dtype=numpy.bool)
+
+    return Vector(data=columns,
+                  projection=target.get_projection(),
+                  geometry=geometry,
+                  name=layer_name)
+
+
 def interpolate_raster_raster(source, target):
     """Check for alignment and returns target layer as is
     """
@@ -661,7 +1143,9 @@ def make_circular_polygon(centers, radii, attributes=None):
     return Z
 
 
-def tag_polygons_by_grid(polygons, grid, threshold=0, tag='affected'):
+def tag_polygons_by_grid(polygons, grid, threshold=0, tag='affected',
+                         max_tag=None, count_tag=None, fraction_tag=None,
+                         nodata=numpy.nan):
     """Tag polygons by raster values
 
     Args:
@@ -669,47 +1153,56 @@ def tag_polygons_by_grid(polygons, grid, threshold=0, tag='affected'):
         * grid: Raster layer
         * threshold: Threshold for grid value to tag polygon
         * tag: Name of new tag
+        * max_tag: Optional name of attribute for the largest grid value
+            in each polygon (nan if no grid point falls inside)
+        * count_tag: Optional name of attribute for the number of grid
+            values exceeding threshold in each polygon
+        * fraction_tag: Optional name of attribute for the fraction of grid
+            values in each polygon that exceed threshold (nan if no grid
+            point falls inside)
+        * nodata: Value of max_tag and fraction_tag for polygons without
+            grid points. Default is nan. Use e.g. 0 for layers that are
+            written to shapefiles as DBF files can not store nan.
 
     Returns:
         Polygon layer: Same as input polygon but with extra attribute tag
-                       set according to grid values
+                       set according to grid values and any of the
+                       requested statistics
 
+    Note:
+        All statistics are computed in one pass over the grid.
     """
 
     verify(polygons.is_polygon_data)
     verify(grid.is_raster)
 
-    polygon_attributes = polygons.get_data()
     polygon_geometry = polygons.get_geometry(as_geometry_objects=True)
 
-    # Separate grid points by polygon
-    res = clip_grid_by_polygons(grid.get_data(),
+    # Burn polygon ids into a grid aligned with the raster and compute
+    # statistics of the grid values in each polygon
+    A = grid.get_data()
+    labels = rasterize_polygons(polygon_geometry,
                                 grid.get_geotransform(),
-                                polygon_geometry)
-
-    # Create new polygon layer with tag set according to grid values
-    # and threshold
-    new_attributes = []
-    for i, (_, values) in enumerate(res):
-        # For each polygon check if any grid value in it exceeds the threshold
-        affected = False
-        for val in values:
-            # Check each grid value in this polygon
-            if val > threshold:
-                affected = True
-
-        # Existing attributes for this polygon
-        attr = polygon_attributes[i].copy()
-
-        # Create tagged polygon feature
-        if affected:
-            attr[tag] = True
-        else:
-            attr[tag] = False
-
-        new_attributes.append(attr)
-
-    R = Vector(data=new_attributes,
+                                A.shape)
+    stats = zonal_statistics(labels, A, number_of_zones=len(polygons),
+                             threshold=threshold)
+
+    # Tag polygons where any grid value exceeds the threshold
+    affected = stats['exceedance'] > 0
+    empty = stats['count'] == 0
+    for name in ['max', 'fraction']:
+        stats[name][empty] = nodata
+
+    columns = polygons.get_columns(copy=True)
+    columns[tag] = affected
+    if max_tag is not None:
+        columns[max_tag] = stats['max']
+    if count_tag is not None:
+        columns[count_tag] = stats['exceedance']
+    if fraction_tag is not None:
+        columns[fraction_tag] = stats['fraction']
+
+    R = Vector(data=columns,
                projection=polygons.get_projection(),
                geometry=polygon_geometry,
                name='%s_tagged_by_%s' % (polygons.name, grid.name))
@@ -8,10 +8,11 @@ import os
 from os.path import join
 
 # Import InaSAFE modules
-from safe.engine.core import calculate_impact
+from safe.engine.core import calculate_impact, map_jobs
 from safe.engine.interpolation import (
     interpolate_polygon_raster,
     interpolate_raster_vector_points,
+    make_interpolation_plan,
     assign_hazard_values_to_exposure_data,
     tag_polygons_by_grid)
 from safe.storage.core import (
@@ -19,11 +20,16 @@ from safe.storage.core import (
     write_vector_data,
     write_raster_data)
 from safe.storage.vector import Vector
+from safe.storage.raster import Raster
+from safe.storage.geometry import Polygon, pack_lines
+from safe.storage.projection import DEFAULT_PROJECTION
 from safe.storage.utilities import DEFAULT_ATTRIBUTE
+from safe.storage.clipping import clip_raster_by_polygons
 from safe.common.polygon import (
     separate_points_by_polygon,
     is_inside_polygon,
     inside_polygon,
+    outside_polygon,
     clip_lines_by_polygon,
     clip_grid_by_polygons,
     line_dictionary_to_geometry)
@@ -38,6 +44,7 @@ from safe.common.utilities import (
     VerificationError,
     unique_filename,
     format_int)
+from safe.common.geodesy import great_circle_distances
 from safe.common.testing import TESTDATA, HAZDATA, EXPDATA
 from safe.common.exceptions import InaSAFEError
 from safe.impact_functions import get_plugins, get_plugin
@@ -84,6 +91,14 @@ def lembang_damage_function(x):
     return value
 
 
+class GridSum(object):
+    """Stand in for impact functions summing the grids of each tile
+    """
+
+    def run_tile(self, layers, window=None):
+        return [numpy.sum(layer.get_data(window=window)) for layer in layers]
+
+
 def padang_check_results(mmi, building_class):
     """Check calculated results through a lookup table
     returns False if the lookup fails and
@@ -270,6 +285,109 @@ class Test_Engine(unittest.TestCase):
                % (x, keywords['impact_summary']))
         assert format_int(x) in keywords['impact_summary'], msg
 
+    def test_tiled_impact_calculation(self):
+        """Raster impact computed tile by tile equals untiled result
+        """
+
+        hazard_filename = '%s/itb_test_mmi.asc' % TESTDATA
+        exposure_filename = '%s/itb_test_pop.asc' % TESTDATA
+        H = read_layer(hazard_filename)
+        E = read_layer(exposure_filename)
+
+        plugin_name = 'I T B Fatality Function'
+        IF = get_plugins(plugin_name)[0][plugin_name]
+
+        reference = read_layer(calculate_impact(layers=[H, E],
+                                                impact_fcn=IF).get_filename())
+
+        # Tile sizes that do and do not divide the number of rows
+        for tile_size in [1, 7, H.rows, H.rows + 10]:
+            impact_layer = calculate_impact(layers=[H, E],
+                                            impact_fcn=IF,
+                                            tile_size=tile_size)
+            I = read_layer(impact_layer.get_filename())
+            assert I.rows == reference.rows
+            assert I.columns == reference.columns
+            assert numpy.allclose(I.get_geotransform(),
+                                  reference.get_geotransform())
+            assert nan_allclose(I.get_data(), reference.get_data(),
+                                rtol=1.0e-12, atol=1.0e-12)
+
+            # Summaries only differ by summation order before rounding
+            keywords = I.get_keywords()
+            expected = reference.get_keywords()
+            for key in ['total_population', 'total_fatalities',
+                        'impact_summary']:
+                msg = ('Tile size %i: Expected %s to be %s, I got %s'
+                       % (tile_size, key, expected[key], keywords[key]))
+                assert keywords[key] == expected[key], msg
+
+    def test_parallel_impact_calculation(self):
+        """Impact computed by several processes equals single process result
+        """
+
+        # Raster exposure is split into blocks of rows
+        H = read_layer('%s/itb_test_mmi.asc' % TESTDATA)
+        E = read_layer('%s/itb_test_pop.asc' % TESTDATA)
+
+        plugin_name = 'I T B Fatality Function'
+        IF = get_plugins(plugin_name)[0][plugin_name]
+
+        reference = read_layer(calculate_impact(layers=[H, E],
+                                                impact_fcn=IF).get_filename())
+        for processes in [2, 3]:
+            impact_layer = calculate_impact(layers=[H, E],
+                                            impact_fcn=IF,
+                                            processes=processes)
+            I = read_layer(impact_layer.get_filename())
+            assert nan_allclose(I.get_data(), reference.get_data(),
+                                rtol=1.0e-12, atol=1.0e-12)
+            assert (I.get_keywords('impact_summary') ==
+                    reference.get_keywords('impact_summary'))
+
+        # Vector exposure features are assigned to chunks by centroid
+        H = read_layer('%s/Shakemap_Padang_2009.asc' % HAZDATA)
+        E = read_layer('%s/OSM_building_polygons_20110905.shp' % TESTDATA)
+
+        plugin_name = 'Earthquake Building Impact Function'
+        IF = get_plugins(plugin_name)[0][plugin_name]
+
+        reference = calculate_impact(layers=[H, E], impact_fcn=IF)
+        for processes in [2, 4]:
+            impact_layer = calculate_impact(layers=[H, E],
+                                            impact_fcn=IF,
+                                            processes=processes)
+            assert len(impact_layer) == len(E)
+            assert impact_layer == reference
+            assert (impact_layer.get_keywords('impact_summary') ==
+                    reference.get_keywords('impact_summary'))
+
+            # Also check what has been written to file
+            I = read_layer(impact_layer.get_filename())
+            assert I == read_layer(reference.get_filename())
+
+    test_parallel_impact_calculation.slow = True
+
+    def test_map_jobs(self):
+        """Jobs only carry their window and chunk of the layers
+        """
+
+        A = numpy.arange(20.0).reshape((4, 5))
+        H = Raster(data=A,
+                   projection=DEFAULT_PROJECTION,
+                   geotransform=(100.0, 1.0, 0.0, 10.0, 0.0, -1.0),
+                   name='depth')
+        E = Raster(data=A * 2,
+                   projection=DEFAULT_PROJECTION,
+                   geotransform=(100.0, 1.0, 0.0, 10.0, 0.0, -1.0),
+                   name='population')
+        windows = [(0, 0, 5, 3), (0, 3, 5, 1)]
+        jobs = [(window, None) for window in windows] + [(None, (1, H))]
+        expected = [[3 * 5 * 7, 2 * 3 * 5 * 7], [85, 170], [190, 190]]
+        for processes in [None, 2]:
+            results = map_jobs(GridSum(), [H, E], jobs, processes=processes)
+            assert [list(x) for x in results] == expected
+
     def test_pager_earthquake_fatality_estimation(self):
         """Fatalities from ground shaking can be computed correctly
             using the Pager fatality model.
@@ -2485,6 +2603,347 @@ class Test_Engine(unittest.TestCase):
 
     test_line_interpolation_from_multiple_polygons.slow = True
 
+    def test_raster_to_lines_interpolation(self):
+        """Lines are split by grid cells and tagged with raster values
+
+        This is a test for raster to line interpolation (issue #36)
+        """
+
+        # Grid of 4 rows and 5 columns with lower left corner (100, 6)
+        # where the value of each cell is its column number
+        A = numpy.zeros((4, 5))
+        A[:] = numpy.arange(5)
+        H = Raster(data=A,
+                   projection=DEFAULT_PROJECTION,
+                   geotransform=(100.0, 1.0, 0.0, 10.0, 0.0, -1.0),
+                   name='depth')
+
+        # Horizontal line, line turning east and line outside the grid
+        lines = [numpy.array([[100.5, 9.25], [103.5, 9.25]]),
+                 numpy.array([[101.5, 9.25], [101.5, 6.75], [103.25, 6.75]]),
+                 numpy.array([[200.0, 0.0], [201.0, 0.0]])]
+        E = Vector(data=[{'name': 'a'}, {'name': 'b'}, {'name': 'c'}],
+                   projection=DEFAULT_PROJECTION,
+                   geometry=lines,
+                   geometry_type='line',
+                   name='roads')
+
+        I = assign_hazard_values_to_exposure_data(H, E,
+                                                  attribute_name='depth',
+                                                  mode='constant')
+        assert I.is_line_data
+        assert len(I) == 8
+
+        I_geometry = I.get_geometry()
+        parents = I.get_data('parent_line_id')
+        values = I.get_data('depth')
+        assert parents.tolist() == [0, 0, 0, 0, 1, 1, 1, 2]
+        assert I.get_data('name').tolist() == ['a'] * 4 + ['b'] * 3 + ['c']
+        assert numpy.allclose(values[:7], [0, 1, 2, 3, 1, 2, 3])
+        assert numpy.isnan(values[7])
+
+        # Line split at cell boundaries
+        assert numpy.allclose(I_geometry[0], [[100.5, 9.25], [101, 9.25]])
+        assert numpy.allclose(I_geometry[3], [[103, 9.25], [103.5, 9.25]])
+
+        # Consecutive pieces with the same value are joined
+        assert numpy.allclose(I_geometry[4], [[101.5, 9.25], [101.5, 9],
+                                              [101.5, 8], [101.5, 7],
+                                              [101.5, 6.75], [102, 6.75]])
+        assert numpy.allclose(I_geometry[5], [[102, 6.75], [103, 6.75]])
+        assert numpy.allclose(I_geometry[6], [[103, 6.75], [103.25, 6.75]])
+        assert numpy.allclose(I_geometry[7], lines[2])
+
+        # Lengths are in meters and add up to the length of each line
+        # (up to the difference between great circles and straight lines
+        # in geographic coordinates)
+        lengths = I.get_data('length')
+        for i, line in enumerate(lines):
+            expected = numpy.sum(great_circle_distances(line[:-1, 0],
+                                                        line[:-1, 1],
+                                                        line[1:, 0],
+                                                        line[1:, 1]))
+            assert numpy.allclose(numpy.sum(lengths[parents == i]),
+                                  expected, rtol=1.0e-5)
+        assert numpy.allclose(lengths[0], 0.5 * 111000 *
+                              numpy.cos(9.25 * numpy.pi / 180), rtol=1.0e-2)
+
+        # Layers where all lines are empty give no pieces
+        E = Vector(data=[{'name': 'a'}, {'name': 'b'}],
+                   projection=DEFAULT_PROJECTION,
+                   geometry=pack_lines([numpy.zeros((0, 2)),
+                                        numpy.zeros((0, 2))]),
+                   geometry_type='line',
+                   name='roads')
+        I = assign_hazard_values_to_exposure_data(H, E,
+                                                  attribute_name='depth',
+                                                  mode='constant')
+        assert len(I) == 0
+
+    def test_polygon_to_polygon_overlay(self):
+        """Polygons can be overlaid with area fractions
+        """
+
+        def square(x0, y0, side):
+            return numpy.array([[x0, y0], [x0 + side, y0],
+                                [x0 + side, y0 + side], [x0, y0 + side],
+                                [x0, y0]])
+
+        # Square hazard zone with a hole and a triangular zone next to it
+        H = Vector(data=[{'level': 'high'}, {'level': 'low'}],
+                   projection=DEFAULT_PROJECTION,
+                   geometry=[Polygon(square(0, 0, 2),
+                                     inner_rings=[square(0.5, 0.5, 0.5)]),
+                             Polygon(numpy.array([[2, 0], [4, 0], [2, 2]]))],
+                   name='flood')
+
+        # Buildings straddling both zones, inside the hole, partly in
+        # the hole, outside everything and a building with a courtyard
+        E = Vector(data=[{'name': x} for x in 'abcde'],
+                   projection=DEFAULT_PROJECTION,
+                   geometry=[Polygon(square(1.5, 0, 1)),
+                             Polygon(square(0.6, 0.6, 0.3)),
+                             Polygon(square(0.25, 0.25, 0.5)),
+                             Polygon(square(10, 10, 1)),
+                             Polygon(square(1, 1, 2),
+                                     inner_rings=[square(1.25, 1.25, 0.5)])],
+                   name='buildings')
+
+        # Default is still to use centroids
+        I = assign_hazard_values_to_exposure_data(H, E)
+        assert len(I) == 5
+        assert I.get_data('level', 1) is None
+        assert I.get_data('level', 3) is None
+
+        I = assign_hazard_values_to_exposure_data(H, E, overlay=True)
+        assert I.is_polygon_data
+        assert I.get_data(DEFAULT_ATTRIBUTE).all()
+
+        # Fractions of each building in each zone add up over fragments
+        parents = I.get_data('parent_polygon_id')
+        polygon_ids = I.get_data('polygon_id')
+        fractions = I.get_data('area_fraction')
+        names = I.get_data('name')
+        levels = I.get_data('level')
+        expected = {(0, 0): 0.5, (0, 1): 0.5, (2, 0): 0.75,
+                    (4, 0): 0.2, (4, 1): 0.5 / 3.75}
+        assert set(zip(parents, polygon_ids)) == set(expected.keys())
+        for (i, j), fraction in expected.items():
+            mask = (parents == i) & (polygon_ids == j)
+            assert numpy.allclose(numpy.sum(fractions[mask]), fraction)
+            assert set(names[mask]) == set(['abcde'[i]])
+            assert set(levels[mask]) == set([['high', 'low'][j]])
+
+        # Fragments lie within their parent building
+        geometry = I.get_geometry(as_geometry_objects=True)
+        areas = E.get_packed_geometry().areas()
+        fragments = I.get_packed_geometry()
+        assert numpy.allclose(fragments.areas(), fractions * areas[parents])
+        for k, polygon in enumerate(geometry):
+            outer_ring = E.get_geometry()[parents[k]]
+            assert len(outside_polygon(polygon.outer_ring, outer_ring)) == 0
+
+        # Holes are carried over where needed
+        assert sum([len(p.inner_rings) for p in geometry]) > 0
+
+        # Slanted hazard edges clip buildings whose first vertex is
+        # outside the zone
+        H = Vector(data=[{'level': 'high'}],
+                   projection=DEFAULT_PROJECTION,
+                   geometry=[Polygon(numpy.array([[5, 0], [10, 5], [5, 10],
+                                                  [0, 5], [5, 0]]))],
+                   name='flood')
+        E = Vector(data=[{'name': x} for x in 'ab'],
+                   projection=DEFAULT_PROJECTION,
+                   geometry=[Polygon(square(4.5, 0.2, 1)),
+                             Polygon(square(0, 4, 2))],
+                   name='buildings')
+        I = assign_hazard_values_to_exposure_data(H, E, overlay=True)
+        parents = I.get_data('parent_polygon_id')
+        fractions = I.get_data('area_fraction')
+        for i, fraction in enumerate([1 - 2 * 0.3 ** 2 / 2, 0.75]):
+            assert numpy.allclose(numpy.sum(fractions[parents == i]),
+                                  fraction)
+
+        # Fragments are closed rings
+        for ring in I.get_geometry():
+            assert numpy.allclose(ring[0], ring[-1])
+
+        # One feature per overlapping pair of building and zone however
+        # finely the zone is decomposed, e.g. a circle of 200 vertices
+        angles = numpy.linspace(0, 2 * numpy.pi, 201)
+        circle = numpy.array([10 * numpy.cos(angles),
+                              10 * numpy.sin(angles)]).transpose()
+        circle[-1] = circle[0]
+        H = Vector(data=[{'level': 'high'}, {'level': 'low'}],
+                   projection=DEFAULT_PROJECTION,
+                   geometry=[Polygon(circle), Polygon(square(10, -1, 3))],
+                   name='flood')
+
+        # Buildings inside the circle, straddling both zones, outside
+        # everything and one of zero area
+        E = Vector(data=[{'name': x} for x in 'abcde'],
+                   projection=DEFAULT_PROJECTION,
+                   geometry=[Polygon(square(0, 0, 1)),
+                             Polygon(square(-5, 2, 1),
+                                     inner_rings=[square(-4.8, 2.2, 0.5)]),
+                             Polygon(square(9, -0.5, 2)),
+                             Polygon(square(20, 20, 1)),
+                             Polygon(numpy.array([[1, 1], [2, 2], [3, 3],
+                                                  [1, 1]]))],
+                   name='buildings')
+        I = assign_hazard_values_to_exposure_data(H, E, overlay=True)
+        parents = I.get_data('parent_polygon_id')
+        polygon_ids = I.get_data('polygon_id')
+        fractions = I.get_data('area_fraction')
+        pairs = zip(parents, polygon_ids)
+        assert len(pairs) == len(set(pairs))
+        assert set(pairs) == set([(0, 0), (1, 0), (2, 0), (2, 1)])
+        assert numpy.all(numpy.isfinite(fractions))
+        areas = E.get_packed_geometry().areas()
+        assert numpy.allclose(I.get_packed_geometry().areas(),
+                              fractions * areas[parents])
+        for (i, j), fraction in zip(pairs, fractions):
+            if i < 2:
+                assert numpy.allclose(fraction, 1)
+        assert numpy.allclose(fractions[pairs.index((2, 1))], 0.5)
+        assert 0.45 < fractions[pairs.index((2, 0))] < 0.5
+        geometry = I.get_geometry(as_geometry_objects=True)
+        assert len(geometry[pairs.index((1, 0))].inner_rings) > 0
+
+    def test_interpolation_plan_reused_for_scenarios(self):
+        """Interpolation plan can be applied to many rasters on one grid
+        """
+
+        # Scenarios on a grid of 40 rows and 50 columns
+        numpy.random.seed(17)
+        geotransform = (100.0, 0.1, 0.0, 10.0, 0.0, -0.1)
+        scenarios = []
+        for i in range(3):
+            A = numpy.random.uniform(0, 10, (40, 50))
+            A[numpy.random.uniform(0, 1, A.shape) < 0.05] = numpy.nan
+            scenarios.append(Raster(data=A,
+                                    projection=DEFAULT_PROJECTION,
+                                    geotransform=geotransform,
+                                    name='scenario_%i' % i))
+
+        # Points covering part of the grid and some outside it
+        points = numpy.random.uniform(0, 1, (500, 2))
+        points[:, 0] = 100.5 + points[:, 0] * 2
+        points[:, 1] = 7.5 + points[:, 1] * 3
+        points[:10, 0] -= 5
+        E = Vector(data={'id': range(len(points))},
+                   geometry=points,
+                   projection=DEFAULT_PROJECTION,
+                   name='buildings')
+
+        for mode in ['linear', 'constant']:
+            plan = make_interpolation_plan(scenarios[0], E, mode=mode)
+            for H in scenarios:
+                longitudes, latitudes = H.get_geometry()
+                reference = interpolate_raster(longitudes, latitudes,
+                                               H.get_data(nan=True), points,
+                                               mode=mode)
+                J = interpolate_raster_vector_points(H, E, plan=plan,
+                                                     attribute_name='depth')
+                assert nan_allclose(reference, J.get_data('depth'),
+                                    rtol=0, atol=0)
+                assert numpy.alltrue(numpy.isnan(J.get_data('depth')[:10]))
+                assert J.get_data('id').tolist() == range(len(points))
+
+        # Plans are only used with the grid and points they were made for
+        H = Raster(data=numpy.zeros((40, 50)),
+                   projection=DEFAULT_PROJECTION,
+                   geotransform=(100.0, 0.2, 0.0, 10.0, 0.0, -0.2))
+        self.assertRaises(Exception, interpolate_raster_vector_points,
+                          H, E, plan=plan)
+        self.assertRaises(Exception, interpolate_raster_vector_points,
+                          scenarios[0], E.get_subset(range(10)), plan=plan)
+
+    def test_polygon_to_raster_by_label_grid(self):
+        """Polygons and grids are combined through a label grid
+        """
+
+        # Grid of 4 rows and 5 columns with lower left corner (100, 6)
+        A = numpy.arange(20.0).reshape((4, 5))
+        A[0, 0] = numpy.nan
+        H = Raster(data=A,
+                   projection=DEFAULT_PROJECTION,
+                   geotransform=(100.0, 1.0, 0.0, 10.0, 0.0, -1.0),
+                   name='depth')
+
+        # Overlapping polygons and one outside the grid
+        P = Vector(data=[{'id': 1}, {'id': 2}, {'id': 3}],
+                   projection=DEFAULT_PROJECTION,
+                   geometry=[Polygon(numpy.array([[100, 6], [102, 6],
+                                                  [102, 10], [100, 10]])),
+                             Polygon(numpy.array([[101, 6], [105, 6],
+                                                  [105, 8], [101, 8]])),
+                             Polygon(numpy.array([[200, 0], [201, 0],
+                                                  [201, 1]]))],
+                   name='zones')
+
+        # Grid points are grouped by polygon - first polygon wins
+        I = interpolate_polygon_raster(P, H, attribute_name='depth')
+        assert len(I) == 14
+        assert I.get_data('polygon_id').tolist() == [0] * 8 + [1] * 6
+        assert I.get_data('id').tolist() == [1] * 8 + [2] * 6
+        values = I.get_data('depth')
+        assert numpy.isnan(values[0])
+        assert numpy.allclose(values[1:], [1, 5, 6, 10, 11, 15, 16,
+                                           12, 13, 14, 17, 18, 19])
+        assert numpy.allclose(I.get_geometry()[:3],
+                              [[100.5, 9.5], [101.5, 9.5], [100.5, 8.5]])
+
+        # Compact result holds the same information without copying
+        # polygon attributes to every grid point
+        C = interpolate_polygon_raster(P, H, attribute_name='depth',
+                                       compact=True)
+        assert len(C) == 14
+        assert C.polygons is P
+        assert C.polygon_ids.tolist() == I.get_data('polygon_id').tolist()
+        assert numpy.allclose(C.values[1:], values[1:])
+        assert numpy.allclose(C.get_geometry(), I.get_geometry())
+        sums = C.sum_by_polygon()
+        assert numpy.isnan(sums[0])
+        assert numpy.allclose(sums[1:], [93, 0])
+        assert numpy.allclose(C.sum_by_polygon(ignore_nan=True), [64, 93, 0])
+        assert numpy.allclose(C.sum_by_polygon(mask=numpy.array(
+            [False, True, True])), [0, 93, 0])
+        V = C.to_vector(attribute_name='depth')
+        assert V.get_attribute_names() == I.get_attribute_names()
+        assert V.get_data('id').tolist() == I.get_data('id').tolist()
+
+        # Polygons are tagged by their largest value
+        T = tag_polygons_by_grid(P, H, threshold=12)
+        assert T.get_data('affected').tolist() == [True, True, False]
+        assert T.get_data('id').tolist() == [1, 2, 3]
+        T = tag_polygons_by_grid(P, H, threshold=16)
+        assert T.get_data('affected').tolist() == [False, True, False]
+
+        # Per polygon statistics can be added as attributes
+        T = tag_polygons_by_grid(P, H, threshold=12, max_tag='max_depth',
+                                 count_tag='n_flooded',
+                                 fraction_tag='flooded')
+        assert T.get_attribute_names() == ['id', 'affected', 'max_depth',
+                                           'n_flooded', 'flooded']
+        assert numpy.allclose(T.get_data('max_depth')[:2], [16, 19])
+        assert T.get_data('n_flooded').tolist() == [2, 5, 0]
+        assert numpy.allclose(T.get_data('flooded')[:2], [2.0 / 7, 5.0 / 6])
+        assert numpy.isnan(T.get_data('max_depth')[2])
+        assert numpy.isnan(T.get_data('flooded')[2])
+
+        # Polygons without grid points can be given a value other than nan
+        # e.g. for writing to DBF files
+        T = tag_polygons_by_grid(P, H, threshold=12, max_tag='max_depth',
+                                 fraction_tag='flooded', nodata=0)
+        assert T.get_data('max_depth').tolist()[2] == 0
+        assert T.get_data('flooded').tolist()[2] == 0
+        assert numpy.allclose(T.get_data('max_depth')[:2], [16, 19])
+
+        res = clip_raster_by_polygons(H, P)
+        assert [len(points) for points, _ in res] == [8, 6, 0]
+
     def test_polygon_to_roads_interpolation_flood_example(self):
         """Roads can be tagged with values from flood polygons
 
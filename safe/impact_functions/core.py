@@ -3,11 +3,19 @@
 The design is based on http://effbot.org/zone/metaclass-plugins.htm
 
 To register the plugin, the module must be imported by the Python process
-using it.
+using it. Impact functions described in the plugin manifest (see
+load_plugin_manifest) are available before their modules are imported.
 """
 
 
+import ast
+import hashlib
+import itertools
+import json
 import logging
+import os
+import re
+import sys
 from math import ceil
 
 import numpy
@@ -15,13 +23,38 @@ from safe.common.utilities import OrderedDict
 
 import keyword as python_keywords
 from safe.common.polygon import inside_polygon
+from safe.common.spatial_index import PointIndex
 from safe.common.utilities import ugettext as tr
+from safe.common.utilities import temp_dir
 from safe.common.tables import Table, TableCell, TableRow
+from safe.storage.utilities import qgis_is_installed
 from utilities import pretty_string, remove_double_spaces
 
 
 LOGGER = logging.getLogger('InaSAFE')
 
+# Keywords used to index impact functions by their requirements
+INDEX_KEYWORDS = ['category', 'subcategory', 'layertype']
+
+# Caches of collected and compiled requirements and of the plugin index.
+# See requirements_collect, compile_requirement and get_admissible_plugins
+_requirements_cache = {}
+_compiled_requirements = {}
+_plugin_index = {}
+
+# Version of the plugin manifest format. Manifests of other versions
+# are rebuilt (see load_plugin_manifest)
+MANIFEST_VERSION = 2
+
+# Class attributes of impact functions held in the plugin manifest
+MANIFEST_ATTRIBUTES = ['plugin_name', 'title', 'synopsis', 'actions',
+                       'citations', 'detailed_description', 'hazard_input',
+                       'exposure_input', 'output', 'limitation',
+                       'target_field', 'symbol_field']
+
+# Impact functions of the loaded plugin manifest (see load_plugin_manifest)
+_lazy_plugins = []
+
 
 # Disable lots of pylint for this as it is using magic
 # for managing the plugin system devised by Ted Dunstone
@@ -53,6 +86,22 @@ class FunctionProvider(object):
       layers           A list of layers
       result           A list of layers
 
+    Plugins may additionally provide the following methods allowing the
+    engine to compute the impact in tiles or chunks, one at a time or in
+    parallel (see calculate_impact)::
+
+      run_tile(layers, window=None)
+          Compute the impact for the pixel window (xoff, yoff, xsize, ysize)
+          of aligned rasters, or for the subset of exposure features given
+          in layers. Returns the impact grid or vector layer for the tile
+          and a structure of numbers (possibly nested in dictionaries and
+          lists) that add up over tiles.
+
+      finalise_impact(layers, totals, extrema)
+          Create name, keywords and style_info for the impact layer from
+          totals summed over all tiles and (for rasters) the (min, max) of
+          the impact grid.
+
     """
     __metaclass__ = PluginMount
 
@@ -167,10 +216,13 @@ def get_plugins(name=None):
     """Retrieve a list of plugins that match the name you pass.
 
        Or all of them if no name is passed.
+
+       Plugins whose modules have not been imported yet are LazyPlugin
+       instances rather than classes (see get_registered_plugins).
     """
 
     plugins_dict = dict([(pretty_function_name(p), p)
-                         for p in FunctionProvider.plugins])
+                         for p in get_registered_plugins()])
 
     if name is None:
         return plugins_dict
@@ -178,7 +230,7 @@ def get_plugins(name=None):
     if isinstance(name, basestring):
         # Add the names
         plugins_dict.update(
-            dict([(p.__name__, p) for p in FunctionProvider.plugins]))
+            dict([(p.__name__, p) for p in get_registered_plugins()]))
 
         msg = ('No plugin named "%s" was found. '
                'List of available plugins is: \n%s'
@@ -216,6 +268,373 @@ def unload_plugins():
         del p
 
 
+def manifest_value(value):
+    """Convert value read from the plugin manifest to its python type
+
+    JSON gives unicode strings. Those that are plain ASCII are converted
+    to str as class attributes of impact functions normally are. Lists and
+    dictionaries are converted recursively.
+    """
+
+    if isinstance(value, unicode):
+        try:
+            return value.encode('ascii')
+        except UnicodeError:
+            return value
+    elif isinstance(value, list):
+        return [manifest_value(x) for x in value]
+    elif isinstance(value, dict):
+        return dict([(manifest_value(k), manifest_value(v))
+                     for k, v in value.items()])
+    else:
+        return value
+
+
+class LazyPlugin(object):
+    """Impact function described in the plugin manifest
+
+    The name, docstring and the attributes listed in MANIFEST_ATTRIBUTES
+    are taken from the manifest so impact functions can be listed, filtered
+    by their requirements and documented without importing their modules.
+    The module is imported when the impact function is called or when any
+    other attribute is needed.
+
+    Instances stand in for impact function classes in get_plugins and
+    get_registered_plugins but they are not classes. Callers must only
+    use the attributes above, other class attributes, calls and
+    get_class. Other special attributes such as __bases__ raise
+    AttributeError, so use get_class for issubclass or similar
+    introspection.
+    """
+
+    def __init__(self, entry):
+        """Create impact function from manifest entry
+
+        Input:
+            entry: Dictionary describing the impact function as made by
+                   describe_plugin
+        """
+
+        attributes = manifest_value(entry['attributes'])
+        for name in ['name', 'module', 'doc']:
+            value = entry[name]
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            attributes['__%s__' % name] = value
+
+        self.__dict__.update(attributes)
+        self.__dict__['_missing'] = set(manifest_value(entry['missing']))
+        self.__dict__['_requirements'] = manifest_value(
+            list(entry['requirements']))
+        self.__dict__['_func'] = None
+
+        # Requirements are not parsed again from the docstring
+        _requirements_cache[self] = (self.__doc__, self._requirements)
+
+    def get_class(self):
+        """Import the module and return the impact function class
+        """
+
+        if self._func is None:
+            __import__(self.__module__)
+            module = sys.modules[self.__module__]
+            self.__dict__['_func'] = getattr(module, self.__name__)
+        return self._func
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in self.__dict__.get('_missing', ()):
+            raise AttributeError('Impact function %s has no attribute %s'
+                                 % (self.__dict__.get('__name__'), name))
+        return getattr(self.get_class(), name)
+
+    def __setattr__(self, name, value):
+        # Attributes such as parameters are set on the impact function
+        setattr(self.get_class(), name, value)
+        if name in self.__dict__:
+            self.__dict__[name] = value
+        self._missing.discard(name)
+
+    def __call__(self, *args, **kwargs):
+        return self.get_class()(*args, **kwargs)
+
+    def __repr__(self):
+        return '<impact function %s.%s>' % (self.__module__, self.__name__)
+
+
+def plugin_modules(dirname=None, package=None):
+    """Find the modules holding impact functions
+
+    Input:
+        dirname: Directory of the impact functions package.
+                 Default is the directory of this module.
+        package: Name of that package. Default is the package of this module.
+
+    Output:
+        List of (module name, path) tuples, one for each Python module in
+        the sub packages of the impact functions package. Tests are not
+        included.
+    """
+
+    if dirname is None:
+        dirname = os.path.dirname(os.path.abspath(__file__))
+    if package is None:
+        package = __name__.rsplit('.', 1)[0]
+
+    modules = []
+    for subpackage in sorted(os.listdir(dirname)):
+        subdir = os.path.join(dirname, subpackage)
+        if not os.path.isfile(os.path.join(subdir, '__init__.py')):
+            # Ignore e.g. directories that are not Python modules
+            continue
+
+        for filename in sorted(os.listdir(subdir)):
+            if (filename == '__init__.py' or not filename.endswith('.py') or
+                    filename.startswith('.#') or
+                    filename.startswith('test_')):
+                continue
+            modules.append(('%s.%s.%s' % (package, subpackage, filename[:-3]),
+                            os.path.join(subdir, filename)))
+
+    return modules
+
+
+def import_plugin_module(module_name):
+    """Import module holding impact functions
+
+    Input:
+        module_name: Full name of module
+
+    Output:
+        True if the module could be imported, otherwise False
+    """
+
+    try:
+        __import__(module_name)
+    except ImportError, e:
+        # Most likely not Qt4 / QGIS present
+        LOGGER.debug('Impact functions in %s were not loaded: %s'
+                     % (module_name, e))
+        return False
+    return True
+
+
+def module_signatures(modules):
+    """Modification times and sizes of modules holding impact functions
+
+    Input:
+        modules: List of (module name, path) as returned by plugin_modules
+
+    Output:
+        Dictionary mapping module names to lists [path, mtime, size]
+    """
+
+    signatures = {}
+    for module_name, path in modules:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        signatures[module_name] = [path, stat.st_mtime, stat.st_size]
+    return signatures
+
+
+def describe_plugin(func):
+    """Describe impact function for the plugin manifest
+
+    Input:
+        func: Impact function class
+
+    Output:
+        Dictionary with name, module, doc (docstring), requirements,
+        attributes (values of those MANIFEST_ATTRIBUTES that can be stored
+        as JSON) and missing (MANIFEST_ATTRIBUTES the function does not have)
+    """
+
+    entry = {'name': func.__name__,
+             'module': func.__module__,
+             'doc': func.__doc__,
+             'requirements': requirements_collect(func),
+             'attributes': {},
+             'missing': []}
+
+    for name in MANIFEST_ATTRIBUTES:
+        if not hasattr(func, name):
+            entry['missing'].append(name)
+            continue
+
+        value = getattr(func, name)
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            # Such attributes are taken from the impact function itself
+            continue
+        entry['attributes'][name] = value
+
+    return entry
+
+
+def build_plugin_manifest(modules):
+    """Import impact functions and describe them in a manifest
+
+    Input:
+        modules: List of (module name, path) as returned by plugin_modules
+
+    Output:
+        Dictionary with
+
+        * version: MANIFEST_VERSION
+        * language: Value of LANG which titles may be translated to
+        * environment: Key of the import environment (see
+          import_environment_key)
+        * modules: Signatures of modules as returned by module_signatures
+        * failed: Names of modules that could not be imported
+        * plugins: List of impact functions described by describe_plugin
+    """
+
+    manifest = {'version': MANIFEST_VERSION,
+                'language': os.environ.get('LANG'),
+                'environment': import_environment_key(),
+                'modules': module_signatures(modules),
+                'failed': [],
+                'plugins': []}
+
+    for module_name, _ in modules:
+        if not import_plugin_module(module_name):
+            manifest['failed'].append(module_name)
+            continue
+
+        names = set()
+        for func in FunctionProvider.plugins:
+            if func.__module__ == module_name and func.__name__ not in names:
+                names.add(func.__name__)
+                manifest['plugins'].append(describe_plugin(func))
+
+    return manifest
+
+
+def import_environment_key():
+    """Key of the environment deciding which plugin modules can be imported
+
+    Output:
+        Hex digest of whether QGIS is installed and of the module search
+        path. E.g. runs within QGIS and headless runs have different keys
+        as modules requiring QGIS only import in the former.
+    """
+
+    environment = repr((qgis_is_installed(), sys.path))
+    return hashlib.sha1(environment).hexdigest()
+
+
+def plugin_manifest_filename():
+    """Name of file caching the manifest of the installed impact functions
+
+    Each import environment (see import_environment_key) has its own file.
+    """
+
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    key = abs(hash(dirname))
+    return os.path.join(temp_dir('plugins'), 'manifest_%x_%s.json'
+                        % (key, import_environment_key()[:16]))
+
+
+def read_plugin_manifest(filename):
+    """Read plugin manifest from file
+
+    Returns None if the file does not exist or can not be read.
+    """
+
+    try:
+        fid = open(filename)
+        try:
+            return json.load(fid)
+        finally:
+            fid.close()
+    except (IOError, ValueError):
+        return None
+
+
+def write_plugin_manifest(manifest, filename):
+    """Write plugin manifest to file
+
+    Failures are logged as the manifest will be rebuilt when next needed.
+    """
+
+    tmp_filename = '%s.%i' % (filename, os.getpid())
+    try:
+        fid = open(tmp_filename, 'w')
+        try:
+            json.dump(manifest, fid)
+        finally:
+            fid.close()
+
+        if os.path.exists(filename):
+            # Windows will not rename onto an existing file
+            os.remove(filename)
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError), e:
+        LOGGER.debug('Plugin manifest %s could not be written: %s'
+                     % (filename, e))
+
+
+def load_plugin_manifest(modules=None, filename=None):
+    """Make impact functions available from the plugin manifest
+
+    Input:
+        modules: List of (module name, path) as returned by plugin_modules.
+                 Default is the modules of this package.
+        filename: File caching the manifest.
+                  Default is given by plugin_manifest_filename.
+
+    Output:
+        Manifest as described in build_plugin_manifest. Its impact functions
+        are returned by get_plugins and the other functions looking up
+        impact functions until another manifest is loaded.
+
+    Note:
+        The manifest is built by importing all modules the first time and
+        whenever modules were added, removed or modified since it was
+        written or the language or import environment has changed. Modules
+        which failed to import are not tried again until then. Otherwise
+        modules of impact functions are only imported when the function is
+        used (see LazyPlugin).
+    """
+
+    if modules is None:
+        modules = plugin_modules()
+    if filename is None:
+        filename = plugin_manifest_filename()
+
+    manifest = read_plugin_manifest(filename)
+    if (not isinstance(manifest, dict) or
+            manifest.get('version') != MANIFEST_VERSION or
+            manifest.get('language') != os.environ.get('LANG') or
+            manifest.get('environment') != import_environment_key() or
+            manifest.get('modules') != module_signatures(modules)):
+        manifest = build_plugin_manifest(modules)
+        write_plugin_manifest(manifest, filename)
+
+    _lazy_plugins[:] = [LazyPlugin(entry) for entry in manifest['plugins']]
+    return manifest
+
+
+def get_registered_plugins():
+    """Get all available impact functions
+
+    Output:
+        List of impact functions registered with FunctionProvider followed
+        by those of the plugin manifest whose modules have not been imported
+        yet. The latter are LazyPlugin instances, which are not classes
+        (see LazyPlugin for the attributes they provide).
+    """
+
+    plugins = list(FunctionProvider.plugins)
+    registered = set([(p.__module__, p.__name__) for p in plugins])
+    for func in _lazy_plugins:
+        if (func.__module__, func.__name__) not in registered:
+            plugins.append(func)
+    return plugins
+
+
 # FIXME (Ole): Deprecate this function (see issue #392)
 def pretty_function_name(func):
     """Return a human readable name for the function
@@ -260,6 +679,16 @@ def requirements_collect(func):
       unit=='m'
     """
 
+    # Requirements are collected once for each docstring
+    docstr = getattr(func, '__doc__', None)
+    try:
+        cached_docstr, requires_lines = _requirements_cache[func]
+    except (KeyError, TypeError):
+        pass
+    else:
+        if cached_docstr is docstr:
+            return list(requires_lines)
+
     requires_lines = []
     if hasattr(func, '__doc__') and func.__doc__:
 
@@ -277,14 +706,109 @@ def requirements_collect(func):
                 expression = ' '.join(doc_line[indent:].split())
                 requires_lines.append(expression)
 
+    try:
+        _requirements_cache[func] = (docstr, requires_lines)
+    except TypeError:
+        # Unhashable objects are not cached
+        pass
+
     # Return list with one item per requirement
-    return requires_lines
+    return list(requires_lines)
+
+
+def compile_requirement(require_str):
+    """Compile requirement expression to be evaluated against keywords
+
+    Each expression is compiled only once and then cached.
+
+    :param require_str: Python expression as collected by
+        requirements_collect.
+    :type require_str: str
+
+    :returns: Code object for use with eval or None if the expression
+        is not valid Python.
+    """
+
+    try:
+        return _compiled_requirements[require_str]
+    except KeyError:
+        pass
+
+    try:
+        code = compile(require_str, '<requirement>', 'eval')
+    except Exception, e:
+        LOGGER.debug('Requirements header could not be compiled: %s. '
+                     'Original message: %s' % (require_str, e))
+        code = None
+
+    _compiled_requirements[require_str] = code
+    return code
+
+
+def requirement_constraints(require_str):
+    """Values of INDEX_KEYWORDS admitted by a requirement expression
+
+    Only terms of the form keyword == value and keyword in [values] which
+    must hold for the entire expression are taken into account.
+
+    :param require_str: Python expression as collected by
+        requirements_collect.
+    :type require_str: str
+
+    :returns: Dictionary mapping keywords to sets of admissible values.
+        Keywords that are not constrained are left out.
+    :rtype: dict
+    """
+
+    constraints = {}
+    try:
+        expression = ast.parse(require_str, mode='eval').body
+    except SyntaxError:
+        return constraints
+
+    # Terms that must all be true
+    if isinstance(expression, ast.BoolOp) and isinstance(expression.op,
+                                                         ast.And):
+        terms = expression.values
+    else:
+        terms = [expression]
+
+    for term in terms:
+        if not (isinstance(term, ast.Compare) and len(term.ops) == 1 and
+                isinstance(term.left, ast.Name) and
+                term.left.id in INDEX_KEYWORDS):
+            continue
+
+        try:
+            value = ast.literal_eval(term.comparators[0])
+            if isinstance(term.ops[0], ast.Eq):
+                values = set([value])
+            elif (isinstance(term.ops[0], ast.In) and
+                  isinstance(value, (list, tuple, set))):
+                values = set(value)
+            else:
+                continue
+        except (ValueError, TypeError):
+            # Not a literal or not hashable
+            continue
+
+        key = term.left.id
+        if key in constraints:
+            constraints[key] &= values
+        else:
+            constraints[key] = values
+
+    return constraints
 
 
 def requirement_check(params, require_str, verbose=False):
     """Checks a dictionary params against the requirements defined
     in require_str. Require_str must be a valid python expression
-    and evaluate to True or False"""
+    and evaluate to True or False
+
+    The expression is compiled once (see compile_requirement) and
+    evaluated with the keywords in params as variables.
+    """
 
     # Some keyword should never go into the requirement check
     # FIXME (Ole): This is not the most robust way. If we get a
@@ -292,7 +816,7 @@ def requirement_check(params, require_str, verbose=False):
     # many other things separately. See issue #148
     excluded_keywords = ['impact_summary']
 
-    execstr = 'def check():\n'
+    namespace = {}
     for key in params.keys():
         if key == '':
             if params[''] != '':
@@ -314,31 +838,32 @@ def requirement_check(params, require_str, verbose=False):
         if key in excluded_keywords:
             continue
 
-        if isinstance(params[key], basestring):
-            execstr += '  %s = "%s" \n' % (key.strip(), params[key])
-        else:
-            execstr += '  %s = %s \n' % (key.strip(), params[key])
+        # Keywords that are not valid Python names can not be checked
+        name = key.strip()
+        if not re.match('[A-Za-z_][A-Za-z0-9_]*$', name):
+            return False
 
-    execstr += '  return ' + require_str
+        namespace[name] = params[key]
 
     if verbose:
-        print execstr
-    try:
-        # pylint: disable=W0122
-        exec(compile(execstr, '<string>', 'exec'))
-        # pylint: enable=W0122
+        print require_str, namespace
+
+    code = compile_requirement(require_str)
+    if code is None:
+        return False
 
-        # pylint: disable=E0602
-        return check()
-        # pylint: enable=E0602
+    try:
+        # pylint: disable=W0123
+        return eval(code, {}, namespace)
+        # pylint: enable=W0123
     except NameError, e:
         # This condition will happen frequently since the function
         # is evaled against many params that are not relevant and
         # hence correctly return False
         pass
     except Exception, e:
-        msg = ('Requirements header could not compiled: %s. '
-               'Original message: %s' % (execstr, e))
+        msg = ('Requirements could not be evaluated: %s. '
+               'Original message: %s' % (require_str, e))
         #print msg
         #logger.error(msg)
 
@@ -519,10 +1044,13 @@ def aggregate_point_data(data=None, boundaries=None,
     points = data.get_geometry()
     attributes = data.get_data()
 
+    # Index points once so that each polygon only tests nearby points
+    index = PointIndex(points)
+
     result = []
     #for i, polygon in enumerate(polygon_geoms):
     for polygon in polygon_geoms:
-        indices = inside_polygon(points, polygon)
+        indices = inside_polygon(points, polygon, index=index)
 
         #print 'Found %i points in polygon %i' % (len(indices), i)
 
@@ -601,6 +1129,11 @@ def get_admissible_plugins(keywords=None):  # , name=None):
 
     Output:
         Dictionary of impact functions ({name: class})
+
+    Note:
+        Candidate impact functions are looked up by category, subcategory
+        and layertype in an index of plugin requirements (see
+        get_plugin_index). Only their requirements are checked in full.
     """
 
     # This is very verbose, but sometimes useful
@@ -614,11 +1147,18 @@ def get_admissible_plugins(keywords=None):  # , name=None):
         keywords = [keywords]
 
     # Get all impact functions
-    plugin_dict = get_plugins()
+    index = get_plugin_index()
+    plugin_dict = index['plugins']
+
+    # Names of impact functions that may match all given keywords
+    candidates = set(plugin_dict.keys())
+    for kw_dict in keywords:
+        candidates &= plugin_candidates(index, kw_dict)
 
     # Build dictionary of those that match given keywords
     admissible_plugins = {}
-    for f_name, func in plugin_dict.items():
+    for f_name in candidates:
+        func = plugin_dict[f_name]
 
         # Required keywords for func
         requirelines = requirements_collect(func)
@@ -628,6 +1168,7 @@ def get_admissible_plugins(keywords=None):  # , name=None):
         for kw_dict in keywords:
             if not requirements_met(requirelines, kw_dict):
                 match = False
+                break
         if match:
             admissible_plugins[f_name] = func
 
@@ -638,6 +1179,81 @@ def get_admissible_plugins(keywords=None):  # , name=None):
     return admissible_plugins
 
 
+def get_plugin_index():
+    """Index of impact functions by their requirements
+
+    The index is rebuilt whenever the available plugins change (see
+    get_registered_plugins).
+
+    Returns:
+        Dictionary with
+
+        * plugins: Dictionary of impact functions as returned by get_plugins
+        * index: Dictionary mapping tuples of values of INDEX_KEYWORDS to
+          sets of names of impact functions with a requirement admitting
+          these values. None in a tuple stands for any value (including
+          a missing keyword).
+    """
+
+    registered = get_registered_plugins()
+    if _plugin_index.get('registered') == registered:
+        return _plugin_index
+
+    plugin_dict = get_plugins()
+    index = {}
+    for f_name, func in plugin_dict.items():
+        requirements = requirements_collect(func)
+        if len(requirements) == 0:
+            # Functions without requirements match any keywords
+            index.setdefault((None,) * len(INDEX_KEYWORDS),
+                             set()).add(f_name)
+
+        for requirement in requirements:
+            constraints = requirement_constraints(requirement)
+            values = [constraints.get(key, [None]) for key in INDEX_KEYWORDS]
+            for key in itertools.product(*values):
+                index.setdefault(key, set()).add(f_name)
+
+    _plugin_index.clear()
+    _plugin_index.update({'registered': registered,
+                          'plugins': plugin_dict,
+                          'index': index})
+    return _plugin_index
+
+
+def plugin_candidates(index, keywords):
+    """Names of impact functions that may be admissible for keywords
+
+    Input:
+        index: Plugin index as returned by get_plugin_index
+        keywords: Dictionary of layer keywords
+
+    Output:
+        Set of names of impact functions. Requirements of these must still
+        be checked against keywords with requirements_met.
+    """
+
+    options = []
+    for key in INDEX_KEYWORDS:
+        values = [None]
+        for name in keywords:
+            if name.strip() == key:
+                value = keywords[name]
+                try:
+                    hash(value)
+                except TypeError:
+                    # Unhashable values can not be looked up
+                    return set(index['plugins'].keys())
+                values.append(value)
+        options.append(values)
+
+    candidates = set()
+    for key in itertools.product(*options):
+        candidates |= index['index'].get(key, set())
+
+    return candidates
+
+
 def parse_single_requirement(requirement):
     '''Parse single requirement from impact function's doc to category,
         subcategory, layertype, datatype, unit, and disabled.'''
@@ -706,7 +1322,7 @@ def get_plugins_as_table(dict_filter=None):
     table_body.append(header)
 
     plugins_dict = dict([(pretty_function_name(p), p)
-                         for p in FunctionProvider.plugins])
+                         for p in get_registered_plugins()])
 
     not_found_value = 'N/A'
     for key, func in plugins_dict.iteritems():
@@ -796,7 +1412,7 @@ def get_unique_values():
                    'title': set()}
 
     plugins_dict = dict([(pretty_function_name(p), p)
-                         for p in FunctionProvider.plugins])
+                         for p in get_registered_plugins()])
     for key, func in plugins_dict.iteritems():
         if not is_function_enabled(func):
             continue
@@ -837,7 +1453,7 @@ def get_metadata(func):
     retval['unique_identifier'] = func
 
     plugins_dict = dict([(pretty_function_name(p), p)
-                         for p in FunctionProvider.plugins])
+                         for p in get_registered_plugins()])
     if func not in plugins_dict.keys():
         return None
     else:
@@ -1,10 +1,13 @@
 # coding=utf-8
 """Earthquake Impact Function on Building."""
 
+import numpy
+
 from safe.common.utilities import OrderedDict
 from safe.impact_functions.core import (
     FunctionProvider, get_hazard_layer, get_exposure_layer, get_question)
 from safe.storage.vector import Vector
+from safe.storage.utilities import column_as_float
 from safe.common.utilities import (ugettext as tr, format_int)
 from safe.common.tables import Table, TableRow
 from safe.engine.interpolation import assign_hazard_values_to_exposure_data
@@ -48,109 +51,132 @@ class EarthquakeBuildingImpactFunction(FunctionProvider):
 
         LOGGER.debug('Running earthquake building impact')
 
-        # merely initialize
-        building_value = 0
-        contents_value = 0
+        impact_layer, totals = self.run_tile(layers)
+        name, keywords, style_info = self.finalise_impact(layers, totals,
+                                                          None)
+
+        # Create vector layer and return
+        result_layer = Vector(
+            data=impact_layer.get_columns(),
+            projection=impact_layer.get_projection(),
+            geometry=impact_layer.get_geometry(),
+            name=name,
+            keywords=keywords,
+            style_info=style_info)
+
+        msg = 'Created vector layer %s' % str(result_layer)
+        LOGGER.debug(msg)
+        return result_layer
+
+    def run_tile(self, layers, window=None):
+        """Classify buildings by shake level
+
+        :param layers: All the input layers (Hazard Layer and Exposure
+            Layer). The exposure layer may hold a subset of the buildings.
+        :param window: Not used as the exposure layer is vector data
+
+        :returns: Tuple of vector layer with classified buildings and
+            dictionary of counts and values per class that add up over
+            subsets of buildings.
+        :rtype: tuple
+        """
 
         # Thresholds for mmi breakdown
         t0 = self.parameters['low_threshold']
         t1 = self.parameters['medium_threshold']
         t2 = self.parameters['high_threshold']
 
-        # Class Attribute and Label
-
-        class_1 = {'label': tr('Low'), 'class': 1}
-        class_2 = {'label': tr('Medium'), 'class': 2}
-        class_3 = {'label': tr('High'), 'class': 3}
-
         # Extract data
         my_hazard = get_hazard_layer(layers)    # Depth
         my_exposure = get_exposure_layer(layers)  # Building locations
 
-        question = get_question(my_hazard.get_name(),
-                                my_exposure.get_name(),
-                                self)
-
         # Define attribute name for hazard levels
         hazard_attribute = 'mmi'
 
-        # Determine if exposure data have NEXIS attributes
-        attribute_names = my_exposure.get_attribute_names()
-        if ('FLOOR_AREA' in attribute_names and
-            'BUILDING_C' in attribute_names and
-                'CONTENTS_C' in attribute_names):
-            is_nexis = True
-        else:
-            is_nexis = False
-
         # Interpolate hazard level to building locations
         my_interpolate_result = assign_hazard_values_to_exposure_data(
             my_hazard, my_exposure, attribute_name=hazard_attribute)
 
         # Extract relevant exposure data
         #attribute_names = my_interpolate_result.get_attribute_names()
-        attributes = my_interpolate_result.get_data()
+        columns = my_interpolate_result.get_columns()
+
+        # Classify building according to shake level
+        x = column_as_float(columns[hazard_attribute])  # MMI
+        classes = numpy.zeros(len(x), dtype=numpy.int)
+        classes[(t0 <= x) * (x < t1)] = 1
+        classes[(t1 <= x) * (x < t2)] = 2
+        classes[t2 <= x] = 3
+        # Not reported for less than level t0 (class 0)
+
+        columns[self.target_field] = classes
+
+        totals = {'counts': numpy.bincount(classes, minlength=4),
+                  'building': numpy.zeros(4),
+                  'contents': numpy.zeros(4)}
+        if is_nexis_data(my_exposure):
+            # Calculate dollar losses
+            area = column_as_float(columns['FLOOR_AREA'])
+            building_value = column_as_float(columns['BUILDING_C']) * area
+            contents_value = column_as_float(columns['CONTENTS_C']) * area
+
+            # Accumulate values for each class
+            totals['building'] = numpy.bincount(classes,
+                                                weights=building_value,
+                                                minlength=4)
+            totals['contents'] = numpy.bincount(classes,
+                                                weights=contents_value,
+                                                minlength=4)
+
+        impact_layer = Vector(
+            data=columns,
+            projection=my_interpolate_result.get_projection(),
+            geometry=my_interpolate_result.get_geometry())
+        return impact_layer, totals
+
+    def finalise_impact(self, layers, totals, extrema):
+        """Create report and style from counts over all buildings
 
-        interpolate_size = len(my_interpolate_result)
+        :param layers: All the input layers (Hazard Layer and Exposure Layer)
+        :param totals: Dictionary of counts returned by run_tile summed
+            over all subsets of buildings.
+        :param extrema: Not used for vector impact layers
+
+        :returns: Tuple (name, keywords, style_info) for the impact layer
+        :rtype: tuple
+        """
+
+        t0 = self.parameters['low_threshold']
+        t1 = self.parameters['medium_threshold']
+        t2 = self.parameters['high_threshold']
+
+        # Class Attribute and Label
+
+        class_1 = {'label': tr('Low'), 'class': 1}
+        class_2 = {'label': tr('Medium'), 'class': 2}
+        class_3 = {'label': tr('High'), 'class': 3}
+
+        my_hazard = get_hazard_layer(layers)
+        my_exposure = get_exposure_layer(layers)
+
+        question = get_question(my_hazard.get_name(),
+                                my_exposure.get_name(),
+                                self)
+
+        # Determine if exposure data have NEXIS attributes
+        is_nexis = is_nexis_data(my_exposure)
+
+        counts = totals['counts']
+        lo = int(counts[1])
+        me = int(counts[2])
+        hi = int(counts[3])
 
-        # Calculate building impact
-        lo = 0
-        me = 0
-        hi = 0
         building_values = {}
         contents_values = {}
-        for key in range(4):
-            building_values[key] = 0
-            contents_values[key] = 0
-        for i in range(interpolate_size):
-            # Classify building according to shake level
-            # and calculate dollar losses
-
-            if is_nexis:
-                try:
-                    area = float(attributes[i]['FLOOR_AREA'])
-                except (ValueError, KeyError):
-                    #print 'Got area', attributes[i]['FLOOR_AREA']
-                    area = 0.0
-
-                try:
-                    building_value_density = float(attributes[i]['BUILDING_C'])
-                except (ValueError, KeyError):
-                    #print 'Got bld value', attributes[i]['BUILDING_C']
-                    building_value_density = 0.0
-
-                try:
-                    contents_value_density = float(attributes[i]['CONTENTS_C'])
-                except (ValueError, KeyError):
-                    #print 'Got cont value', attributes[i]['CONTENTS_C']
-                    contents_value_density = 0.0
-
-                building_value = building_value_density * area
-                contents_value = contents_value_density * area
-
-            try:
-                x = float(attributes[i][hazard_attribute])  # MMI
-            except TypeError:
-                x = 0.0
-            if t0 <= x < t1:
-                lo += 1
-                cls = 1
-            elif t1 <= x < t2:
-                me += 1
-                cls = 2
-            elif t2 <= x:
-                hi += 1
-                cls = 3
-            else:
-                # Not reported for less than level t0
-                cls = 0
-
-            attributes[i][self.target_field] = cls
-
-            if is_nexis:
-                # Accumulate values in 1M dollar units
-                building_values[cls] += building_value
-                contents_values[cls] += contents_value
+        if is_nexis:
+            for key in range(4):
+                building_values[key] = totals['building'][key]
+                contents_values[key] = totals['contents'][key]
 
         if is_nexis:
             # Convert to units of one million dollars
@@ -217,25 +243,31 @@ class EarthquakeBuildingImpactFunction(FunctionProvider):
         legend_units = tr('(mmi)')
         legend_title = tr('Impact level')
 
-        # Create vector layer and return
-        result_layer = Vector(
-            data=attributes,
-            projection=my_interpolate_result.get_projection(),
-            geometry=my_interpolate_result.get_geometry(),
-            name=tr('Estimated buildings affected'),
-            keywords={
-                'impact_summary': impact_summary,
-                'impact_table': impact_table,
-                'map_title': map_title,
-                'legend_notes': legend_notes,
-                'legend_units': legend_units,
-                'legend_title': legend_title,
-                'target_field': self.target_field,
-                'statistics_type': self.statistics_type,
-                'statistics_classes': self
-                .statistics_classes},
-            style_info=style_info)
+        keywords = {
+            'impact_summary': impact_summary,
+            'impact_table': impact_table,
+            'map_title': map_title,
+            'legend_notes': legend_notes,
+            'legend_units': legend_units,
+            'legend_title': legend_title,
+            'target_field': self.target_field,
+            'statistics_type': self.statistics_type,
+            'statistics_classes': self.statistics_classes}
+        name = tr('Estimated buildings affected')
+        return name, keywords, style_info
 
-        msg = 'Created vector layer %s' % str(result_layer)
-        LOGGER.debug(msg)
-        return result_layer
+
+def is_nexis_data(layer):
+    """Determine if exposure data have NEXIS attributes
+
+    :param layer: Building exposure layer
+    :type layer: Vector
+
+    :returns: True if floor area, building and contents costs are available
+    :rtype: bool
+    """
+
+    attribute_names = layer.get_attribute_names()
+    return ('FLOOR_AREA' in attribute_names and
+            'BUILDING_C' in attribute_names and
+            'CONTENTS_C' in attribute_names)
@@ -191,6 +191,43 @@ class ITBFatalityFunction(FunctionProvider):
                 my_exposure: Raster layer of population density
         """
 
+        # Extract input layers
+        population = get_exposure_layer(layers)
+
+        # Calculate impact for the whole grid as one tile
+        R, totals = self.run_tile(layers)
+        extrema = (numpy.nanmin(R), numpy.nanmax(R))
+        name, keywords, style_info = self.finalise_impact(layers, totals,
+                                                          extrema)
+
+        # Create raster object and return
+        L = Raster(R,
+                   projection=population.get_projection(),
+                   geotransform=population.get_geotransform(),
+                   keywords=keywords,
+                   name=name,
+                   style_info=style_info)
+
+        return L
+
+    def run_tile(self, layers, window=None):
+        """Calculate displaced people and fatalities in one tile
+
+        :param layers: List of layers expected to contain,
+
+                my_hazard: Raster layer of MMI ground shaking
+
+                my_exposure: Raster layer of population density
+
+        :param window: Optional pixel window (xoff, yoff, xsize, ysize) of
+            the grids to use. If None the whole grids are used.
+        :type window: tuple
+
+        :returns: Tuple (R, totals) with displaced population for the tile
+            and a dictionary of counts per MMI level that add up over tiles.
+        :rtype: tuple
+        """
+
         displacement_rate = self.parameters['displacement_rate']
 
         # Tolerance for transparency
@@ -200,13 +237,10 @@ class ITBFatalityFunction(FunctionProvider):
         intensity = get_hazard_layer(layers)
         population = get_exposure_layer(layers)
 
-        question = get_question(intensity.get_name(),
-                                population.get_name(),
-                                self)
-
         # Extract data grids
-        my_hazard = intensity.get_data()   # Ground Shaking
-        my_exposure = population.get_data(scaling=True)  # Population Density
+        my_hazard = intensity.get_data(window=window)   # Ground Shaking
+        # Population Density
+        my_exposure = population.get_data(scaling=True, window=window)
 
         # Calculate population affected by each MMI level
         # FIXME (Ole): this range is 2-9. Should 10 be included?
@@ -258,8 +292,39 @@ class ITBFatalityFunction(FunctionProvider):
         # achieve transparency (see issue #126).
         R[R < tolerance] = numpy.nan
 
+        totals = {'exposed': number_of_exposed,
+                  'displaced': number_of_displaced,
+                  'fatalities': number_of_fatalities,
+                  'total': numpy.nansum(my_exposure.flat)}
+        return R, totals
+
+    def finalise_impact(self, layers, totals, extrema):
+        """Create report and style from counts summed over all tiles
+
+        :param layers: List of hazard and exposure layers
+        :param totals: Dictionary of counts returned by run_tile summed
+            over all tiles.
+        :param extrema: Tuple (min, max) of impact over all tiles
+
+        :returns: Tuple (name, keywords, style_info) for the impact layer
+        :rtype: tuple
+
+        :raises: ZeroImpactException
+        """
+
+        intensity = get_hazard_layer(layers)
+        population = get_exposure_layer(layers)
+
+        question = get_question(intensity.get_name(),
+                                population.get_name(),
+                                self)
+
+        number_of_exposed = totals['exposed']
+        number_of_displaced = totals['displaced']
+        number_of_fatalities = totals['fatalities']
+
         # Total statistics
-        total = int(round(numpy.nansum(my_exposure.flat) / 1000) * 1000)
+        total = int(round(totals['total'] / 1000) * 1000)
 
         # Compute number of fatalities
         fatalities = int(round(numpy.nansum(number_of_fatalities.values())
@@ -358,7 +423,7 @@ class ITBFatalityFunction(FunctionProvider):
         impact_table = impact_summary
 
         # check for zero impact
-        if numpy.nanmax(R) == 0 == numpy.nanmin(R):
+        if extrema[1] == 0 == extrema[0]:
             table_body = [
                 question,
                 TableRow([tr('Fatalities'), '%s' % format_int(fatalities)],
@@ -368,7 +433,7 @@ class ITBFatalityFunction(FunctionProvider):
 
         # Create style
         colours = ['#EEFFEE', '#FFFF7F', '#E15500', '#E4001B', '#730000']
-        classes = create_classes(R.flat[:], len(colours))
+        classes = create_classes(extrema, len(colours))
         interval_classes = humanize_class(classes)
         style_classes = []
         for i in xrange(len(colours)):
@@ -394,22 +459,16 @@ class ITBFatalityFunction(FunctionProvider):
         legend_units = tr('(people per cell)')
         legend_title = tr('Population density')
 
-        # Create raster object and return
-        L = Raster(R,
-                   projection=population.get_projection(),
-                   geotransform=population.get_geotransform(),
-                   keywords={'impact_summary': impact_summary,
-                             'total_population': total,
-                             'total_fatalities': fatalities,
-                             'fatalities_per_mmi': number_of_fatalities,
-                             'exposed_per_mmi': number_of_exposed,
-                             'displaced_per_mmi': number_of_displaced,
-                             'impact_table': impact_table,
-                             'map_title': map_title,
-                             'legend_notes': legend_notes,
-                             'legend_units': legend_units,
-                             'legend_title': legend_title},
-                   name=tr('Estimated displaced population per cell'),
-                   style_info=style_info)
-
-        return L
+        keywords = {'impact_summary': impact_summary,
+                    'total_population': total,
+                    'total_fatalities': fatalities,
+                    'fatalities_per_mmi': number_of_fatalities,
+                    'exposed_per_mmi': number_of_exposed,
+                    'displaced_per_mmi': number_of_displaced,
+                    'impact_table': impact_table,
+                    'map_title': map_title,
+                    'legend_notes': legend_notes,
+                    'legend_units': legend_units,
+                    'legend_title': legend_title}
+        name = tr('Estimated displaced population per cell')
+        return name, keywords, style_info
@@ -114,11 +114,44 @@ class FloodEvacuationFunction(FunctionProvider):
 
         # Identify hazard and exposure layers
         my_hazard = get_hazard_layer(layers)  # Flood inundation [m]
-        my_exposure = get_exposure_layer(layers)
 
-        question = get_question(my_hazard.get_name(),
-                                my_exposure.get_name(),
-                                self)
+        # Calculate impact for the whole grid as one tile
+        impact, totals = self.run_tile(layers)
+        extrema = (numpy.nanmin(impact), numpy.nanmax(impact))
+        name, keywords, style_info = self.finalise_impact(layers, totals,
+                                                          extrema)
+
+        # Create raster object and return
+        raster = Raster(
+            impact,
+            projection=my_hazard.get_projection(),
+            geotransform=my_hazard.get_geotransform(),
+            name=name,
+            keywords=keywords,
+            style_info=style_info)
+        return raster
+
+    def run_tile(self, layers, window=None):
+        """Calculate population needing evacuation in one tile
+
+        :param layers: List of layers expected to contain
+              my_hazard: Raster layer of flood depth
+              my_exposure: Raster layer of population data on the same grid
+              as my_hazard
+
+        :param window: Optional pixel window (xoff, yoff, xsize, ysize) of
+            the grids to use. If None the whole grids are used.
+        :type window: tuple
+
+        :returns: Tuple (impact, counts) with the population exposed to
+            depths above the largest threshold for the tile and a dictionary
+            of population counts that add up over tiles.
+        :rtype: tuple
+        """
+
+        # Identify hazard and exposure layers
+        my_hazard = get_hazard_layer(layers)  # Flood inundation [m]
+        my_exposure = get_exposure_layer(layers)
 
         # Determine depths above which people are regarded affected [m]
         # Use thresholds from inundation layer if specified
@@ -128,14 +161,14 @@ class FloodEvacuationFunction(FunctionProvider):
                'Expected thresholds to be a list. Got %s' % str(thresholds))
 
         # Extract data as numeric arrays
-        data = my_hazard.get_data(nan=0.0)  # Depth
+        data = my_hazard.get_data(nan=0.0, window=window)  # Depth
 
         # Calculate impact as population exposed to depths > max threshold
-        population = my_exposure.get_data(nan=0.0, scaling=True)
+        population = my_exposure.get_data(nan=0.0, scaling=True,
+                                          window=window)
 
         # Calculate impact to intermediate thresholds
         counts = []
-        # merely initialize
         impact = None
         for i, lo in enumerate(thresholds):
             if i == len(thresholds) - 1:
@@ -147,17 +180,37 @@ class FloodEvacuationFunction(FunctionProvider):
                 medium = numpy.where((data >= lo) * (data < hi), population, 0)
 
             # Count
-            val = int(numpy.sum(medium))
+            counts.append(numpy.sum(medium))
+
+        return impact, {'counts': counts, 'total': numpy.sum(population)}
+
+    def finalise_impact(self, layers, totals, extrema):
+        """Create report and style from counts summed over all tiles
+
+        :param layers: List of hazard and exposure layers
+        :param totals: Dictionary of counts returned by run_tile summed
+            over all tiles.
+        :param extrema: Tuple (min, max) of impact over all tiles
+
+        :returns: Tuple (name, keywords, style_info) for the impact layer
+        :rtype: tuple
+
+        :raises: ZeroImpactException
+        """
+
+        my_hazard = get_hazard_layer(layers)
+        my_exposure = get_exposure_layer(layers)
+        question = get_question(my_hazard.get_name(),
+                                my_exposure.get_name(),
+                                self)
+        thresholds = self.parameters['thresholds [m]']
 
-            # Don't show digits less than a 1000
-            val = round_thousand(val)
-            counts.append(val)
+        # Don't show digits less than a 1000
+        counts = [round_thousand(int(val)) for val in totals['counts']]
 
         # Count totals
         evacuated = counts[-1]
-        total = int(numpy.sum(population))
-        # Don't show digits less than a 1000
-        total = round_thousand(total)
+        total = round_thousand(int(totals['total']))
 
         # Calculate estimated minimum needs
         # The default value of each logistic is based on BNPB Perka 7/2008
@@ -221,7 +274,7 @@ class FloodEvacuationFunction(FunctionProvider):
         impact_table = impact_summary
 
         # check for zero impact
-        if numpy.nanmax(impact) == 0 == numpy.nanmin(impact):
+        if extrema[1] == 0 == extrema[0]:
             table_body = [
                 question,
                 TableRow([(tr('People in %.1f m of water') % thresholds[-1]),
@@ -233,7 +286,7 @@ class FloodEvacuationFunction(FunctionProvider):
         # Create style
         colours = ['#FFFFFF', '#38A800', '#79C900', '#CEED00',
                    '#FFCC00', '#FF6600', '#FF0000', '#7A0000']
-        classes = create_classes(impact.flat[:], len(colours))
+        classes = create_classes(extrema, len(colours))
         interval_classes = humanize_class(classes)
         style_classes = []
 
@@ -268,21 +321,14 @@ class FloodEvacuationFunction(FunctionProvider):
         legend_units = tr('(people per cell)')
         legend_title = tr('Population density')
 
-        # Create raster object and return
-        raster = Raster(
-            impact,
-            projection=my_hazard.get_projection(),
-            geotransform=my_hazard.get_geotransform(),
-            name=tr('Population which %s') % (
-                get_function_title(self).lower()),
-            keywords={
-                'impact_summary': impact_summary,
-                'impact_table': impact_table,
-                'map_title': map_title,
-                'legend_notes': legend_notes,
-                'legend_units': legend_units,
-                'legend_title': legend_title,
-                'evacuated': evacuated,
-                'total_needs': tot_needs},
-            style_info=style_info)
-        return raster
+        name = tr('Population which %s') % (get_function_title(self).lower())
+        keywords = {
+            'impact_summary': impact_summary,
+            'impact_table': impact_table,
+            'map_title': map_title,
+            'legend_notes': legend_notes,
+            'legend_units': legend_units,
+            'legend_title': legend_title,
+            'evacuated': evacuated,
+            'total_needs': tot_needs}
+        return name, keywords, style_info
@@ -145,7 +145,8 @@ class FloodEvacuationFunctionVectorHazard(FunctionProvider):
 
         # Run interpolation function for polygon2raster
         P = assign_hazard_values_to_exposure_data(my_hazard, my_exposure,
-                                                  attribute_name='population')
+                                                  attribute_name='population',
+                                                  compact=True)
 
         # Initialise attributes of output dataset with all attributes
         # from input polygon and a population count of zero
@@ -164,9 +165,9 @@ class FloodEvacuationFunctionVectorHazard(FunctionProvider):
                 except KeyError:
                     pass
 
-        # Count affected population per polygon, per category and total
-        affected_population = 0
-        for attr in P.get_data():
+        # Determine which polygons are affected
+        affected_polygons = numpy.zeros(len(new_attributes), dtype=numpy.bool)
+        for poly_id, attr in enumerate(new_attributes):
 
             affected = False
             if 'affected' in attr:
@@ -202,25 +203,28 @@ class FloodEvacuationFunctionVectorHazard(FunctionProvider):
                 #       'Sorry I can\'t help more.')
                 #raise Exception(msg)
 
-            if affected:
-                # Get population at this location
-                pop = float(attr['population'])
-
-                # Update population count for associated polygon
-                poly_id = attr['polygon_id']
-                new_attributes[poly_id][self.target_field] += pop
-
-                # Update population count for each category
-                if len(categories) > 0:
-                    try:
-                        cat = new_attributes[poly_id][category_title]
-                    except KeyError:
-                        cat = new_attributes[poly_id][
-                            deprecated_category_title]
-                    categories[cat] += pop
-
-                # Update total
-                affected_population += pop
+            affected_polygons[poly_id] = affected
+
+        # Count affected population per polygon, per category and total
+        population = P.sum_by_polygon(mask=affected_polygons)
+        affected_population = 0
+        for poly_id in numpy.where(affected_polygons)[0]:
+            pop = float(population[poly_id])
+
+            # Update population count for associated polygon
+            new_attributes[poly_id][self.target_field] += pop
+
+            # Update population count for each category
+            if len(categories) > 0:
+                try:
+                    cat = new_attributes[poly_id][category_title]
+                except KeyError:
+                    cat = new_attributes[poly_id][
+                        deprecated_category_title]
+                categories[cat] += pop
+
+            # Update total
+            affected_population += pop
 
         affected_population = round_thousand(affected_population)
         # Estimate number of people in need of evacuation
@@ -2,25 +2,57 @@
 import unittest
 import logging
 import os
+import sys
+import time
 
+from safe.impact_functions import core
 from safe.impact_functions.core import (
     FunctionProvider,
     requirements_collect,
     requirement_check,
     requirements_met,
     get_admissible_plugins,
+    get_plugins,
+    get_plugin_index,
+    plugin_candidates,
+    compile_requirement,
+    requirement_constraints,
     get_function_title,
     get_plugins_as_table,
     parse_single_requirement,
     get_metadata,
     evacuated_population_weekly_needs,
-    aggregate)
+    aggregate,
+    plugin_modules,
+    load_plugin_manifest,
+    plugin_manifest_filename,
+    LazyPlugin)
 from safe.impact_functions.utilities import pretty_string
-from safe.common.utilities import format_int
+from safe.common.utilities import format_int, temp_dir, unique_filename
 # from safe.impact_functions.core import get_dict_doc_func
 
 LOGGER = logging.getLogger('InaSAFE')
 
+LAZY_PLUGIN_MODULE = """
+from safe.impact_functions.core import FunctionProvider
+
+
+class LazyImpactFunction(FunctionProvider):
+    \"\"\"Impact function for testing of the plugin manifest
+
+    :author Lazy
+    :rating 2
+    :param requires category=='test_lazy' and layertype=='raster'
+    \"\"\"
+
+    title = '%s'
+    synopsis = 'To test that modules are imported when needed'
+    parameters = {'threshold': 1}
+
+    def run(self, layers):
+        return layers
+"""
+
 
 # noinspection PyUnresolvedReferences
 class BasicFunction(FunctionProvider):
@@ -121,6 +153,38 @@ class SyntaxErrorFunction(FunctionProvider):
         return None
 
 
+def exec_requirements_met(requirements, params):
+    """Check requirements by executing generated code for each of them
+
+    This is how requirements were checked before they were compiled and
+    serves as reference for the current implementation.
+    """
+
+    if len(requirements) == 0:
+        return True
+
+    for requirement in requirements:
+        code = 'def check():\n'
+        for key, value in params.items():
+            if key in ['', 'impact_summary']:
+                continue
+            if isinstance(value, basestring):
+                code += '  %s = "%s" \n' % (key.strip(), value)
+            else:
+                code += '  %s = %s \n' % (key.strip(), value)
+        code += '  return ' + requirement
+
+        namespace = {}
+        try:
+            exec compile(code, '<string>', 'exec') in namespace
+            if namespace['check']():
+                return True
+        except Exception:
+            pass
+
+    return False
+
+
 class Test_plugin_core(unittest.TestCase):
     """Tests of InaSAFE calculations
     """
@@ -204,6 +268,227 @@ class Test_plugin_core(unittest.TestCase):
                % str(P.keys()))
         assert 'F1' in P and 'F2' in P and 'F3' in P, msg
 
+    def test_requirement_index(self):
+        """Requirements are indexed by category, subcategory and layertype
+        """
+
+        constraints = requirement_constraints(requirements_collect(F1)[0])
+        assert constraints == {'category': set(['test_cat1']),
+                               'layertype': set(['raster'])}
+
+        constraints = requirement_constraints(requirements_collect(F4)[0])
+        assert constraints == {'category': set(['hazard']),
+                               'subcategory': set(['flood', 'tsunami'])}
+
+        # Malformed requirements are not indexed
+        assert requirement_constraints('unit="MMI"') == {}
+        assert compile_requirement('unit="MMI"') is None
+
+        # Candidates are a superset of admissible plugins
+        index = get_plugin_index()
+        keywords = dict(category='test_cat2', subcategory='building')
+        candidates = plugin_candidates(index, keywords)
+        assert 'F2' in candidates and 'F3' in candidates
+        assert 'F1' not in candidates and 'F4' not in candidates
+
+    def test_admissible_plugins_performance(self):
+        """Admissible plugins are checked among few candidates only
+        """
+
+        # Register a few hundred synthetic impact functions
+        hazards = ['flood', 'tsunami', 'earthquake', 'volcano', 'tephra']
+        exposures = ['population', 'building', 'road', 'structure']
+        synthetic = []
+        for i in range(400):
+            hazard = hazards[i % len(hazards)]
+            exposure = exposures[i % len(exposures)]
+            layertype = ['raster', 'vector'][i % 2]
+            doc = ('Synthetic plugin for testing\n\n'
+                   '    :param requires category==\'hazard\' and '
+                   'subcategory==\'%s\' and layertype==\'%s\' and '
+                   'unit==\'unit_%i\'\n'
+                   '    :param requires category==\'exposure\' and '
+                   'subcategory in [\'%s\', \'other\'] and '
+                   'layertype==\'%s\'\n'
+                   % (hazard, layertype, i % 7, exposure, layertype))
+            synthetic.append(type('SyntheticFunction%i' % i,
+                                  (FunctionProvider,),
+                                  {'__doc__': doc}))
+
+        try:
+            keywords = [dict(category='hazard', subcategory='flood',
+                             layertype='vector', unit='unit_3'),
+                        dict(category='exposure', subcategory='building',
+                             layertype='vector')]
+
+            # Reference result from checking all plugins by executing
+            # generated code for every requirement as was done before
+            # requirements were compiled and indexed
+            t0 = time.time()
+            reference = {}
+            for name, func in get_plugins().items():
+                requirements = requirements_collect(func)
+                if all([exec_requirements_met(requirements, x)
+                        for x in keywords]):
+                    reference[name] = func
+            t1 = time.time()
+
+            # Requirements are only checked for candidates from the index
+            checked = []
+
+            def counting_requirements_met(requirements, params):
+                checked.append(params)
+                return requirements_met_orig(requirements, params)
+
+            requirements_met_orig = core.requirements_met
+            core.requirements_met = counting_requirements_met
+            try:
+                plugins = get_admissible_plugins(keywords)
+            finally:
+                core.requirements_met = requirements_met_orig
+            t2 = time.time()
+            LOGGER.info('Admissible plugins: exec %.4fs, index %.4fs'
+                        % (t1 - t0, t2 - t1))
+
+            assert plugins == reference
+            names = ['Synthetic Function%i' % i for i in range(400)
+                     if i % 5 == 0 and i % 4 == 1 and i % 7 == 3]
+            assert len(names) == 3
+            found = [x for x in plugins if x.startswith('Synthetic')]
+            assert sorted(found) == sorted(names)
+
+            # Of the 400 synthetic plugins only the 20 for flood hazard
+            # and building exposure on vector layers are candidates
+            candidates = (plugin_candidates(get_plugin_index(),
+                                            keywords[0]) &
+                          plugin_candidates(get_plugin_index(),
+                                            keywords[1]))
+            synthetic_candidates = [x for x in candidates
+                                    if x.startswith('Synthetic')]
+            assert len(synthetic_candidates) == 20
+            msg = ('Requirements were checked %i times for %i plugins'
+                   % (len(checked), len(get_plugins())))
+            assert len(checked) <= 2 * len(candidates), msg
+            assert len(candidates) < len(get_plugins()) - 300, msg
+        finally:
+            for func in synthetic:
+                FunctionProvider.plugins.remove(func)
+
+    def test_plugin_manifest(self):
+        """Impact functions are served from the manifest until they are run
+        """
+
+        import_plugin_module_orig = core.import_plugin_module
+
+        # Package with one impact function
+        dirname = temp_dir(sub_dir='test')
+        package = os.path.basename(unique_filename(prefix='lazy_plugins_',
+                                                   dir=dirname))
+        os.makedirs(os.path.join(dirname, package, 'hazard'))
+        open(os.path.join(dirname, package, '__init__.py'), 'w').close()
+        open(os.path.join(dirname, package, 'hazard',
+                          '__init__.py'), 'w').close()
+        path = os.path.join(dirname, package, 'hazard', 'lazy_impact.py')
+        fid = open(path, 'w')
+        fid.write(LAZY_PLUGIN_MODULE % 'Be lazy')
+        fid.close()
+
+        # Module that can not be imported (e.g. as QGIS is missing)
+        broken_path = os.path.join(dirname, package, 'hazard',
+                                   'broken_impact.py')
+        fid = open(broken_path, 'w')
+        fid.write('import no_such_module_for_testing\n')
+        fid.close()
+
+        module_name = '%s.hazard.lazy_impact' % package
+        broken_name = '%s.hazard.broken_impact' % package
+        modules = plugin_modules(os.path.join(dirname, package), package)
+        assert modules == [(broken_name, broken_path), (module_name, path)]
+        filename = unique_filename(suffix='.json', dir=dirname)
+
+        def unload():
+            for func in FunctionProvider.plugins[:]:
+                if func.__module__ == module_name:
+                    FunctionProvider.plugins.remove(func)
+            for name in sys.modules.keys():
+                if name.startswith(package):
+                    del sys.modules[name]
+
+        sys.path.insert(0, dirname)
+        try:
+            # First load imports the module to build the manifest
+            manifest = load_plugin_manifest(modules, filename)
+            assert os.path.exists(filename)
+            assert module_name in sys.modules
+            entry = manifest['plugins'][0]
+            assert entry['name'] == 'LazyImpactFunction'
+            assert entry['requirements'] == [
+                'category==\'test_lazy\' and layertype==\'raster\'']
+            assert 'parameters' not in entry['attributes']
+            assert manifest['failed'] == [broken_name]
+            unload()
+
+            # Next load only reads the manifest and does not try modules
+            # that failed to import again
+            imported = []
+
+            def import_plugin_module(module_name):
+                imported.append(module_name)
+
+            core.import_plugin_module = import_plugin_module
+            try:
+                load_plugin_manifest(modules, filename)
+            finally:
+                core.import_plugin_module = import_plugin_module_orig
+            assert imported == []
+            name = 'Lazy Impact Function'
+            func = get_plugins()[name]
+            assert isinstance(func, LazyPlugin)
+            assert get_function_title(func) == 'Be lazy'
+
+            # Manifest attributes have the types of the class attributes
+            assert type(func.title) is str
+            assert type(func.synopsis) is str
+            assert type(func.__name__) is str
+
+            keywords = dict(category='test_lazy', layertype='raster')
+            assert get_admissible_plugins(keywords).keys() == [name]
+            metadata = get_metadata(name)
+            assert metadata['author'] == 'Lazy'
+            assert metadata['rating'] == '2'
+            assert metadata['synopsis'].startswith('To test')
+            assert module_name not in sys.modules
+
+            # The module is imported when the impact function is used
+            assert func.parameters == {'threshold': 1}
+            assert func().run([1, 2]) == [1, 2]
+            assert module_name in sys.modules
+            assert get_plugins()[name] is func.get_class()
+            assert issubclass(func.get_class(), FunctionProvider)
+            unload()
+
+            # Modified modules are described again
+            fid = open(path, 'w')
+            fid.write(LAZY_PLUGIN_MODULE % 'Be lazier')
+            fid.close()
+            mtime = os.path.getmtime(path) + 10
+            os.utime(path, (mtime, mtime))
+            load_plugin_manifest(modules, filename)
+            assert module_name in sys.modules
+            assert get_function_title(get_plugins()[name]) == 'Be lazier'
+
+            # Other import environments have their own manifests
+            default_filename = plugin_manifest_filename()
+            sys.path.append(dirname)
+            try:
+                assert plugin_manifest_filename() != default_filename
+            finally:
+                sys.path.pop()
+        finally:
+            unload()
+            sys.path.remove(dirname)
+            load_plugin_manifest()
+
     def test_parse_requirement(self):
         """Test parse requirements of a function to dictionary."""
         myRequirement = requirements_collect(F4)[0]
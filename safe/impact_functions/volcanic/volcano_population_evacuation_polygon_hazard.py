@@ -173,7 +173,8 @@ class VolcanoPolygonHazardPopulation(FunctionProvider):
 
         # Run interpolation function for polygon2raster
         P = assign_hazard_values_to_exposure_data(
-            my_hazard, my_exposure, attribute_name='population')
+            my_hazard, my_exposure, attribute_name='population',
+            compact=True)
 
         # Initialise attributes of output dataset with all attributes
         # from input polygon and a population count of zero
@@ -187,13 +188,12 @@ class VolcanoPolygonHazardPopulation(FunctionProvider):
 
         # Count affected population per polygon and total
         evacuated = 0
-        for attr in P.get_data():
-            # Get population at this location
-            pop = float(attr['population'])
+        population = P.sum_by_polygon()
+        for poly_id, attr in enumerate(new_attributes):
+            pop = float(population[poly_id])
 
             # Update population count for associated polygon
-            poly_id = attr['polygon_id']
-            new_attributes[poly_id][self.target_field] += pop
+            attr[self.target_field] += pop
 
             # Update population count for each category
             cat = new_attributes[poly_id][category_title]
@@ -17,19 +17,8 @@ __copyright__ += 'Disaster Reduction'
 import logging
 from safe.common.utilities import ugettext as tr
 
-# pylint: disable=W0611
-from gender_postprocessor import GenderPostprocessor
-from age_postprocessor import AgePostprocessor
-from aggregation_postprocessor import AggregationPostprocessor
-from building_type_postprocessor import BuildingTypePostprocessor
-from road_type_postprocessor import RoadTypePostprocessor
-from aggregation_categorical_postprocessor import \
-    AggregationCategoricalPostprocessor
-from minimum_needs_postprocessor import MinimumNeedsPostprocessor
-# pylint: enable=W0611
-
 LOGGER = logging.getLogger('InaSAFE')
-#this _must_reflect the imported classes above
+# this _must_ reflect POSTPROCESSOR_MODULES below
 # please put the value of this dictionary in
 # safe/common/dynamic_translations.py for the run time translation
 AVAILABLE_POSTPTOCESSORS = {'Gender': 'Gender',
@@ -42,6 +31,33 @@ AVAILABLE_POSTPTOCESSORS = {'Gender': 'Gender',
                             'MinimumNeeds': 'Minimum needs'
                             }
 
+# Modules defining the postprocessors. These are imported when the
+# postprocessors are first requested rather than with this module.
+POSTPROCESSOR_MODULES = {
+    'Gender': 'gender_postprocessor',
+    'Age': 'age_postprocessor',
+    'Aggregation': 'aggregation_postprocessor',
+    'BuildingType': 'building_type_postprocessor',
+    'RoadType': 'road_type_postprocessor',
+    'AggregationCategorical': 'aggregation_categorical_postprocessor',
+    'MinimumNeeds': 'minimum_needs_postprocessor'}
+
+
+def get_postprocessor_class(name):
+    """
+    Imports the class implementing a postprocessor
+
+    Args:
+        * name: Name of the postprocessor, e.g. 'Gender'
+
+    Returns:
+        postprocessor class e.g. GenderPostprocessor
+    """
+    module_name = 'safe.postprocessors.%s' % POSTPROCESSOR_MODULES[name]
+    constr_id = name + 'Postprocessor'
+    module = __import__(module_name, globals(), locals(), [constr_id])
+    return getattr(module, constr_id)
+
 
 def get_postprocessors(requested_postprocessors, aoi_mode):
     """
@@ -97,8 +113,7 @@ def get_postprocessors(requested_postprocessors, aoi_mode):
         try:
             if values['on'] and requires_aggregation:
                 if name in AVAILABLE_POSTPTOCESSORS.keys():
-                    #http://stackoverflow.com/a/554462
-                    constr = globals()[constr_id]
+                    constr = get_postprocessor_class(name)
                     instance = constr()
                     postprocessor_instances[name] = instance
                 else:
@@ -0,0 +1,422 @@
+# coding=utf-8
+"""**Bulk reading of OGR vector layers**
+
+.. tip:: Reads geometry as WKB and decodes it with numpy into the packed
+   coordinate layout of module geometry.py. Attributes of shapefiles are
+   read straight from the dbf file into typed columns. This avoids the
+   per vertex and per attribute calls into OGR made by the feature by
+   feature reader in Vector.read_from_file.
+"""
+
+import os
+import struct
+import numpy
+
+from osgeo import ogr
+
+from safe.common.exceptions import ReadLayerError
+
+from geometry import PackedGeometry
+
+# Number of WKB geometries decoded at a time
+WKB_BATCH_SIZE = 10000
+
+# WKB geometry kinds (ignoring dimension flags)
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+
+# Flag for 2.5D geometries used by OGR in ExportToWkb
+WKB_25D_FLAG = 0x80000000
+
+
+def _ragged_arange(counts):
+    """Concatenation of arange(n) for each n in counts
+    """
+
+    counts = numpy.asarray(counts, dtype=numpy.int)
+    total = counts.sum()
+    starts = numpy.zeros(len(counts), dtype=numpy.int)
+    if len(counts) > 1:
+        numpy.cumsum(counts[:-1], out=starts[1:])
+    return numpy.arange(total) - numpy.repeat(starts, counts)
+
+
+def _parse_wkb_header(buf, pos):
+    """Byte order, kind, dimension and OGR geometry type at pos
+    """
+
+    if buf[pos] == '\x01':
+        endian = '<'
+    else:
+        endian = '>'
+
+    wkb_type = struct.unpack_from(endian + 'I', buf, pos + 1)[0]
+    if wkb_type & WKB_25D_FLAG:
+        kind = wkb_type & 0xff
+        ndim = 3
+        # OGR exposes 2.5D types as negative 32 bit integers
+        geometry_type = wkb_type - 2 ** 32
+    else:
+        # ISO codes 1000, 2000 and 3000 denote Z, M and ZM
+        kind = wkb_type % 1000
+        ndim = [2, 3, 3, 4][wkb_type // 1000]
+        geometry_type = wkb_type
+    return endian, kind, ndim, geometry_type
+
+
+def _walk_polygon(buf, pos, endian, ndim, blocks):
+    """Record coordinate blocks of rings in WKB polygon body at pos
+
+    Returns position after polygon and number of rings.
+    """
+
+    number_of_rings = struct.unpack_from(endian + 'I', buf, pos)[0]
+    pos += 4
+    for _ in range(number_of_rings):
+        n = struct.unpack_from(endian + 'I', buf, pos)[0]
+        blocks.append((pos + 4, n, ndim, endian))
+        pos += 4 + n * ndim * 8
+    return pos, number_of_rings
+
+
+def decode_wkb(wkbs):
+    """Decode list of WKB geometries into numpy arrays
+
+    Only the small headers are walked in Python. All vertex coordinates
+    are gathered from the concatenated WKB buffer with one numpy
+    operation.
+
+    :param wkbs: WKB strings - one per feature. Geometries must all be
+        points, all be lines or all be polygons or multipolygons.
+        Multipolygons are read as one polygon holding all rings of all
+        parts as done by ogr.ForceToPolygon.
+    :type wkbs: list
+
+    :returns: Tuple (geometry_type, geometry) where geometry_type is the
+        OGR geometry type and geometry is an Nx2 array of points or a
+        PackedGeometry of lines or polygons.
+
+    :raises: ReadLayerError
+    """
+
+    buf = ''.join(wkbs)
+    kinds = set()
+    geometry_type = None
+
+    # Coordinate blocks (byte offset, number of vertices, ndim, endian)
+    blocks = []
+    rings_per_feature = []
+    pos = 0
+    for wkb in wkbs:
+        end = pos + len(wkb)
+        endian, kind, ndim, geometry_type = _parse_wkb_header(buf, pos)
+        if kind == WKB_POINT:
+            blocks.append((pos + 5, 1, ndim, endian))
+        elif kind == WKB_LINESTRING:
+            n = struct.unpack_from(endian + 'I', buf, pos + 5)[0]
+            blocks.append((pos + 9, n, ndim, endian))
+        elif kind == WKB_POLYGON:
+            _, number_of_rings = _walk_polygon(buf, pos + 5,
+                                               endian, ndim, blocks)
+            rings_per_feature.append(number_of_rings)
+        elif kind == WKB_MULTIPOLYGON:
+            number_of_parts = struct.unpack_from(endian + 'I',
+                                                 buf, pos + 5)[0]
+            part_pos = pos + 9
+            number_of_rings = 0
+            for _ in range(number_of_parts):
+                part_endian, _, part_ndim, _ = _parse_wkb_header(buf,
+                                                                 part_pos)
+                part_pos, n = _walk_polygon(buf, part_pos + 5,
+                                            part_endian, part_ndim, blocks)
+                number_of_rings += n
+            rings_per_feature.append(number_of_rings)
+            kind = WKB_POLYGON
+            geometry_type = ogr.wkbPolygon
+        else:
+            msg = ('Only point, line and polygon geometries are '
+                   'supported. Got WKB geometry type %i' % kind)
+            raise ReadLayerError(msg)
+
+        kinds.add(kind)
+        pos = end
+
+    if len(kinds) > 1:
+        msg = ('Vector layers must hold only one kind of geometry. '
+               'Got WKB geometry types %s' % str(sorted(kinds)))
+        raise ReadLayerError(msg)
+
+    # Gather x and y of all vertices
+    offsets = numpy.array([b[0] for b in blocks], dtype=numpy.int)
+    counts = numpy.array([b[1] for b in blocks], dtype=numpy.int)
+    strides = numpy.array([b[2] * 8 for b in blocks], dtype=numpy.int)
+    vertex_offsets = (numpy.repeat(offsets, counts) +
+                      _ragged_arange(counts) * numpy.repeat(strides, counts))
+
+    raw = numpy.frombuffer(buf, dtype=numpy.uint8)
+    xy = raw[vertex_offsets[:, numpy.newaxis] + numpy.arange(16)]
+    coordinates = xy.view('<f8').reshape((-1, 2))
+
+    big_endian = numpy.array([b[3] == '>' for b in blocks], dtype=bool)
+    if numpy.any(big_endian):
+        swap = numpy.repeat(big_endian, counts)
+        coordinates[swap] = coordinates[swap].byteswap()
+
+    if kinds == set([WKB_POINT]):
+        return geometry_type, coordinates
+
+    ring_offsets = numpy.zeros(len(blocks) + 1, dtype=numpy.int)
+    numpy.cumsum(counts, out=ring_offsets[1:])
+
+    if kinds == set([WKB_LINESTRING]):
+        rings_per_feature = numpy.ones(len(wkbs), dtype=numpy.int)
+    elif min(rings_per_feature) == 0:
+        msg = 'Polygons must have at least one ring'
+        raise ReadLayerError(msg)
+
+    part_offsets = numpy.zeros(len(rings_per_feature) + 1, dtype=numpy.int)
+    numpy.cumsum(rings_per_feature, out=part_offsets[1:])
+
+    packed = PackedGeometry(coordinates, ring_offsets, part_offsets,
+                            is_polygon=(kinds == set([WKB_POLYGON])))
+    return geometry_type, packed
+
+
+def concatenate_geometry(pieces):
+    """Concatenate decoded batches of points or packed geometry
+    """
+
+    if isinstance(pieces[0], PackedGeometry):
+        coordinates = [p.coordinates for p in pieces]
+        ring_offsets = [numpy.zeros(1, dtype=numpy.int)]
+        part_offsets = [numpy.zeros(1, dtype=numpy.int)]
+        vertices = rings = 0
+        for p in pieces:
+            ring_offsets.append(p.ring_offsets[1:] + vertices)
+            part_offsets.append(p.part_offsets[1:] + rings)
+            vertices += p.coordinates.shape[0]
+            rings += p.number_of_rings()
+
+        return PackedGeometry(numpy.concatenate(coordinates),
+                              numpy.concatenate(ring_offsets),
+                              numpy.concatenate(part_offsets),
+                              is_polygon=pieces[0].is_polygon)
+    else:
+        return numpy.concatenate(pieces)
+
+
+def _geometry_kind(geometry):
+    """Kind of decoded geometry: 'point', 'line' or 'polygon'
+    """
+
+    if not isinstance(geometry, PackedGeometry):
+        return 'point'
+    elif geometry.is_polygon:
+        return 'polygon'
+    else:
+        return 'line'
+
+
+def read_geometry(layer, filename):
+    """Read geometry of all features in OGR layer
+
+    Geometries are exported as WKB and decoded in batches of
+    WKB_BATCH_SIZE features.
+
+    :param layer: OGR layer positioned at its first feature
+    :param filename: Name of file (for error messages)
+
+    :returns: Tuple (geometry_type, geometry) as returned by decode_wkb.
+        Both are None if there are no features.
+
+    :raises: ReadLayerError
+    """
+
+    batches = []
+    wkbs = []
+    for feature in layer:
+        G = feature.GetGeometryRef()
+        if G is None:
+            msg = ('Geometry was None in filename %s ' % filename)
+            raise ReadLayerError(msg)
+
+        wkbs.append(G.ExportToWkb(ogr.wkbNDR))
+        if len(wkbs) == WKB_BATCH_SIZE:
+            batches.append(decode_wkb(wkbs))
+            wkbs = []
+
+    if len(wkbs) > 0:
+        batches.append(decode_wkb(wkbs))
+
+    if len(batches) == 0:
+        return None, None
+
+    kinds = set([_geometry_kind(geometry) for _, geometry in batches])
+    if len(kinds) > 1:
+        msg = ('Vector layers must hold only one kind of geometry. '
+               'Got %s in %s' % (', '.join(sorted(kinds)), filename))
+        raise ReadLayerError(msg)
+
+    geometry_type = batches[-1][0]
+    geometry = concatenate_geometry([geometry for _, geometry in batches])
+    return geometry_type, geometry
+
+
+def _dbf_filename(filename):
+    """Name of existing dbf file associated with shapefile or None
+    """
+
+    base_name = os.path.splitext(filename)[0]
+    for extension in ['.dbf', '.DBF']:
+        if os.path.isfile(base_name + extension):
+            return base_name + extension
+    return None
+
+
+def read_dbf_columns(filename, field_types, N, pseudo_inf=None):
+    """Read attributes of shapefile into typed columns
+
+    The dbf file is read with one numpy call and each field is converted
+    to a column in bulk. Only plain ascii integer, real, string and date
+    fields are handled. Other content results in None being returned so
+    that attributes can be read through OGR instead.
+
+    :param filename: Name of shapefile
+    :type filename: str
+
+    :param field_types: OGR field types of the layer fields in order
+    :type field_types: list
+
+    :param N: Number of features read through OGR
+    :type N: int
+
+    :param pseudo_inf: Optional value to be converted to NaN in real
+        fields (see Vector.read_from_file)
+    :type pseudo_inf: float
+
+    :returns: List of columns - one per field - or None.
+    :rtype: list
+    """
+
+    dbf_filename = _dbf_filename(filename)
+    if dbf_filename is None:
+        return None
+
+    fid = open(dbf_filename, 'rb')
+    try:
+        header = fid.read(32)
+        number_of_records, header_length, record_length = \
+            struct.unpack('<IHH', header[4:12])
+        descriptors = fid.read(header_length - 32)
+        fid.seek(header_length)
+        records = fid.read(number_of_records * record_length)
+    finally:
+        fid.close()
+
+    # Field descriptors are 32 bytes each terminated by 0x0D
+    fields = []
+    offset = 1  # Deletion flag
+    for i in range(0, len(descriptors) - 31, 32):
+        if descriptors[i] == '\x0d':
+            break
+        field_type = descriptors[i + 11]
+        width = ord(descriptors[i + 16])
+        fields.append((field_type, offset, width))
+        offset += width
+
+    if (len(fields) != len(field_types) or offset > record_length or
+            len(records) != number_of_records * record_length):
+        return None
+
+    formats = ['S1'] + ['S%i' % w for _, _, w in fields]
+    dtype = numpy.dtype({'names': ['f%i' % i for i in range(len(formats))],
+                         'formats': formats,
+                         'offsets': [0] + [o for _, o, _ in fields],
+                         'itemsize': record_length})
+    table = numpy.frombuffer(records, dtype=dtype)
+
+    # Deleted records are skipped by OGR
+    table = table[table['f0'] != '*']
+    if len(table) != N:
+        return None
+
+    columns = []
+    for i, field_type in enumerate(field_types):
+        raw = numpy.ascontiguousarray(table['f%i' % (i + 1)])
+        if numpy.any(raw.view(numpy.uint8) > 127):
+            # Leave recoding of non ascii text to OGR
+            return None
+
+        try:
+            column = _convert_dbf_field(raw, field_type, pseudo_inf)
+        except ValueError:
+            return None
+
+        if column is None:
+            return None
+        columns.append(column)
+
+    return columns
+
+
+def _convert_dbf_field(raw, field_type, pseudo_inf):
+    """Convert raw dbf field values to column matching OGR GetField
+    """
+
+    N = len(raw)
+
+    # OGR strips leading and trailing blanks of all fields (shapelib is
+    # built with TRIM_DBF_WHITESPACE)
+    values = numpy.char.strip(raw)
+
+    # Empty values and numbers overflowing the field are null in OGR as
+    # are dates of all zeros
+    null = (numpy.char.str_len(values) == 0)
+    if field_type in [ogr.OFTInteger, ogr.OFTReal]:
+        null += (numpy.char.strip(values, '*') == '')
+    elif field_type == ogr.OFTDate:
+        null += (values == '00000000')
+
+    if numpy.all(null):
+        column = numpy.empty(N, dtype=object)
+        column[:] = None
+        return column
+
+    if field_type == ogr.OFTString:
+        column = values.astype(object)
+        column[null] = None
+        return column
+    elif field_type == ogr.OFTDate:
+        # OGR formats dates as YYYY/MM/DD
+        values = values[~null]
+        if numpy.any(numpy.char.str_len(values) != 8):
+            return None
+        column = numpy.empty(N, dtype=object)
+        column[~null] = [v[:4] + '/' + v[4:6] + '/' + v[6:]
+                         for v in values]
+        column[null] = None
+        return column
+    elif field_type == ogr.OFTInteger:
+        dtype = numpy.int
+    elif field_type == ogr.OFTReal:
+        dtype = numpy.float
+    else:
+        return None
+
+    values = values.copy()
+    values[null] = '0'
+    column = values.astype(dtype)
+
+    if pseudo_inf is not None and numpy.any(column == pseudo_inf):
+        if dtype is not numpy.float:
+            # OGR reader turns these into float NaN in integer fields
+            return None
+
+        # See issue #269 and Vector.read_from_file
+        column[column == pseudo_inf] = numpy.nan
+
+    if numpy.any(null):
+        column = numpy.ma.array(column, mask=null)
+    return column
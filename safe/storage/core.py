@@ -8,6 +8,8 @@ import os
 
 from vector import Vector
 from raster import Raster
+from layer_cache import get_layer_cache
+from sidecar import read_sidecar
 from safe.common.utilities import verify, VerificationError
 from safe.common.exceptions import BoundingBoxError, ReadLayerError
 
@@ -16,21 +18,49 @@ import logging
 logger = logging.getLogger('inasafe')
 
 
-def read_layer(filename):
+def read_layer(filename, sublayer=None):
     """Read spatial layer from file.
     This can be either raster or vector data.
+
+    Args:
+        * filename: Name of raster or vector file
+        * sublayer: Optional name of layer within a vector file
+
+    Note:
+        If a layer cache is enabled (see module layer_cache), layers
+        that have been read before and whose files are unchanged are
+        served from the cache.
+
+        If the file has an up to date sidecar (see module sidecar), the
+        layer is read from that rather than through OGR or GDAL.
     """
 
+    cache = get_layer_cache()
+    if cache is not None:
+        layer = cache.get(filename, sublayer)
+        if layer is not None:
+            return layer
+
     _, ext = os.path.splitext(filename)
     if ext in ['.asc', '.tif', '.nc']:
-        return Raster(filename)
-    elif ext in ['.shp', '.sqlite']:
-        return Vector(filename)
-    else:
+        msg = 'Sublayers are only supported for vector layers'
+        verify(sublayer is None, msg)
+    elif ext not in ['.shp', '.sqlite']:
         msg = ('Could not read %s. '
                'Extension "%s" has not been implemented' % (filename, ext))
         raise ReadLayerError(msg)
 
+    layer = read_sidecar(filename, sublayer)
+    if layer is None:
+        if ext in ['.shp', '.sqlite']:
+            layer = Vector(filename, sublayer=sublayer)
+        else:
+            layer = Raster(filename)
+
+    if cache is not None:
+        cache.put(filename, layer, sublayer)
+    return layer
+
 
 def write_raster_data(data, projection, geotransform, filename, keywords=None):
     """Write array to raster file with specified metadata and one data layer
@@ -1,5 +1,7 @@
 # Geometry types
 
+import numpy
+
 
 class Geometry:
     """Common class for geometries
@@ -28,3 +30,321 @@ class Polygon(Geometry):
         s = 'Polygon(%s, inner_rings=%s' % (self.outer_ring,
                                             self.inner_rings)
         return s
+
+
+class PackedGeometry:
+    """Polygon or line geometry packed into flat numpy arrays
+
+    All vertices are stored in one Mx2 array of coordinates. Rings (or
+    lines) are contiguous slices of this array delimited by ring_offsets
+    and features are contiguous ranges of rings delimited by part_offsets.
+    For polygons the first ring of each feature is the outer ring and
+    the remaining ones are inner rings (holes). Line features have exactly
+    one ring each.
+
+    Coordinates of ring i are
+        coordinates[ring_offsets[i]:ring_offsets[i + 1]]
+    and the rings of feature j are
+        ring_offsets[part_offsets[j]:part_offsets[j + 1]]
+
+    This layout allows bulk operations such as bounding boxes, areas and
+    centroids to be computed for all features at once and it is cheap to
+    pickle or share between processes.
+
+    Use pack_polygons or pack_lines to create instances from lists.
+    """
+
+    def __init__(self, coordinates, ring_offsets, part_offsets,
+                 is_polygon=True):
+        self.coordinates = numpy.asarray(coordinates,
+                                         dtype=numpy.float).reshape((-1, 2))
+        self.ring_offsets = numpy.asarray(ring_offsets, dtype=numpy.int)
+        self.part_offsets = numpy.asarray(part_offsets, dtype=numpy.int)
+        self.is_polygon = is_polygon
+
+        msg = ('Offsets must start at zero and end at the number of '
+               'coordinates (%i) and rings (%i) respectively'
+               % (self.coordinates.shape[0], len(self.ring_offsets) - 1))
+        if (self.ring_offsets[0] != 0 or self.part_offsets[0] != 0 or
+                self.ring_offsets[-1] != self.coordinates.shape[0] or
+                self.part_offsets[-1] != len(self.ring_offsets) - 1):
+            raise ValueError(msg)
+
+    def __len__(self):
+        """Number of features
+        """
+        return len(self.part_offsets) - 1
+
+    def __repr__(self):
+        s = ('PackedGeometry(%i features, %i rings, %i vertices)'
+             % (len(self), self.number_of_rings(),
+                self.coordinates.shape[0]))
+        return s
+
+    def number_of_rings(self):
+        """Total number of rings (or lines)
+        """
+        return len(self.ring_offsets) - 1
+
+    def get_ring(self, i):
+        """Coordinates of ring i as a view into the coordinate buffer
+        """
+        return self.coordinates[self.ring_offsets[i]:
+                                self.ring_offsets[i + 1]]
+
+    def get_feature(self, i):
+        """Feature i as a Polygon object or a line array
+
+        Rings are views into the coordinate buffer.
+        """
+
+        first = self.part_offsets[i]
+        if not self.is_polygon:
+            return self.get_ring(first)
+
+        inner_rings = [self.get_ring(j)
+                       for j in range(first + 1, self.part_offsets[i + 1])]
+        return Polygon(self.get_ring(first), inner_rings=inner_rings)
+
+    def outer_rings(self):
+        """List of outer rings (or lines) - one per feature
+        """
+        return [self.get_ring(j) for j in self.part_offsets[:-1]]
+
+    def unpack(self, copy=False):
+        """Convert to list of Polygon objects or line arrays
+
+        :param copy: Set to copy the coordinates. Otherwise rings are views
+            into the coordinate buffer.
+        :type copy: bool
+
+        :returns: List with one entry per feature
+        :rtype: list
+        """
+
+        if copy:
+            packed = self.copy()
+        else:
+            packed = self
+        return [packed.get_feature(i) for i in range(len(packed))]
+
+    def copy(self):
+        """Return copy with its own coordinate buffer
+        """
+        return PackedGeometry(self.coordinates.copy(),
+                              self.ring_offsets.copy(),
+                              self.part_offsets.copy(),
+                              is_polygon=self.is_polygon)
+
+    def _ring_ids(self):
+        """Ring index for each vertex
+        """
+        lengths = numpy.diff(self.ring_offsets)
+        return numpy.repeat(numpy.arange(len(lengths)), lengths)
+
+    def ring_bounding_boxes(self):
+        """Bounding boxes of all rings
+
+        :returns: Rx4 array with rows [minx, maxx, miny, maxy] following
+            the convention for polygon_bbox in module polygon.py. Rows for
+            empty rings are nan.
+        :rtype: numpy.ndarray
+        """
+
+        R = self.number_of_rings()
+        bboxes = numpy.empty((R, 4), dtype=numpy.float)
+        bboxes[:] = numpy.nan
+
+        starts = self.ring_offsets[:-1]
+        nonempty = numpy.where(self.ring_offsets[1:] > starts)[0]
+        if len(nonempty) == 0:
+            return bboxes
+
+        x = self.coordinates[:, 0]
+        y = self.coordinates[:, 1]
+        starts = starts[nonempty]
+        bboxes[nonempty, 0] = numpy.minimum.reduceat(x, starts)
+        bboxes[nonempty, 1] = numpy.maximum.reduceat(x, starts)
+        bboxes[nonempty, 2] = numpy.minimum.reduceat(y, starts)
+        bboxes[nonempty, 3] = numpy.maximum.reduceat(y, starts)
+        return bboxes
+
+    def bounding_boxes(self):
+        """Bounding boxes of all features
+
+        Holes lie within their outer ring so the bounding box of a feature
+        is that of its first ring.
+
+        :returns: Nx4 array with rows [minx, maxx, miny, maxy]
+        :rtype: numpy.ndarray
+        """
+        return self.ring_bounding_boxes()[self.part_offsets[:-1]]
+
+    def get_extent(self):
+        """Bounding box [minx, maxx, miny, maxy] of all features
+        """
+
+        bboxes = self.bounding_boxes()
+        if len(bboxes) == 0:
+            return [0, 0, 0, 0]
+
+        return [numpy.nanmin(bboxes[:, 0]), numpy.nanmax(bboxes[:, 1]),
+                numpy.nanmin(bboxes[:, 2]), numpy.nanmax(bboxes[:, 3])]
+
+    def _ring_sums(self):
+        """Per ring shoelace sums used for areas and centroids
+
+        Coordinates are normalised by the lower left corner of each ring
+        to retain numerical accuracy (see calculate_polygon_centroid).
+
+        :returns: Tuple of arrays (A, Sx, Sy, origin) where A is the
+            signed area of each ring, Sx and Sy are the sums
+            sum (x_i + x_{i+1})(x_i y_{i+1} - x_{i+1} y_i) and similarly
+            for y, and origin is the Rx2 array of normalisation offsets.
+        """
+
+        R = self.number_of_rings()
+        if R == 0:
+            empty = numpy.zeros(0)
+            return empty, empty, empty, numpy.zeros((0, 2))
+
+        bboxes = self.ring_bounding_boxes()
+        origin = numpy.nan_to_num(bboxes[:, [0, 2]])
+
+        ring_ids = self._ring_ids()
+        P = self.coordinates - origin[ring_ids]
+        x = P[:, 0]
+        y = P[:, 1]
+
+        # Segments from vertex i to i + 1 within the same ring
+        cross = x[:-1] * y[1:] - y[:-1] * x[1:]
+        valid = ring_ids[:-1] == ring_ids[1:]
+        cross = cross * valid
+        ids = ring_ids[:-1]
+
+        A = numpy.bincount(ids, weights=cross, minlength=R) / 2.
+        Sx = numpy.bincount(ids, weights=(x[:-1] + x[1:]) * cross,
+                            minlength=R)
+        Sy = numpy.bincount(ids, weights=(y[:-1] + y[1:]) * cross,
+                            minlength=R)
+        return A, Sx, Sy, origin
+
+    def ring_areas(self, signed=False):
+        """Areas of all rings as computed by calculate_polygon_area
+
+        Rings are assumed to be closed.
+        """
+
+        A = self._ring_sums()[0]
+        if signed:
+            return A
+        else:
+            return numpy.abs(A)
+
+    def areas(self):
+        """Areas of all polygon features
+
+        The area of a feature is that of its outer ring less the areas of
+        its inner rings.
+
+        :returns: Array of areas - one per feature
+        :rtype: numpy.ndarray
+        """
+
+        msg = 'Areas are only defined for polygon geometry'
+        if not self.is_polygon:
+            raise ValueError(msg)
+
+        ring_areas = self.ring_areas()
+        if len(self) == 0:
+            return ring_areas
+
+        # Outer rings count positive and holes negative
+        sign = -numpy.ones(len(ring_areas))
+        sign[self.part_offsets[:-1]] = 1
+        part_ids = numpy.repeat(numpy.arange(len(self)),
+                                numpy.diff(self.part_offsets))
+        return numpy.bincount(part_ids, weights=sign * ring_areas,
+                              minlength=len(self))
+
+    def centroids(self):
+        """Centroids of all polygon features
+
+        Centroids are computed from the outer rings only, as done by
+        calculate_polygon_centroid for each polygon.
+
+        :returns: Nx2 array of centroids - one per feature
+        :rtype: numpy.ndarray
+        """
+
+        msg = 'Centroids are only defined for polygon geometry'
+        if not self.is_polygon:
+            raise ValueError(msg)
+
+        A, Sx, Sy, origin = self._ring_sums()
+        outer = self.part_offsets[:-1]
+
+        C = numpy.empty((len(outer), 2), dtype=numpy.float)
+        C[:, 0] = Sx[outer] / (6. * A[outer])
+        C[:, 1] = Sy[outer] / (6. * A[outer])
+        return C + origin[outer]
+
+
+def pack_polygons(polygons):
+    """Pack polygons into a PackedGeometry
+
+    :param polygons: List of Polygon objects or arrays of outer ring
+        coordinates
+    :type polygons: list
+
+    :returns: Packed polygon geometry
+    :rtype: PackedGeometry
+    """
+
+    rings = []
+    part_lengths = []
+    for polygon in polygons:
+        if isinstance(polygon, Polygon):
+            rings.append(polygon.outer_ring)
+            rings.extend(polygon.inner_rings)
+            part_lengths.append(1 + len(polygon.inner_rings))
+        else:
+            rings.append(polygon)
+            part_lengths.append(1)
+
+    return _pack_rings(rings, part_lengths, is_polygon=True)
+
+
+def pack_lines(lines):
+    """Pack lines into a PackedGeometry
+
+    :param lines: List of arrays of line coordinates
+    :type lines: list
+
+    :returns: Packed line geometry
+    :rtype: PackedGeometry
+    """
+
+    return _pack_rings(lines, [1] * len(lines), is_polygon=False)
+
+
+def _pack_rings(rings, part_lengths, is_polygon):
+    """Concatenate rings into one coordinate buffer with offsets
+    """
+
+    arrays = [numpy.asarray(ring, dtype=numpy.float).reshape((-1, 2))
+              for ring in rings]
+
+    ring_offsets = numpy.zeros(len(arrays) + 1, dtype=numpy.int)
+    numpy.cumsum([len(A) for A in arrays], out=ring_offsets[1:])
+
+    part_offsets = numpy.zeros(len(part_lengths) + 1, dtype=numpy.int)
+    numpy.cumsum(part_lengths, out=part_offsets[1:])
+
+    if len(arrays) > 0:
+        coordinates = numpy.concatenate(arrays)
+    else:
+        coordinates = numpy.zeros((0, 2), dtype=numpy.float)
+
+    return PackedGeometry(coordinates, ring_offsets, part_offsets,
+                          is_polygon=is_polygon)
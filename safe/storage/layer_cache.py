@@ -0,0 +1,690 @@
+# coding=utf-8
+"""**Cache of layers read from file**
+
+.. tip:: Layers read with read_layer are kept as numpy arrays (packed
+   geometry, attribute columns or raster grids) together with their
+   metadata so that reading the same unchanged file again does not
+   involve OGR or GDAL. Entries are keyed by the absolute path, the
+   sublayer and the modification time and size of the file and its
+   companion files (keywords, projection, dbf, ...).
+
+   The cache is opt-in. Enable it with::
+
+       from safe.storage.layer_cache import enable_layer_cache
+       enable_layer_cache(max_bytes=512 * 1024 * 1024, spill_dir='layers')
+
+   Entries are evicted least recently used first when the arrays held
+   exceed max_bytes. If spill_dir is given, every entry is also written
+   there as a directory of .npy files which are memory mapped when read
+   again, e.g. by later runs. Relative spill directories are placed in
+   the InaSAFE temporary directory (see temp_dir) and the spill
+   directory is only accessible to the current user. Metadata of entries
+   is stored as JSON and object arrays as byte buffers so nothing is
+   unpickled when entries are read.
+"""
+
+import os
+import sys
+import copy
+import glob
+import json
+import stat
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy
+
+from safe.common.utilities import ugettext as safe_tr
+from safe.common.utilities import OrderedDict, temp_dir
+
+from vector import Vector
+from raster import Raster
+from projection import Projection
+from geometry import PackedGeometry
+
+LOGGER = logging.getLogger('InaSAFE')
+
+# Default budget for arrays held in memory
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Files whose changes invalidate cached layers (in addition to the file)
+COMPANION_EXTENSIONS = ['.keywords', '.prj', '.dbf', '.shx', '.cpg']
+
+# Version of the layout of entries spilled to disk
+SPILL_VERSION = 2
+
+# The active cache used by read_layer (None if disabled)
+_layer_cache = None
+
+
+def encode_value(value):
+    """Convert python value to one that can be written as JSON
+
+    Strings, tuples and dictionaries with keys other than strings do not
+    survive a JSON round trip as they are. They are tagged so that
+    decode_value restores the original types.
+
+    :param value: None, bool, number, str, unicode, numpy scalar or
+        dtype or a list, tuple or dictionary of these.
+
+    :returns: Value made of None, bools, numbers, unicode strings, lists
+        and dictionaries with unicode keys.
+
+    :raises: TypeError for values of other types
+    """
+
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    if isinstance(value, numpy.generic):
+        return encode_value(value.item())
+    if isinstance(value, str):
+        # Latin-1 maps every byte to one character so any str survives
+        return {'str': value.decode('latin-1')}
+    if isinstance(value, unicode):
+        return {'unicode': value}
+    if isinstance(value, list):
+        return [encode_value(x) for x in value]
+    if isinstance(value, tuple):
+        return {'tuple': [encode_value(x) for x in value]}
+    if isinstance(value, dict):
+        return {'dict': [[encode_value(k), encode_value(v)]
+                         for k, v in value.items()]}
+    if isinstance(value, numpy.dtype) or (isinstance(value, type) and
+                                          issubclass(value, numpy.generic)):
+        return {'dtype': numpy.dtype(value).str}
+
+    msg = 'Can not encode value %s of type %s' % (value, type(value))
+    raise TypeError(msg)
+
+
+def decode_value(value):
+    """Restore value encoded by encode_value
+
+    :raises: ValueError if value was not made by encode_value
+    """
+
+    if isinstance(value, list):
+        return [decode_value(x) for x in value]
+    if not isinstance(value, dict):
+        return value
+
+    if len(value) != 1:
+        msg = 'Invalid encoded value %s' % value
+        raise ValueError(msg)
+    tag, content = value.items()[0]
+    if tag == 'str':
+        return content.encode('latin-1')
+    elif tag == 'unicode':
+        return content
+    elif tag == 'tuple':
+        return tuple([decode_value(x) for x in content])
+    elif tag == 'dict':
+        return dict([(decode_value(k), decode_value(v))
+                     for k, v in content])
+    elif tag == 'dtype':
+        return numpy.dtype(str(content))
+    else:
+        msg = 'Invalid encoded value %s' % value
+        raise ValueError(msg)
+
+
+def _join_strings(strings):
+    """Concatenate strings to bytes and offsets of each into them
+    """
+
+    offsets = numpy.zeros(len(strings) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(x) for x in strings], out=offsets[1:])
+    data = numpy.fromstring(''.join(strings), dtype=numpy.uint8)
+    return data, offsets
+
+
+def _split_strings(data, offsets):
+    """Split bytes joined by _join_strings
+    """
+
+    buf = data.tostring()
+    return [buf[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def encode_column(array):
+    """Encode array as one or more arrays of numeric types
+
+    :param array: Array of numeric or object type
+    :type array: numpy.ndarray
+
+    :returns: Tuple (encoding, parts) where encoding is
+
+        * 'array': parts is [array]
+        * 'strings': Values are str or None. parts are the concatenated
+          bytes, offsets of values into them and a mask of the Nones.
+        * 'unicode': As 'strings' for unicode values encoded as UTF-8.
+        * 'values': parts is the list of values as JSON (see
+          encode_value) in bytes.
+    :rtype: tuple
+
+    :raises: TypeError if values of object arrays can not be encoded
+    """
+
+    if array.dtype != object:
+        return 'array', [array]
+
+    values = array.tolist()
+    for encoding, kind in [('strings', str), ('unicode', unicode)]:
+        if all([value is None or type(value) is kind for value in values]):
+            mask = numpy.array([value is None for value in values],
+                               dtype=numpy.bool)
+            strings = ['' if value is None else value for value in values]
+            if kind is unicode:
+                strings = [x.encode('utf-8') for x in strings]
+            data, offsets = _join_strings(strings)
+            return encoding, [data, offsets, mask]
+
+    data = numpy.fromstring(json.dumps(encode_value(values)),
+                            dtype=numpy.uint8)
+    return 'values', [data]
+
+
+def decode_column(encoding, parts):
+    """Decode array encoded by encode_column
+
+    :raises: ValueError if encoding is unknown or parts are invalid
+    """
+
+    if encoding == 'array':
+        return parts[0]
+
+    if encoding in ['strings', 'unicode']:
+        data, offsets, mask = parts
+        values = _split_strings(data, offsets)
+        if encoding == 'unicode':
+            values = [x.decode('utf-8') for x in values]
+    elif encoding == 'values':
+        values = decode_value(json.loads(parts[0].tostring()))
+    else:
+        msg = 'Unknown column encoding %s' % encoding
+        raise ValueError(msg)
+
+    column = numpy.empty(len(values), dtype=object)
+    column[:] = values
+    if encoding in ['strings', 'unicode']:
+        column[mask] = None
+    return column
+
+
+def layer_signature(filename, sublayer=None):
+    """Identify the state of a layer file
+
+    :param filename: Name of layer file
+    :type filename: str
+
+    :param sublayer: Optional name of sublayer
+    :type sublayer: str
+
+    :returns: Tuple of absolute path, sublayer and the modification time
+        and size of the file and each existing companion file.
+    :rtype: tuple
+
+    :raises: OSError if filename does not exist
+    """
+
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    files = [('', st.st_mtime, st.st_size)]
+
+    basename = os.path.splitext(path)[0]
+    for ext in COMPANION_EXTENSIONS:
+        try:
+            st = os.stat(basename + ext)
+        except OSError:
+            continue
+        files.append((ext, st.st_mtime, st.st_size))
+
+    return path, sublayer, tuple(files)
+
+
+def layer_name(keywords, filename):
+    """Name given to layers read from file
+
+    :returns: Translated title from keywords if present, otherwise the
+        base name of the file as in read_from_file of Vector and Raster.
+    :rtype: str
+    """
+
+    if 'title' in keywords:
+        return safe_tr(keywords['title'])
+    else:
+        return os.path.split(os.path.splitext(filename)[0])[-1]
+
+
+def layer_to_record(layer):
+    """Convert layer to arrays and metadata
+
+    :param layer: Vector or raster layer
+    :type layer: Vector, Raster
+
+    :returns: Tuple (meta, arrays) where meta is a dictionary of python
+        values and arrays a dictionary of numpy arrays. None if layer is
+        empty.
+    :rtype: tuple, None
+    """
+
+    meta = {'projection': layer.get_projection(),
+            'keywords': layer.get_keywords(),
+            'style_info': layer.get_style_info()}
+    arrays = OrderedDict()
+
+    if layer.is_raster:
+        if len(layer) == 0:
+            return None
+
+        meta['kind'] = 'raster'
+        meta['geotransform'] = tuple(layer.get_geotransform())
+        meta['dtype'] = layer.dtype
+        meta['nodata_value'] = layer.get_nodata_value()
+        arrays['data'] = layer.get_data(nan=False, scaling=False,
+                                        dtype=layer.get_native_dtype())
+        return meta, arrays
+
+    if len(layer) == 0:
+        return None
+
+    meta['kind'] = 'vector'
+    meta['sublayer'] = layer.sublayer
+    meta['geometry_type'] = layer.geometry_type
+    meta['extent'] = list(layer.extent)
+    if layer.is_point_data:
+        arrays['points'] = numpy.array(layer.get_geometry(),
+                                       dtype=numpy.float)
+    else:
+        packed = layer.get_packed_geometry()
+        meta['is_polygon'] = packed.is_polygon
+        arrays['coordinates'] = packed.coordinates
+        arrays['ring_offsets'] = packed.ring_offsets
+        arrays['part_offsets'] = packed.part_offsets
+
+    columns = layer.get_columns()
+    meta['attribute_names'] = columns.keys()
+    for i, column in enumerate(columns.values()):
+        arrays['column_%i' % i] = numpy.ma.getdata(column)
+        if numpy.ma.isMaskedArray(column):
+            arrays['mask_%i' % i] = numpy.ma.getmaskarray(column)
+
+    return meta, arrays
+
+
+def record_to_layer(meta, arrays, filename, copy_arrays=True):
+    """Create layer from arrays and metadata made by layer_to_record
+
+    :param meta: Metadata of layer
+    :type meta: dict
+
+    :param arrays: Arrays of layer
+    :type arrays: dict
+
+    :param filename: Name of the file the layer was read from
+    :type filename: str
+
+    :param copy_arrays: Set to False to give the layer the arrays
+        without copying them (raster grids are never copied).
+    :type copy_arrays: bool
+
+    :returns: New layer equal to the one given to layer_to_record
+    :rtype: Vector, Raster
+    """
+
+    def get_array(name):
+        if copy_arrays:
+            return numpy.array(arrays[name])
+        return arrays[name]
+
+    keywords = copy.deepcopy(meta['keywords'])
+    style_info = copy.deepcopy(meta['style_info'])
+
+    if raster_record(meta):
+        layer = Raster(name=layer_name(keywords, filename),
+                       keywords=keywords, style_info=style_info,
+                       dtype=meta['dtype'])
+        layer.projection = Projection(meta['projection'])
+        layer.geotransform = meta['geotransform']
+        layer.data = arrays['data']
+        layer.rows, layer.columns = layer.data.shape
+        layer.number_of_bands = 1
+        layer.nodata_value = meta['nodata_value']
+        layer.filename = filename
+        return layer
+
+    columns = OrderedDict()
+    for i, name in enumerate(meta['attribute_names']):
+        column = get_array('column_%i' % i)
+        if 'mask_%i' % i in arrays:
+            column = numpy.ma.array(column, mask=get_array('mask_%i' % i))
+        columns[name] = column
+
+    if 'points' in arrays:
+        geometry = get_array('points')
+        geometry_type = 'point'
+    else:
+        geometry = PackedGeometry(get_array('coordinates'),
+                                  get_array('ring_offsets'),
+                                  get_array('part_offsets'),
+                                  is_polygon=meta['is_polygon'])
+        geometry_type = None
+
+    layer = Vector(data=columns, geometry=geometry,
+                   geometry_type=geometry_type,
+                   projection=meta['projection'],
+                   name=layer_name(keywords, filename),
+                   keywords=keywords, style_info=style_info,
+                   sublayer=meta['sublayer'])
+    layer.geometry_type = meta['geometry_type']
+    layer.extent = copy.copy(meta['extent'])
+    layer.filename = filename
+    return layer
+
+
+def raster_record(meta):
+    """True if record made by layer_to_record is of a raster layer
+    """
+
+    return meta['kind'] == 'raster'
+
+
+def record_nbytes(arrays):
+    """Estimate memory held by arrays of a record
+
+    Memory mapped arrays are not counted. Objects referenced by object
+    arrays (e.g. strings) are included.
+    """
+
+    nbytes = 0
+    for array in arrays.values():
+        if isinstance(array, numpy.memmap):
+            continue
+        nbytes += array.nbytes
+        if array.dtype == object:
+            nbytes += sum([sys.getsizeof(x) for x in array])
+    return nbytes
+
+
+def make_private_dir(dirname):
+    """Create directory only the current user can access
+
+    :param dirname: Name of directory. Relative names are taken to be in
+        the InaSAFE temporary directory (see temp_dir).
+    :type dirname: str
+
+    :returns: Absolute name of directory
+    :rtype: str
+
+    :raises: OSError if the directory exists but is not a directory
+        owned by the current user.
+    """
+
+    dirname = os.path.join(os.path.normpath(temp_dir(sub_dir='')), dirname)
+    try:
+        os.makedirs(dirname, 0700)
+    except OSError:
+        if not os.path.isdir(dirname):
+            raise
+
+    st = os.lstat(dirname)
+    if not stat.S_ISDIR(st.st_mode) or (hasattr(os, 'getuid') and
+                                        st.st_uid != os.getuid()):
+        msg = ('Directory %s is not a directory owned by the current user'
+               % dirname)
+        raise OSError(msg)
+    if st.st_mode & 0077:
+        os.chmod(dirname, 0700)
+    return dirname
+
+
+def write_spill(dirname, signature, meta, arrays):
+    """Write record to directory of .npy files
+
+    The directory is written under a temporary name and renamed when
+    complete so readers never see partial entries. Object arrays are
+    encoded as numeric arrays (see encode_column) and the metadata is
+    written as JSON.
+    """
+
+    parent = os.path.dirname(dirname)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+    try:
+        directory = []
+        for i, (name, array) in enumerate(arrays.items()):
+            encoding, parts = encode_column(array)
+            for j, part in enumerate(parts):
+                numpy.save(os.path.join(tmp_dir, '%i_%i.npy' % (i, j)),
+                           numpy.ascontiguousarray(part))
+            directory.append([name, encoding, len(parts)])
+
+        content = encode_value({'version': SPILL_VERSION,
+                                'signature': signature,
+                                'meta': meta,
+                                'arrays': directory})
+        fid = open(os.path.join(tmp_dir, 'meta.json'), 'wb')
+        try:
+            json.dump(content, fid)
+        finally:
+            fid.close()
+
+        os.rename(tmp_dir, dirname)
+    except (OSError, IOError, TypeError), e:
+        # E.g. another process wrote the same entry first
+        LOGGER.debug('Could not write cached layer %s: %s' % (dirname, e))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_spill(dirname, signature):
+    """Read record written by write_spill
+
+    :returns: Tuple (meta, arrays) with numeric arrays memory mapped
+        read only or None if the entry is missing or does not match
+        signature.
+    """
+
+    try:
+        fid = open(os.path.join(dirname, 'meta.json'), 'rb')
+    except IOError:
+        return None
+
+    try:
+        try:
+            content = decode_value(json.load(fid))
+        finally:
+            fid.close()
+        if (content.get('version') != SPILL_VERSION or
+                content.get('signature') != signature):
+            return None
+
+        arrays = OrderedDict()
+        for i, (name, encoding, count) in enumerate(content['arrays']):
+            parts = [numpy.load(os.path.join(dirname, '%i_%i.npy' % (i, j)),
+                                mmap_mode='r', allow_pickle=False)
+                     for j in range(count)]
+            arrays[name] = decode_column(encoding, parts)
+    except Exception, e:
+        LOGGER.debug('Could not read cached layer %s: %s' % (dirname, e))
+        return None
+
+    return content['meta'], arrays
+
+
+class LayerCache(object):
+    """Least recently used cache of layers read from file
+
+    Layers are held as records made by layer_to_record. Each call to get
+    returns a new layer. Vector arrays are copied as callers may modify
+    them whereas raster grids are shared read only (get_data always
+    returns a new array).
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, spill_dir=None):
+        """Create empty cache
+
+        :param max_bytes: Budget for arrays held in memory
+        :type max_bytes: int
+
+        :param spill_dir: Optional directory to also store entries in,
+            e.g. 'layers'. Relative names are taken to be in the InaSAFE
+            temporary directory. It is created accessible to the current
+            user only if it does not exist (see make_private_dir).
+        :type spill_dir: str
+        """
+
+        self.max_bytes = max_bytes
+        self.spill_dir = None
+        if spill_dir is not None:
+            self.spill_dir = make_private_dir(spill_dir)
+
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """Drop all entries held in memory
+        """
+
+        self.entries.clear()
+        self.nbytes = 0
+
+    def _spill_dirname(self, signature):
+        path_key = hashlib.sha1(repr(signature[:2])).hexdigest()
+        state_key = hashlib.sha1(repr(signature)).hexdigest()
+        return os.path.join(self.spill_dir,
+                            '%s_%s' % (path_key[:16], state_key[:16]))
+
+    def _insert(self, signature, meta, arrays):
+        nbytes = record_nbytes(arrays)
+        if nbytes > self.max_bytes:
+            return
+
+        if raster_record(meta):
+            # Grids are shared between layers
+            for array in arrays.values():
+                array.flags.writeable = False
+
+        self.entries[signature] = (meta, arrays, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.nbytes -= evicted
+
+    def get(self, filename, sublayer=None):
+        """Get layer from cache
+
+        :param filename: Name of layer file
+        :type filename: str
+
+        :param sublayer: Optional name of sublayer
+        :type sublayer: str
+
+        :returns: New layer if filename is cached and unchanged since,
+            otherwise None.
+        :rtype: Vector, Raster, None
+        """
+
+        try:
+            signature = layer_signature(filename, sublayer)
+        except OSError:
+            return None
+
+        if signature in self.entries:
+            entry = self.entries.pop(signature)
+            self.entries[signature] = entry
+            meta, arrays, _ = entry
+        else:
+            record = None
+            if self.spill_dir is not None:
+                record = read_spill(self._spill_dirname(signature),
+                                    signature)
+            if record is None:
+                self.misses += 1
+                return None
+            meta, arrays = record
+            self._insert(signature, meta, arrays)
+
+        self.hits += 1
+        return record_to_layer(meta, arrays, filename,
+                               copy_arrays=not raster_record(meta))
+
+    def put(self, filename, layer, sublayer=None):
+        """Store layer read from file
+
+        :param filename: Name of layer file
+        :type filename: str
+
+        :param layer: Layer as read from filename
+        :type layer: Vector, Raster
+
+        :param sublayer: Optional name of sublayer
+        :type sublayer: str
+
+        Note:
+            Raster grids larger than max_bytes are neither held nor
+            spilled. Their size is estimated from the dimensions so the
+            grid is not read.
+        """
+
+        if layer.is_raster:
+            itemsize = numpy.dtype(layer.get_native_dtype()).itemsize
+            if len(layer) * itemsize > self.max_bytes:
+                return
+
+        signature = layer_signature(filename, sublayer)
+        record = layer_to_record(layer)
+        if record is None:
+            return
+        meta, arrays = record
+
+        if raster_record(meta):
+            # The grid read from file is not held by layer
+            self._insert(signature, meta, arrays)
+        else:
+            self._insert(signature, meta, OrderedDict(
+                [(name, numpy.array(array))
+                 for name, array in arrays.items()]))
+
+        if self.spill_dir is not None:
+            dirname = self._spill_dirname(signature)
+            prefix = os.path.basename(dirname).split('_')[0]
+            for stale in glob.glob(os.path.join(self.spill_dir,
+                                                prefix + '_*')):
+                if stale != dirname:
+                    shutil.rmtree(stale, ignore_errors=True)
+            if not os.path.isdir(dirname):
+                write_spill(dirname, signature, meta, arrays)
+
+
+def enable_layer_cache(max_bytes=DEFAULT_CACHE_BYTES, spill_dir=None):
+    """Cache layers read with read_layer
+
+    See LayerCache for the arguments. An existing cache is replaced.
+
+    :returns: The new cache
+    :rtype: LayerCache
+    """
+
+    global _layer_cache
+    _layer_cache = LayerCache(max_bytes=max_bytes, spill_dir=spill_dir)
+    return _layer_cache
+
+
+def disable_layer_cache():
+    """Stop caching layers read with read_layer
+    """
+
+    global _layer_cache
+    _layer_cache = None
+
+
+def get_layer_cache():
+    """Get the cache used by read_layer or None if caching is disabled
+    """
+
+    return _layer_cache
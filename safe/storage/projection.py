@@ -99,6 +99,16 @@ class Projection:
     def __repr__(self):
         return self.wkt
 
+    def __getstate__(self):
+        """Pickle as WKT as the OSR spatial reference can not be pickled
+        """
+        return {'wkt': self.wkt}
+
+    def __setstate__(self, state):
+        """Recreate spatial reference from pickled WKT
+        """
+        self.__init__(state['wkt'])
+
     def get_projection(self, proj4=False):
         """Return projection
 
@@ -120,6 +130,12 @@ class Projection:
 
         return p.strip()
 
+    def is_geographic(self):
+        """Return True if coordinates are geographic (longitude, latitude)
+        """
+
+        return bool(self.spatial_reference.IsGeographic())
+
     def __eq__(self, other):
         """Override '==' to allow comparison with other projection objecs
         """
@@ -7,19 +7,10 @@ import numpy
 import copy as copy_module
 from osgeo import gdal
 
-qgis_imported = True
-try:
-    from qgis.core import (
-        QgsRasterLayer,
-        QgsRasterFileWriter,
-        QgsRasterPipe
-    )
-except ImportError:
-    qgis_imported = False
-
 from safe.common.utilities import (verify,
                                    ugettext as safe_tr,
-                                   unique_filename)
+                                   unique_filename,
+                                   create_memmap)
 from safe.common.numerics import (nan_allclose,
                                   geotransform_to_axes,
                                   grid_to_points)
@@ -34,8 +25,49 @@ from utilities import DRIVER_MAP
 from utilities import read_keywords
 from utilities import write_keywords
 from utilities import (geotransform_to_bbox, geotransform_to_resolution,
-                       check_geotransform)
+                       check_geotransform, bbox_to_window,
+                       window_to_geotransform, get_working_dtype)
 from utilities import safe_to_qgis_layer
+from utilities import qgis_core_available, get_qgis_core, is_qgis_layer
+
+# qgis.core is only imported when QGIS layers are used or this is tested
+qgis_imported = qgis_core_available
+
+# Numeric types of values stored in GDAL raster bands
+GDAL_TO_NUMPY_TYPE = {gdal.GDT_Byte: numpy.uint8,
+                      gdal.GDT_UInt16: numpy.uint16,
+                      gdal.GDT_Int16: numpy.int16,
+                      gdal.GDT_UInt32: numpy.uint32,
+                      gdal.GDT_Int32: numpy.int32,
+                      gdal.GDT_Float32: numpy.float32,
+                      gdal.GDT_Float64: numpy.float64}
+NUMPY_TO_GDAL_TYPE = {numpy.dtype(numpy.float32): gdal.GDT_Float32,
+                      numpy.dtype(numpy.float64): gdal.GDT_Float64}
+
+
+def read_native_dtype(filename):
+    """Get numeric type values of raster file are stored in
+
+    Args:
+        * filename: Name of raster file
+
+    Returns:
+        * dtype: Type corresponding to the first raster band and double
+                 precision if that is not known. Only the file header is
+                 read.
+
+    Raises:
+        * ReadLayerError if the file can not be opened by GDAL
+    """
+
+    fid = gdal.Open(filename, gdal.GA_ReadOnly)
+    if fid is None:
+        msg = 'Could not open file %s' % filename
+        raise ReadLayerError(msg)
+
+    data_type = fid.GetRasterBand(1).DataType
+    fid = None  # Close
+    return numpy.dtype(GDAL_TO_NUMPY_TYPE.get(data_type, numpy.float64))
 
 
 class Raster(Layer):
@@ -63,6 +95,11 @@ class Raster(Layer):
         * style_info: Dictionary with information about how this layer
             should be styled. See impact_functions/styles.py
             for examples.
+        * dtype: Optional numeric type grids are processed in. If None,
+            hazard grids use single precision where that is lossless and
+            all other grids double precision. See get_working_dtype.
+        * memmap: If True, array data is held in a memory mapped
+            temporary file rather than on the heap.
 
     Returns:
         * InaSAFE raster layer instance
@@ -77,7 +114,8 @@ class Raster(Layer):
     """
 
     def __init__(self, data=None, projection=None, geotransform=None,
-                 name=None, keywords=None, style_info=None):
+                 name=None, keywords=None, style_info=None, dtype=None,
+                 memmap=False):
         """Initialise object with either data or filename
 
         NOTE: Doc strings in constructor are not harvested and exposed in
@@ -92,6 +130,8 @@ class Raster(Layer):
                        keywords=keywords,
                        style_info=style_info)
 
+        self.dtype = dtype
+
         # Input checks
         if data is None:
             # Instantiate empty object
@@ -102,13 +142,23 @@ class Raster(Layer):
         # Initialisation
         if isinstance(data, basestring):
             self.read_from_file(data)
-        elif isinstance(data, QgsRasterLayer):
+        elif is_qgis_layer(data, 'QgsRasterLayer'):
             self.read_from_qgis_native(data)
         else:
             # Assume that data is provided as a numpy array
             # with extra keyword arguments supplying metadata
 
-            self.data = numpy.array(data, dtype='d', copy=False)
+            data = numpy.asarray(data)
+            working_dtype = self.dtype
+            if working_dtype is None:
+                working_dtype = get_working_dtype(self.get_keywords(),
+                                                  data.dtype)
+            if memmap:
+                self.data = create_memmap(data.shape, dtype=working_dtype)
+                self.data[:] = data
+            else:
+                self.data = numpy.array(data, dtype=working_dtype,
+                                        copy=False)
 
             proj4 = self.get_projection(proj4=True)
             if 'longlat' in proj4 and 'WGS84' in proj4:
@@ -136,7 +186,33 @@ class Raster(Layer):
     def __len__(self):
         """Size of data set defined as total number of grid points
         """
-        return len(self.get_data().flat)
+        return self.rows * self.columns
+
+    def __getstate__(self):
+        """Pickle file backed rasters by filename
+
+        GDAL handles can not be pickled, so the file is opened again
+        when unpickling. This keeps pickles of large grids small, e.g.
+        when passing layers to other processes.
+        """
+
+        state = self.__dict__.copy()
+        if 'fid' in state:
+            del state['fid']
+            state.pop('band', None)
+        return state
+
+    def __setstate__(self, state):
+        """Restore raster and reopen file if it is file backed
+        """
+
+        self.__dict__.update(state)
+        if 'data' not in state and state.get('filename') is not None:
+            fid = self.fid = gdal.Open(self.filename, gdal.GA_ReadOnly)
+            if fid is None:
+                msg = 'Could not reopen file %s' % self.filename
+                raise ReadLayerError(msg)
+            self.band = fid.GetRasterBand(1)
 
     def __eq__(self, other, rtol=1.0e-5, atol=1.0e-8):
         """Override '==' to allow comparison with other raster objecs
@@ -272,12 +348,14 @@ class Raster(Layer):
         # Get Dimensions. Note numpy and Gdal swap order
         N, M = A.shape
 
-        # Create empty file.
+        # Create empty file of the working type (single precision grids
+        # are stored as such).
         # FIXME (Ole): It appears that this is created as single
         #              precision even though Float64 is specified
         #              - see issue #17
+        data_type = NUMPY_TO_GDAL_TYPE.get(A.dtype, gdal.GDT_Float64)
         driver = gdal.GetDriverByName(file_format)
-        fid = driver.Create(filename, M, N, 1, gdal.GDT_Float64)
+        fid = driver.Create(filename, M, N, 1, data_type)
         if fid is None:
             msg = ('Gdal could not create filename %s using '
                    'format %s' % (filename, file_format))
@@ -310,7 +388,8 @@ class Raster(Layer):
                 * GetDataError      if can't create copy of qgis_layer's
                                         dataProvider
         """
-        if not qgis_imported:   # FIXME (DK): this branch isn't covered by test
+        qgis_core = get_qgis_core()
+        if qgis_core is None:  # FIXME (DK): this branch isn't covered by test
             msg = ('Used data is QgsRasterLayer instance, '
                    'but QGIS is not avialable.')
             raise TypeError(msg)
@@ -318,8 +397,8 @@ class Raster(Layer):
         base_name = unique_filename()
         file_name = base_name + '.tif'
 
-        file_writer = QgsRasterFileWriter(file_name)
-        pipe = QgsRasterPipe()
+        file_writer = qgis_core.QgsRasterFileWriter(file_name)
+        pipe = qgis_core.QgsRasterPipe()
         provider = qgis_layer.dataProvider()
         if not pipe.set(provider.clone()):
             msg = "Cannot set pipe provider"
@@ -346,7 +425,7 @@ class Raster(Layer):
             Raises:
                 * TypeError         if qgis is not avialable
         """
-        if not qgis_imported:   # FIXME (DK): this branch isn't covered by test
+        if get_qgis_core() is None:  # FIXME (DK): not covered by test
             msg = ('Tried to convert layer to QgsRasterLayer instance, '
                    'but QGIS is not avialable.')
             raise TypeError(msg)
@@ -354,7 +433,8 @@ class Raster(Layer):
         qgis_layer = safe_to_qgis_layer(self)
         return qgis_layer
 
-    def get_data(self, nan=True, scaling=None, copy=False):
+    def get_data(self, nan=True, scaling=None, copy=False,
+                 window=None, bbox=None, dtype=None, memmap=False):
         """Get raster data as numeric array
 
         Args:
@@ -385,39 +465,78 @@ class Raster(Layer):
                        scalar value: If scaling takes a numerical scalar value,
                                      that will be use to scale the data
 
-            * copy (optional): If present and True return copy
+            * copy (optional): If present and True return copy.
+                   The returned array is always a new array so this is
+                   retained for backwards compatibility only.
+
+            * window: Optional pixel window (xoff, yoff, xsize, ysize) as
+                      used by GDAL's ReadAsArray. Only this part of the
+                      grid is read. See get_window.
+
+            * bbox: Optional bounding box [west, south, east, north] in
+                    the coordinates of the layer. Only the pixels
+                    intersecting it are read. Use get_geometry or
+                    get_geotransform with window=self.get_window(bbox) to
+                    get the corresponding coordinates.
+
+            * dtype: Optional numeric type of returned array. If None,
+                     the working type of this layer is used. See
+                     get_working_dtype.
+
+            * memmap: If True, the returned array is held in a memory
+                      mapped temporary file rather than on the heap.
 
         Note:
             Scaling does not currently work with projected layers.
             See issue #123
+
+            Nodata replacement and scaling are done in place on the
+            array that is read so no additional grids are allocated.
         """
 
-        if hasattr(self, 'data') and self.data is not None:
-            # Return internal data grid
-            if copy:
+        if bbox is not None:
+            msg = 'Only one of arguments window and bbox can be specified'
+            verify(window is None, msg)
+            window = self.get_window(bbox)
 
-                A = copy_module.deepcopy(self.data)
-            else:
-                A = self.data
-            verify(A.shape[0] == self.rows and A.shape[1] == self.columns)
+        if window is None:
+            window = (0, 0, self.columns, self.rows)
+        xoff, yoff, xsize, ysize = [int(x) for x in window]
+
+        msg = ('Window %s is not within the %i x %i grid of raster %s'
+               % (str(window), self.columns, self.rows, self.get_name()))
+        verify(xoff >= 0 and yoff >= 0 and xsize >= 0 and ysize >= 0, msg)
+        verify(xoff + xsize <= self.columns, msg)
+        verify(yoff + ysize <= self.rows, msg)
+
+        if dtype is None:
+            dtype = self.get_working_dtype()
 
+        if memmap:
+            A = create_memmap((ysize, xsize), dtype=dtype)
         else:
+            A = numpy.empty((ysize, xsize), dtype=dtype)
+
+        if hasattr(self, 'data') and self.data is not None:
+            # Copy window of internal data grid so that it can be
+            # modified in place
+            verify(self.data.shape[0] == self.rows and
+                   self.data.shape[1] == self.columns)
+            A[:] = self.data[yoff:yoff + ysize, xoff:xoff + xsize]
+        elif xsize > 0 and ysize > 0:
             # Force garbage collection to free up any memory we can (TS)
             gc.collect()
 
-            # Read from raster file
-            # FIXME: This can be slow so should be moved to read_from_file
-            A = self.band.ReadAsArray()
-
-            # Convert to double precision (issue #75)
-            A = numpy.array(A, dtype=numpy.float64)
+            # Read window from raster file directly into array of the
+            # working type. GDAL converts the stored values.
+            self.band.ReadAsArray(xoff, yoff, xsize, ysize, buf_obj=A)
 
             # Self check
             M, N = A.shape
             msg = ('Dimensions of raster array do not match those of '
                    'raster file %s' % self.filename)
-            verify(M == self.rows, msg)
-            verify(N == self.columns, msg)
+            verify(M == ysize, msg)
+            verify(N == xsize, msg)
 
         # Handle no data value
         # FIXME (Ole): This only pertains to data read from file
@@ -442,10 +561,8 @@ class Raster(Layer):
                            'number. I got "nan=%s"' % str(nan))
                     raise InaSAFEError(msg)
 
-            # Replace NODATA_VALUE with NaN array
-            #print 'Replacing', nodata, 'with', NAN
-            NaN = numpy.ones(A.shape, A.dtype) * NAN
-            A = numpy.where(A == nodata, NaN, A)
+            # Replace NODATA_VALUE with NaN in place
+            A[A == nodata] = NAN
 
         # Take care of possible scaling
         if scaling is None:
@@ -480,9 +597,61 @@ class Raster(Layer):
                 raise GetDataError(msg)
 
         # Return possibly scaled data
-        return sigma * A
+        if sigma != 1:
+            A *= sigma
+        return A
 
-    def get_geotransform(self, copy=False):
+    def get_working_dtype(self):
+        """Get numeric type grids of this layer are processed in
+
+        Returns:
+            * dtype: The type given to the constructor if any. Otherwise
+                     single precision for hazard layers whose stored values
+                     convert to it without loss, e.g. Float32 or Int16
+                     bands, and double precision for everything else.
+        """
+
+        if self.dtype is not None:
+            return numpy.dtype(self.dtype)
+
+        return get_working_dtype(self.get_keywords(),
+                                 self.get_native_dtype())
+
+    def get_native_dtype(self):
+        """Get numeric type values of this layer are stored in
+
+        Returns:
+            * dtype: Type of the internal grid if any. Otherwise the type
+                     corresponding to the raster band in the file and
+                     double precision if that is not known.
+        """
+
+        if hasattr(self, 'data') and self.data is not None:
+            return self.data.dtype
+        elif hasattr(self, 'band'):
+            return numpy.dtype(GDAL_TO_NUMPY_TYPE.get(self.band.DataType,
+                                                      numpy.float64))
+        else:
+            return numpy.dtype(numpy.float64)
+
+    def get_window(self, bbox, padding=0):
+        """Get pixel window of grid covering a bounding box
+
+        Args:
+            * bbox: Bounding box [west, south, east, north] in the
+                    coordinates of the layer.
+            * padding: Optional number of pixels to add on each side
+
+        Returns:
+            * window: Tuple (xoff, yoff, xsize, ysize) of pixels
+                      intersecting bbox clipped to the grid.
+                      See get_data.
+        """
+
+        return bbox_to_window(bbox, self.geotransform,
+                              self.columns, self.rows, padding=padding)
+
+    def get_geotransform(self, copy=False, window=None):
         """Return geotransform for this raster layer
 
         Returns:
@@ -494,16 +663,26 @@ class Raster(Layer):
             See e.g. http://www.gdal.org/gdal_tutorial.html
 
         * copy (optional): If present and True return copy
+        * window (optional): Pixel window (see get_data). If present
+            return geotransform of that part of the grid.
         """
 
+        if window is not None:
+            return window_to_geotransform(self.geotransform, window)
+
         if copy:
             return copy_module.copy(self.geotransform)
         else:
             return self.geotransform
 
-    def get_geometry(self):
+    def get_geometry(self, window=None):
         """Return longitudes and latitudes (the axes) for grid.
 
+        Args:
+            * window: Optional pixel window (see get_data). If present the
+                      axes of that part of the grid are returned. They are
+                      identical to the corresponding part of the full axes.
+
         Note:
             Return two vectors (longitudes and latitudes) corresponding to
             grid. The values are offset by half a pixel size to correspond to
@@ -525,6 +704,12 @@ class Raster(Layer):
         # Compute x and y axes
         x, y = geotransform_to_axes(g, nx, ny)
 
+        if window is not None:
+            # Latitudes run south to north whereas rows run north to south
+            xoff, yoff, xsize, ysize = window
+            x = x[xoff:xoff + xsize]
+            y = y[ny - yoff - ysize:ny - yoff]
+
         # Return them
         return x, y
 
@@ -537,7 +722,8 @@ class Raster(Layer):
         return Raster(data=self.get_data(copy=True),
                       geotransform=self.get_geotransform(copy=True),
                       projection=self.get_projection(),
-                      keywords=self.get_keywords())
+                      keywords=self.get_keywords(),
+                      dtype=self.dtype)
 
     def __mul__(self, other):
         return self.get_data() * other.get_data()
@@ -702,10 +888,114 @@ class Raster(Layer):
         coordinates, values = self.to_vector_points()
 
         # Create corresponding vector layer
-        attributes = [{'value': x} for x in values]
+        attributes = [{'value': x} for x in values.astype(numpy.float64)]
         V = Vector(geometry=coordinates,
                    data=attributes,
                    projection=self.get_projection(),
                    geometry_type='point')
 
         return V
+
+
+class TiledRasterWriter(object):
+    """Write raster file one pixel window at a time
+
+    This allows impact grids to be computed tile by tile without ever
+    holding the entire grid in memory.
+    """
+
+    def __init__(self, filename, columns, rows, geotransform, projection,
+                 nodata_value=numpy.nan, dtype=None):
+        """Prepare GeoTIFF file
+
+        Args:
+            * filename: filename with extension .tif
+            * columns: Number of columns (pixels in x direction)
+            * rows: Number of rows (pixels in y direction)
+            * geotransform: GDAL geotransform (6-tuple) of the grid
+            * projection: Projection object or WKT string
+            * nodata_value: Value registered as NODATA in the file.
+                Default is nan as for grids held in memory.
+            * dtype: Numeric type stored. If None (default) the file is
+                created when the first array is written and has its type.
+
+        Note:
+            As in Raster.write_to_file single and double precision are
+            stored as such and other types as double precision.
+        """
+
+        basename, extension = os.path.splitext(filename)
+
+        msg = ('Invalid file type for file %s. Only extension '
+               'tif allowed.' % filename)
+        verify(extension in ['.tif'], msg)
+        self.file_format = DRIVER_MAP[extension]
+
+        self.filename = filename
+        self.columns = columns
+        self.rows = rows
+        self.geotransform = geotransform
+        self.projection = projection
+        self.nodata_value = nodata_value
+        self.fid = None
+        self.band = None
+        self.closed = False
+
+        if dtype is not None:
+            self._create(dtype)
+
+    def _create(self, dtype):
+        """Create empty file storing values of given type
+        """
+
+        data_type = NUMPY_TO_GDAL_TYPE.get(numpy.dtype(dtype),
+                                           gdal.GDT_Float64)
+        driver = gdal.GetDriverByName(self.file_format)
+        fid = driver.Create(self.filename, self.columns, self.rows, 1,
+                            data_type)
+        if fid is None:
+            msg = ('Gdal could not create filename %s using '
+                   'format %s' % (self.filename, self.file_format))
+            raise WriteLayerError(msg)
+
+        fid.SetProjection(str(self.projection))
+        fid.SetGeoTransform(self.geotransform)
+
+        self.fid = fid
+        self.band = fid.GetRasterBand(1)
+
+    def write(self, A, window):
+        """Write array to pixel window of file
+
+        Args:
+            * A: Numpy array of shape (ysize, xsize)
+            * window: Pixel window (xoff, yoff, xsize, ysize)
+        """
+
+        xoff, yoff, xsize, ysize = window
+        msg = ('Array of shape %s does not match window %s'
+               % (str(A.shape), str(window)))
+        verify(A.shape == (ysize, xsize), msg)
+
+        msg = 'Raster file %s has already been closed' % self.filename
+        verify(not self.closed, msg)
+
+        if self.fid is None:
+            self._create(A.dtype)
+        self.band.WriteArray(A, xoff, yoff)
+
+    def close(self):
+        """Register NODATA value and flush file to disk
+        """
+
+        if self.closed:
+            return
+
+        if self.fid is None:
+            # Nothing was written
+            self._create(numpy.float64)
+
+        self.band.SetNoDataValue(self.nodata_value)
+        self.band = None
+        self.fid = None  # Close
+        self.closed = True
@@ -0,0 +1,343 @@
+# coding=utf-8
+"""**Binary sidecar files for fast reloading of layers**
+
+.. tip:: A sidecar holds everything read_layer gets from a layer file -
+   packed coordinates and ring offsets, typed attribute columns (or the
+   raster grid), projection and keywords - in one binary file next to it,
+   e.g. buildings.shp.safebin next to buildings.shp. Numeric arrays are
+   stored uncompressed and aligned so they are memory mapped when the
+   sidecar is read rather than parsed.
+
+   Sidecars are written by Vector.write_to_file(filename, sidecar=True)
+   or write_sidecar and read_layer uses them in preference to OGR when
+   they are up to date, i.e. when the layer file and its companion files
+   (see layer_cache.COMPANION_EXTENSIONS) have the modification times and
+   sizes recorded when the sidecar was written. Sidecars that are stale,
+   of another version or whose header fails validation are ignored.
+
+   read_layer only validates the header (its checksum and the file size)
+   so that loading touches nothing but the pages of the data used. The
+   checksum of the data is written with the sidecar and can be checked
+   explicitly with verify_sidecar.
+
+   Layout (little endian)::
+
+       magic        8 bytes  SIDECAR_MAGIC
+       version      uint32   SIDECAR_VERSION
+       header size  uint32   Number of bytes of header
+       header crc   uint32   CRC32 of header
+       data crc     uint32   CRC32 of data section
+       data size    uint64   Number of bytes of data section
+       header                JSON dictionary (see layer_cache.encode_value)
+                             with layer metadata, source file state and
+                             array directory, padded with blanks
+       data                  Arrays, each starting at a multiple of
+                             SIDECAR_ALIGNMENT bytes
+
+   Sidecars are read implicitly whenever a layer is opened, so nothing in
+   them is unpickled: object columns are stored as string buffers or JSON
+   (see layer_cache.encode_column). Sidecars of version 1, which were
+   pickled, are ignored.
+"""
+
+import os
+import zlib
+import json
+import struct
+import logging
+import tempfile
+import numpy
+
+from safe.common.exceptions import ReadLayerError
+from safe.common.utilities import OrderedDict
+
+from layer_cache import (layer_signature, layer_to_record, record_to_layer,
+                         encode_value, decode_value, encode_column,
+                         decode_column)
+
+LOGGER = logging.getLogger('InaSAFE')
+
+SIDECAR_EXTENSION = '.safebin'
+SIDECAR_MAGIC = 'INASAFE\x1a'
+SIDECAR_VERSION = 2
+SIDECAR_ALIGNMENT = 64
+
+# Fixed part of file preceding the header
+PREAMBLE = struct.Struct('<8sIIIIQ')
+
+
+def sidecar_filename(filename, sublayer=None):
+    """Name of sidecar file of a layer file
+
+    :param filename: Name of layer file
+    :type filename: str
+
+    :param sublayer: Optional name of sublayer
+    :type sublayer: str
+
+    :returns: filename with SIDECAR_EXTENSION appended (and the sublayer
+        if given)
+    :rtype: str
+    """
+
+    if sublayer is None:
+        return filename + SIDECAR_EXTENSION
+    else:
+        return '%s.%s%s' % (filename, sublayer, SIDECAR_EXTENSION)
+
+
+def _padding(size):
+    """Number of bytes to add to size to reach the next aligned offset
+    """
+
+    return -size % SIDECAR_ALIGNMENT
+
+
+def write_record(filename, meta, arrays, source=None):
+    """Write layer record to binary file
+
+    :param filename: Name of file to write
+    :type filename: str
+
+    :param meta: Metadata as made by layer_cache.layer_to_record
+    :type meta: dict
+
+    :param arrays: Arrays as made by layer_cache.layer_to_record
+    :type arrays: dict
+
+    :param source: Optional description of the state of the layer file
+        the record was read from (see layer_cache.layer_signature)
+
+    Note:
+        The file is written under a temporary name and renamed when
+        complete so readers never see partial files.
+    """
+
+    directory = []
+    blocks = []
+    offset = 0
+    for name, array in arrays.items():
+        encoding, parts = encode_column(array)
+        entries = []
+        for part in parts:
+            part = numpy.ascontiguousarray(part)
+            dtype = part.dtype.newbyteorder('<')
+            part = part.astype(dtype, copy=False)
+            entries.append((dtype.str, part.shape, offset, part.nbytes))
+            blocks.append(part)
+            offset += part.nbytes + _padding(part.nbytes)
+        directory.append((name, encoding, entries))
+
+    header = json.dumps(encode_value({'meta': meta,
+                                      'source': source,
+                                      'arrays': directory}))
+    header += ' ' * _padding(PREAMBLE.size + len(header))
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(dir=dirname, prefix='.tmp_',
+                                        suffix=SIDECAR_EXTENSION)
+    fid = os.fdopen(fd, 'wb')
+    try:
+        # Preamble is written when the data checksum is known
+        fid.write('\0' * PREAMBLE.size)
+        fid.write(header)
+        data_crc = 0
+        for block in blocks:
+            padding = '\0' * _padding(block.nbytes)
+            data_crc = zlib.crc32(block, data_crc)
+            data_crc = zlib.crc32(padding, data_crc)
+            fid.write(block.data)
+            fid.write(padding)
+
+        fid.seek(0)
+        fid.write(PREAMBLE.pack(SIDECAR_MAGIC, SIDECAR_VERSION, len(header),
+                                zlib.crc32(header) & 0xffffffff,
+                                data_crc & 0xffffffff, offset))
+        fid.close()
+
+        if os.path.exists(filename):
+            # Rename does not replace files on Windows
+            os.remove(filename)
+        os.rename(tmp_filename, filename)
+    except:
+        fid.close()
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def read_record(filename, verify_checksum=False):
+    """Read layer record written by write_record
+
+    :param filename: Name of file to read
+    :type filename: str
+
+    :param verify_checksum: Set to True to also validate the checksum of
+        the data. This reads the whole file. The header checksum is
+        always validated.
+    :type verify_checksum: bool
+
+    :returns: Tuple (meta, arrays, source). Numeric arrays are copy on
+        write memory maps of the file.
+    :rtype: tuple
+
+    :raises: ReadLayerError if the file is not a sidecar of this version
+        or it is corrupt.
+    """
+
+    fid = open(filename, 'rb')
+    try:
+        preamble = fid.read(PREAMBLE.size)
+        if len(preamble) < PREAMBLE.size:
+            msg = 'File %s is not an InaSAFE sidecar' % filename
+            raise ReadLayerError(msg)
+        (magic, version, header_size, header_crc, data_crc,
+         data_size) = PREAMBLE.unpack(preamble)
+        if magic != SIDECAR_MAGIC:
+            msg = 'File %s is not an InaSAFE sidecar' % filename
+            raise ReadLayerError(msg)
+        if version != SIDECAR_VERSION:
+            msg = ('Sidecar %s has version %i, expected %i'
+                   % (filename, version, SIDECAR_VERSION))
+            raise ReadLayerError(msg)
+
+        data_start = PREAMBLE.size + header_size
+        if os.path.getsize(filename) != data_start + data_size:
+            msg = 'Sidecar %s is corrupt' % filename
+            raise ReadLayerError(msg)
+        header = fid.read(header_size)
+    finally:
+        fid.close()
+
+    if (len(header) != header_size or
+            zlib.crc32(header) & 0xffffffff != header_crc):
+        msg = 'Sidecar %s is corrupt' % filename
+        raise ReadLayerError(msg)
+    try:
+        header = decode_value(json.loads(header))
+    except ValueError, e:
+        msg = 'Sidecar %s has invalid header: %s' % (filename, e)
+        raise ReadLayerError(msg)
+
+    if data_size > 0:
+        data = numpy.memmap(filename, dtype=numpy.uint8, mode='c',
+                            offset=data_start, shape=(data_size,))
+    else:
+        data = numpy.zeros(0, dtype=numpy.uint8)
+    if verify_checksum and zlib.crc32(data) & 0xffffffff != data_crc:
+        msg = 'Checksum of sidecar %s does not match' % filename
+        raise ReadLayerError(msg)
+
+    arrays = OrderedDict()
+    for name, encoding, entries in header['arrays']:
+        if encoding == 'pickle':
+            msg = ('Sidecar %s has pickled column %s which is not loaded'
+                   % (filename, name))
+            raise ReadLayerError(msg)
+        parts = []
+        try:
+            for dtype, shape, offset, nbytes in entries:
+                dtype = numpy.dtype(str(dtype))
+                if dtype.hasobject or offset + nbytes > data_size:
+                    raise ValueError('Invalid array %s' % name)
+                part = data[offset:offset + nbytes].view(dtype)
+                parts.append(part.reshape(shape))
+            arrays[name] = decode_column(encoding, parts)
+        except (ValueError, TypeError), e:
+            msg = 'Sidecar %s is corrupt: %s' % (filename, e)
+            raise ReadLayerError(msg)
+
+    return header['meta'], arrays, header['source']
+
+
+def write_sidecar(layer, filename, sublayer=None):
+    """Write sidecar for layer read from file
+
+    :param layer: Layer as read from filename
+    :type layer: Vector, Raster
+
+    :param filename: Name of layer file
+    :type filename: str
+
+    :param sublayer: Optional name of sublayer
+    :type sublayer: str
+
+    :returns: Name of sidecar file or None if layer is empty
+    :rtype: str, None
+    """
+
+    record = layer_to_record(layer)
+    if record is None:
+        return None
+
+    meta, arrays = record
+    source = layer_signature(filename, sublayer)[1:]
+    name = sidecar_filename(filename, sublayer)
+    write_record(name, meta, arrays, source=source)
+    return name
+
+
+def read_sidecar(filename, sublayer=None, verify_checksum=False):
+    """Read layer from its sidecar
+
+    :param filename: Name of layer file
+    :type filename: str
+
+    :param sublayer: Optional name of sublayer
+    :type sublayer: str
+
+    :param verify_checksum: See read_record
+    :type verify_checksum: bool
+
+    :returns: Layer equal to the one read from filename or None if there
+        is no up to date and valid sidecar.
+    :rtype: Vector, Raster, None
+    """
+
+    name = sidecar_filename(filename, sublayer)
+    if not os.path.isfile(name):
+        return None
+
+    try:
+        source = layer_signature(filename, sublayer)[1:]
+        meta, arrays, recorded_source = read_record(
+            name, verify_checksum=verify_checksum)
+    except (OSError, IOError, ReadLayerError), e:
+        LOGGER.debug('Ignoring sidecar %s: %s' % (name, e))
+        return None
+
+    if recorded_source != source:
+        LOGGER.debug('Ignoring sidecar %s as %s has changed'
+                     % (name, filename))
+        return None
+
+    return record_to_layer(meta, arrays, filename, copy_arrays=False)
+
+
+def verify_sidecar(filename, sublayer=None):
+    """Check that the sidecar of a layer file is up to date and intact
+
+    Unlike read_sidecar this validates the checksum of all data.
+
+    :param filename: Name of layer file
+    :type filename: str
+
+    :param sublayer: Optional name of sublayer
+    :type sublayer: str
+
+    :returns: True if read_sidecar would return a layer equal to the one
+        the sidecar was written from.
+    :rtype: bool
+    """
+
+    return read_sidecar(filename, sublayer, verify_checksum=True) is not None
+
+
+def remove_sidecar(filename, sublayer=None):
+    """Remove sidecar of layer file if any
+    """
+
+    try:
+        os.remove(sidecar_filename(filename, sublayer))
+    except OSError:
+        pass
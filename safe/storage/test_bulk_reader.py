@@ -0,0 +1,162 @@
+"""**Tests for bulk reading of vector data**
+"""
+
+import os
+import struct
+import unittest
+import numpy
+from osgeo import ogr
+
+from safe.common.exceptions import ReadLayerError
+from safe.common.utilities import temp_dir, unique_filename
+from safe.storage.vector import Vector
+from safe.storage.bulk_reader import (decode_wkb, concatenate_geometry,
+                                      read_dbf_columns)
+
+
+def polygon_to_wkb(rings, byte_order=ogr.wkbNDR):
+    """WKB of polygon with given rings made by OGR
+    """
+
+    G = ogr.Geometry(ogr.wkbPolygon)
+    for ring in rings:
+        R = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in ring:
+            R.AddPoint_2D(x, y)
+        G.AddGeometry(R)
+    return G.ExportToWkb(byte_order)
+
+
+def write_dbf(filename, fields, records):
+    """Write dbf file
+
+    Fields are tuples (name, type, width) and records tuples of the raw
+    field values which are padded with blanks to the field width.
+    """
+
+    header_length = 32 + 32 * len(fields) + 1
+    record_length = 1 + sum([width for _, _, width in fields])
+    fid = open(filename, 'wb')
+    fid.write(struct.pack('<B3BIHH20x', 3, 113, 10, 18, len(records),
+                          header_length, record_length))
+    for name, field_type, width in fields:
+        fid.write(struct.pack('<11sc4xBB14x', name, field_type, width, 0))
+    fid.write('\x0d')
+    for record in records:
+        fid.write(' ')
+        for (_, _, width), value in zip(fields, record):
+            fid.write(value.ljust(width))
+    fid.write('\x1a')
+    fid.close()
+
+
+class Test_BulkReader(unittest.TestCase):
+
+    def test_decode_polygons(self):
+        """Polygons and multipolygons are decoded into packed geometry
+        """
+
+        outer = [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]]
+        hole = [[1, 1], [2, 1], [2, 2], [1, 1]]
+        other = [[10, 10], [11, 10], [11, 11], [10, 10]]
+
+        multi = ogr.Geometry(ogr.wkbMultiPolygon)
+        multi.AddGeometry(ogr.CreateGeometryFromWkb(
+            polygon_to_wkb([outer, hole])))
+        multi.AddGeometry(ogr.CreateGeometryFromWkb(
+            polygon_to_wkb([other])))
+
+        wkbs = [polygon_to_wkb([outer]),
+                polygon_to_wkb([outer, hole], byte_order=ogr.wkbXDR),
+                multi.ExportToWkb(ogr.wkbNDR)]
+
+        geometry_type, packed = decode_wkb(wkbs)
+        self.assertEqual(geometry_type, ogr.wkbPolygon)
+        self.assertEqual(len(packed), 3)
+        self.assertTrue(packed.is_polygon)
+        self.assertTrue(numpy.alltrue(packed.part_offsets == [0, 1, 3, 6]))
+
+        # Big endian coordinates are swapped
+        polygon = packed.get_feature(1)
+        self.assertTrue(numpy.allclose(polygon.outer_ring, outer))
+        self.assertTrue(numpy.allclose(polygon.inner_rings[0], hole))
+
+        # Multipolygon is forced to a polygon holding all rings
+        polygon = packed.get_feature(2)
+        self.assertTrue(numpy.allclose(polygon.outer_ring, outer))
+        self.assertTrue(numpy.allclose(polygon.inner_rings[1], other))
+
+        # Batches can be concatenated
+        pieces = [decode_wkb(wkbs[:2])[1], decode_wkb(wkbs[2:])[1]]
+        combined = concatenate_geometry(pieces)
+        self.assertTrue(numpy.alltrue(combined.coordinates ==
+                                      packed.coordinates))
+        self.assertTrue(numpy.alltrue(combined.ring_offsets ==
+                                      packed.ring_offsets))
+        self.assertTrue(numpy.alltrue(combined.part_offsets ==
+                                      packed.part_offsets))
+
+    def test_decode_points_and_lines(self):
+        """Points (also 2.5D) and lines are decoded
+        """
+
+        points = [ogr.Geometry(ogr.wkbPoint25D) for _ in range(3)]
+        for i, G in enumerate(points):
+            G.AddPoint(i, 2 * i, 7)
+        geometry_type, A = decode_wkb([G.ExportToWkb(ogr.wkbNDR)
+                                       for G in points])
+        self.assertEqual(geometry_type, ogr.wkbPoint25D)
+        self.assertTrue(numpy.allclose(A, [[0, 0], [1, 2], [2, 4]]))
+
+        line = ogr.Geometry(ogr.wkbLineString)
+        line.AddPoint_2D(0, 0)
+        line.AddPoint_2D(3, 1)
+        geometry_type, packed = decode_wkb([line.ExportToWkb(ogr.wkbNDR)])
+        self.assertEqual(geometry_type, ogr.wkbLineString)
+        self.assertFalse(packed.is_polygon)
+        self.assertTrue(numpy.allclose(packed.get_feature(0),
+                                       [[0, 0], [3, 1]]))
+
+        # Mixed geometries are rejected
+        self.assertRaises(ReadLayerError, decode_wkb,
+                          [line.ExportToWkb(ogr.wkbNDR),
+                           points[0].ExportToWkb(ogr.wkbNDR)])
+
+    def test_dbf_columns(self):
+        """Attributes read from dbf files match those read through OGR
+        """
+
+        # Point layer whose dbf is replaced by one with blanks around
+        # strings and empty and all zero dates
+        filename = unique_filename(suffix='.shp',
+                                   dir=temp_dir(sub_dir='test'))
+        Vector(data=[{'ID': i} for i in range(4)],
+               geometry=[[float(i), 0.0] for i in range(4)]
+               ).write_to_file(filename)
+        write_dbf(os.path.splitext(filename)[0] + '.dbf',
+                  [('NAME', 'C', 12), ('DATE', 'D', 8), ('COUNT', 'N', 5)],
+                  [('  Jakarta', '20130918', '   12'),
+                   ('Padang  ', '', '3'),
+                   ('    ', '00000000', ''),
+                   (' Aceh Jaya ', '        ', '*****')])
+
+        columns = read_dbf_columns(filename, [ogr.OFTString, ogr.OFTDate,
+                                              ogr.OFTInteger], 4)
+        self.assertEqual([x.tolist() for x in columns],
+                         [['Jakarta', 'Padang', None, 'Aceh Jaya'],
+                          ['2013/09/18', None, None, None],
+                          [12, 3, None, None]])
+
+        reference = Vector()
+        reference.read_from_file(filename, bulk=False)
+        layer = Vector(data=filename)
+        self.assertEqual(layer.get_attribute_names(),
+                         reference.get_attribute_names())
+        for name in reference.get_attribute_names():
+            self.assertEqual(layer.get_data(name).tolist(),
+                             reference.get_data(name).tolist())
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_BulkReader, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,149 @@
+"""**Tests for packed geometry**
+"""
+
+import cPickle
+import unittest
+import numpy
+
+from safe.storage.geometry import (Polygon, PackedGeometry,
+                                   pack_polygons, pack_lines)
+from safe.storage.utilities import (calculate_polygon_area,
+                                    calculate_polygon_centroid)
+
+
+def square(x0, y0, side):
+    """Closed counter clockwise square ring with lower left corner x0, y0
+    """
+    return numpy.array([[x0, y0], [x0 + side, y0], [x0 + side, y0 + side],
+                        [x0, y0 + side], [x0, y0]])
+
+
+class Test_Geometry(unittest.TestCase):
+
+    def setUp(self):
+        # Three polygons, the second with two holes
+        self.polygons = [Polygon(square(0, 0, 1)),
+                         Polygon(square(10, 10, 4),
+                                 inner_rings=[square(11, 11, 1),
+                                              square(12.5, 12.5, 1)]),
+                         Polygon(numpy.array([[106.8, -6.2],
+                                              [106.81, -6.2],
+                                              [106.805, -6.19],
+                                              [106.8, -6.2]]))]
+
+    def test_pack_polygons(self):
+        """Polygons can be packed and unpacked
+        """
+
+        packed = pack_polygons(self.polygons)
+        assert len(packed) == 3
+        assert packed.number_of_rings() == 5
+        assert packed.coordinates.shape == (24, 2)
+        assert numpy.alltrue(packed.ring_offsets == [0, 5, 10, 15, 20, 24])
+        assert numpy.alltrue(packed.part_offsets == [0, 1, 4, 5])
+
+        polygons = packed.unpack()
+        for p, q in zip(self.polygons, polygons):
+            assert numpy.allclose(p.outer_ring, q.outer_ring)
+            assert len(p.inner_rings) == len(q.inner_rings)
+            for a, b in zip(p.inner_rings, q.inner_rings):
+                assert numpy.allclose(a, b)
+
+        # Unpacked rings are views into the packed coordinates ...
+        polygons[0].outer_ring[0, 0] = 99
+        assert packed.coordinates[0, 0] == 99
+
+        # ... unless copied
+        polygons = packed.unpack(copy=True)
+        polygons[0].outer_ring[0, 0] = 0
+        assert packed.coordinates[0, 0] == 99
+
+        # Plain arrays are taken as outer rings
+        packed = pack_polygons([p.outer_ring for p in self.polygons])
+        assert numpy.alltrue(packed.part_offsets == [0, 1, 2, 3])
+
+        # Empty
+        packed = pack_polygons([])
+        assert len(packed) == 0
+        assert len(packed.areas()) == 0
+        assert len(packed.centroids()) == 0
+        assert packed.get_extent() == [0, 0, 0, 0]
+
+        # Inconsistent offsets are rejected
+        self.assertRaises(ValueError, PackedGeometry,
+                          numpy.zeros((4, 2)), [0, 3], [0, 1])
+
+    def test_bulk_operations(self):
+        """Bounding boxes, areas and centroids match per polygon results
+        """
+
+        packed = pack_polygons(self.polygons)
+
+        bboxes = packed.bounding_boxes()
+        assert numpy.allclose(bboxes[0], [0, 1, 0, 1])
+        assert numpy.allclose(bboxes[1], [10, 14, 10, 14])
+        assert numpy.allclose(bboxes[2], [106.8, 106.81, -6.2, -6.19])
+        assert numpy.allclose(packed.get_extent(), [0, 106.81, -6.2, 14])
+
+        areas = packed.areas()
+        assert numpy.allclose(areas[:2], [1, 14])
+        assert numpy.allclose(areas[2],
+                              calculate_polygon_area(
+                                  self.polygons[2].outer_ring))
+
+        ring_areas = packed.ring_areas(signed=True)
+        assert numpy.allclose(ring_areas[:4], [1, 16, 1, 1])
+
+        centroids = packed.centroids()
+        for i, p in enumerate(self.polygons):
+            assert numpy.allclose(centroids[i],
+                                  calculate_polygon_centroid(p.outer_ring),
+                                  rtol=1.0e-12, atol=1.0e-12)
+
+        # Randomly perturbed polygons
+        numpy.random.seed(13)
+        polygons = []
+        for i in range(100):
+            N = numpy.random.randint(3, 20)
+            angles = numpy.sort(numpy.random.uniform(0, 2 * numpy.pi, N))
+            radii = numpy.random.uniform(0.5, 1, N) * 0.001
+            ring = numpy.zeros((N + 1, 2))
+            ring[:N, 0] = 106 + i * 0.01 + radii * numpy.cos(angles)
+            ring[:N, 1] = -6 + radii * numpy.sin(angles)
+            ring[N] = ring[0]
+            polygons.append(ring)
+
+        # Packed areas are computed in normalised coordinates as well so
+        # centroids differ slightly from calculate_polygon_centroid
+        packed = pack_polygons(polygons)
+        centroids = packed.centroids()
+        areas = packed.areas()
+        for i, ring in enumerate(polygons):
+            assert numpy.allclose(areas[i], calculate_polygon_area(ring))
+            assert numpy.allclose(centroids[i],
+                                  calculate_polygon_centroid(ring),
+                                  rtol=0, atol=1.0e-8)
+
+    def test_pack_lines(self):
+        """Lines can be packed and pickled
+        """
+
+        lines = [numpy.array([[0, 0], [1, 1], [2, 0]]),
+                 numpy.array([[5, 5], [6, 7]])]
+        packed = pack_lines(lines)
+        assert len(packed) == 2
+        assert not packed.is_polygon
+        assert numpy.allclose(packed.bounding_boxes(),
+                              [[0, 2, 0, 1], [5, 6, 5, 7]])
+        self.assertRaises(ValueError, packed.centroids)
+        self.assertRaises(ValueError, packed.areas)
+
+        s = cPickle.dumps(packed, protocol=2)
+        unpickled = cPickle.loads(s)
+        for a, b in zip(lines, unpickled.unpack()):
+            assert numpy.allclose(a, b)
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_Geometry, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
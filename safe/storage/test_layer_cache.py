@@ -0,0 +1,278 @@
+# coding=utf-8
+"""**Tests for cache of layers read from file**"""
+
+import os
+import json
+import stat
+import shutil
+import unittest
+import numpy
+
+from safe.common.testing import UNITDATA
+from safe.common.utilities import temp_dir, unique_filename
+from safe.storage.core import read_layer
+from safe.storage.vector import Vector
+from safe.storage.raster import Raster
+from safe.storage.geometry import Polygon
+from safe.storage.layer_cache import (LayerCache, enable_layer_cache,
+                                      disable_layer_cache, get_layer_cache,
+                                      layer_to_record, record_to_layer,
+                                      encode_value, decode_value,
+                                      encode_column, decode_column)
+
+SHP_BASE = os.path.join(UNITDATA, 'exposure', 'buildings_osm_4326')
+SQLITE_PATH = os.path.join(UNITDATA, 'exposure', 'exposure.sqlite')
+TIF_PATH = os.path.join(UNITDATA, 'hazard', 'jakarta_flood_design.tif')
+GEOTRANSFORM = (106.0, 0.01, 0.0, -6.0, 0.0, -0.01)
+
+
+def make_vector():
+    """Small polygon layer with a hole and typed attribute columns
+    """
+
+    outer = numpy.array([[0, 0], [0, 2], [2, 2], [2, 0], [0, 0]],
+                        dtype=numpy.float)
+    hole = numpy.array([[0.5, 0.5], [1, 1], [1, 0.5], [0.5, 0.5]])
+    geometry = [Polygon(outer_ring=outer, inner_rings=[hole]),
+                Polygon(outer_ring=outer + 3)]
+    columns = {'name': ['a', None],
+               'depth': [1.5, None],
+               'count': [1, 2]}
+    return Vector(data=columns, geometry=geometry,
+                  keywords={'category': 'exposure'})
+
+
+def make_raster():
+    """Small raster layer
+    """
+
+    data = numpy.arange(12, dtype=numpy.float32).reshape((3, 4))
+    data[1, 1] = -9999
+    return Raster(data=data, geotransform=GEOTRANSFORM,
+                  keywords={'category': 'hazard', 'title': 'Depth'})
+
+
+def make_file(suffix):
+    """Create empty file to key layers held in cache by
+    """
+
+    filename = unique_filename(suffix=suffix, dir=temp_dir(sub_dir='test'))
+    open(filename, 'w').close()
+    return filename
+
+
+class Test_LayerCache(unittest.TestCase):
+
+    def tearDown(self):
+        disable_layer_cache()
+
+    def test_records(self):
+        """Layers are converted to arrays and back without loss
+        """
+
+        vector = make_vector()
+        meta, arrays = layer_to_record(vector)
+        layer = record_to_layer(meta, arrays, 'buildings.shp')
+        self.assertEqual(layer, vector)
+        self.assertEqual(layer.get_name(), 'buildings')
+        self.assertEqual(layer.get_data('name', 1), None)
+        self.assertEqual(layer.get_data('depth', 1), None)
+        self.assertEqual(layer.get_data('count', 1), 2)
+        self.assertEqual(len(layer.get_geometry(as_geometry_objects=True)
+                             [0].inner_rings), 1)
+
+        raster = make_raster()
+        meta, arrays = layer_to_record(raster)
+        layer = record_to_layer(meta, arrays, 'depth.tif')
+        self.assertEqual(layer, raster)
+        self.assertEqual(layer.get_name(), 'Depth')
+        self.assertEqual(layer.get_data().dtype, numpy.float32)
+
+    def test_encoding(self):
+        """Values and object columns are encoded without loss
+        """
+
+        value = {'title': 'Flood', u'unit': u'm\xe5', 3: (1, 2.5, None),
+                 'levels': [True, {'x': 'y'}], 'dtype': numpy.dtype('f4'),
+                 'nodata': float('nan'), 'raw': '\xff\x00'}
+        new_value = decode_value(json.loads(json.dumps(encode_value(value))))
+        self.assertTrue(numpy.isnan(new_value.pop('nodata')))
+        value.pop('nodata')
+        self.assertEqual(new_value, value)
+        for key in new_value:
+            self.assertEqual(type(new_value[key]), type(value[key]))
+        self.assertRaises(TypeError, encode_value, object())
+
+        for values, expected_encoding in [(['a', None, ''], 'strings'),
+                                          ([u'\xe5', None], 'unicode'),
+                                          ([1, 'b', u'c', 2.5], 'values'),
+                                          ([None, None], 'strings')]:
+            column = numpy.empty(len(values), dtype=object)
+            column[:] = values
+            encoding, parts = encode_column(column)
+            self.assertEqual(encoding, expected_encoding)
+            for part in parts:
+                self.assertNotEqual(part.dtype, object)
+            new_values = decode_column(encoding, parts).tolist()
+            self.assertEqual(new_values, values)
+            self.assertEqual([type(x) for x in new_values],
+                             [type(x) for x in values])
+
+    def test_get_and_put(self):
+        """Cached layers are new objects and invalidated by file changes
+        """
+
+        filename = make_file('.shp')
+        cache = LayerCache()
+        self.assertTrue(cache.get(filename) is None)
+        cache.put(filename, make_vector())
+        self.assertEqual(len(cache), 1)
+
+        layer = cache.get(filename)
+        self.assertEqual(layer, make_vector())
+        self.assertEqual(layer.get_filename(), filename)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Changes to layers do not change the cache
+        layer.get_data('count')[:] = 7
+        layer.get_packed_geometry().coordinates[:] = 0
+        self.assertEqual(cache.get(filename), make_vector())
+
+        # Sublayers are cached separately
+        self.assertTrue(cache.get(filename, sublayer='foo') is None)
+
+        # Changed companion files invalidate the entry
+        keywords_filename = os.path.splitext(filename)[0] + '.keywords'
+        open(keywords_filename, 'w').close()
+        self.assertTrue(cache.get(filename) is None)
+
+        # As do changed files
+        cache.put(filename, make_vector())
+        self.assertTrue(cache.get(filename) is not None)
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 10))
+        self.assertTrue(cache.get(filename) is None)
+
+        # Raster grids are shared but can not be modified
+        filename = make_file('.tif')
+        cache.put(filename, make_raster())
+        layer = cache.get(filename)
+        self.assertEqual(layer, make_raster())
+        self.assertTrue(cache.get(filename).data is layer.data)
+        self.assertRaises(ValueError, layer.data.__setitem__, (0, 0), 1)
+        self.assertTrue(numpy.isnan(layer.get_nodata_value()))
+
+    def test_eviction(self):
+        """Least recently used layers are evicted to stay within budget
+        """
+
+        raster = make_raster()
+        nbytes = raster.get_data().nbytes
+        cache = LayerCache(max_bytes=2 * nbytes)
+        filenames = [make_file('.tif') for _ in range(3)]
+
+        cache.put(filenames[0], raster)
+        cache.put(filenames[1], raster)
+        self.assertEqual(cache.nbytes, 2 * nbytes)
+        self.assertTrue(cache.get(filenames[0]) is not None)
+
+        cache.put(filenames[2], raster)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 2 * nbytes)
+        self.assertTrue(cache.get(filenames[1]) is None)
+        self.assertTrue(cache.get(filenames[0]) is not None)
+        self.assertTrue(cache.get(filenames[2]) is not None)
+
+        # Layers larger than the budget are not held and raster grids
+        # larger than that are not read
+        cache = LayerCache(max_bytes=nbytes - 1)
+        cache.put(filenames[0], raster)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+        def get_data(*args, **kwargs):
+            raise AssertionError('Grid should not be read')
+
+        raster.get_data = get_data
+        cache.put(filenames[0], raster)
+        self.assertEqual(len(cache), 0)
+
+    def test_spill(self):
+        """Entries written to spill directory are read again memory mapped
+        """
+
+        spill_dir = unique_filename(suffix='_spill',
+                                    dir=temp_dir(sub_dir='test'))
+        vector_filename = make_file('.shp')
+        raster_filename = make_file('.tif')
+        cache = LayerCache(spill_dir=spill_dir)
+        cache.put(vector_filename, make_vector())
+        cache.put(raster_filename, make_raster())
+        self.assertEqual(len(os.listdir(spill_dir)), 2)
+
+        # Only the current user can access entries and nothing in them
+        # is pickled
+        self.assertEqual(stat.S_IMODE(os.stat(spill_dir).st_mode), 0700)
+        for dirname in os.listdir(spill_dir):
+            names = os.listdir(os.path.join(spill_dir, dirname))
+            self.assertTrue('meta.json' in names)
+            for name in names:
+                if name.endswith('.npy'):
+                    numpy.load(os.path.join(spill_dir, dirname, name),
+                               allow_pickle=False)
+
+        # A new cache (e.g. in a later run) reads the entries from disk
+        cache = LayerCache(spill_dir=spill_dir)
+        self.assertEqual(cache.get(vector_filename), make_vector())
+        layer = cache.get(raster_filename)
+        self.assertEqual(layer, make_raster())
+        self.assertTrue(isinstance(layer.data, numpy.memmap))
+        self.assertEqual(cache.hits, 2)
+
+        # Entries of changed files are not used and replaced
+        st = os.stat(raster_filename)
+        os.utime(raster_filename, (st.st_atime, st.st_mtime + 10))
+        cache = LayerCache(spill_dir=spill_dir)
+        self.assertTrue(cache.get(raster_filename) is None)
+        cache.put(raster_filename, make_raster())
+        self.assertEqual(len(os.listdir(spill_dir)), 2)
+
+        shutil.rmtree(spill_dir)
+
+    def test_read_layer(self):
+        """Layers are served from the cache by read_layer when enabled
+        """
+
+        self.assertTrue(get_layer_cache() is None)
+        cache = enable_layer_cache()
+        self.assertTrue(get_layer_cache() is cache)
+
+        for filename, sublayer in [(SHP_BASE + '.shp', None),
+                                   (SQLITE_PATH, 'buildings_osm_4326'),
+                                   (TIF_PATH, None)]:
+            reference = read_layer(filename, sublayer=sublayer)
+            hits = cache.hits
+            layer = read_layer(filename, sublayer=sublayer)
+            self.assertEqual(cache.hits, hits + 1)
+            self.assertEqual(layer, reference)
+            self.assertEqual(layer.get_name(), reference.get_name())
+            self.assertEqual(layer.get_keywords(), reference.get_keywords())
+            self.assertEqual(layer.get_bounding_box(),
+                             reference.get_bounding_box())
+            if layer.is_vector:
+                self.assertEqual(layer.geometry_type,
+                                 reference.geometry_type)
+                self.assertEqual(layer.get_columns().keys(),
+                                 reference.get_columns().keys())
+            else:
+                self.assertTrue(numpy.allclose(layer.get_data(),
+                                               reference.get_data(),
+                                               equal_nan=True))
+
+        disable_layer_cache()
+        self.assertTrue(get_layer_cache() is None)
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_LayerCache, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
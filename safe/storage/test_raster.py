@@ -12,12 +12,18 @@ __copyright__ = 'Copyright 2012, Australia Indonesia Facility for '
 __copyright__ += 'Disaster Reduction'
 
 import os
+import numpy
 import logging
 import unittest
+from osgeo import gdal
 
 from safe.common.testing import UNITDATA, get_qgis_app
-from safe.storage.utilities import read_keywords
-from safe.storage.raster import Raster, qgis_imported
+from safe.common.numerics import nan_allclose
+from safe.common.utilities import unique_filename
+from safe.storage.utilities import read_keywords, get_tile_windows
+from safe.storage.projection import DEFAULT_PROJECTION
+from safe.storage.raster import (Raster, TiledRasterWriter, qgis_imported,
+                                 read_native_dtype)
 
 if qgis_imported:   # Import QgsRasterLayer if qgis is available
     QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
@@ -67,6 +73,127 @@ class RasterTest(unittest.TestCase):
                 layer_exent, qgis_extent,
                 'Expected %s extent, got %s' % (qgis_extent, layer_exent))
 
+    def test_windowed_reading(self):
+        """Windows of raster data can be read from file and memory."""
+        layer = Raster(data=RASTER_BASE + '.tif')
+        A = layer.get_data()
+        x, y = layer.get_geometry()
+        rows, columns = A.shape
+
+        for source in [layer, layer.copy()]:
+            window = (3, 5, 20, 10)
+            B = source.get_data(window=window)
+            self.assertEqual(B.shape, (10, 20))
+            self.assertTrue(nan_allclose(B, A[5:15, 3:23]))
+
+            # Axes of window are part of full axes
+            wx, wy = source.get_geometry(window=window)
+            self.assertTrue(numpy.alltrue(wx == x[3:23]))
+            self.assertTrue(numpy.alltrue(wy == y[rows - 15:rows - 5]))
+
+            # Nodata replacement and scaling in window
+            B = source.get_data(nan=0.0, scaling=2.0, window=window)
+            C = numpy.where(numpy.isnan(A[5:15, 3:23]), 0.0, A[5:15, 3:23])
+            self.assertTrue(numpy.allclose(B, 2 * C))
+
+        # Window of bounding box holds pixels intersecting it
+        bbox = [x[10], y[20], x[15], y[30]]
+        window = layer.get_window(bbox)
+        self.assertEqual(window, (10, rows - 31, 6, 11))
+        B = layer.get_data(bbox=bbox)
+        self.assertTrue(nan_allclose(B, A[rows - 31:rows - 20, 10:16]))
+
+        # Geotransform of window is consistent with its axes
+        g = layer.get_geotransform(window=window)
+        self.assertTrue(numpy.allclose(g[0] + g[1] / 2, x[10]))
+
+        # Bounding box outside grid gives empty data
+        B = layer.get_data(bbox=[0, 0, 1, 1])
+        self.assertEqual(B.size, 0)
+
+        # Returned data is never the internal grid
+        memory_layer = layer.copy()
+        B = memory_layer.get_data()
+        B[:] = 0
+        self.assertTrue(nan_allclose(memory_layer.get_data(), A))
+
+    def test_working_dtype(self):
+        """Hazard grids are processed in single precision if lossless."""
+        geotransform = (106.5, 0.01, 0, -6.0, 0, -0.01)
+        hazard = {'category': 'hazard', 'subcategory': 'flood'}
+        exposure = {'category': 'exposure', 'subcategory': 'population'}
+        A = numpy.arange(12, dtype=numpy.float32).reshape(3, 4) / 3
+
+        for data, keywords, expected in [
+                (A, hazard, numpy.float32),
+                (A.astype(numpy.int16), hazard, numpy.float32),
+                (A.astype(numpy.float64), hazard, numpy.float64),
+                (A.astype(numpy.int32), hazard, numpy.float64),
+                (A, exposure, numpy.float64)]:
+            layer = Raster(data, geotransform=geotransform,
+                           keywords=keywords)
+            self.assertEqual(layer.get_working_dtype(), expected)
+            B = layer.get_data()
+            self.assertEqual(B.dtype, expected)
+            self.assertTrue(numpy.alltrue(B == data))
+
+        # Working type can be given explicitly
+        layer = Raster(A, geotransform=geotransform, keywords=exposure,
+                       dtype=numpy.float32)
+        self.assertEqual(layer.get_data().dtype, numpy.float32)
+        self.assertEqual(layer.get_data(dtype=numpy.float64).dtype,
+                         numpy.float64)
+
+        # Single precision grids are stored as such
+        layer = Raster(A, geotransform=geotransform, keywords=hazard)
+        filename = unique_filename(suffix='.tif')
+        layer.write_to_file(filename)
+        layer = Raster(filename)
+        self.assertEqual(layer.band.DataType, gdal.GDT_Float32)
+        self.assertEqual(layer.get_working_dtype(), numpy.float32)
+        self.assertEqual(read_native_dtype(filename), numpy.float32)
+        self.assertTrue(numpy.alltrue(layer.get_data() == A))
+
+    def test_tiled_writing(self):
+        """Grids written tile by tile are stored as by write_to_file."""
+        geotransform = (106.5, 0.01, 0, -6.0, 0, -0.01)
+        A = numpy.arange(12, dtype=numpy.float32).reshape(3, 4) / 3
+        A[1, 2] = numpy.nan
+
+        filename = unique_filename(suffix='.tif')
+        writer = TiledRasterWriter(filename, 4, 3, geotransform,
+                                   DEFAULT_PROJECTION)
+        for window in get_tile_windows(4, 3, 2):
+            _, yoff, _, ysize = window
+            writer.write(A[yoff:yoff + ysize], window)
+        writer.close()
+
+        layer = Raster(filename)
+        reference_filename = unique_filename(suffix='.tif')
+        Raster(A, geotransform=geotransform).write_to_file(reference_filename)
+        reference = Raster(reference_filename)
+        self.assertEqual(layer.band.DataType, gdal.GDT_Float32)
+        self.assertEqual(layer.band.DataType, reference.band.DataType)
+        self.assertTrue(numpy.isnan(layer.get_nodata_value()))
+        self.assertTrue(nan_allclose(layer.get_data(), A))
+
+    def test_memory_mapped_data(self):
+        """Raster data can be held in memory mapped files."""
+        layer = Raster(data=RASTER_BASE + '.tif')
+        A = layer.get_data()
+
+        B = layer.get_data(memmap=True)
+        self.assertTrue(isinstance(B, numpy.memmap))
+        self.assertTrue(nan_allclose(A, B))
+
+        memory_layer = Raster(A, geotransform=layer.get_geotransform(),
+                              keywords=layer.get_keywords(), memmap=True)
+        self.assertTrue(isinstance(memory_layer.data, numpy.memmap))
+        B = memory_layer.get_data()
+        self.assertFalse(isinstance(B, numpy.memmap))
+        self.assertTrue(nan_allclose(A, B))
+        self.assertEqual(memory_layer, layer)
+
 
 if __name__ == '__main__':
     suite = unittest.makeSuite(RasterTest, 'test')
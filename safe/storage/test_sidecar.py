@@ -0,0 +1,298 @@
+# coding=utf-8
+"""**Tests for binary sidecar files**"""
+
+import os
+import glob
+import time
+import cPickle
+import shutil
+import logging
+import unittest
+import numpy
+
+from safe.common.testing import UNITDATA
+from safe.common.exceptions import ReadLayerError
+from safe.common.utilities import temp_dir, unique_filename
+from safe.storage.core import read_layer
+from safe.storage.vector import Vector
+from safe.storage.raster import Raster
+from safe.storage.geometry import Polygon
+from safe.storage import sidecar
+from safe.storage.sidecar import (write_sidecar, read_sidecar, read_record,
+                                  verify_sidecar, sidecar_filename,
+                                  SIDECAR_ALIGNMENT, PREAMBLE)
+
+LOGGER = logging.getLogger('InaSAFE')
+EXPOSURE_DATA = [
+    (os.path.join(UNITDATA, 'exposure', 'buildings_osm_4326.shp'), None),
+    (os.path.join(UNITDATA, 'exposure',
+                  'padang_buildings_osm_900913.shp'), None),
+    (os.path.join(UNITDATA, 'exposure', 'roads_osm_4326.shp'), None),
+    (os.path.join(UNITDATA, 'exposure', 'exposure.sqlite'),
+     'buildings_osm_4326')]
+
+
+def copy_layer(filename):
+    """Copy layer file and its companion files to temporary directory
+    """
+
+    dirname = unique_filename(dir=temp_dir(sub_dir='test'))
+    os.mkdir(dirname)
+    for name in glob.glob(os.path.splitext(filename)[0] + '.*'):
+        shutil.copy(name, dirname)
+    return os.path.join(dirname, os.path.basename(filename))
+
+
+def make_file(suffix):
+    """Create empty file standing in for layer file
+    """
+
+    filename = unique_filename(suffix=suffix, dir=temp_dir(sub_dir='test'))
+    open(filename, 'w').close()
+    return filename
+
+
+def is_memory_mapped(array):
+    """True if array is a view into a memory mapped file
+    """
+
+    while isinstance(array, numpy.ndarray):
+        if isinstance(array, numpy.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def make_layers():
+    """Point, line and polygon layers with attribute columns of all types
+    """
+
+    columns = {'name': ['a', None, 'ccc'],
+               'label': [u'å', u'b', None],
+               'mixed': [1, 'b', 2.5],
+               'empty': [None, None, None],
+               'depth': [1.5, None, 0.25],
+               'count': [1, 2, 3],
+               'flag': [True, False, True]}
+    ring = numpy.array([[0, 0], [0, 2], [2, 2], [2, 0], [0, 0]],
+                       dtype=numpy.float)
+    hole = numpy.array([[0.5, 0.5], [1, 1], [1, 0.5], [0.5, 0.5]])
+    polygons = [Polygon(outer_ring=ring, inner_rings=[hole]),
+                Polygon(outer_ring=ring + 3),
+                Polygon(outer_ring=ring - 3, inner_rings=[hole - 3,
+                                                          hole - 2.5])]
+    return [Vector(data=columns, geometry=ring[:3]),
+            Vector(data=columns, geometry=[ring, ring[:3], ring + 1],
+                   geometry_type='line'),
+            Vector(data=columns, geometry=polygons,
+                   keywords={'category': 'exposure', 'title': 'Houses'})]
+
+
+class Test_Sidecar(unittest.TestCase):
+
+    def test_round_trip(self):
+        """Layers are written to sidecars and read again without loss
+        """
+
+        for layer in make_layers():
+            filename = make_file('.shp')
+            name = write_sidecar(layer, filename)
+            self.assertEqual(name, sidecar_filename(filename))
+
+            new_layer = read_sidecar(filename)
+            self.assertEqual(new_layer, layer)
+            self.assertEqual(new_layer.geometry_type, layer.geometry_type)
+            self.assertEqual(new_layer.get_keywords(), layer.get_keywords())
+            self.assertEqual(new_layer.get_filename(), filename)
+            columns = layer.get_columns()
+            new_columns = new_layer.get_columns()
+            self.assertEqual(new_columns.keys(), columns.keys())
+            for key in columns:
+                values = columns[key].tolist()
+                new_values = new_columns[key].tolist()
+                self.assertEqual(new_values, values)
+                self.assertEqual([type(x) for x in new_values],
+                                 [type(x) for x in values])
+
+        # Geometry is memory mapped, aligned and can be modified in place
+        # without changing the file
+        packed = read_sidecar(filename).get_packed_geometry()
+        self.assertTrue(is_memory_mapped(packed.coordinates))
+        self.assertEqual(packed.coordinates.ctypes.data % SIDECAR_ALIGNMENT,
+                         0)
+        packed.coordinates[:] = 0
+        self.assertEqual(read_sidecar(filename), layer)
+
+        # Rasters
+        data = numpy.arange(12, dtype=numpy.float32).reshape((3, 4))
+        raster = Raster(data=data, geotransform=(106.0, 0.01, 0.0,
+                                                 -6.0, 0.0, -0.01),
+                        keywords={'category': 'hazard'})
+        filename = make_file('.tif')
+        write_sidecar(raster, filename)
+        new_raster = read_sidecar(filename)
+        self.assertEqual(new_raster, raster)
+        self.assertEqual(new_raster.get_native_dtype(), numpy.float32)
+
+    def test_validation(self):
+        """Stale, corrupt and foreign sidecars are ignored
+        """
+
+        layer = make_layers()[-1]
+        filename = make_file('.shp')
+        self.assertTrue(read_sidecar(filename) is None)
+        name = write_sidecar(layer, filename)
+        fid = open(name, 'rb')
+        preamble = PREAMBLE.unpack(fid.read(PREAMBLE.size))
+        fid.close()
+        header_size = preamble[2]
+        self.assertEqual((PREAMBLE.size + header_size) % SIDECAR_ALIGNMENT,
+                         0)
+
+        # Sublayers have their own sidecars
+        self.assertTrue(read_sidecar(filename, sublayer='foo') is None)
+
+        # Changed layer files
+        keywords_filename = os.path.splitext(filename)[0] + '.keywords'
+        open(keywords_filename, 'w').close()
+        self.assertTrue(read_sidecar(filename) is None)
+        write_sidecar(layer, filename)
+        self.assertEqual(read_sidecar(filename), layer)
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 10))
+        self.assertTrue(read_sidecar(filename) is None)
+
+        # Corrupt files
+        write_sidecar(layer, filename)
+        self.assertTrue(verify_sidecar(filename))
+        content = open(name, 'rb').read()
+        for corrupt in [content[:-1],
+                        content[:10],
+                        content[:17] + 'x' + content[18:],
+                        content[:PREAMBLE.size + 1] + 'x' +
+                        content[PREAMBLE.size + 2:],
+                        content.replace('INASAFE', 'INASAFF', 1)]:
+            fid = open(name, 'wb')
+            fid.write(corrupt)
+            fid.close()
+            self.assertRaises(ReadLayerError, read_record, name)
+            self.assertTrue(read_sidecar(filename) is None)
+
+        # The data checksum is only validated on request as it means
+        # reading all data
+        header_size = PREAMBLE.unpack(content[:PREAMBLE.size])[2]
+        position = PREAMBLE.size + header_size + 3
+        fid = open(name, 'wb')
+        fid.write(content[:position] + chr(ord(content[position]) ^ 1) +
+                  content[position + 1:])
+        fid.close()
+        self.assertTrue(read_sidecar(filename) is not None)
+        self.assertRaises(ReadLayerError, read_record, name,
+                          verify_checksum=True)
+        self.assertFalse(verify_sidecar(filename))
+
+        # Other versions, including version 1 with pickled headers
+        for version in ['\x01', '\x03']:
+            fid = open(name, 'wb')
+            fid.write(content[:8] + version + content[9:])
+            fid.close()
+            self.assertRaises(ReadLayerError, read_record, name)
+            self.assertTrue(read_sidecar(filename) is None)
+
+    def test_no_pickles(self):
+        """Sidecars with pickled columns are not loaded
+        """
+
+        layer = make_layers()[0]
+        filename = make_file('.shp')
+        name = write_sidecar(layer, filename)
+        self.assertFalse('pickle' in open(name, 'rb').read())
+
+        encode_column = sidecar.encode_column
+
+        def pickle_column(array):
+            if array.dtype != object:
+                return encode_column(array)
+            data = numpy.fromstring(cPickle.dumps(array.tolist()),
+                                    dtype=numpy.uint8)
+            return 'pickle', [data]
+
+        sidecar.encode_column = pickle_column
+        try:
+            write_sidecar(layer, filename)
+        finally:
+            sidecar.encode_column = encode_column
+        self.assertRaises(ReadLayerError, read_record, name)
+        self.assertTrue(read_sidecar(filename) is None)
+
+    def test_test_data(self):
+        """Sidecars of test data give the layers read through OGR
+        """
+
+        for source, sublayer in EXPOSURE_DATA:
+            filename = copy_layer(source)
+            reference = Vector(filename, sublayer=sublayer)
+            self.assertFalse(is_memory_mapped(
+                reference.get_packed_geometry().coordinates))
+
+            write_sidecar(reference, filename, sublayer=sublayer)
+            layer = read_layer(filename, sublayer=sublayer)
+            self.assertTrue(is_memory_mapped(
+                layer.get_packed_geometry().coordinates))
+            self.assertEqual(layer, reference)
+            self.assertEqual(layer.get_name(), reference.get_name())
+            self.assertEqual(layer.get_keywords(), reference.get_keywords())
+            self.assertEqual(layer.get_bounding_box(),
+                             reference.get_bounding_box())
+            self.assertEqual(layer.geometry_type, reference.geometry_type)
+            for name in reference.get_attribute_names():
+                self.assertEqual(layer.get_data(name).tolist(),
+                                 reference.get_data(name).tolist())
+
+    def test_write_to_file(self):
+        """Sidecars can be written with shapefiles
+        """
+
+        source, _ = EXPOSURE_DATA[0]
+        reference = read_layer(source)
+        filename = unique_filename(suffix='.shp',
+                                   dir=temp_dir(sub_dir='test'))
+        reference.write_to_file(filename, sidecar=True)
+        self.assertTrue(os.path.isfile(sidecar_filename(filename)))
+        layer = read_layer(filename)
+        self.assertTrue(is_memory_mapped(
+            layer.get_packed_geometry().coordinates))
+        self.assertEqual(layer, Vector(filename))
+        self.assertEqual(layer, reference)
+
+        # Files written without sidecars do not keep stale ones
+        reference.write_to_file(filename)
+        self.assertFalse(os.path.isfile(sidecar_filename(filename)))
+
+    def test_load_time(self):
+        """Layers load faster from sidecars than through OGR
+        """
+
+        for source, sublayer in EXPOSURE_DATA:
+            filename = copy_layer(source)
+            t0 = time.time()
+            for _ in range(5):
+                reference = read_layer(filename, sublayer=sublayer)
+            t1 = time.time()
+            write_sidecar(reference, filename, sublayer=sublayer)
+            t2 = time.time()
+            for _ in range(5):
+                layer = read_layer(filename, sublayer=sublayer)
+            t3 = time.time()
+            LOGGER.info('Reading %s: OGR %.3fs, sidecar %.3fs '
+                        '(written in %.3fs)'
+                        % (os.path.basename(filename), (t1 - t0) / 5,
+                           (t3 - t2) / 5, t2 - t1))
+            self.assertEqual(layer, reference)
+            self.assertTrue(t3 - t2 < t1 - t0)
+    test_load_time.slow = True
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_Sidecar, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
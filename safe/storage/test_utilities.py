@@ -15,7 +15,9 @@ import unittest
 
 from safe.common.testing import UNITDATA
 from safe.storage.utilities import (read_keywords,
-                                    write_keywords)
+                                    write_keywords,
+                                    get_qgis_core,
+                                    QgisCoreFlag)
 
 LOGGER = logging.getLogger('InaSAFE')
 KEYWORD_PATH = os.path.abspath(
@@ -120,5 +122,16 @@ class CommonUtilitiesTest(unittest.TestCase):
         self.assertEquals(keywords, expected_keywords, msg)
         LOGGER.debug(keywords)
 
+    def test_qgis_core_flag(self):
+        """QGIS flags tell whether qgis.core imports
+        """
+        from safe.storage.vector import QGIS_IS_AVAILABLE
+        from safe.storage.raster import qgis_imported
+
+        available = get_qgis_core() is not None
+        for flag in [QgisCoreFlag(), QGIS_IS_AVAILABLE, qgis_imported]:
+            self.assertEqual(bool(flag), available)
+            self.assertEqual(not flag, not available)
+
 if __name__ == '__main__':
     unittest.main()
@@ -9,12 +9,16 @@ __copyright__ = 'Copyright 2012, Australia Indonesia Facility for '
 __copyright__ += 'Disaster Reduction'
 
 import os
+import time
+import cPickle
+import numpy
 import logging
 import unittest
 
 from safe.common.testing import UNITDATA, get_qgis_app
 from safe.common.utilities import temp_dir, unique_filename
-from safe.storage.utilities import read_keywords
+from safe.storage.utilities import (read_keywords, values_to_column,
+                                    concatenate_columns)
 from safe.storage.vector import Vector, QGIS_IS_AVAILABLE
 
 if QGIS_IS_AVAILABLE:   # Import QgsVectorLayer if qgis is available
@@ -30,6 +34,10 @@ SQLITE_PATH = os.path.abspath(
 #noinspection PyUnresolvedReferences
 SHP_BASE = os.path.abspath(
     os.path.join(UNITDATA, 'exposure', 'buildings_osm_4326'))
+PADANG_SHP_PATH = os.path.abspath(
+    os.path.join(UNITDATA, 'exposure', 'padang_buildings_osm_900913.shp'))
+ROADS_SHP_PATH = os.path.abspath(
+    os.path.join(UNITDATA, 'exposure', 'roads_osm_4326.shp'))
 EXPOSURE_SUBLAYER_NAME = 'buildings_osm_4326'
 
 
@@ -64,6 +72,148 @@ class VectorTest(unittest.TestCase):
         count = len(layer)
         self.assertEqual(count, 250, 'Expected 250 features, got %s' % count)
 
+    def test_columnar_attributes(self):
+        """Attributes read from file are held as columns."""
+        layer = Vector(data=SHP_BASE + '.shp')
+        names = layer.get_attribute_names()
+
+        # Column access does not create dictionaries and is not a copy
+        name = names[0]
+        column = layer.get_data(attribute=name)
+        self.assertTrue(isinstance(column, numpy.ndarray))
+        self.assertEqual(len(column), 250)
+        self.assertTrue(layer.get_data(attribute=name) is column)
+        self.assertTrue(layer.get_data(attribute=name, copy=True)
+                        is not column)
+
+        # Individual values are python values
+        value = layer.get_data(name, 0)
+        self.assertEqual(value, column.tolist()[0])
+
+        # List of dictionaries is available and consistent with columns
+        columns = layer.get_columns(copy=True)
+        data = layer.get_data()
+        self.assertEqual(len(data), 250)
+        for key in names:
+            self.assertEqual([x[key] for x in data], columns[key].tolist())
+
+        # Dictionaries now hold the attributes
+        data[0][name] = 'changed'
+        self.assertEqual(layer.get_data(name, 0), 'changed')
+
+    def test_columns_as_data(self):
+        """Vector layer can be created from attribute columns."""
+        geometry = [[0.0, 0.0], [1.0, 1.0], [2.0, 0.0]]
+        columns = {'depth': numpy.array([0.5, 1.5, numpy.nan]),
+                   'name': ['a', None, 'c'],
+                   'count': [1, None, 3]}
+        layer = Vector(data=columns, geometry=geometry)
+
+        self.assertTrue(layer.get_data('depth') is columns['depth'])
+        self.assertEqual(layer.get_data('count', 1), None)
+        self.assertEqual(layer.get_data('count', 2), 3)
+
+        data = layer.get_data()
+        self.assertEqual(data[0], {'depth': 0.5, 'name': 'a', 'count': 1})
+        self.assertEqual(data[1]['name'], None)
+        self.assertEqual(data[1]['count'], None)
+
+        # Columns must match number of features
+        self.assertRaises(Exception, Vector,
+                          data={'depth': [1.0]}, geometry=geometry)
+
+    def test_packed_geometry(self):
+        """Polygon geometry can be packed, pickled and unpacked."""
+        layer = Vector(data=SHP_BASE + '.shp')
+        polygons = layer.get_geometry(as_geometry_objects=True)
+        extent = layer.get_bounding_box()
+
+        packed = layer.get_packed_geometry()
+        self.assertEqual(len(packed), 250)
+        self.assertTrue(layer.get_packed_geometry() is packed)
+
+        # Outer rings are served from packed geometry
+        rings = layer.get_geometry()
+        for i in range(250):
+            self.assertTrue(numpy.allclose(rings[i], polygons[i].outer_ring))
+
+        # Layers created from packed geometry
+        new_layer = Vector(data=layer.get_columns(), geometry=packed,
+                           projection=layer.get_projection(),
+                           keywords=layer.get_keywords())
+        self.assertTrue(new_layer.is_polygon_data)
+        self.assertTrue(numpy.allclose(new_layer.get_bounding_box(), extent))
+        self.assertEqual(new_layer, layer)
+
+        # Pickling
+        s = cPickle.dumps(layer, protocol=2)
+        unpickled = cPickle.loads(s)
+        self.assertTrue(unpickled._geometry is None)
+        self.assertEqual(unpickled, layer)
+
+    def test_bulk_reader(self):
+        """Bulk reader gives same layers as feature by feature reader."""
+        for filename in [SHP_BASE + '.shp', PADANG_SHP_PATH, ROADS_SHP_PATH,
+                         SQLITE_PATH]:
+            sublayer = None
+            if filename == SQLITE_PATH:
+                sublayer = EXPOSURE_SUBLAYER_NAME
+
+            t0 = time.time()
+            for _ in range(5):
+                reference = Vector(sublayer=sublayer)
+                reference.read_from_file(filename, bulk=False)
+            t1 = time.time()
+            for _ in range(5):
+                layer = Vector(sublayer=sublayer)
+                layer.read_from_file(filename)
+            t2 = time.time()
+            LOGGER.info('Reading %s: feature by feature %.3fs, bulk %.3fs'
+                        % (os.path.basename(filename), t1 - t0, t2 - t1))
+
+            # Geometry is packed, attributes are typed columns
+            self.assertTrue(layer._packed is not None)
+            self.assertEqual(len(layer), len(reference))
+            self.assertEqual(layer.geometry_type, reference.geometry_type)
+            self.assertEqual(layer.get_attribute_names(),
+                             reference.get_attribute_names())
+            for name in layer.get_attribute_names():
+                self.assertEqual(layer.get_data(name).tolist(),
+                                 reference.get_data(name).tolist())
+
+            self.assertEqual(layer, reference)
+    test_bulk_reader.slow = True
+
+    def test_get_subset(self):
+        """Subsets of features can be selected and joined again."""
+        layer = Vector(data=SHP_BASE + '.shp')
+        names = layer.get_attribute_names()
+
+        indices = [5, 2, 200]
+        subset = layer.get_subset(indices)
+        self.assertTrue(subset.is_polygon_data)
+        self.assertEqual(len(subset), 3)
+        self.assertEqual(subset.get_attribute_names(), names)
+        rings = layer.get_geometry()
+        for i, ring in zip(indices, subset.get_geometry()):
+            self.assertTrue(numpy.allclose(ring, rings[i]))
+            for name in names:
+                self.assertEqual(subset.get_data(name, indices.index(i)),
+                                 layer.get_data(name, i))
+
+        # Columns of consecutive subsets join to the original columns
+        first = layer.get_subset(range(100))
+        second = layer.get_subset(range(100, 250))
+        for name in names:
+            column = concatenate_columns([first.get_data(name),
+                                          second.get_data(name)])
+            self.assertEqual(column.tolist(), layer.get_data(name).tolist())
+
+        # Columns of different types are joined as values
+        column = concatenate_columns([values_to_column([1, 2]),
+                                      values_to_column([None, 'a'])])
+        self.assertEqual(column.tolist(), [1, 2, None, 'a'])
+
     def test_sqlite_writing(self):
         """Test that writing a dataset to sqlite works."""
         keywords = read_keywords(SHP_BASE + '.keywords')
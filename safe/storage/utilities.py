@@ -4,6 +4,8 @@
 
 import os
 import re
+import sys
+import imp
 import copy
 import numpy
 import math
@@ -43,6 +45,13 @@ TYPE_MAP = {type(None): ogr.OFTString,  # What else should this be?
             type(numpy.array([0.0])[0]): ogr.OFTReal,  # numpy.float64
             type(numpy.array([[0.0]])[0]): ogr.OFTReal}  # numpy.ndarray
 
+# Working precision of raster grids. Hazard grids such as water depths or
+# MMI do not need double precision, so they are processed in single
+# precision wherever their stored values can be represented exactly.
+# Anything else is processed in double precision (see issue #75).
+HAZARD_DTYPE = numpy.float32
+DEFAULT_DTYPE = numpy.float64
+
 # Map between verbose types and OGR geometry types
 INVERSE_GEOMETRY_TYPE_MAP = {'point': ogr.wkbPoint,
                              'line': ogr.wkbLineString,
@@ -424,6 +433,120 @@ def geotransform_to_bbox(geotransform, columns, rows):
     return [min_x, min_y, max_x, max_y]
 
 
+def get_working_dtype(keywords, native_dtype):
+    """Numeric type raster grids of a layer are processed in
+
+    :param keywords: Keywords of layer
+    :type keywords: dict
+
+    :param native_dtype: Numeric type of stored values
+    :type native_dtype: numpy.dtype
+
+    :returns: HAZARD_DTYPE for hazard layers if values of native_dtype can
+        be converted to it without loss, otherwise DEFAULT_DTYPE.
+    :rtype: numpy.dtype
+    """
+
+    if (keywords.get('category') == 'hazard' and
+            numpy.can_cast(native_dtype, HAZARD_DTYPE)):
+        return numpy.dtype(HAZARD_DTYPE)
+    else:
+        return numpy.dtype(DEFAULT_DTYPE)
+
+
+def bbox_to_window(bbox, geotransform, columns, rows, padding=0):
+    """Convert geographic bounding box to pixel window of grid
+
+    :param bbox: Bounding box as a list of geographic coordinates
+        [west, south, east, north]
+    :type bbox: list
+
+    :param geotransform: GDAL geotransform (6-tuple) of grid
+    :type geotransform: tuple
+
+    :param columns: Number of columns in grid
+    :type columns: int
+
+    :param rows: Number of rows in grid
+    :type rows: int
+
+    :param padding: Optional number of pixels to add on each side
+    :type padding: int
+
+    :returns: window: Tuple (xoff, yoff, xsize, ysize) as used by GDAL's
+        ReadAsArray, i.e. column and row of top left pixel and number of
+        columns and rows. The window holds all pixels intersecting the
+        bounding box (plus padding) clipped to the grid. Its size is zero
+        if the bounding box does not overlap the grid.
+    """
+
+    x_origin = geotransform[0]  # top left x
+    y_origin = geotransform[3]  # top left y
+    x_res = geotransform[1]     # w-e pixel resolution
+    y_res = -geotransform[5]    # n-s pixel resolution (positive)
+
+    west, south, east, north = [float(v) for v in bbox]
+
+    col0 = int(math.floor((west - x_origin) / x_res)) - padding
+    col1 = int(math.ceil((east - x_origin) / x_res)) + padding
+    row0 = int(math.floor((y_origin - north) / y_res)) - padding
+    row1 = int(math.ceil((y_origin - south) / y_res)) + padding
+
+    col0 = min(max(col0, 0), columns)
+    col1 = min(max(col1, col0), columns)
+    row0 = min(max(row0, 0), rows)
+    row1 = min(max(row1, row0), rows)
+
+    return col0, row0, col1 - col0, row1 - row0
+
+
+def window_to_geotransform(geotransform, window):
+    """Geotransform of pixel window within grid
+
+    :param geotransform: GDAL geotransform (6-tuple) of grid
+    :type geotransform: tuple
+
+    :param window: Pixel window (xoff, yoff, xsize, ysize)
+    :type window: tuple
+
+    :returns: GDAL geotransform of the window
+    :rtype: tuple
+    """
+
+    xoff, yoff = window[:2]
+    return (geotransform[0] + xoff * geotransform[1] + yoff * geotransform[2],
+            geotransform[1],
+            geotransform[2],
+            geotransform[3] + xoff * geotransform[4] + yoff * geotransform[5],
+            geotransform[4],
+            geotransform[5])
+
+
+def get_tile_windows(columns, rows, tile_size):
+    """Split grid into pixel windows of at most tile_size rows
+
+    :param columns: Number of columns in grid
+    :type columns: int
+
+    :param rows: Number of rows in grid
+    :type rows: int
+
+    :param tile_size: Maximal number of rows in each window. Windows span
+        all columns so each tile is a contiguous block of scanlines.
+    :type tile_size: int
+
+    :returns: List of windows (xoff, yoff, xsize, ysize) covering the grid
+    :rtype: list
+    """
+
+    msg = 'Tile size must be a positive integer. I got %s' % str(tile_size)
+    verify(int(tile_size) > 0, msg)
+
+    tile_size = int(tile_size)
+    return [(0, yoff, columns, min(tile_size, rows - yoff))
+            for yoff in range(0, rows, tile_size)]
+
+
 def geotransform_to_resolution(geotransform, isotropic=False):
     """Convert geotransform to resolution
 
@@ -743,6 +866,197 @@ def is_sequence(x):
         return True
 
 
+def values_to_column(values):
+    """Convert sequence of attribute values to a numpy column
+
+    :param values: Attribute values for one field - one per feature.
+        Missing values are given as None.
+    :type values: list, numpy.ndarray
+
+    :returns: Array of length len(values). If all values (apart from None)
+        are of the same boolean, integer or floating point type, the array
+        is of the corresponding numpy type and missing values are masked.
+        Otherwise it is an object array holding the values as is.
+    :rtype: numpy.ndarray, numpy.ma.MaskedArray
+
+    Note:
+        Values are only given a numeric type if they all have the same
+        type so that the values returned by column.tolist() have the same
+        python types as the input. Mixed types (e.g. ints and floats)
+        give an object array.
+    """
+
+    if isinstance(values, numpy.ndarray):
+        return values
+
+    N = len(values)
+    types = set()
+    has_null = False
+    for value in values:
+        if value is None:
+            has_null = True
+        else:
+            types.add(type(value))
+
+    dtype = None
+    if len(types) == 1:
+        value_type = types.pop()
+        if value_type is bool:
+            dtype = numpy.bool
+        elif value_type is int:
+            dtype = numpy.int
+        elif issubclass(value_type, float):
+            dtype = numpy.float
+
+    if dtype is None:
+        # Strings, mixed types or anything else
+        column = numpy.empty(N, dtype=object)
+        for i, value in enumerate(values):
+            column[i] = value
+        return column
+
+    if has_null:
+        mask = numpy.array([value is None for value in values],
+                           dtype=numpy.bool)
+        filled = [dtype(0) if value is None else value for value in values]
+        return numpy.ma.array(filled, dtype=dtype, mask=mask)
+    else:
+        return numpy.array(values, dtype=dtype)
+
+
+def column_value(column, index):
+    """Get one attribute value from a column as a python object
+
+    :param column: Attribute column as made by values_to_column
+    :type column: numpy.ndarray, numpy.ma.MaskedArray
+
+    :param index: Index of feature
+    :type index: int
+
+    :returns: Python value at index. Masked values are returned as None.
+    """
+
+    value = column[index]
+    if value is numpy.ma.masked:
+        return None
+    elif isinstance(value, numpy.generic):
+        return value.item()
+    else:
+        return value
+
+
+def take_values(column, indices, missing=None):
+    """Select attribute values from a column
+
+    :param column: Attribute column as made by values_to_column
+    :type column: numpy.ndarray, numpy.ma.MaskedArray
+
+    :param indices: Indices of values to select
+    :type indices: numpy.ndarray
+
+    :param missing: Optional boolean array of same length as indices.
+        Selected values where missing is True are set to None (masked).
+    :type missing: numpy.ndarray
+
+    :returns: New column with selected values
+    :rtype: numpy.ndarray, numpy.ma.MaskedArray
+    """
+
+    N = len(indices)
+    if len(column) == 0:
+        # Nothing to select from so all values are missing
+        values = numpy.empty(N, dtype=object)
+        values[:] = None
+        return values
+
+    values = column[indices]
+    if missing is None or not numpy.any(missing):
+        return values
+
+    if values.dtype == object:
+        values[missing] = None
+        return values
+    else:
+        return numpy.ma.array(values,
+                              mask=numpy.ma.getmaskarray(values) + missing)
+
+
+def concatenate_columns(columns):
+    """Join attribute columns for consecutive sets of features
+
+    :param columns: List of attribute columns for the same field as made
+        by values_to_column
+    :type columns: list
+
+    :returns: Column with the values of all columns in the given order.
+        If the columns have different types (e.g. one holds only missing
+        values) the type is determined from all values as in
+        values_to_column.
+    :rtype: numpy.ndarray, numpy.ma.MaskedArray
+    """
+
+    dtypes = set([numpy.ma.getdata(column).dtype for column in columns])
+    if len(dtypes) > 1:
+        values = []
+        for column in columns:
+            values.extend(column.tolist())
+        return values_to_column(values)
+
+    if numpy.any([numpy.ma.isMaskedArray(column) for column in columns]):
+        return numpy.ma.concatenate(columns)
+    else:
+        return numpy.concatenate(columns)
+
+
+def column_as_float(column, default=0.0):
+    """Convert attribute column to floating point values
+
+    :param column: Attribute column as made by values_to_column
+    :type column: numpy.ndarray, numpy.ma.MaskedArray
+
+    :param default: Value to use for missing values and values that can
+        not be converted to float (e.g. None or '')
+    :type default: float
+
+    :returns: New array of floating point values
+    :rtype: numpy.ndarray
+    """
+
+    if column.dtype != object:
+        values = column.astype(numpy.float)
+        return numpy.ma.filled(values, default)
+
+    values = numpy.empty(len(column), dtype=numpy.float)
+    for i, value in enumerate(column):
+        try:
+            values[i] = float(value)
+        except (TypeError, ValueError):
+            values[i] = default
+    return values
+
+
+def columns_to_dicts(columns, N):
+    """Convert attribute columns to list of dictionaries
+
+    :param columns: Dictionary of attribute columns
+    :type columns: dict
+
+    :param N: Number of features
+    :type N: int
+
+    :returns: List of N dictionaries of attribute values - one per feature
+    :rtype: list
+    """
+
+    names = columns.keys()
+    if len(names) == 0:
+        return [{} for _ in range(N)]
+
+    # Convert to python values (masked values become None)
+    rows = zip(*[columns[name].tolist() for name in names])
+    return [dict(zip(names, row)) for row in rows]
+
+
 def array_to_line(A, geometry_type=ogr.wkbLinearRing):
     """Convert coordinates to linear_ring
 
@@ -1151,6 +1465,85 @@ def get_polygon_data(G):
                    inner_rings=inner_rings)
 
 
+def qgis_is_installed():
+    """Check whether QGIS python bindings are installed without importing them
+
+    This only looks for the package. Use qgis_core_available to find out
+    whether qgis.core can actually be imported.
+
+    :returns: True if the qgis package can be found.
+    :rtype: bool
+    """
+    try:
+        imp.find_module('qgis')
+    except ImportError:
+        return False
+    return True
+
+
+# Module qgis.core or None once get_qgis_core has tried to import it
+_qgis_core = None
+_qgis_core_imported = False
+
+
+def get_qgis_core():
+    """Import qgis.core when QGIS functionality is first needed.
+
+    Importing qgis.core is slow so the storage modules do not import it
+    when they are imported. The outcome of the first import is kept so
+    failed imports are not repeated.
+
+    :returns: The qgis.core module or None when QGIS is not available.
+    """
+    global _qgis_core, _qgis_core_imported
+    if not _qgis_core_imported:
+        try:
+            from qgis import core
+        except ImportError:
+            core = None
+        _qgis_core = core
+        _qgis_core_imported = True
+    return _qgis_core
+
+
+class QgisCoreFlag(object):
+    """Truth value telling whether qgis.core can be imported.
+
+    Flags such as vector.QGIS_IS_AVAILABLE are used in if statements when
+    other modules are imported. qgis.core is only imported (by
+    get_qgis_core) the first time the flag is tested.
+    """
+
+    def __nonzero__(self):
+        return get_qgis_core() is not None
+
+    def __repr__(self):
+        return repr(bool(self))
+
+
+qgis_core_available = QgisCoreFlag()
+
+
+def is_qgis_layer(data, class_name):
+    """Check whether data is an instance of a class in qgis.core.
+
+    qgis.core is not imported by this check: If it has not been imported
+    yet, data can not be an instance of its classes.
+
+    :param data: Any object.
+
+    :param class_name: Name of class in qgis.core e.g. 'QgsVectorLayer'.
+    :type class_name: str
+
+    :returns: True if data is an instance of that class.
+    :rtype: bool
+    """
+    qgis_core = sys.modules.get('qgis.core')
+    if qgis_core is None:
+        return False
+    return isinstance(data, getattr(qgis_core, class_name))
+
+
 def safe_to_qgis_layer(layer):
     """Helper function to make a QgsMapLayer from a safe read_layer layer.
 
@@ -23,36 +23,36 @@ import sys
 import numpy
 import logging
 
-QGIS_IS_AVAILABLE = True
-try:
-    from qgis.core import QgsVectorLayer, QgsVectorFileWriter
-except ImportError:
-    QGIS_IS_AVAILABLE = False
-
 import copy as copy_module
 from osgeo import ogr, gdal
 from safe.common.utilities import verify, ugettext as safe_tr
+from safe.common.utilities import OrderedDict
 from safe.common.exceptions import ReadLayerError, WriteLayerError
 from safe.common.exceptions import GetDataError, InaSAFEError
 
 from layer import Layer
 from projection import Projection
-from geometry import Polygon
+from geometry import Polygon, PackedGeometry, pack_polygons, pack_lines
 from utilities import DRIVER_MAP, TYPE_MAP
 from utilities import read_keywords
 from utilities import write_keywords
 from utilities import get_geometry_type
 from utilities import is_sequence
 from utilities import array_to_line
-from utilities import calculate_polygon_centroid
 from utilities import points_along_line
 from utilities import geometry_type_to_string
 from utilities import get_ring_data, get_polygon_data
 from utilities import rings_equal
+from utilities import values_to_column, column_value, columns_to_dicts
 from utilities import safe_to_qgis_layer
+from utilities import qgis_core_available, get_qgis_core, is_qgis_layer
+from bulk_reader import read_geometry, read_dbf_columns
 from safe.common.utilities import unique_filename
 
 LOGGER = logging.getLogger('InaSAFE')
+
+# qgis.core is only imported when QGIS layers are used or this is tested
+QGIS_IS_AVAILABLE = qgis_core_available
 _pseudo_inf = float(99999999)
 
 
@@ -66,13 +66,15 @@ class Vector(Layer):
                 * A filename of a vector file format known to GDAL.
                 * List of dictionaries of field names and attribute values
                   associated with each point coordinate.
+                * Dictionary of attribute columns, i.e. field names and
+                  sequences (or numpy arrays) of values - one per feature.
                 * A QgsVectorLayer associated with geometry and data.
                 * None
             * projection: Geospatial reference in WKT format.
                 Only used if geometry is provided as a numeric array,
                 if None, WGS84 geographic is assumed.
             * geometry: A list of either point coordinates or polygons/lines
-                (see note below).
+                (see note below) or a PackedGeometry instance.
             * geometry_type: Desired interpretation of geometry.
                 Valid options are 'point', 'line', 'polygon' or
                 the ogr types: 1, 2, 3.
@@ -121,6 +123,20 @@ class Vector(Layer):
             list of polygon geometry objects
             (as defined in module geometry.py)
 
+            Attributes are held either as a list of dictionaries (one per
+            feature) or as a numpy array per field (columns). Columns are
+            used when reading from file or when data is given as a
+            dictionary of columns. Use get_data(attribute) to get a column
+            without copying it. The list of dictionaries is created from
+            the columns when first requested and from then on it holds
+            the attribute values.
+
+            Polygon and line geometry can also be held packed into flat
+            coordinate and offset arrays (see PackedGeometry in module
+            geometry.py). Use get_packed_geometry() to get this
+            representation, e.g. for vectorised bounding boxes, areas or
+            centroids. Layers are pickled with packed geometry.
+
     """
 
     def __init__(
@@ -140,6 +156,10 @@ class Vector(Layer):
         class docstring.
         """
 
+        # Geometry is held as a list and/or packed into arrays
+        self._geometry = None
+        self._packed = None
+
         # Invoke common layer constructor
         Layer.__init__(
             self,
@@ -158,8 +178,7 @@ class Vector(Layer):
 
         if isinstance(data, basestring):
             self.read_from_file(data)
-        # check QGIS_IS_AVAILABLE to avoid QgsVectorLayer undefined error
-        elif QGIS_IS_AVAILABLE and isinstance(data, QgsVectorLayer):
+        elif is_qgis_layer(data, 'QgsVectorLayer'):
             self.read_from_qgis_native(data)
         else:
             # Assume that data is provided as sequences provided as
@@ -170,9 +189,16 @@ class Vector(Layer):
             verify(geometry is not None, msg)
 
             msg = 'Geometry must be a sequence'
-            verify(is_sequence(geometry), msg)
+            verify(isinstance(geometry, PackedGeometry) or
+                   is_sequence(geometry), msg)
 
-            if len(geometry) > 0 and isinstance(geometry[0], Polygon):
+            if isinstance(geometry, PackedGeometry):
+                if geometry.is_polygon:
+                    self.geometry_type = ogr.wkbPolygon
+                else:
+                    self.geometry_type = ogr.wkbLineString
+                self._packed = geometry
+            elif len(geometry) > 0 and isinstance(geometry[0], Polygon):
                 self.geometry_type = ogr.wkbPolygon
                 self.geometry = geometry
             else:
@@ -196,14 +222,18 @@ class Vector(Layer):
                     data.append({'ID': i})
 
             # Check data
-            self.data = data
+            if isinstance(data, dict):
+                self.set_columns(data)
+            else:
+                self.data = data
             if data is not None:
                 msg = 'Data must be a sequence'
                 verify(is_sequence(data), msg)
 
                 msg = ('The number of entries in geometry and data '
                        'must be the same')
-                verify(len(geometry) == len(data), msg)
+                verify(isinstance(data, dict) or
+                       len(geometry) == len(data), msg)
 
             # Establish extent
             if len(geometry) == 0:
@@ -211,6 +241,10 @@ class Vector(Layer):
                 self.extent = [0, 0, 0, 0]
                 return
 
+            if self._packed is not None:
+                self.extent = self._packed.get_extent()
+                return
+
             # Compute bounding box for each geometry type
             minx = miny = sys.maxint
             maxx = maxy = -minx
@@ -249,12 +283,136 @@ class Vector(Layer):
                              str(self.geometry_type),
                              g_type_str))
 
+    @property
+    def data(self):
+        """List of dictionaries of attribute values - one per feature
+
+        If attributes are held as columns, the list is created on first
+        access and the columns are dropped as callers may modify the
+        dictionaries in place.
+        """
+
+        if self._data is None and self._columns is not None:
+            self._data = columns_to_dicts(self._columns, len(self))
+            self._columns = None
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        """Set attributes as list of dictionaries - one per feature
+        """
+
+        self._data = value
+        self._columns = None
+
+    def set_columns(self, columns):
+        """Set attributes as columns
+
+        :param columns: Dictionary of field names and sequences of values
+            (one per feature). Sequences are converted to numpy arrays with
+            values_to_column. Arrays are stored without copying.
+        :type columns: dict
+
+        :raises: VerificationError
+        """
+
+        N = len(self)
+        new_columns = OrderedDict()
+        for name in columns:
+            column = values_to_column(columns[name])
+
+            msg = ('Attribute column %s must be one dimensional with one '
+                   'entry per feature (%i). I got shape %s'
+                   % (name, N, str(column.shape)))
+            verify(column.shape == (N,), msg)
+
+            new_columns[name] = column
+
+        self._data = None
+        self._columns = new_columns
+
+    def get_columns(self, copy=False):
+        """Get attributes as columns
+
+        :param copy: Set to return copies of the columns. Otherwise columns
+            are returned without copying if attributes are held as columns.
+        :type copy: bool
+
+        :returns: Dictionary of field names and numpy arrays of values.
+            The dictionary itself is always new.
+        :rtype: OrderedDict
+        """
+
+        columns = OrderedDict()
+        for name in self.get_attribute_names():
+            columns[name] = self.get_data(attribute=name, copy=copy)
+        return columns
+
+    @property
+    def geometry(self):
+        """List of geometries - one per feature
+
+        If geometry is held packed, the list is created on first access
+        with rings being views into the packed coordinates. The packed
+        geometry is then dropped as callers may modify the list.
+        """
+
+        if self._geometry is None and self._packed is not None:
+            self._geometry = self._packed.unpack()
+        self._packed = None
+        return self._geometry
+
+    @geometry.setter
+    def geometry(self, value):
+        """Set geometry as list - one entry per feature
+        """
+
+        self._geometry = value
+        self._packed = None
+
+    def get_packed_geometry(self):
+        """Get polygon or line geometry packed into flat arrays
+
+        The packed geometry is kept until the geometry list is accessed,
+        so repeated calls are cheap.
+
+        :returns: Packed geometry with one feature per entry in layer.
+        :rtype: PackedGeometry
+
+        :raises: InaSAFEError if layer does not hold polygon or line data
+        """
+
+        if self._packed is None:
+            if self.is_polygon_data:
+                self._packed = pack_polygons(self._geometry)
+            elif self.is_line_data:
+                self._packed = pack_lines(self._geometry)
+            else:
+                msg = ('Packed geometry is only available for polygon '
+                       'and line data. I got %s' % self.get_geometry_name())
+                raise InaSAFEError(msg)
+
+        return self._packed
+
+    def __getstate__(self):
+        """Pickle polygon and line geometry in packed form
+        """
+
+        state = self.__dict__.copy()
+        if self._geometry is not None and (self.is_polygon_data or
+                                           self.is_line_data):
+            state['_packed'] = self.get_packed_geometry()
+            state['_geometry'] = None
+        return state
+
     def __len__(self):
         """Size of vector layer defined as number of features
         """
 
-        if hasattr(self, 'geometry') and self.geometry is not None:
-            return len(self.geometry)
+        if self._packed is not None:
+            return len(self._packed)
+        elif self._geometry is not None:
+            return len(self._geometry)
         else:
             return 0
 
@@ -384,7 +542,7 @@ class Vector(Layer):
         return True
 
     # noinspection PyExceptionInherit
-    def read_from_file(self, filename):
+    def read_from_file(self, filename, bulk=True):
         """Read and unpack vector data.
 
         It is assumed that the file contains only one layer with the
@@ -410,9 +568,18 @@ class Vector(Layer):
         geoprocessing_tool_reference/
         geoprocessing_considerations_for_shapefile_output.htm
 
+        By default geometries are read in bulk as WKB and decoded with
+        numpy (polygons and lines are stored packed) and attributes of
+        shapefiles are read directly from the dbf file. Other attributes
+        are read feature by feature through OGR.
+
         :param filename: a fully qualified location to the file
         :type filename: str
 
+        :param bulk: Set to False to read geometry and attributes feature
+            by feature through OGR.
+        :type bulk: bool
+
         :raises: ReadLayerError
         """
 
@@ -471,9 +638,45 @@ class Vector(Layer):
 
         layer.ResetReading()
 
+        # Get field names and types from layer definition
+        layer_definition = layer.GetLayerDefn()
+        field_names = []
+        field_types = []
+        for j in range(layer_definition.GetFieldCount()):
+            field_definition = layer_definition.GetFieldDefn(j)
+            field_names.append(field_definition.GetName())
+            field_types.append(field_definition.GetType())
+
+        if bulk:
+            geometry_type, geometry = read_geometry(layer, filename)
+            if geometry_type is not None:
+                self.geometry_type = geometry_type
+            if isinstance(geometry, PackedGeometry):
+                self._geometry = None
+                self._packed = geometry
+            elif geometry is None:
+                self.geometry = []
+            else:
+                self.geometry = geometry.tolist()
+
+            values = None
+            if fid.GetDriver().GetName() == DRIVER_MAP['.shp']:
+                values = read_dbf_columns(filename, field_types, len(self),
+                                          pseudo_inf=_pseudo_inf)
+
+            if values is None:
+                layer.ResetReading()
+                values = [[] for _ in field_names]
+                for feature in layer:
+                    for j, field_values in enumerate(values):
+                        field_values.append(get_field_value(feature, j))
+
+            self.set_columns(OrderedDict(zip(field_names, values)))
+            return
+
         # Extract coordinates and attributes for all features
         geometry = []
-        data = []
+        values = [[] for _ in field_names]
         # Use feature iterator
         for feature in layer:
             # Record coordinates ordered as Longitude, Latitude
@@ -517,34 +720,13 @@ class Vector(Layer):
                                         self.geometry_type))
                     raise ReadLayerError(msg)
 
-            # Record attributes by name
-            number_of_fields = feature.GetFieldCount()
-            fields = {}
-            for j in range(number_of_fields):
-                name = feature.GetFieldDefnRef(j).GetName()
-
-                # FIXME (Ole): Ascertain the type of each field?
-                #              We need to cast each appropriately?
-                #              This is issue #66
-                #              (https://github.com/AIFDR/riab/issues/66)
-                #feature_type = feature.GetFieldDefnRef(j).GetType()
-                fields[name] = feature.GetField(j)
+            # Record attributes by field
+            for j, field_values in enumerate(values):
+                field_values.append(get_field_value(feature, j))
 
-                    # We do this because there is NaN problem on windows
-                    # NaN value must be converted to _pseudo_in to solve the
-                    # problem. But, when InaSAFE read the file, it'll be
-                    # converted back to NaN value, so that NaN in InaSAFE is a
-                    # numpy.nan
-                    # please check https://github.com/AIFDR/inasafe/issues/269
-                    # for more information
-                if fields[name] == _pseudo_inf:
-                    fields[name] = float('nan')
-                #print 'Field', name, feature_type, j, fields[name]
-
-            data.append(fields)
-        # Store geometry coordinates as a compact numeric array
+        # Store geometry and attributes as one column per field
         self.geometry = geometry
-        self.data = data
+        self.set_columns(OrderedDict(zip(field_names, values)))
 
     def read_from_qgis_native(self, qgis_layer):
         """Read and unpack vector data from qgis layer QgsVectorLayer.
@@ -557,12 +739,14 @@ class Vector(Layer):
                 * TypeError         if qgis is not avialable
                 * IOError           if can't store temporary file
         """
+        qgis_core = get_qgis_core()
         # FIXME (DK): this branch isn't covered by test
-        if not QGIS_IS_AVAILABLE:
+        if qgis_core is None:
             msg = ('Used data is QgsVectorLayer instance, '
                    'but QGIS is not avialable.')
             raise TypeError(msg)
 
+        QgsVectorFileWriter = qgis_core.QgsVectorFileWriter
         base_name = unique_filename()
         file_name = base_name + '.shp'
         error = QgsVectorFileWriter.writeAsVectorFormat(
@@ -592,7 +776,7 @@ class Vector(Layer):
                 * TypeError         if qgis is not avialable
         """
         # FIXME (DK): this branch isn't covered by test
-        if not QGIS_IS_AVAILABLE:
+        if get_qgis_core() is None:
             msg = ('Tried to convert layer to QgsVectorLayer instance, '
                    'but QGIS is not avialable.')
             raise TypeError(msg)
@@ -603,7 +787,7 @@ class Vector(Layer):
         qgis_layer = safe_to_qgis_layer(self)
         return qgis_layer
 
-    def write_to_file(self, filename, sublayer=None):
+    def write_to_file(self, filename, sublayer=None, sidecar=False):
         """Save vector data to file
 
         :param filename: filename with extension .shp or .gml
@@ -613,6 +797,12 @@ class Vector(Layer):
             unless we are writing to an sqlite file.
         :type sublayer: str
 
+        :param sidecar: Set to also write a binary sidecar file from which
+            read_layer reloads the layer without OGR (see module
+            sidecar.py). It is made from the file as written so it
+            reflects any conversions of the file format.
+        :type sidecar: bool
+
         :raises: WriteLayerError
 
         Note:
@@ -811,29 +1001,90 @@ class Vector(Layer):
 
         # FIXME (Ole): Maybe store style_info
 
+        # Sidecars of earlier files of this name are stale
+        from sidecar import write_sidecar, remove_sidecar
+        if extension != '.sqlite':
+            sublayer = None
+        remove_sidecar(filename, sublayer)
+        if sidecar:
+            # Close file before reading it again
+            lyr = ds = None
+            write_sidecar(Vector(filename, sublayer=sublayer), filename,
+                          sublayer)
+
     def copy(self):
         """Return copy of vector layer
 
         This copy will be equal to self in the sense defined by __eq__
         """
 
-        if self.is_polygon_data:
+        if self._packed is not None:
+            geometry = self._packed.copy()
+        elif self.is_polygon_data:
             geometry = self.get_geometry(copy=True, as_geometry_objects=True)
         else:
             geometry = self.get_geometry(copy=True)
 
-        return Vector(data=self.get_data(copy=True),
+        if self._columns is not None:
+            data = self.get_columns(copy=True)
+        else:
+            data = self.get_data(copy=True)
+
+        return Vector(data=data,
                       geometry=geometry,
                       projection=self.get_projection(),
                       keywords=self.get_keywords())
 
+    def get_subset(self, indices):
+        """Return new vector layer holding selected features
+
+        :param indices: Indices of features to select
+        :type indices: list, numpy.ndarray
+
+        :returns: Vector layer with the selected features in the order
+            given by indices. Attribute columns are copied whereas
+            geometry may share coordinates with this layer.
+        :rtype: Vector
+        """
+
+        indices = numpy.asarray(indices, dtype=numpy.int)
+
+        if self._packed is not None:
+            geometry = [self._packed.get_feature(i) for i in indices]
+        else:
+            geometry = [self._geometry[i] for i in indices]
+
+        if self._columns is not None:
+            data = OrderedDict()
+            for name in self._columns:
+                data[name] = self._columns[name][indices]
+        else:
+            data = [copy_module.copy(self.data[i]) for i in indices]
+
+        if self.is_point_data:
+            geometry_type = 'point'
+        elif self.is_line_data:
+            geometry_type = 'line'
+        else:
+            geometry_type = 'polygon'
+
+        return Vector(data=data,
+                      geometry=geometry,
+                      geometry_type=geometry_type,
+                      projection=self.get_projection(),
+                      name=self.get_name(),
+                      keywords=copy_module.copy(self.get_keywords()))
+
     def get_attribute_names(self):
         """Get available attribute names
 
         These are the ones that can be used with get_data
         """
 
-        return self.data[0].keys()
+        if self._columns is not None:
+            return self._columns.keys()
+        else:
+            return self.data[0].keys()
 
     def get_data(self, attribute=None, index=None, copy=False):
         """Get vector attributes
@@ -861,47 +1112,60 @@ class Vector(Layer):
             get_data() are related as 1-to-1
 
             If optional argument attribute is specified and a valid name,
-            then the list of values for that attribute is returned.
+            then the values for that attribute are returned as a numpy
+            array (see values_to_column for its type). If attributes are
+            held as columns this is the column itself - not a copy.
 
             If optional argument index is specified on the that value will
             be returned. Any value of index is ignored if attribute is None.
 
-            If optional argument copy is True and all attributes are requested,
-            a copy will be returned. Otherwise a pointer to the data is
-            returned.
+            If optional argument copy is True, a copy will be returned.
+            Otherwise a pointer to the data is returned.
         """
 
-        if hasattr(self, 'data'):
-            if attribute is None:
-                if copy:
-                    return copy_module.deepcopy(self.data)
-                else:
-                    return self.data
+        if attribute is None:
+            if copy:
+                return copy_module.deepcopy(self.data)
             else:
-                msg = ('Specified attribute %s does not exist in '
-                       'vector layer %s. Valid names are %s'
-                       '' % (attribute, self, self.data[0].keys()))
-                verify(attribute in self.data[0], msg)
-
-                if index is None:
-                    # Return all values for specified attribute
-                    return [x[attribute] for x in self.data]
-                else:
-                    # Return value for specified attribute and index
-                    msg = ('Specified index must be either None or '
-                           'an integer. I got %s' % index)
-                    verify(isinstance(index, int), msg)
+                return self.data
 
-                    msg = ('Specified index must lie within the bounds '
-                           'of vector layer %s which is [%i, %i]'
-                           '' % (self, 0, len(self) - 1))
-                    verify(0 <= index < len(self), msg)
-
-                    return self.data[index][attribute]
-        else:
+        if self._data is None and self._columns is None:
             msg = 'Vector data instance does not have any attributes'
             raise GetDataError(msg)
 
+        msg = ('Specified attribute %s does not exist in '
+               'vector layer %s. Valid names are %s'
+               '' % (attribute, self, self.get_attribute_names()))
+        verify(attribute in self.get_attribute_names(), msg)
+
+        if self._columns is not None:
+            column = self._columns[attribute]
+            if copy:
+                column = column.copy()
+        else:
+            column = None
+
+        if index is None:
+            # Return all values for specified attribute
+            if column is None:
+                column = values_to_column([x[attribute] for x in self.data])
+            return column
+        else:
+            # Return value for specified attribute and index
+            msg = ('Specified index must be either None or '
+                   'an integer. I got %s' % index)
+            verify(isinstance(index, int), msg)
+
+            msg = ('Specified index must lie within the bounds '
+                   'of vector layer %s which is [%i, %i]'
+                   '' % (self, 0, len(self) - 1))
+            verify(0 <= index < len(self), msg)
+
+            if column is None:
+                return self.data[index][attribute]
+            else:
+                return column_value(column, index)
+
     def get_geometry_type(self):
         """Return geometry type for vector layer
         """
@@ -940,6 +1204,19 @@ class Vector(Layer):
         :rtype: list
         """
 
+        if self._packed is not None and not (self.is_polygon_data and
+                                             as_geometry_objects):
+            # Arrays can be taken from packed geometry without unpacking
+            if as_geometry_objects:
+                msg = ('Argument as_geometry_objects can currently '
+                       'be True only for polygon data')
+                raise InaSAFEError(msg)
+
+            geometry = self._packed.outer_rings()
+            if copy:
+                geometry = [A.copy() for A in geometry]
+            return geometry
+
         if copy:
             geometry = copy_module.deepcopy(self.geometry)
         else:
@@ -1075,6 +1352,36 @@ class Vector(Layer):
 #----------------------------------
 # Helper functions for class Vector
 #----------------------------------
+def get_field_value(feature, j):
+    """Get value of field j from OGR feature
+
+    :param feature: OGR feature
+    :param j: Field index
+    :type j: int
+
+    :returns: Field value with _pseudo_inf converted to NaN
+    """
+
+    # FIXME (Ole): Ascertain the type of each field?
+    #              We need to cast each appropriately?
+    #              This is issue #66
+    #              (https://github.com/AIFDR/riab/issues/66)
+    #feature_type = feature.GetFieldDefnRef(j).GetType()
+    value = feature.GetField(j)
+
+    # We do this because there is NaN problem on windows
+    # NaN value must be converted to _pseudo_in to solve the
+    # problem. But, when InaSAFE read the file, it'll be
+    # converted back to NaN value, so that NaN in InaSAFE is a
+    # numpy.nan
+    # please check https://github.com/AIFDR/inasafe/issues/269
+    # for more information
+    if value == _pseudo_inf:
+        value = float('nan')
+
+    return value
+
+
 def convert_line_to_points(V, delta):
     """Convert line vector data to point vector data
 
@@ -1129,14 +1436,8 @@ def convert_polygons_to_centroids(V):
     msg = 'Input data %s must be polygon vector data' % V
     verify(V.is_polygon_data, msg)
 
-    geometry = V.get_geometry()
-    N = len(V)
-
-    # Calculate points for each polygon
-    centroids = []
-    for i in range(N):
-        c = calculate_polygon_centroid(geometry[i])
-        centroids.append(c)
+    # Calculate points for all polygons at once
+    centroids = V.get_packed_geometry().centroids()
 
     # Create new point vector layer with same attributes and return
     V = Vector(data=V.get_data(),
@@ -20,8 +20,9 @@ __copyright__ = ('Copyright 2012, Australia Indonesia Facility for '
 import unittest
 import sys
 import os
+import numpy
 
-from qgis.core import QgsRectangle
+from qgis.core import QgsRectangle, QgsRasterLayer, QgsVectorLayer
 
 # Add parent directory to path to make test aware of other modules
 # We should be able to remove this now that we use env vars. TS
@@ -30,10 +31,17 @@ pardir = os.path.abspath(
 sys.path.append(pardir)
 
 from safe_qgis.impact_statistics.zonal_stats import (
-    calculate_zonal_stats, intersection_box)
+    calculate_zonal_stats, batch_zonal_stats, intersection_box)
 from safe_qgis.utilities.utilities_for_testing import (
     load_layer)
-from safe_qgis.safe_interface import UNITDATA
+from safe_qgis.safe_interface import (
+    UNITDATA,
+    temp_dir,
+    unique_filename,
+    Raster,
+    Vector)
+from safe.storage.geometry import Polygon
+from safe.storage.projection import DEFAULT_PROJECTION
 
 QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
 
@@ -102,6 +110,78 @@ class ZonalStatsTest(unittest.TestCase):
         self.maxDiff = None
         self.assertDictEqual(expected_result, result)
 
+    def test_batch_matches_single_polygons(self):
+        """Test that batch and polygon by polygon zonal stats agree."""
+        raster_layer, _ = load_layer(os.path.join(
+            UNITDATA, 'other', 'tenbytenraster.asc'))
+        for filename in ['zonal_polygons.shp',
+                         'ten_by_ten_raster_as_polys.shp']:
+            vector_layer, _ = load_layer(os.path.join(
+                UNITDATA, 'other', filename))
+            expected_result = calculate_zonal_stats(
+                raster_layer=raster_layer,
+                polygon_layer=vector_layer,
+                batch=False)
+
+            # Small blocks so that the raster is read in several passes
+            result = batch_zonal_stats(
+                raster_layer, vector_layer, block_size=25)
+            #noinspection PyPep8Naming
+            self.maxDiff = None
+            self.assertDictEqual(expected_result, result)
+
+    def test_batch_matches_single_overlapping_polygons(self):
+        """Test that zonal stats agree for overlapping polygons."""
+        def square(x0, y0, side):
+            return numpy.array([[x0, y0], [x0, y0 + side],
+                                [x0 + side, y0 + side], [x0 + side, y0],
+                                [x0, y0]])
+
+        # Float data with a no data cell
+        numpy.random.seed(13)
+        data = numpy.random.uniform(0, 10, (10, 10)).astype(numpy.float32)
+        data[4, 4] = -9999
+        raster_path = unique_filename(
+            suffix='.tif', dir=temp_dir(sub_dir='test'))
+        Raster(data=data,
+               projection=DEFAULT_PROJECTION,
+               geotransform=(100.0, 1.0, 0.0, 10.0, 0.0, -1.0),
+               keywords={'category': 'hazard'}).write_to_file(raster_path)
+        raster_layer = QgsRasterLayer(raster_path, 'data')
+
+        # Overlapping polygons and one apart from them
+        vector_path = unique_filename(
+            suffix='.shp', dir=temp_dir(sub_dir='test'))
+        Vector(data=[{'id': i} for i in range(4)],
+               projection=DEFAULT_PROJECTION,
+               geometry=[Polygon(square(101, 1, 4)),
+                         Polygon(square(103, 3, 4)),
+                         Polygon(square(100.5, 5.5, 3.2)),
+                         Polygon(square(106, 0, 3))]).write_to_file(
+                             vector_path)
+        vector_layer = QgsVectorLayer(vector_path, 'zones', 'ogr')
+
+        expected_result = calculate_zonal_stats(
+            raster_layer=raster_layer,
+            polygon_layer=vector_layer,
+            batch=False)
+        result = calculate_zonal_stats(
+            raster_layer=raster_layer,
+            polygon_layer=vector_layer)
+        self.assertEqual(sorted(result.keys()),
+                         sorted(expected_result.keys()))
+        for key in expected_result:
+            self.assertEqual(result[key]['count'],
+                             expected_result[key]['count'])
+            for name in ['sum', 'mean']:
+                self.assertAlmostEqual(result[key][name],
+                                       expected_result[key][name], places=3)
+
+        # Shared cells count for both polygons (the second one covers the
+        # no data cell)
+        self.assertEqual(result[0]['count'], 16)
+        self.assertEqual(result[1]['count'], 15)
+
     def test_cell_info_for_bbox(self):
         """Test that cell info for bbox returns expected values."""
         raster_box = QgsRectangle(1535375.0, 5083255.0, 1535475.0, 5083355.0)
@@ -55,7 +55,7 @@ def tr(text):
     return QCoreApplication.translate('zonal_stats', text)
 
 
-def calculate_zonal_stats(raster_layer, polygon_layer):
+def calculate_zonal_stats(raster_layer, polygon_layer, batch=True):
     """Calculate zonal statics given two layers.
 
     :param raster_layer: A QGIS raster layer.
@@ -64,6 +64,12 @@ def calculate_zonal_stats(raster_layer, polygon_layer):
     :param polygon_layer: A QGIS vector layer containing polygons.
     :type polygon_layer: QgsVectorLayer, QgsMapLayer
 
+    :param batch: If True (default) statistics for all polygons are
+        calculated at once by :func:`batch_zonal_stats` unless polygons
+        overlap. Otherwise each polygon is rasterised and processed on its
+        own by :func:`polygon_zonal_stats`. Both give the same results.
+    :type batch: bool
+
     :returns: A data structure containing sum, mean, min, max,
         count of raster values for each polygonal area.
     :rtype: dict
@@ -102,6 +108,27 @@ def calculate_zonal_stats(raster_layer, polygon_layer):
     LOGGER.debug('Calculating zonal stats for:')
     LOGGER.debug('Raster: %s' % raster_layer.source())
     LOGGER.debug('Vector: %s' % polygon_layer.source())
+    if batch:
+        return batch_zonal_stats(raster_layer, polygon_layer)
+    else:
+        return polygon_zonal_stats(raster_layer, polygon_layer)
+
+
+def polygon_zonal_stats(raster_layer, polygon_layer):
+    """Calculate zonal statistics one polygon at a time.
+
+    :param raster_layer: A QGIS raster layer.
+    :type raster_layer: QgsRasterLayer, QgsMapLayer
+
+    :param polygon_layer: A QGIS vector layer containing polygons.
+    :type polygon_layer: QgsVectorLayer, QgsMapLayer
+
+    :returns: A data structure containing sum, mean and count of raster
+        values for each polygonal area - see :func:`calculate_zonal_stats`.
+    :rtype: dict
+
+    :raises: InvalidGeometryError if a feature has no geometry.
+    """
     results = {}
     raster_source = raster_layer.source()
     feature_id = gdal.Open(str(raster_source), gdal.GA_ReadOnly)
@@ -112,17 +139,8 @@ def calculate_zonal_stats(raster_layer, polygon_layer):
     band = feature_id.GetRasterBand(1)
     no_data = band.GetNoDataValue()
     #print 'No data %s' % no_data
-    cell_size_x = geo_transform[1]
-    if cell_size_x < 0:
-        cell_size_x = -cell_size_x
-    cell_size_y = geo_transform[5]
-    if cell_size_y < 0:
-        cell_size_y = -cell_size_y
-    raster_box = QgsRectangle(
-        geo_transform[0],
-        geo_transform[3] - (cell_size_y * rows),
-        geo_transform[0] + (cell_size_x * columns),
-        geo_transform[3])
+    raster_box, cell_size_x, cell_size_y = raster_extent(
+        geo_transform, columns, rows)
 
     #noinspection PyCallByClass,PyTypeChecker,PyArgumentList
     raster_geometry = QgsGeometry.fromRect(raster_box)
@@ -150,7 +168,6 @@ def calculate_zonal_stats(raster_layer, polygon_layer):
 
         count += 1
         feature_box = geometry.boundingBox().intersect(raster_box)
-        print 'NEW AGGR: %s' % myFeature.id()
 
         #print 'Raster Box: %s' % raster_box.asWktCoordinates()
         #print 'Feature Box: %s' % feature_box.asWktCoordinates()
@@ -209,6 +226,197 @@ def calculate_zonal_stats(raster_layer, polygon_layer):
     return results
 
 
+def batch_zonal_stats(raster_layer, polygon_layer, block_size=1048576):
+    """Calculate zonal statistics for all polygons at once.
+
+    All polygons are rasterised into one label band aligned with the
+    raster in a single call to gdal.RasterizeLayer. The raster is then read
+    in blocks of rows and sums and counts for all polygons are accumulated
+    with numpy.bincount. As for the single polygon calculation, polygons
+    covering at most one cell fall back to :func:`precise_stats`.
+
+    A cell of the label band can only hold one polygon. If polygons share
+    cells, the layer is passed on to :func:`polygon_zonal_stats` instead
+    so that shared cells count for every polygon covering them.
+
+    :param raster_layer: A QGIS raster layer.
+    :type raster_layer: QgsRasterLayer, QgsMapLayer
+
+    :param polygon_layer: A QGIS vector layer containing polygons.
+    :type polygon_layer: QgsVectorLayer, QgsMapLayer
+
+    :param block_size: Approximate number of cells to read at a time.
+    :type block_size: int
+
+    :returns: A data structure containing sum, mean and count of raster
+        values for each polygonal area - see :func:`calculate_zonal_stats`.
+    :rtype: dict
+
+    :raises: InvalidGeometryError if a feature has no geometry.
+    """
+    raster_source = raster_layer.source()
+    dataset = gdal.Open(str(raster_source), gdal.GA_ReadOnly)
+    geo_transform = dataset.GetGeoTransform()
+    columns = dataset.RasterXSize
+    rows = dataset.RasterYSize
+    band = dataset.GetRasterBand(1)
+    no_data = band.GetNoDataValue()
+    raster_box, cell_size_x, cell_size_y = raster_extent(
+        geo_transform, columns, rows)
+
+    provider = polygon_layer.dataProvider()
+    if provider is None:
+        message = tr(
+            'Could not obtain data provider from layer "%s"') % (
+                polygon_layer.source())
+        raise Exception(message)
+
+    crs = osr.SpatialReference()
+    crs.ImportFromProj4(str(polygon_layer.crs().toProj4()))
+
+    # Copy all polygons into one memory layer where zone i + 1 is the
+    # i'th feature. Zone 0 is left for cells outside all polygons.
+    mem_ds = ogr.GetDriverByName('Memory').CreateDataSource('out')
+    mem_layer = mem_ds.CreateLayer('zones', crs, ogr.wkbUnknown)
+    mem_layer.CreateField(ogr.FieldDefn('zone', ogr.OFTInteger))
+
+    feature_ids = []
+    geometries = []
+    for feature in provider.getFeatures(QgsFeatureRequest()):
+        geometry = feature.geometry()
+        if geometry is None:
+            message = tr(
+                'Feature %d has no geometry or geometry is invalid') % (
+                    feature.id())
+            raise InvalidGeometryError(message)
+
+        feature_ids.append(feature.id())
+        geometries.append(QgsGeometry(geometry))
+
+        ogr_feature = ogr.Feature(mem_layer.GetLayerDefn())
+        ogr_feature.SetGeometry(
+            ogr.CreateGeometryFromWkt(str(geometry.exportToWkt())))
+        ogr_feature.SetField('zone', len(feature_ids))
+        mem_layer.CreateFeature(ogr_feature)
+        ogr_feature.Destroy()
+
+    # Count the polygons covering each cell to detect overlaps
+    block_rows = max(1, block_size // max(columns, 1))
+    label_ds = gdal.GetDriverByName('MEM').Create(
+        '', columns, rows, 1, gdal.GDT_Int32)
+    label_ds.SetGeoTransform(geo_transform)
+    gdal.RasterizeLayer(
+        label_ds, [1], mem_layer, burn_values=[1], options=['MERGE_ALG=ADD'])
+    label_band = label_ds.GetRasterBand(1)
+    for row in range(0, rows, block_rows):
+        block_height = min(block_rows, rows - row)
+        coverage = label_band.ReadAsArray(0, row, columns, block_height)
+        if numpy.any(coverage > 1):
+            LOGGER.debug('Polygons overlap, calculating zonal stats one '
+                         'polygon at a time')
+            # noinspection PyUnusedLocal
+            dataset = None  # Close
+            return polygon_zonal_stats(raster_layer, polygon_layer)
+
+    # Burn zones into one label band
+    label_band.Fill(0)
+    gdal.RasterizeLayer(label_ds, [1], mem_layer, options=['ATTRIBUTE=zone'])
+
+    # Accumulate sums and counts block by block
+    number_of_zones = len(feature_ids) + 1
+    sums = numpy.zeros(number_of_zones)
+    counts = numpy.zeros(number_of_zones, dtype=numpy.int)
+    for row in range(0, rows, block_rows):
+        block_height = min(block_rows, rows - row)
+        labels = label_band.ReadAsArray(0, row, columns, block_height)
+        values = band.ReadAsArray(0, row, columns, block_height)
+
+        # Nan values count as zero as in numpy_stats
+        values = numpy.nan_to_num(values)
+        valid = labels > 0
+        if no_data is not None:
+            valid &= values != no_data
+        labels = labels[valid]
+        values = values[valid]
+
+        counts += numpy.bincount(labels, minlength=number_of_zones)
+        sums += numpy.bincount(
+            labels, weights=values, minlength=number_of_zones)
+
+    results = {}
+    for i, feature_id in enumerate(feature_ids):
+        geometry_sum = float(sums[i + 1])
+        count = int(counts[i + 1])
+
+        if count <= 1:
+            # The cell resolution is probably larger than the polygon area.
+            # We switch to precise pixel - polygon intersection in this case
+            geometry = geometries[i]
+            feature_box = geometry.boundingBox().intersect(raster_box)
+            offset_x, offset_y, cells_x, cells_y = intersection_box(
+                raster_box, feature_box, cell_size_x, cell_size_y)
+
+            # If the poly does not intersect the raster just continue
+            if None in [offset_x, offset_y, cells_x, cells_y]:
+                continue
+
+            # avoid access to cells outside of the raster
+            cells_x = min(cells_x, columns - offset_x)
+            cells_y = min(cells_y, rows - offset_y)
+
+            geometry_sum, count = precise_stats(
+                band,
+                geometry,
+                offset_x,
+                offset_y,
+                cells_x,
+                cells_y,
+                cell_size_x,
+                cell_size_y,
+                raster_box,
+                no_data)
+
+        if count == 0:
+            mean = 0
+        else:
+            mean = geometry_sum / count
+
+        results[feature_id] = {
+            'sum': geometry_sum,
+            'count': count,
+            'mean': mean}
+
+    # noinspection PyUnusedLocal
+    dataset = None  # Close
+    return results
+
+
+def raster_extent(geo_transform, columns, rows):
+    """Bounding box and cell sizes of a raster.
+
+    :param geo_transform: Geo-referencing transform from raster metadata.
+    :type geo_transform: list (six floats)
+
+    :param columns: Number of columns in the raster.
+    :type columns: int
+
+    :param rows: Number of rows in the raster.
+    :type rows: int
+
+    :returns: Box defining the extents of the raster and the (positive)
+        cell sizes in the x and y directions.
+    :rtype: (QgsRectangle, float, float)
+    """
+    cell_size_x = abs(geo_transform[1])
+    cell_size_y = abs(geo_transform[5])
+    raster_box = QgsRectangle(
+        geo_transform[0],
+        geo_transform[3] - (cell_size_y * rows),
+        geo_transform[0] + (cell_size_x * columns),
+        geo_transform[3])
+    return raster_box, cell_size_x, cell_size_y
+
+
 def intersection_box(
         raster_box,
         feature_box,
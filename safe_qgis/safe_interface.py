@@ -68,6 +68,8 @@ from safe.api import (
     Layer,
     Vector,
     Raster,
+    read_native_dtype,
+    get_working_dtype,
     nan_allclose,
     DEFAULTS,
     messaging,
@@ -20,6 +20,7 @@ __copyright__ += 'Disaster Reduction'
 import os
 import tempfile
 import logging
+import numpy
 
 from PyQt4.QtCore import QProcess
 from qgis.core import (
@@ -38,7 +39,10 @@ from safe_qgis.safe_interface import (
     verify,
     read_file_keywords,
     temp_dir,
-    which)
+    which,
+    read_native_dtype,
+    get_working_dtype,
+    ReadLayerError)
 
 from safe_qgis.utilities.keyword_io import KeywordIO
 from safe_qgis.exceptions import (
@@ -477,6 +481,19 @@ def _clip_raster_layer(
                 ))
             raise InvalidProjectionError(message)
 
+    # Hazard grids are clipped to single precision where that is lossless
+    # as they will be processed as such anyway (see issue #75). Only the
+    # band type is read from the file.
+    try:
+        native_dtype = read_native_dtype(working_layer)
+    except ReadLayerError:
+        native_dtype = numpy.float64
+    working_dtype = get_working_dtype(keywords, native_dtype)
+    if working_dtype == numpy.float32:
+        output_type = 'Float32'
+    else:
+        output_type = 'Float64'
+
     # We need to provide gdalwarp with a dataset for the clip
     # because unline gdal_translate, it does not take projwin.
     clip_kml = extent_to_kml(extent)
@@ -499,19 +516,21 @@ def _clip_raster_layer(
     if cell_size is None:
         command = (
             '"%s" -q -t_srs EPSG:4326 -r near -cutline %s -crop_to_cutline '
-            '-ot Float64 -of GTiff "%s" "%s"' % (
+            '-ot %s -of GTiff "%s" "%s"' % (
                 binary,
                 clip_kml,
+                output_type,
                 working_layer,
                 filename))
     else:
         command = (
             '"%s" -q -t_srs EPSG:4326 -r near -tr %f %f -cutline %s '
-            '-crop_to_cutline -ot Float64 -of GTiff "%s" "%s"' % (
+            '-crop_to_cutline -ot %s -of GTiff "%s" "%s"' % (
                 binary,
                 cell_size,
                 cell_size,
                 clip_kml,
+                output_type,
                 working_layer,
                 filename))
 